@@ -1,24 +1,77 @@
 
 import streamlit as st
 import pandas as pd
-import numpy as np
-import math
 from pathlib import Path
-import tempfile
+import json
+import uuid
 
-from src.io import load_yaml, load_csv
-from src.calculations import Factors, estimate_module, totals_table, SCENARIOS, SCENARIO_LABELS
-from src.pdf_report import export_pdf, ReportInputs
+from src.calculations import Factors, totals_table, SCENARIOS, SCENARIO_LABELS, FACTOR_RANGES, FACTOR_LABELS
+from src.pipeline import EstimatePipeline
+from src import instrument, resources, estimate_cache, jobs  # resources: model, CSVs and heavy modules loaded on first use
 
 st.set_page_config(page_title="Costes Construcción España", page_icon="🏗️", layout="wide")
+instrument.start_run("rerun")  # no-op unless CAPEX_PROFILE=1
+instrument.phase("modelo")
+
+# compiled once per process, shared across sessions/pages, reloaded when data files change
+model = resources.model()
+cost_data = model.cost_data
+bench_df = model.benchmarks
+cities_df = model.cities
+soft_df = model.soft_items
+cont_df = model.cont_items
+
+# long computations run in the process-wide job pool; reruns reattach to the job with the same inputs
+job_pool = jobs.shared()
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+
+@st.fragment(run_every=0.5)
+def job_progress(job_id: str, show_partial=None):
+    """Se refresca sola mientras el trabajo sigue; al terminar relanza la app para pintar el resultado."""
+    job = job_pool.get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    text = f"{job.label}: {jobs.STATUS_LABELS[job.status].lower()}" + (f" · {job.message}" if job.message else "")
+    st.progress(job.progress, text=text)
+    if show_partial is not None and job.partial is not None:
+        show_partial(job.partial)
+    if st.button("Cancelar", key=f"cancel_{job_id}"):
+        job.cancel()
+        st.rerun()
+
+
+def run_job(slot: str, kind: str, inputs, fn, *args, label: str, start: bool = True, show_partial=None):
+    """Resultado del trabajo si ya terminó; si no, progreso/cancelar (o error/relanzar) y None.
+    Con start=False solo se re-engancha a un trabajo ya lanzado con esas entradas."""
+    restart = st.session_state.pop(f"job_restart_{slot}", False)
+    if start or restart:
+        try:
+            job = job_pool.submit(kind, inputs, fn, *args, label=label, owner=(session_id, slot), restart=restart)
+        except jobs.JobQueueFull:
+            st.warning(f"{label}: servidor ocupado ({job_pool.max_workers} trabajos simultáneos); inténtalo en un momento.")
+            return None
+    else:
+        job = job_pool.find(kind, inputs)
+        if job is None or (job.done and job.status != jobs.DONE and (session_id, slot) not in job.owners):
+            return None
+    if job.status == jobs.DONE:
+        return job.result
+    if job.done:
+        (st.error if job.status == jobs.FAILED else st.info)(f"{label}: {jobs.STATUS_LABELS[job.status].lower()}"
+                                                             + (f" ({job.error})" if job.error else ""))
+        st.button("Relanzar", key=f"retry_{slot}", on_click=st.session_state.__setitem__, args=(f"job_restart_{slot}", True))
+    else:
+        job_progress(job.id, show_partial)
+    return None
+
+
+@st.cache_data(max_entries=16, show_spinner="Simulando registro de riesgos…")
+def cached_register(items: tuple, n_iter: int, rho: float):
+    """Registro de riesgos simulado (fracción del directo); solo se recalcula si cambian los conceptos o la configuración."""
+    rrg = resources.module("src.risk_register")
+    return rrg.simulate_register(list(items), 1.0, rrg.RegisterConfig(n_iter=n_iter, seed=42, group_correlation=rho))
 
-DATA_DIR = Path(__file__).parent / "data"
-cost_data = load_yaml(DATA_DIR / "cost_ranges.yaml")
-sources_df = load_csv(DATA_DIR / "sources_matrix.csv")
-bench_df = load_csv(DATA_DIR / "benchmarks.csv")
-cities_df = load_csv(DATA_DIR / "cities.csv")
-soft_df = load_csv(DATA_DIR / "soft_cost_items.csv")
-cont_df = load_csv(DATA_DIR / "contingency_items.csv")
 
 st.title("🏗️ Costes Construcción España")
 st.caption("Modelo paramétrico: bottom-up por capítulos + benchmarks top-down + calibración opcional + exportables.")
@@ -32,6 +85,7 @@ Monte Carlo (riesgo): hace muchas simulaciones para estimar incertidumbre y te d
 
 
 # Sidebar: module
+instrument.phase("entradas")
 module_options = [
  ("obra_nueva_edificio","Nueva edificación (edificio completo)"),
  ("reposicionamiento_edificio","Reposicionamiento (rehabilitación integral)"),
@@ -69,12 +123,25 @@ with col2:
 
 with col_city:
     st.markdown("**Ciudad**")
-    city = st.selectbox("Ciudad", options=list(cities_df["city"].values), index=0)
-    if city == "Custom":
-        city_factor = st.slider("Factor localización (manual)", 0.90, 1.20, 1.0, 0.01)
+    locs = resources.module("src.locations")
+    city_query = st.text_input("Buscar municipio o provincia", "", placeholder="p. ej. Getafe, Girona…",
+                               help="Índice de municipios INE: sin tildes ni mayúsculas; si el municipio no tiene "
+                                    "factor propio se usa el de su provincia, comunidad o el nacional.")
+    hits = locs.index_for(model).search(city_query, limit=25) if city_query.strip() else None
+    if hits is None or hits.empty:
+        if hits is not None:
+            st.caption("Sin coincidencias: lista rápida.")
+        city = st.selectbox("Ciudad", options=list(cities_df["city"].values), index=0)
+        if city == "Custom":
+            city_factor = st.slider("Factor localización (manual)", 0.90, 1.20, 1.0, 0.01)
+        else:
+            city_factor = model.city_factors[city]
+        st.caption(f"Factor localización: {city_factor:.2f}")
     else:
-        city_factor = float(cities_df.loc[cities_df["city"]==city, "location_factor"].iloc[0])
-    st.caption(f"Factor localización: {city_factor:.2f}")
+        hit = hits.iloc[st.selectbox("Resultado", options=range(len(hits)), format_func=lambda i: hits["label"].iat[i])]
+        city = hit["name"]
+        city_factor = float(hit["factor"])
+        st.caption(f"Factor localización: {city_factor:.2f} ({locs.LEVEL_LABELS[hit['level']]})")
 
 with col3:
     st.markdown("**Benchmark / calibración**")
@@ -87,7 +154,14 @@ with col4:
     st.markdown("**Modo**")
     st.caption("Monte Carlo simula incertidumbre para estimar P50/P80/P90 del coste total (riesgo).")
     show_montecarlo = st.checkbox("Monte Carlo (riesgo)", value=False)
-    n_mc = st.number_input("Simulaciones", min_value=200, max_value=20000, value=2000, step=200, disabled=not show_montecarlo)
+    n_mc = st.number_input("Simulaciones", min_value=1000, max_value=10_000_000, value=100_000, step=10_000, disabled=not show_montecarlo)
+    mc_dist = st.selectbox("Distribución €/m² por capítulo", ["triangular","pert"], disabled=not show_montecarlo,
+                           help="Muestrea cada capítulo entre sus tarifas Bajo/Medio/Alto (moda = escenario).")
+    mc_rho = st.slider("Correlación entre capítulos", 0.0, 0.95, 0.5, 0.05, disabled=not show_montecarlo)
+    mc_spread = st.slider("Incertidumbre factores (±)", 0.0, 0.20, 0.05, 0.01, disabled=not show_montecarlo)
+    mc_seed = st.number_input("Semilla", min_value=0, value=42, step=1, disabled=not show_montecarlo)
+    mc_keep = st.checkbox("Guardar muestras (análisis por filtros)", value=False, disabled=not show_montecarlo,
+                          help="Guarda las muestras en disco (data/.cache/mc); con las mismas entradas se reabren sin volver a simular.")
 
 if area_ref <= 0:
     st.warning("Introduce una superficie > 0.")
@@ -139,23 +213,37 @@ if module_key == "fitout_local_por_uso":
 st.markdown("### Factores (multiplicadores)")
 f1,f2,f3,f4,f5 = st.columns(5)
 with f1:
-    complejidad = st.slider("Complejidad", 0.85, 1.25, 1.0, 0.01)
-    altura = st.slider("Altura", 0.95, 1.20, 1.0, 0.01)
+    complejidad = st.slider("Complejidad", *FACTOR_RANGES["complejidad"], 1.0, 0.01)
+    altura = st.slider("Altura", *FACTOR_RANGES["altura"], 1.0, 0.01)
 with f2:
-    localizacion_adj = st.slider("Localización (ajuste adicional)", 0.90, 1.20, 1.0, 0.01)
+    localizacion_adj = st.slider("Localización (ajuste adicional)", *FACTOR_RANGES["localizacion"], 1.0, 0.01)
     localizacion = float(localizacion_adj * city_factor)
-    indexacion = st.slider("Indexación temporal", 0.85, 1.35, 1.0, 0.01, help="Factor manual (MITMA/INE).")
+    idx = resources.module("src.indexation")
+    idx_table = idx.index_table(model)
+    use_series = st.checkbox("Indexar con series MITMA/INE", value=False, disabled=idx_table.empty,
+                             help="Series en data/cost_indices.csv; factores distintos para MEP, acabados y resto.")
+    indexacion = st.slider("Indexación temporal", *FACTOR_RANGES["indexacion_temporal"], 1.0, 0.01,
+                           help="Factor manual (MITMA/INE).", disabled=use_series)
+    if use_series:
+        idx_lo, idx_hi = (pd.Timestamp(d).date() for d in idx_table.date_range())
+        idx_target = st.date_input("Fecha objetivo", value=idx_hi, min_value=idx_lo, max_value=idx_hi)
+        indexacion, idx_groups = idx.blended_factor(model, module_key, "mid", float(m2_above), float(m2_below), idx_target)
+        st.caption(f"Desde {idx.base_date(model)}: factor {indexacion:.3f} "
+                   + " · ".join(f"{idx.GROUP_LABELS[g]} {v:.3f}" for g, v in idx_groups.items()))
+    elif idx_table.empty:
+        st.caption("Sin series en data/cost_indices.csv (indexación manual).")
     st.caption(f"Localización efectiva: {localizacion:.2f}")
 with f3:
-    intensidad_mep = st.slider("Intensidad MEP", 0.90, 1.30, 1.0, 0.01)
-    acabados = st.slider("Nivel acabados", 0.90, 1.30, 1.0, 0.01)
+    intensidad_mep = st.slider("Intensidad MEP", *FACTOR_RANGES["intensidad_mep"], 1.0, 0.01)
+    acabados = st.slider("Nivel acabados", *FACTOR_RANGES["acabados"], 1.0, 0.01)
 with f4:
-    certificacion = st.slider("Certificación/ESG", 1.00, 1.12, 1.0, 0.01)
-    plazo = st.slider("Plazo", 0.95, 1.15, 1.0, 0.01)
+    certificacion = st.slider("Certificación/ESG", *FACTOR_RANGES["certificacion"], 1.0, 0.01)
+    plazo = st.slider("Plazo", *FACTOR_RANGES["plazo"], 1.0, 0.01)
 with f5:
-    estado_previo = st.slider("Estado previo", 0.85, 1.35, 1.0, 0.01)
+    estado_previo = st.slider("Estado previo", *FACTOR_RANGES["estado_previo"], 1.0, 0.01)
 
 
+instrument.phase("editores")
 st.markdown("### Soft costs (desglose)")
 with st.expander("Editar desglose de soft costs (sobre coste directo)"):
     st.caption("Se aplican como % sobre coste directo. Marca 'aplica' para incluir/excluir conceptos.")
@@ -192,11 +280,49 @@ with st.expander("Editar desglose de contingencia (sobre coste directo)"):
             "aplica": st.column_config.CheckboxColumn("Aplica", help="Incluir este concepto en el total"),
             "concepto": st.column_config.TextColumn("Concepto"),
             "pct_sobre_directo": st.column_config.NumberColumn("% sobre directo", format="%.2f %%", min_value=0.0, step=0.10),
+            "probabilidad": st.column_config.NumberColumn("Probabilidad", format="%.2f", min_value=0.0, max_value=1.0, step=0.05),
+            "impacto_min_pct": st.column_config.NumberColumn("Impacto mín. %", format="%.2f", min_value=0.0, step=0.10),
+            "impacto_moda_pct": st.column_config.NumberColumn("Impacto moda %", format="%.2f", min_value=0.0, step=0.10),
+            "impacto_max_pct": st.column_config.NumberColumn("Impacto máx. %", format="%.2f", min_value=0.0, step=0.10),
+            "distribucion": st.column_config.SelectboxColumn("Distribución", options=["triangular","pert"]),
+            "grupo": st.column_config.TextColumn("Grupo", help="Conceptos del mismo grupo tienden a ocurrir juntos"),
+            "depende_de": st.column_config.TextColumn("Depende de", help="Concepto cuya ocurrencia cambia la probabilidad"),
+            "prob_si_depende": st.column_config.NumberColumn("Prob. si ocurre", format="%.2f", min_value=0.0, max_value=1.0, step=0.05),
         },
     )
     cont_items_pct = float(cont_edit.loc[cont_edit["aplica"]==True, "pct_sobre_directo"].sum())
     cont_items_frac = cont_items_pct/100.0
-    st.write(f"**Contingencia total (suma aplicables): {cont_items_pct:.2f}% del directo**")
+    cont_mode = st.radio("Cálculo de la contingencia", ["Suma de % (plana)", "Registro de riesgos (simulación)"],
+                         horizontal=True,
+                         help="La simulación trata cada concepto como un evento con probabilidad e impacto (% del directo) "
+                              "y usa el percentil elegido de la contingencia total.")
+    if cont_mode.startswith("Registro"):
+        rrg = resources.module("src.risk_register")
+        r1, r2, r3 = st.columns(3)
+        with r1:
+            cont_level = st.selectbox("Percentil", [50, 80, 90], index=1, format_func=lambda p: f"P{p}")
+        with r2:
+            cont_n = st.number_input("Iteraciones", min_value=1000, max_value=5_000_000, value=200_000, step=50_000)
+        with r3:
+            cont_rho = st.slider("Correlación dentro de grupo", 0.0, 0.95, 0.5, 0.05)
+        try:
+            cont_sim = cached_register(tuple(rrg.items_from_frame(cont_edit)), int(cont_n), float(cont_rho))
+        except ValueError as e:
+            st.error(f"Registro de riesgos no válido: {e}")
+        else:
+            cont_items_frac = cont_sim.pct(cont_level)
+            cont_items_pct = cont_items_frac*100.0
+            st.caption("Contingencia simulada (% del directo): media {:.2f}% · ".format(cont_sim.total.mean*100)
+                       + " · ".join(f"{k} {v*100:.2f}%" for k, v in cont_sim.percentiles().items()))
+            contrib = cont_sim.items[["item","probability","occurrence","mean"] + [f"contrib_P{p}" for p in rrg.LEVELS]].copy()
+            contrib[["mean"] + [f"contrib_P{p}" for p in rrg.LEVELS]] *= 100.0
+            st.dataframe(contrib.rename(columns={"item":"Concepto","probability":"Prob.","occurrence":"Ocurrencia",
+                                                 "mean":"Media %", **{f"contrib_P{p}": f"Aporte P{p} %" for p in rrg.LEVELS}})
+                         .style.format({"Prob.":"{:.2f}","Ocurrencia":"{:.2%}","Media %":"{:.2f}",
+                                        **{f"Aporte P{p} %": "{:.2f}" for p in rrg.LEVELS}}),
+                         hide_index=True, use_container_width=True)
+    st.write(f"**Contingencia total ({'P%d simulado' % cont_level if cont_mode.startswith('Registro') else 'suma aplicables'}): "
+             f"{cont_items_pct:.2f}% del directo**")
 
 factors = Factors(
 
@@ -205,36 +331,6 @@ factors = Factors(
     plazo=plazo, estado_previo=estado_previo, indexacion_temporal=indexacion
 )
 
-# Compute
-totals_by_scenario, breakdowns = {}, {}
-# Soft costs + contingencia overrides
-options['soft_items_pct'] = float(soft_items_frac) if 'soft_items_frac' in globals() else float(soft_df['pct_sobre_directo'].sum())/100.0
-options['cont_items_pct'] = float(cont_items_frac) if 'cont_items_frac' in globals() else float(cont_df['pct_sobre_directo'].sum())/100.0
-for sc in scenario_pick:
-    df, totals = estimate_module(
-        cost_data, module_key, sc,
-        float(m2_above), float(m2_below),
-        factors, options=options,
-        benchmark_row=bench_row,
-        auto_calibrate_to_benchmark=auto_calib
-    )
-    if not include_optional:
-        df = df[df["basis"]!="optional"].copy()
-        direct = float(df["cost_direct"].sum())
-        defaults = module_def["defaults"]
-        totals = {
-            "direct": direct,
-            "indirects": direct * float(defaults["indirects_pct"][sc]),
-            "gg_bi": direct * float(defaults["gg_bi_pct"]),
-            "soft_costs": direct * float(defaults["soft_costs_pct"][sc]),
-            "contingency": direct * float(defaults["contingency_pct"][sc]),
-        }
-        totals["total"] = sum(totals.values())
-        totals["calibration"] = 1.0
-    totals_by_scenario[sc] = totals
-    breakdowns[sc] = df
-
-
 st.markdown("### Capítulos (aplicabilidad)")
 st.caption("Marca qué capítulos aplican. Se aplica a todos los escenarios.")
 chap_base = pd.DataFrame(
@@ -254,26 +350,48 @@ chap_edit = st.data_editor(
 )
 chap_included = set(chap_edit.loc[chap_edit["aplica"]==True, "chapter_key"].tolist())
 
-# Recalcular totales con capítulos seleccionados
-for sc in scenario_pick:
-    df = breakdowns[sc].copy()
-    df = df[df["chapter_key"].isin(chap_included)].copy()
-    breakdowns[sc] = df
-    direct = float(df["cost_direct"].sum())
-    defaults = module_def["defaults"]
-    indirects = direct * float(defaults["indirects_pct"][sc])
-    gg_bi = direct * float(defaults["gg_bi_pct"])
-    soft = direct * float(options.get("soft_items_pct", defaults["soft_costs_pct"][sc]))
-    cont = direct * float(options.get("cont_items_pct", defaults["contingency_pct"][sc]))
-    totals_by_scenario[sc].update({
-        "direct": direct,
-        "indirects": indirects,
-        "gg_bi": gg_bi,
-        "soft_costs": soft,
-        "contingency": cont,
-        "total": direct + indirects + gg_bi + soft + cont,
-    })
+# Compute (staged + memoized per session: only the stages whose inputs changed are recomputed)
+instrument.phase("estimación")
+if st.session_state.get("pipeline_fp") != model.fingerprint:
+    st.session_state["pipeline"] = EstimatePipeline(model)
+    st.session_state["pipeline_fp"] = model.fingerprint
+pipeline = st.session_state["pipeline"]
 
+totals_by_scenario, breakdowns = {}, {}
+# Soft costs + contingencia overrides
+options['soft_items_pct'] = float(soft_items_frac) if 'soft_items_frac' in globals() else float(soft_df['pct_sobre_directo'].sum())/100.0
+options['cont_items_pct'] = float(cont_items_frac) if 'cont_items_frac' in globals() else float(cont_df['pct_sobre_directo'].sum())/100.0
+shared_cache = estimate_cache.shared()  # same inputs from any session/user: served from memory or disk
+price_cube = resources.module("src.cube").cube_for(model)  # standard typologies (no chapter factors / calibration): €/m² lookup + scaling
+for sc in scenario_pick:
+    res = price_cube.estimate_result(
+        model, module_key, sc, float(m2_above), float(m2_below), factors, options=options, benchmark_row=bench_row,
+        auto_calibrate_to_benchmark=auto_calib, include_optional=include_optional, chapters=chap_included)
+    if res is None:
+        res = shared_cache.estimate_result(
+            model, module_key, sc,
+            float(m2_above), float(m2_below),
+            factors, options=options,
+            benchmark_row=bench_row,
+            auto_calibrate_to_benchmark=auto_calib,
+            include_optional=include_optional,
+            chapters=chap_included,
+            compute=pipeline.run_result,
+        )
+    totals_by_scenario[sc] = res.totals()
+    breakdowns[sc] = res  # EstimateResult: the DataFrame is only built for CSV/PDF export
+
+with st.sidebar.expander("Recálculo incremental"):
+    cs = shared_cache.stats()
+    st.caption(f"Caché compartida: {cs['hit_rate']:.0%} aciertos ({cs['hits_memory']} memoria, {cs['hits_disk']} disco, "
+               f"{cs['misses']} fallos) · {cs['entries']} entradas, {cs['bytes']/1e6:.1f} MB"
+               + (f" · disco {cs['disk']['entries']} entradas" if cs["disk"] else ""))
+    st.caption(f"Cubo €/m²: {price_cube.cells:,} celdas ({price_cube.nbytes/1e3:,.0f} kB) · {price_cube.hits:,} consultas "
+               f"resueltas, {price_cube.misses:,} al cálculo completo (factores de capítulo, calibración)")
+    st.caption("Aciertos/fallos de caché por etapa (esta sesión, solo fallos de la caché compartida).")
+    st.dataframe(pipeline.stats_frame(), hide_index=True, use_container_width=True)
+
+instrument.phase("resultados")
 st.markdown("### Resultados")
 t_tab = totals_table(totals_by_scenario, float(area_ref))
 st.dataframe(t_tab.style.format({
@@ -287,44 +405,201 @@ st.markdown("### Desglose por capítulos (directo)")
 tabs = st.tabs([SCENARIO_LABELS[s] for s in scenario_pick]) if scenario_pick else []
 for i, sc in enumerate(scenario_pick):
     with tabs[i]:
-        df = breakdowns[sc].copy()
-        df2 = df[["capitulo","cost_direct"]].groupby("capitulo", as_index=False).sum().sort_values("cost_direct", ascending=False)
-        st.dataframe(df2.style.format({"cost_direct":"{:,.0f} €"}), use_container_width=True)
-        st.bar_chart(df2.set_index("capitulo")["cost_direct"])
-
-# Tornado sensitivity (simple): show contribution of each factor
-st.markdown("### Sensibilidad (drivers)")
-driver = pd.DataFrame([
-    ["Complejidad", complejidad],
-    ["Altura", altura],
-    ["Localización", localizacion],
-    ["Indexación temporal", indexacion],
-    ["Intensidad MEP", intensidad_mep],
-    ["Nivel acabados", acabados],
-    ["Certificación/ESG", certificacion],
-    ["Plazo", plazo],
-    ["Estado previo", estado_previo],
-], columns=["driver","factor"])
-driver["impact_vs_1"] = (driver["factor"] - 1.0).abs()
-driver = driver.sort_values("impact_vs_1", ascending=False)
-st.dataframe(driver[["driver","factor"]].style.format({"factor":"{:.3f}"}), use_container_width=True)
-
-# Monte Carlo risk (lognormal around current totals of mid scenario)
+        by_chapter = breakdowns[sc].by_label()
+        st.dataframe(by_chapter.reset_index().style.format({"cost_direct":"{:,.0f} €"}), use_container_width=True)
+        st.bar_chart(by_chapter)
+
+# Variance: Δ total and per chapter split by cause (vs. another scenario, a pinned reference or an earlier CSV export)
+instrument.phase("variación")
+var_pdf = None
+if scenario_pick and st.checkbox("Análisis de variaciones", value=False):
+    st.markdown("### Variación")
+    vm = resources.module("src.variance")
+    cur_frame = pd.concat([vm.result_frame(breakdowns[sc]) for sc in scenario_pick], ignore_index=True)
+    var_modes = {"escenarios": "Otro escenario", "referencia": "Referencia fijada", "csv": "CSV exportado"}
+    if len(scenario_pick) < 2:
+        var_modes.pop("escenarios")
+    v1, v2 = st.columns([1.2, 2.0])
+    with v1:
+        var_mode = st.radio("Comparar con", list(var_modes), format_func=var_modes.get)
+        if st.button("Fijar como referencia", help="Guarda la estimación actual (todos los escenarios) para comparar tras cambiar entradas o datos."):
+            st.session_state["variance_ref"] = cur_frame
+    var, var_title = None, ""
+    with v2:
+        if var_mode == "escenarios":
+            va, vb = st.columns(2)
+            sc_a = va.selectbox("Base", scenario_pick, format_func=lambda s: SCENARIO_LABELS[s], key="var_sc_a")
+            sc_b = vb.selectbox("Comparado", scenario_pick, index=len(scenario_pick)-1, format_func=lambda s: SCENARIO_LABELS[s], key="var_sc_b")
+            var = vm.decompose(vm.drivers_from_result(breakdowns[sc_a]), vm.drivers_from_result(breakdowns[sc_b]),
+                               on=["project","module"])
+            var_title = f"escenario {SCENARIO_LABELS[sc_a]} ({SCENARIO_LABELS[sc_b]})"
+        elif var_mode == "referencia":
+            ref_frame = st.session_state.get("variance_ref")
+            if ref_frame is None:
+                st.info("Pulsa «Fijar como referencia», cambia entradas y vuelve aquí.")
+            else:
+                var = vm.decompose(vm.drivers_from_frame(ref_frame), vm.drivers_from_frame(cur_frame), on=["scenario"])
+                var_title = "la referencia fijada"
+        else:
+            var_up = st.file_uploader("CSV de «Preparar CSV»", type=["csv"], key="variance_upload")
+            if var_up is not None:
+                old_frame = pd.read_csv(var_up)
+                if "factor_capitulo" not in old_frame.columns:
+                    st.error("El CSV no tiene las columnas factor_* del desglose exportado.")
+                else:
+                    new_frame = cur_frame
+                    if not all(c in old_frame.columns for c in vm.PCT_COLUMNS):  # older exports: direct cost only
+                        new_frame = cur_frame.drop(columns=vm.PCT_COLUMNS)
+                        st.caption("CSV sin columnas de % del total: se compara solo el coste directo.")
+                    var = vm.decompose(vm.drivers_from_frame(old_frame), vm.drivers_from_frame(new_frame), on=["scenario"])
+                    var_title = var_up.name
+    if var is not None:
+        vs = var.summary()
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Anterior", f"{vs['old']:,.0f} €")
+        m2.metric("Actual", f"{vs['new']:,.0f} €")
+        m3.metric("Δ", f"{vs['delta']:+,.0f} €", f"{vs['delta']/vs['old']:+.1%}" if vs["old"] else None, delta_color="inverse")
+        dt = vm.driver_table(var)
+        st.bar_chart(dt[dt["delta"].abs() >= 0.5].set_index("causa")["delta"], horizontal=True)
+        var_cols = {"old": "anterior", "new": "actual", "delta": "Δ", **vm.DRIVER_LABELS}
+        st.dataframe(var.by_chapter(15).rename(columns=var_cols).style.format("{:,.0f} €", subset=[var_cols[c] for c in ("old","new","delta", *vm.DIRECT_DRIVERS)]),
+                     hide_index=True, use_container_width=True)
+        st.download_button("⬇️ Variaciones por capítulo (CSV)", var.chapters.to_csv(index=False).encode("utf-8"),
+                           file_name="capex_variaciones.csv", mime="text/csv")
+        var_pdf = vm.report_section(var, var_title)
+
+# Sensitivity: tornado (one-at-a-time, slider ranges) + Sobol indices (factors, chapter rates, soft/contingency)
+instrument.phase("sensibilidad")
+st.markdown("### Sensibilidad")
+sens_sc = "mid" if "mid" in totals_by_scenario else (scenario_pick[0] if scenario_pick else None)
+if sens_sc is not None and st.checkbox("Tornado e índices de sensibilidad", value=False):
+    sensitivity = resources.module("src.sensitivity")  # pulls in src.risk: only when asked for
+    sens = sensitivity.build_model(model, module_key, sens_sc, float(m2_above), float(m2_below), factors,
+                                     options=options, chapters=chap_included, include_optional=include_optional,
+                                     calibration=totals_by_scenario[sens_sc]["calibration"],
+                                     ranges={"localizacion": tuple(x*city_factor for x in FACTOR_RANGES["localizacion"])})
+    tor = sensitivity.tornado(sens).head(15)
+    st.caption(f"Escenario {SCENARIO_LABELS[sens_sc]}: Δ total al llevar cada entrada a su extremo (sliders; €/m² capítulo "
+               f"bajo→alto; soft/contingencia ±50%). Base {tor.attrs['base_total']:,.0f} €.")
+    st.bar_chart(tor.set_index("label")[["delta_low","delta_high"]], horizontal=True, stack=False)
+    if st.checkbox("Índices de Sobol (varianza)", value=False):
+        n_sobol = st.number_input("Muestras N", min_value=256, max_value=65536, value=4096, step=256)
+        sob = run_job("sobol", "sobol", (sens, int(n_sobol)), jobs.sobol_job, sens, int(n_sobol), label="Sobol")
+        if sob is not None:
+            st.dataframe(sob[["label","S1","ST"]].head(15).style.format({"S1":"{:.3f}","ST":"{:.3f}"}),
+                         hide_index=True, use_container_width=True)
+            st.caption(f"{sob.attrs['evaluations']:,} evaluaciones; S1 = efecto propio, ST = efecto total (con interacciones).")
+
+# Design-space search: which specification fits a target €/m² (Pareto front cost × specification)
+instrument.phase("diseño")
+if sens_sc is not None and st.checkbox("Búsqueda de diseño (presupuesto objetivo)", value=False):
+    st.markdown("### Búsqueda de diseño")
+    dsp = resources.module("src.design_space")
+    eur_m2_now = totals_by_scenario[sens_sc]["total"]/float(area_ref)
+    d1, d2, d3 = st.columns([1.2, 2.0, 1.0])
+    with d1:
+        budget = st.number_input(f"Objetivo (€/{area_label}, total)", min_value=0.0,
+                                 value=float(round(eur_m2_now, -1)), step=10.0)
+    with d2:
+        option_dims = [o for o in ("building_use","intervention_level","reform_level","use","include_furniture")
+                       if (o == "building_use" and module_key in ("obra_nueva_edificio","reposicionamiento_edificio"))
+                       or (o == "include_furniture" and module_key == "fitout_oficinas")
+                       or (o in ("intervention_level","reform_level","use") and o in options)]
+        dim_labels = {**FACTOR_LABELS, **dsp.OPTION_LABELS}
+        default_dims = [d for d in list(dsp.SPEC_FACTORS) + option_dims if d != "building_use"]
+        vary = st.multiselect("Dimensiones a explorar", list(FACTOR_RANGES) + option_dims, default=default_dims,
+                              format_func=lambda k: dim_labels.get(k, k),
+                              help="El resto de factores y opciones quedan en los valores actuales. Uso = programa (un frente por uso).")
+    with d3:
+        ds_step = st.select_slider("Paso factores", options=[0.05, 0.02, 0.01, 0.005], value=0.01)
+    space = dsp.build_space(model, module_key, float(m2_above), float(m2_below), factors, options=options,
+                            scenario=sens_sc, vary=vary, step=float(ds_step), include_optional=include_optional,
+                            chapters=chap_included,
+                            ranges={"localizacion": tuple(x*city_factor for x in FACTOR_RANGES["localizacion"])})
+    ds = dsp.search(space, budget_eur_m2=float(budget))
+    st.caption(f"{ds.evaluated:,} configuraciones {'(muestra) ' if ds.sampled else ''}de {space.size:,} en "
+               f"{ds.seconds:.2f} s; {ds.feasible:,} bajo objetivo. Escenario {SCENARIO_LABELS[sens_sc]}, sin auto-calibración.")
+    front = ds.front.rename(columns={"eur_m2": "€/m²", "score": "especificación"})
+    st.scatter_chart(front, x="€/m²", y="especificación", color="within_budget" if budget > 0 else None)
+    if ds.best.empty:
+        st.warning("Ninguna configuración cumple el objetivo.")
+    else:
+        show = ds.best.drop(columns=["group","within_budget"]).rename(columns=dim_labels)
+        st.markdown("**Mayor especificación dentro del objetivo**")
+        st.dataframe(show.style.format({"total":"{:,.0f} €","eur_m2":"{:,.0f}","score":"{:.2f}"}),
+                     hide_index=True, use_container_width=True)
+
+# Monthly cashflow (S-curve) of the estimate: chapter timing profiles + retention (data/cashflow_profiles.yaml)
+instrument.phase("flujo_caja")
+if sens_sc is not None and st.checkbox("Flujo de caja mensual (curva S)", value=False):
+    st.markdown("### Flujo de caja (curva S)")
+    cfm = resources.module("src.cashflow")
+    cf_dur, cf_pre = cfm.default_schedule(module_key, float(m2_above) + float(m2_below))
+    f1, f2, f3 = st.columns(3)
+    with f1:
+        cf_start = st.date_input("Inicio de obra", value=pd.Timestamp.today().normalize().replace(day=1))
+    with f2:
+        cf_dur = st.number_input("Plazo de obra (meses)", min_value=1, max_value=120, value=cf_dur, step=1)
+    with f3:
+        cf_pre = st.number_input("Preconstrucción (meses)", min_value=0, max_value=36, value=cf_pre, step=1,
+                                 help="Proyecto y licencias antes de obra: ahí caen la mayor parte de los soft costs.")
+    cf = cfm.estimate_cashflow(breakdowns[sens_sc], duration_months=int(cf_dur), preconstruction_months=int(cf_pre),
+                               start_month=cf_start.year*12 + cf_start.month - 1, dated=True)
+    cf_df = cf.frame()
+    peak = cf_df.loc[cf_df["total"].idxmax()]
+    st.caption(f"Escenario {SCENARIO_LABELS[sens_sc]}. Pico {peak['total']:,.0f} € en {peak['month']}; "
+               f"la retención ({cfm.load_profiles().retention_pct:.0%}) se devuelve "
+               f"{cfm.load_profiles().release_months} meses después del fin de obra.")
+    monthly = cf_df.set_index("month")[[c for c in cf.components]].rename(columns=cfm.COMPONENT_LABELS)
+    st.bar_chart(monthly)
+    st.line_chart(cf_df.set_index("month")[["cumulative"]].rename(columns={"cumulative": "Acumulado"}))
+    st.download_button("Descargar flujo mensual (CSV)", data=cf_df.to_csv(index=False).encode("utf-8"),
+                       file_name="flujo_caja.csv", mime="text/csv")
+
+# Monte Carlo risk (chapter rates + factors, mid scenario)
+instrument.phase("monte_carlo")
 if show_montecarlo and "mid" in totals_by_scenario:
     st.markdown("### Riesgo (Monte Carlo)")
-    base_total = totals_by_scenario["mid"]["total"]
-    # sigma based on contingency + complexity (heuristic)
-    sigma = min(0.35, 0.12 + 0.10*(complejidad-1.0) + 0.15*(estado_previo-1.0))
-    mu = math.log(base_total) - 0.5*sigma*sigma
-    sims = np.random.lognormal(mean=mu, sigma=sigma, size=int(n_mc))
-    p50 = float(np.percentile(sims,50))
-    p80 = float(np.percentile(sims,80))
-    p90 = float(np.percentile(sims,90))
-    st.write(f"P50: **{p50:,.0f} €** | P80: **{p80:,.0f} €** | P90: **{p90:,.0f} €**  (sigma={sigma:.2f})")
-    hist = pd.DataFrame({"total": sims})
-    st.bar_chart(hist["total"].value_counts(bins=30).sort_index())
+    risk = resources.module("src.risk")
+    mc_cfg = risk.MonteCarloConfig(n_iter=int(n_mc), seed=int(mc_seed), rate_dist=mc_dist,
+                              rate_correlation=float(mc_rho), factor_spread=float(mc_spread))
+    mc_spec = risk.build_spec(model, module_key, "mid", float(m2_above), float(m2_below), factors, options=options,
+                         chapters=chap_included, include_optional=include_optional,
+                         calibration=totals_by_scenario["mid"]["calibration"], config=mc_cfg)
+    mc_out = run_job("monte_carlo", "monte_carlo", (mc_spec, mc_cfg, bool(mc_keep)), jobs.monte_carlo_job,
+                     mc_spec, mc_cfg, bool(mc_keep), label=f"Monte Carlo ({int(n_mc):,} iteraciones)",
+                     show_partial=lambda p: st.caption(f"Parcial ({p['n']:,} iteraciones): P50 {p['P50']:,.0f} € | "
+                                                       f"P80 {p['P80']:,.0f} € | P90 {p['P90']:,.0f} €"))
+    if mc_out is not None:
+        mc, mc_store, mc_reused = mc_out if mc_keep else (mc_out, None, False)
+        if mc_store is not None and not resources.module("src.columnar").is_dataset(mc_store.path):
+            st.session_state["job_restart_monte_carlo"] = True  # samples pruned from disk since the job finished
+            st.rerun()
+        pct = mc.percentiles((50, 80, 90))
+        st.write(f"P50: **{pct['P50']:,.0f} €** | P80: **{pct['P80']:,.0f} €** | P90: **{pct['P90']:,.0f} €**  "
+                 f"(media {mc.total.mean:,.0f} €, σ {mc.total.std:,.0f} €, n={mc.n:,})")
+        edges, counts = mc.total.coarse(30)
+        st.bar_chart(pd.Series(counts, index=[f"{e:,.0f}" for e in edges[:-1]], name="total"))
+        if mc_keep:
+            st.caption(("Muestras reabiertas del disco (sin simular). " if mc_reused else "Muestras guardadas. ")
+                       + f"{mc_store.rows:,} iteraciones en {mc_store.path.name}")
+            fc1, fc2 = st.columns([1, 2])
+            with fc1:
+                f_name = st.selectbox("Filtrar por factor", list(FACTOR_LABELS), format_func=lambda k: FACTOR_LABELS[k])
+            f_lo, f_hi = float(mc_store.spec[f_name]["min"]), float(mc_store.spec[f_name]["max"])
+            with fc2:
+                f_rng = st.slider("Rango del factor", f_lo, f_hi, (f_lo, f_hi), step=max((f_hi - f_lo)/100, 1e-4),
+                                  format="%.3f", disabled=not f_hi > f_lo)
+            sub = mc_store.distribution("total", where={f_name: tuple(f_rng)})
+            if sub.n:
+                st.write(f"Con {FACTOR_LABELS[f_name]} en [{f_rng[0]:.3f}, {f_rng[1]:.3f}] ({sub.n/mc_store.rows:.0%} de las "
+                         f"iteraciones): P50 **{sub.quantile(0.5):,.0f} €** | P80 **{sub.quantile(0.8):,.0f} €** | "
+                         f"P90 **{sub.quantile(0.9):,.0f} €**")
+            else:
+                st.info("Ninguna iteración cumple el filtro.")
 
 # Export
+instrument.phase("exportables")
 st.markdown("### Exportables")
 cA, cB, cC = st.columns([1,1,2])
 with cA:
@@ -332,20 +607,25 @@ with cA:
 with cB:
     project_name = st.text_input("Proyecto (opcional)", value="")
 with cC:
-    st.caption("CSV: desglose + factores. PDF: resumen + desglose + fuentes + benchmark.")
-
-if st.button("Preparar CSV"):
-    df_out = breakdowns[sc_export].copy()
-    df_out["scenario"] = sc_export
-    df_out["module"] = module_key
-    df_out["project"] = project_name
-    df_out["area_ref_m2"] = float(area_ref)
-    st.download_button("⬇️ Descargar CSV", df_out.to_csv(index=False).encode("utf-8"), file_name=f"capex_{module_key}_{sc_export}.csv", mime="text/csv")
-
-if st.button("Preparar PDF"):
-    with tempfile.TemporaryDirectory() as td:
-        pdf_path = Path(td) / f"capex_{module_key}_{sc_export}.pdf"
-        inp = ReportInputs(
+    st.caption("CSV: desglose + factores. PDF: resumen + desglose + fuentes + benchmark (+ variación si está activa).")
+
+if not scenario_pick:
+    st.info("Selecciona al menos un escenario para exportar CSV/PDF.")
+else:
+    if st.button("Preparar CSV"):
+        df_out = resources.module("src.variance").result_frame(breakdowns[sc_export], project_name)  # + % of the total: diffable
+        df_out["area_ref_m2"] = float(area_ref)
+        st.download_button("⬇️ Descargar CSV", df_out.to_csv(index=False).encode("utf-8"), file_name=f"capex_{module_key}_{sc_export}.csv", mime="text/csv")
+
+    # PDF rendered in the job pool: the button starts it, later reruns with the same inputs reattach to it
+    pdf_name = f"capex_{module_key}_{sc_export}.pdf"
+    pdf_key = (pdf_name, project_name, building_use_label, float(m2_above), float(m2_below), factors,
+               sorted((k, str(v)) for k, v in options.items()), totals_by_scenario[sc_export], bench_row, var_pdf)
+    pdf_clicked = st.button("Preparar PDF")
+    pdf_args = ()
+    if pdf_clicked or st.session_state.get("job_restart_pdf"):
+        pdf = resources.module("src.pdf_report")  # reportlab only when a PDF is requested
+        inp = pdf.ReportInputs(
             title=f"Informe CAPEX PRO - {project_name}".strip(" -"),
             module_label=module_def["label"],
             area_label=area_label,
@@ -360,14 +640,54 @@ if st.button("Preparar PDF"):
             options={k:str(v) for k,v in options.items()},
             notes="Estimación paramétrica orientativa."
         )
-        export_pdf(pdf_path, inp, breakdowns[sc_export], totals_by_scenario[sc_export], sources_df, bench_row)
-        st.download_button("⬇️ Descargar PDF", pdf_path.read_bytes(), file_name=pdf_path.name, mime="application/pdf")
-
-with st.expander("Fuentes (matriz)"):
-    st.dataframe(sources_df, use_container_width=True)
-
-with st.expander("Benchmarks (data/benchmarks.csv)"):
+        pdf_args = (inp, breakdowns[sc_export].to_frame(), totals_by_scenario[sc_export], resources.frame("sources"),
+                    bench_row, pdf_name, var_pdf)
+    pdf_bytes = run_job("pdf", "pdf", pdf_key, jobs.pdf_job, *pdf_args, label="Informe PDF", start=pdf_clicked)
+    if pdf_bytes is not None:
+        st.download_button("⬇️ Descargar PDF", pdf_bytes, file_name=pdf_name, mime="application/pdf")
+
+# Portfolio batch (same engine as `python -m src.batch`), run as a background job
+with st.expander("Cartera por lotes (CSV/JSONL)"):
+    st.caption("Una fila por proyecto con las columnas de `python -m src.batch` (module, m2_above, m2_below, city, factores…).")
+    up = st.file_uploader("Proyectos", type=["csv", "jsonl"], key="batch_upload")
+    if up is not None:
+        up_bytes = up.getvalue()
+        suffix = Path(up.name).suffix.lower()
+        n_proj = max(up_bytes.count(b"\n") - (suffix == ".csv"), 1)
+        batch_items = st.checkbox("% soft/contingencia de data/*_items.csv", value=True, key="batch_items")
+        batch_out = run_job("batch", "batch", (up_bytes, suffix, batch_items), jobs.batch_job, up_bytes, suffix, n_proj,
+                            batch_items, label=f"Cartera {up.name}", start=st.button("Estimar cartera"))
+        if batch_out is not None:
+            bs = batch_out["stats"]
+            st.caption(f"{bs['projects']:,} proyectos → {bs['rows_out']:,} filas en {bs['seconds']:.1f} s")
+            st.download_button("⬇️ Totales (CSV)", batch_out["csv"], file_name=f"totales_{Path(up.name).stem}.csv",
+                               mime="text/csv")
+
+# reference tables: read and serialised only when shown
+if st.toggle("Fuentes (matriz)", value=False):
+    st.dataframe(resources.frame("sources"), use_container_width=True)
+
+if st.toggle("Benchmarks (data/benchmarks.csv)", value=False):
     st.dataframe(bench_df, use_container_width=True)
 
 st.markdown("---")
 st.caption("Edita rangos y multiplicadores en data/cost_ranges.yaml y benchmarks en data/benchmarks.csv. Mantén trazabilidad en data/sources_matrix.csv.")
+
+with st.sidebar.expander("Trabajos en segundo plano"):
+    js = job_pool.stats()
+    st.caption(f"{js['running']} en marcha / {js['workers']} simultáneos (CAPEX_JOB_WORKERS) · {js['queued']} en cola · "
+               f"{js['finished']} terminados")
+    if js["running"] or js["queued"] or js["finished"]:
+        st.dataframe(job_pool.frame().style.format({"progreso": "{:.0%}"}), hide_index=True, use_container_width=True)
+
+# Profiling panel (CAPEX_PROFILE=1): timings of this rerun
+prof = instrument.finish_run()
+if prof is not None:
+    with st.sidebar.expander("Perfilado (este rerun)", expanded=False):
+        st.dataframe(pd.DataFrame(prof.summary()).style.format({"total_ms":"{:,.1f}","mean_ms":"{:,.2f}"}),
+                     hide_index=True, use_container_width=True)
+        st.write({k: v for k, v in sorted(prof.counters.items())})
+        st.download_button("⬇️ Spans (JSON)", json.dumps(prof.to_dict(), ensure_ascii=False, default=str),
+                           file_name="capex_profile.json", mime="application/json")
+        st.download_button("⬇️ Chrome trace", json.dumps(prof.to_chrome_trace(), default=str),
+                           file_name="capex_trace.json", mime="application/json")
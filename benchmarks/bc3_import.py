@@ -0,0 +1,116 @@
+"""
+Importador BC3: rendimiento de parseo y memoria pico con un fichero FIEBDC-3 sintético.
+
+    python benchmarks/bc3_import.py [--concepts 200000] [--chapters 20] [--keep DIR]
+
+Genera un banco de precios con raíz, capítulos, subcapítulos, partidas y descompuestos (mano de obra,
+maquinaria, materiales), codificado en cp850 como los ficheros reales. Mide MB/s, conceptos/s, memoria
+pico de Python (tracemalloc) y RSS máximo del proceso, latencia de búsqueda por código y por capítulo,
+y comprueba que el rollup por capítulo cuadra con los importes generados.
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.bc3 import import_bc3, Bc3Store
+
+
+def make_bc3(path: Path, n_concepts: int = 200_000, n_chapters: int = 20, seed: int = 0) -> float:
+    """Escribe un .bc3 sintético y devuelve el importe total esperado (Σ rendimiento × precio de partidas)."""
+    rng = random.Random(seed)
+    n_basic = max(10, n_concepts//3)
+    n_items = max(n_chapters*2, n_concepts - n_basic - n_chapters*3)
+    subs_per = 2
+    total = 0.0
+    with open(path, "w", encoding="cp850", newline="\r\n") as fh:
+        fh.write("~V|SINTETICO|FIEBDC-3/2020\\01012024|benchmarks|BANCO SINTÉTICO\\|850|Banco de pruebas|1|||\n")
+        fh.write("~C|0##||Banco de precios sintético|0|01012024|0|\n")
+        fh.write("~D|0##|" + "".join(f"{c:02d}#\\1\\1\\" for c in range(1, n_chapters + 1)) + "|\n")
+        for b in range(n_basic):
+            kind = (1, 2, 3)[b % 3]
+            unit = ("h", "h", "kg")[b % 3]
+            fh.write(f"~C|B{b:07d}|{unit}|Recurso básico {b} áéíóú ñ|{rng.uniform(1, 60):.2f}|01012024|{kind}|\n")
+        item = 0
+        for c in range(1, n_chapters + 1):
+            fh.write(f"~C|{c:02d}#||Capítulo {c:02d} hormigón y acabados|0|01012024|0|\n")
+            subs = [f"{c:02d}.{s:02d}" for s in range(1, subs_per + 1)]
+            fh.write(f"~D|{c:02d}#|" + "".join(f"{s}#\\1\\1\\" for s in subs) + "|\n")
+            per_sub = n_items//(n_chapters*subs_per)
+            for s in subs:
+                fh.write(f"~C|{s}#||Subcapítulo {s}|0|01012024|0|\n")
+                lines = []
+                for _ in range(per_sub):
+                    code = f"E{item:07d}"
+                    parts = [(f"B{rng.randrange(n_basic):07d}", rng.uniform(0.05, 3.0)) for _ in range(4)]
+                    price = round(sum(q*rng.uniform(1, 60) for _, q in parts), 2)
+                    fh.write(f"~C|{code}|m2|Partida {item} de obra|{price:.2f}|01012024|0|\n")
+                    fh.write(f"~D|{code}|" + "".join(f"{p}\\1\\{q:.3f}\\" for p, q in parts) + "|\n")
+                    fh.write(f"~T|{code}|Descripción larga de la partida {item}.\nIncluye medios auxiliares.|\n")
+                    qty = round(rng.uniform(1, 500), 2)
+                    lines.append(f"{code}\\1\\{qty:.2f}\\")
+                    total += qty*price
+                    item += 1
+                fh.write(f"~D|{s}#|" + "".join(lines) + "|\n")
+    return total
+
+
+def run(n_concepts: int = 200_000, n_chapters: int = 20, keep: str | None = None, lookups: int = 2000) -> dict:
+    tmp = Path(keep) if keep else Path(tempfile.mkdtemp(prefix="bc3_bench_"))
+    tmp.mkdir(parents=True, exist_ok=True)
+    bc3, db = tmp / "synthetic.bc3", tmp / "synthetic.sqlite"
+    t = time.perf_counter()
+    expected = make_bc3(bc3, n_concepts, n_chapters)
+    out = {"generate_s": time.perf_counter() - t, "file_mb": bc3.stat().st_size/1e6}
+
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    stats = import_bc3(bc3, db)
+    out["python_peak_mb"] = tracemalloc.get_traced_memory()[1]/1e6
+    tracemalloc.stop()
+    out["rss_growth_mb"] = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0)/1024
+    stats = import_bc3(bc3, db)  # untraced run for throughput
+    out.update({k: stats[k] for k in ("concepts", "decompositions", "records", "seconds", "mb_per_second")})
+    out["concepts_per_second"] = stats["concepts"]/stats["seconds"]
+    out["db_mb"] = db.stat().st_size/1e6
+
+    store = Bc3Store(db)
+    rng = random.Random(1)
+    codes = [f"E{rng.randrange(n_concepts//2):07d}" for _ in range(lookups)]
+    t = time.perf_counter()
+    found = sum(store.concept(c) is not None for c in codes)
+    out["lookup_code_us"] = (time.perf_counter() - t)/lookups*1e6
+    out["lookup_found"] = found
+    t = time.perf_counter()
+    sizes = [len(store.chapter_items(f"{c:02d}")) for c in range(1, n_chapters + 1)]
+    out["lookup_chapter_ms"] = (time.perf_counter() - t)/n_chapters*1e3
+    out["items_per_chapter"] = sum(sizes)/n_chapters
+    t = time.perf_counter()
+    amounts = store.chapter_amounts()
+    out["rollup_s"] = time.perf_counter() - t
+    out["rollup_rel_error"] = abs(amounts["amount"].sum() - expected)/expected
+    store.close()
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concepts", type=int, default=200_000)
+    ap.add_argument("--chapters", type=int, default=20)
+    ap.add_argument("--keep", help="directorio donde dejar el .bc3 y el .sqlite generados")
+    args = ap.parse_args(argv)
+    print(json.dumps(run(args.concepts, args.chapters, args.keep), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+"""
+Coste por estimación: DataFrame (estimate_module) frente a EstimateResult (arrays, DataFrame perezoso).
+
+    python benchmarks/result_footprint.py [--n 2000] [--chapters 0]
+
+Mide tiempo por estimación y memoria retenida por resultado (tracemalloc, manteniendo n resultados vivos),
+además del flujo típico de la app: estimar, filtrar capítulos y re-totalizar.
+--chapters N usa un módulo sintético de N capítulos en vez de los datos reales.
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.calculations import Factors, estimate_module
+from src.model import load_model
+from src.pipeline import estimate_result
+
+MODULE, OPTS = "obra_nueva_edificio", {"building_use": "hotel"}
+
+
+def _args(i: int):
+    return (MODULE, "mid", 1000.0 + i, 200.0, Factors(plazo=1.0 + (i % 20)/100), OPTS)
+
+
+def _time_per_call(fn, n: int) -> float:
+    fn(0)
+    t = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t)/n
+
+
+def _retained_bytes(fn, n: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    keep = [fn(i) for i in range(n)]
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del keep
+    return used/n
+
+
+def run(n: int = 2000, chapters: int = 0) -> dict:
+    model = load_model(ROOT / "data")
+    if chapters:
+        from benchmarks.suite import synthetic_model
+        model = synthetic_model(model, chapters)
+    cd = model.cost_data
+    keys = list(model.module(MODULE).keys)
+    subset = keys[: max(1, len(keys)//2)]
+
+    def frame_path(i):
+        return estimate_module(cd, *_args(i))
+
+    def result_path(i):
+        return estimate_result(model, *_args(i))
+
+    def frame_filter(i):
+        df, totals = estimate_module(cd, *_args(i))
+        df = df[df["chapter_key"].isin(subset)].copy()
+        return float(df["cost_direct"].sum())
+
+    def result_filter(i):
+        return estimate_result(model, *_args(i)).keep_chapters(subset).direct
+
+    out = {"chapters": len(keys), "n": n}
+    out["dataframe_us"] = _time_per_call(frame_path, n)*1e6
+    out["result_us"] = _time_per_call(result_path, n)*1e6
+    out["result_to_frame_us"] = _time_per_call(lambda i: result_path(i).to_frame(), n)*1e6
+    out["dataframe_filter_retotal_us"] = _time_per_call(frame_filter, n)*1e6
+    out["result_filter_retotal_us"] = _time_per_call(result_filter, n)*1e6
+    out["dataframe_bytes"] = _retained_bytes(frame_path, n)
+    out["result_bytes"] = _retained_bytes(result_path, n)
+    out["speedup"] = out["dataframe_us"]/out["result_us"]
+    out["memory_ratio"] = out["dataframe_bytes"]/out["result_bytes"]
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--chapters", type=int, default=0)
+    args = ap.parse_args(argv)
+    print(json.dumps(run(args.n, args.chapters), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,145 @@
+"""
+Generador de carga local para src.service: latencia p50/p99 y throughput.
+
+    python benchmarks/service_load.py                      # en proceso (sin servidor)
+    python benchmarks/service_load.py --url http://127.0.0.1:8000 --concurrency 64
+
+--distinct controla cuántas entradas distintas se envían (menos = más aciertos de caché).
+"""
+from __future__ import annotations
+from pathlib import Path
+from urllib.parse import urlparse
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+MODULES = {
+    "obra_nueva_edificio": {"building_use": ["residencial","oficinas","hotel","sanitario"]},
+    "reposicionamiento_edificio": {"intervention_level": ["ligero","medio","intensivo"]},
+    "reforma_piso": {"reform_level": ["parcial","integral","integral_plus"]},
+    "fitout_oficinas": {"include_furniture": [True, False]},
+}
+CITIES = ["Madrid","Barcelona","Valencia","Sevilla","Bilbao"]
+
+
+def make_payloads(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        module = rng.choice(list(MODULES))
+        p = {"module": module, "m2_above": round(rng.uniform(80, 8000), 0), "city": rng.choice(CITIES),
+             "plazo": round(rng.uniform(0.95, 1.15), 2)}
+        if module in ("obra_nueva_edificio","reposicionamiento_edificio"):
+            p["m2_below"] = round(rng.uniform(0, 1500), 0)
+        for k, vals in MODULES[module].items():
+            p[k] = rng.choice(vals)
+        out.append(p)
+    return out
+
+
+async def _inprocess_client():
+    from src.service import EstimatorApp
+    app = EstimatorApp()
+    await app.startup()
+
+    async def call(path: str, payload) -> int:
+        body = json.dumps(payload).encode()
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.sleep(3600)
+
+        status = 0
+
+        async def send(msg):
+            nonlocal status
+            if msg["type"] == "http.response.start":
+                status = msg["status"]
+
+        await app({"type": "http", "method": "POST", "path": path, "headers": []}, receive, send)
+        return status
+
+    return app, call
+
+
+def _http_client(url: str):
+    u = urlparse(url)
+    host, port = u.hostname, u.port or 80
+
+    async def call(path: str, payload) -> int:
+        body = json.dumps(payload).encode()
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        data = await reader.read()
+        writer.close()
+        return int(data.split(b" ", 2)[1]) if data else 0
+
+    return None, call
+
+
+def _pct(sorted_vals, q):
+    if not sorted_vals:
+        return float("nan")
+    i = min(len(sorted_vals) - 1, max(0, int(round(q*(len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+async def run_load(requests: int, concurrency: int, distinct: int, url: str | None = None, seed: int = 0) -> dict:
+    app, call = (await _inprocess_client()) if url is None else _http_client(url)
+    payloads = make_payloads(distinct, seed)
+    rng = random.Random(seed + 1)
+    order = [rng.randrange(distinct) for _ in range(requests)]
+    latencies = []
+    errors = 0
+    it = iter(order)
+
+    async def worker():
+        nonlocal errors
+        for idx in it:
+            t = time.perf_counter()
+            status = await call("/estimate", payloads[idx])
+            latencies.append(time.perf_counter() - t)
+            if status != 200:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    lat = sorted(latencies)
+    res = {"mode": "http" if url else "in-process", "requests": requests, "concurrency": concurrency,
+           "distinct": distinct, "errors": errors, "seconds": elapsed, "throughput_rps": requests/elapsed,
+           "p50_ms": _pct(lat, 0.50)*1000, "p99_ms": _pct(lat, 0.99)*1000}
+    if app is not None:
+        res.update({"cache_hits": app.cache.hits, "cache_misses": app.cache.misses,
+                    "batches": app.batcher.batches, "avg_batch": app.batcher.items/max(1, app.batcher.batches)})
+        await app.shutdown()
+    return res
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="servidor en marcha; sin --url se llama a la app ASGI en proceso")
+    ap.add_argument("--requests", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--distinct", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    res = asyncio.run(run_load(args.requests, args.concurrency, args.distinct, args.url, args.seed))
+    print(json.dumps(res, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,83 @@
+"""
+Arranque en frío de las páginas Streamlit: tiempo de imports y tiempo hasta el primer render.
+
+    python benchmarks/startup.py [--repeat 3] [--no-model-cache] [-o startup.json]
+
+Cada medida se hace en un proceso nuevo: primero se ejecutan solo las sentencias import de la página
+(tiempo de imports) y después la página completa con streamlit.testing (primer render, sin navegador).
+También se indica qué módulos pesados quedaron cargados tras el primer render (los diferidos no deberían).
+--no-model-cache borra data/.cache/cost_model.pkl antes de cada medida (arranque de un contenedor nuevo).
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGES = ["app.py"] + sorted(str(p.relative_to(ROOT)) for p in (ROOT / "pages").glob("*.py"))
+HEAVY = ["pandas", "numpy", "yaml", "altair", "reportlab", "src.model", "src.pdf_report", "src.risk",
+         "src.design_space", "src.sensitivity", "src.cashflow"]
+
+_CHILD = r"""
+import ast, json, sys, time
+page = sys.argv[1]
+t0 = time.perf_counter()
+tree = ast.parse(open(page, encoding="utf-8").read())
+imports = [n for n in tree.body if isinstance(n, (ast.Import, ast.ImportFrom))]
+exec(compile(ast.Module(imports, []), page, "exec"), {"__name__": "__startup__"})
+t1 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t2 = time.perf_counter()
+at = AppTest.from_file(page, default_timeout=600).run()
+t3 = time.perf_counter()
+print(json.dumps({"imports_s": t1 - t0, "first_render_s": t3 - t2, "exceptions": [str(e.value) for e in at.exception],
+                  "loaded": [m for m in HEAVY if m in sys.modules]}))
+"""
+
+
+def measure_page(page: str, model_cache: bool = True) -> dict:
+    if not model_cache:
+        (ROOT / "data" / ".cache" / "cost_model.pkl").unlink(missing_ok=True)
+    code = f"HEAVY = {HEAVY!r}\n" + _CHILD
+    out = subprocess.run([sys.executable, "-c", code, page], cwd=str(ROOT), capture_output=True, text=True,
+                         env={**os.environ, "PYTHONPATH": str(ROOT)})
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr[-2000:])
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(repeat: int = 3, model_cache: bool = True) -> dict:
+    results = {}
+    for page in PAGES:
+        runs = [measure_page(page, model_cache) for _ in range(repeat)]
+        imp = [r["imports_s"] for r in runs]
+        ren = [r["first_render_s"] for r in runs]
+        results[page] = {"imports_s": statistics.median(imp), "first_render_s": statistics.median(ren),
+                         "total_s": statistics.median(i + r for i, r in zip(imp, ren)),
+                         "exceptions": runs[-1]["exceptions"], "loaded": runs[-1]["loaded"], "runs": repeat}
+    return {"model_cache": model_cache, "pages": results}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--no-model-cache", action="store_true")
+    ap.add_argument("-o", "--output")
+    args = ap.parse_args(argv)
+    res = run(args.repeat, not args.no_model_cache)
+    for page, r in res["pages"].items():
+        print(f"{page:40s} imports {r['imports_s']*1000:8.0f} ms  primer render {r['first_render_s']*1000:8.0f} ms  "
+              f"cargados: {', '.join(r['loaded'])}", file=sys.stderr)
+    if args.output:
+        Path(args.output).write_text(json.dumps(res, indent=2))
+    else:
+        print(json.dumps(res, indent=2))
+    return 1 if any(r["exceptions"] for r in res["pages"].values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,425 @@
+"""
+Suite de rendimiento de los caminos críticos (estimación, cartera, riesgo, sensibilidad, PDF, arranque).
+
+    python benchmarks/suite.py -o bench.json                       # ejecuta y guarda resultados
+    python benchmarks/suite.py -o new.json --baseline bench.json   # y compara con una línea base
+    python benchmarks/suite.py --from new.json --baseline bench.json
+    python benchmarks/suite.py --quick -k estimate                 # tamaños reducidos, filtro por nombre
+
+Los módulos sintéticos tienen la forma de cost_ranges.yaml (cientos de capítulos, MEP/acabados, perfiles
+de uso) y las carteras se generan con semilla fija. La comparación marca como regresión todo caso cuya
+mediana supere la de la línea base en más de --threshold (por defecto 25%) y devuelve código 1.
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import dataclasses
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pandas as pd
+
+from src.calculations import Factors, sum_chapters, apply_building_use, estimate_module, totals_table, SCENARIOS
+from src.model import CostModel, compile_cost_data, load_model
+from src.pipeline import EstimatePipeline, estimate_result
+from src.portfolio import estimate_portfolio
+from src.cube import build_cube, cube_for, estimate_totals
+from src.risk import MonteCarloConfig, build_spec, run_monte_carlo
+from src.sensitivity import build_model as build_sensitivity, sobol
+
+DATA_DIR = ROOT / "data"
+_FINISH_KEYS = ("acabados","particiones","carpinterias","envolvente","techos","obra_civil","albanileria")
+
+
+def make_module(n_chapters: int, split: bool = True, seed: int = 0) -> Dict[str, Any]:
+    """Módulo con la estructura de cost_ranges.yaml: ~30% capítulos MEP, los de acabados, resto genéricos."""
+    rng = np.random.default_rng(seed)
+    chapters = []
+    for i in range(n_chapters):
+        if i < len(_FINISH_KEYS):
+            key = _FINISH_KEYS[i]
+        elif rng.random() < 0.3:
+            key = f"mep_{i:04d}"
+        else:
+            key = f"cap_{i:04d}"
+        low = float(rng.uniform(5, 200))
+        mid, high = round(low*rng.uniform(1.1, 1.4), 1), round(low*rng.uniform(1.5, 2.0), 1)
+        ch = {"key": key, "label": f"Capítulo {i} ({key})", "basis": "base" if rng.random() < 0.9 else "optional"}
+        if split:
+            ch["above"] = {"low": round(low, 1), "mid": mid, "high": high}
+            ch["below"] = {"low": round(low*0.6, 1), "mid": round(mid*0.6, 1), "high": round(high*0.6, 1)}
+        else:
+            ch["single"] = {"low": round(low, 1), "mid": mid, "high": high}
+        chapters.append(ch)
+    return {
+        "label": f"Sintético {n_chapters} capítulos",
+        "use_profiles": {"residencial": {"label": "Residencial", "arch": 0.95, "mep": 0.95, "overall": 0.95},
+                         "hotel": {"label": "Hotel", "arch": 1.1, "mep": 1.2, "overall": 1.15}},
+        "defaults": {"indirects_pct": {"low": 0.12, "mid": 0.14, "high": 0.16}, "gg_bi_pct": 0.19,
+                     "soft_costs_pct": {"low": 0.1, "mid": 0.12, "high": 0.15},
+                     "contingency_pct": {"low": 0.05, "mid": 0.08, "high": 0.12},
+                     "level_multiplier": {"parcial": 0.75, "integral": 1.0, "integral_plus": 1.15}},
+        "chapters": chapters,
+    }
+
+
+def make_cost_data(n_chapters: int, seed: int = 0) -> Dict[str, Any]:
+    """cost_data con los módulos de edificio (sobre/bajo) y de piso (único) sustituidos por sintéticos."""
+    return {"meta": {"synthetic": True},
+            "modules": {"obra_nueva_edificio": make_module(n_chapters, True, seed),
+                        "reforma_piso": make_module(n_chapters, False, seed + 1)}}
+
+
+def synthetic_model(base: CostModel, n_chapters: int, seed: int = 0) -> CostModel:
+    cost_data = make_cost_data(n_chapters, seed)
+    return dataclasses.replace(base, fingerprint=f"synthetic-{n_chapters}-{seed}", cost_data=cost_data,
+                               modules=compile_cost_data(cost_data))
+
+
+def make_portfolio(n: int, modules: Dict[str, Any], seed: int = 0) -> pd.DataFrame:
+    """Cartera aleatoria (escenario, superficies, factores y opciones) sobre los módulos de `modules`."""
+    rng = np.random.default_rng(seed)
+    keys = list(modules)
+    return pd.DataFrame({
+        "module": rng.choice(keys, n),
+        "scenario": rng.choice(SCENARIOS, n),
+        "m2_above": rng.uniform(80, 8000, n).round(0),
+        "m2_below": rng.uniform(0, 1500, n).round(0),
+        "plazo": rng.uniform(0.95, 1.15, n).round(2),
+        "localizacion": rng.uniform(0.9, 1.2, n).round(2),
+        "building_use": rng.choice(["residencial","hotel"], n),
+        "reform_level": rng.choice(["parcial","integral","integral_plus"], n),
+    })
+
+
+def _count_pages(path: Path) -> int:
+    return path.read_bytes().count(b"/Type /Page\n") or path.read_bytes().count(b"/Type /Page")
+
+
+def measure(fn: Callable[[], Any], items: float = 1.0, unit: str = "call",
+            repeat: int = 5, min_time: float = 0.2) -> Dict[str, Any]:
+    """Mediana / mínimo por ejecución de fn (tras un calentamiento); repite hasta `repeat` y `min_time`."""
+    fn()
+    times: List[float] = []
+    t_start = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - t_start < min_time and len(times) < 1000):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    med = statistics.median(times)
+    return {"median_s": med, "min_s": min(times), "runs": len(times), "items": items, "unit": unit,
+            "rate_per_s": items/med if med > 0 else float("inf")}
+
+
+def _cold_start() -> float:
+    code = ("import streamlit, pandas, numpy, reportlab, yaml; "
+            "from src.model import load_model; from src import calculations, pipeline, risk, sensitivity, pdf_report; "
+            f"load_model({str(DATA_DIR)!r})")
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=str(ROOT), check=True)
+    return time.perf_counter() - t
+
+
+def cases(quick: bool = False) -> Dict[str, Callable[[], Dict[str, Any]]]:
+    """name → callable que devuelve la medida; los datos se preparan al ejecutar cada caso."""
+    n_chap = 100 if quick else 400
+    n_port = 20_000 if quick else 200_000
+    n_mc = 200_000 if quick else 1_000_000
+    n_sob = 1024 if quick else 4096
+    real = load_model(DATA_DIR)
+    synth = synthetic_model(real, n_chap)
+    f = Factors(plazo=1.05, localizacion=1.1, intensidad_mep=1.1, acabados=0.95)
+    opts = {"building_use": "hotel"}
+    out: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    for tag, m in (("real", real), (f"synth{n_chap}", synth)):
+        mdef = m.cost_data["modules"]["obra_nueva_edificio"]
+        n = len(mdef["chapters"])
+        out[f"sum_chapters[{tag}]"] = lambda mdef=mdef, n=n: measure(
+            lambda: sum_chapters(mdef, "mid", 2000, 500, 1.1, 0.95), n, "chapter")
+        out[f"apply_building_use[{tag}]"] = lambda mdef=mdef, n=n: measure(
+            lambda df=sum_chapters(mdef, "mid", 2000, 500, 1.1, 0.95): apply_building_use(df, mdef, "hotel"), n, "chapter")
+        out[f"estimate_module[{tag}]"] = lambda m=m: measure(
+            lambda: estimate_module(m.cost_data, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts))
+        out[f"estimate_result[{tag}]"] = lambda m=m: measure(
+            lambda: estimate_result(m, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts))
+        out[f"pipeline_warm[{tag}]"] = lambda m=m: _pipeline_case(m, f, opts)
+        out[f"monte_carlo[{tag}]"] = lambda m=m: measure(
+            lambda spec=build_spec(m, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts):
+            run_monte_carlo(spec, MonteCarloConfig(n_iter=n_mc, seed=1)), n_mc, "iteration", repeat=3, min_time=0)
+        out[f"sobol[{tag}]"] = lambda m=m: _sobol_case(m, f, opts, n_sob)
+        out[f"export_pdf[{tag}]"] = lambda m=m: _pdf_case(m, f, opts)
+
+    totals = {sc: estimate_module(real.cost_data, "obra_nueva_edificio", sc, 2000, 500, f, options=opts)[1] for sc in SCENARIOS}
+    out["totals_table"] = lambda: measure(lambda: totals_table(totals, 2500.0))
+    out["portfolio[real]"] = lambda: measure(
+        lambda p=make_portfolio(n_port, {"obra_nueva_edificio": 0, "reforma_piso": 0}): estimate_portfolio(real, p),
+        n_port, "project", repeat=3, min_time=0)
+    out[f"portfolio[synth{n_chap}]"] = lambda: measure(
+        lambda p=make_portfolio(n_port//10, synth.cost_data["modules"]): estimate_portfolio(synth, p),
+        n_port//10, "project", repeat=3, min_time=0)
+    for tag, m, mods, n in (("real", real, {"obra_nueva_edificio": 0, "reforma_piso": 0}, n_port),
+                            (f"synth{n_chap}", synth, synth.cost_data["modules"], n_port//10)):
+        out[f"cube_totals[{tag}]"] = lambda m=m, mods=mods, n=n: _cube_case(m, mods, n)
+    out["cube_build[real]"] = lambda: measure(lambda: build_cube(real), repeat=5, min_time=0)
+    out["estimate_cache_hit[real]"] = lambda: _cache_case(real, f, opts, disk=False)
+    out["estimate_cache_disk_hit[real]"] = lambda: _cache_case(real, f, opts, disk=True)
+    out["locations_resolve[synth8000]"] = lambda: _locations_case(8_000, 50_000 if quick else 200_000)
+    out["cashflow[real]"] = lambda: _cashflow_case(real, 2_000 if quick else 10_000)
+    out["reprice_one_rate[real]"] = lambda: _reprice_case(real, 10_000 if quick else 50_000)
+    out["risk_register[real]"] = lambda: _register_case(real, None, 200_000 if quick else 1_000_000)
+    out["risk_register[synth300]"] = lambda: _register_case(real, 300, 20_000 if quick else 200_000)
+    out["columnar_quantiles[mc]"] = lambda: _columnar_case(real, f, opts, n_mc, "mc")
+    out["columnar_filter[chapters]"] = lambda: _columnar_case(real, f, opts, n_port//4, "chapters")
+    out["variance_portfolio[real]"] = lambda: _variance_case(real, n_port//4)
+    out["design_search[real]"] = lambda: _design_case(real, 200_000 if quick else 1_000_000)
+    out["calibration[real]"] = lambda: _calibration_case(real, 2_000 if quick else 10_000)
+    out["pdf_batch[real]"] = lambda: _pdf_batch_case(real, 20 if quick else 100, consolidated=False)
+    out["pdf_consolidated[real]"] = lambda: _pdf_batch_case(real, 20 if quick else 100, consolidated=True)
+    out["cold_start"] = lambda: _cold_case(2 if quick else 3)
+    return out
+
+
+def _pipeline_case(m, f: Factors, opts) -> Dict[str, Any]:
+    pipe = EstimatePipeline(m)
+    plazos = itertools.cycle(np.linspace(0.95, 1.15, 21).round(2))  # only the global stage onwards changes
+    return measure(lambda: pipe.run("obra_nueva_edificio", "mid", 2000, 500,
+                                    Factors(plazo=float(next(plazos)), acabados=f.acabados), options=opts))
+
+
+def _cache_case(m, f: Factors, opts, disk: bool) -> Dict[str, Any]:
+    from src.estimate_cache import EstimateCache
+    with tempfile.TemporaryDirectory() as td:
+        warm = EstimateCache(path=Path(td) / "e.sqlite")
+        warm.estimate_result(m, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts)
+        if not disk:
+            return measure(lambda: warm.estimate_result(m, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts))
+        warm.close()
+
+        def _fresh():  # new process memory, same file: served from SQLite
+            c = EstimateCache(path=Path(td) / "e.sqlite")
+            c.estimate_result(m, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts)
+            c.close()
+        return measure(_fresh)
+
+
+def _sobol_case(m, f: Factors, opts, n: int) -> Dict[str, Any]:
+    sm = build_sensitivity(m, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts)
+    return measure(lambda: sobol(sm, n=n), n*(sm.k + 2), "evaluation", repeat=3, min_time=0)
+
+
+def _pdf_case(m, f: Factors, opts) -> Dict[str, Any]:
+    from src.pdf_report import ReportInputs, export_pdf
+    df, totals = estimate_module(m.cost_data, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts)
+    inp = ReportInputs(title="Benchmark", module_label="Nueva edificación", area_label="m²", m2_above=2000,
+                       m2_below=500, scenario_label="Medio", building_use="Hotel", factors=f.__dict__,
+                       options={k: str(v) for k, v in opts.items()}, notes="")
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td) / "bench.pdf"
+        export_pdf(path, inp, df, totals, m.sources, None)
+        pages = _count_pages(path)
+        return measure(lambda: export_pdf(path, inp, df, totals, m.sources, None), pages, "page")
+
+
+def _pdf_batch_case(m, n_projects: int, consolidated: bool) -> Dict[str, Any]:
+    from src.batch import prepare_projects
+    from src.reports import jobs_from_portfolio, export_many, export_consolidated
+    projects = prepare_projects(m, make_portfolio(n_projects, {"obra_nueva_edificio": 0, "reforma_piso": 0,
+                                                              "fitout_oficinas": 0}).drop(columns=["scenario"]))
+    with tempfile.TemporaryDirectory() as td:
+        def _run():
+            jobs = jobs_from_portfolio(m, projects)
+            if consolidated:
+                return export_consolidated(Path(td) / "cartera.pdf", jobs, m.sources)
+            return export_many(jobs, td, m.sources)
+        pages = _run()["pages"]
+        return measure(_run, pages, "page", repeat=3, min_time=0)
+
+
+def _design_case(m, n: int) -> Dict[str, Any]:
+    from src.design_space import build_space, search
+    space = build_space(m, "obra_nueva_edificio", 5000, 1000, Factors(), {"building_use": "hotel"},
+                        vary=("acabados","intensidad_mep","certificacion","complejidad","building_use"), step=0.005)
+    return measure(lambda: search(space, budget_eur_m2=2200, max_configs=n), n, "config", repeat=3, min_time=0)
+
+
+def synthetic_locations(n: int, seed: int = 0):
+    """Índice con `n` municipios inventados (nombres y factores aleatorios) sobre las provincias reales."""
+    from src.locations import LocationIndex, DATA_DIR as LOC_DIR, PROVINCES_FILE, _read
+    rng = np.random.default_rng(seed)
+    prov = _read(LOC_DIR / PROVINCES_FILE)
+    pc = rng.choice(prov["province_code"].to_numpy(), n)
+    syll = np.array(["al","ba","ca","de","el","fu","ga","la","mo","na","ro","sa","ta","vi","zu"])
+    names = ["".join(rng.choice(syll, 3)).capitalize() + f" de {s}" for s in rng.choice(syll, n)]
+    muni = pd.DataFrame({"ine_code": [f"{p}{i % 1000:03d}" for i, p in enumerate(pc)], "name": names,
+                         "province_code": pc, "factor": np.where(rng.random(n) < 0.3, rng.uniform(0.9, 1.1, n), np.nan)})
+    return LocationIndex(muni, prov), names
+
+
+def _locations_case(n_muni: int, n: int) -> Dict[str, Any]:
+    idx, names = synthetic_locations(n_muni)
+    rng = np.random.default_rng(5)
+    vals = [names[i].upper() if i % 2 else names[i] for i in rng.integers(0, n_muni, n)]
+    return measure(lambda: idx.resolve(vals), n, "row", repeat=3, min_time=0)
+
+
+def _cashflow_case(m, n: int) -> Dict[str, Any]:
+    from src.cashflow import portfolio_cashflow
+    p = make_portfolio(n, {"obra_nueva_edificio": 0, "reforma_piso": 0, "reposicionamiento_edificio": 0,
+                           "fitout_oficinas": 0}, seed=4).drop(columns=["scenario"])
+    p["start_month"] = np.random.default_rng(4).integers(0, 36, n)
+    return measure(lambda: portfolio_cashflow(m, p), n, "project", repeat=3, min_time=0)
+
+
+def _reprice_case(m, n: int) -> Dict[str, Any]:
+    """Cartera guardada de n proyectos × 3 escenarios; cambia una tarifa del YAML y se reprecia desde SQLite."""
+    import copy
+    from src.estimate_store import EstimateStore
+    cd = copy.deepcopy(m.cost_data)
+    cd["modules"]["obra_nueva_edificio"]["chapters"][1]["above"]["mid"] *= 1.05
+    new = dataclasses.replace(m, fingerprint=m.fingerprint + "-bench", cost_data=cd, modules=compile_cost_data(cd))
+    raw = make_portfolio(n, m.cost_data["modules"], seed=6).drop(columns=["scenario"])
+    with tempfile.TemporaryDirectory() as td:
+        store = EstimateStore(Path(td) / "store.sqlite")
+        store.save("bench", m, raw)
+        try:
+            return measure(lambda: store.reprice("bench", new, dry_run=True), 3*n, "estimate", repeat=3, min_time=0)
+        finally:
+            store.close()
+
+
+def _register_case(m, k: Optional[int], n: int) -> Dict[str, Any]:
+    from src.risk_register import RegisterConfig, items_from_frame, simulate_register, synthetic_register
+    items = synthetic_register(k) if k else items_from_frame(m.cont_items)
+    cfg = RegisterConfig(n_iter=n, seed=1)
+    return measure(lambda: simulate_register(items, 1.0, cfg), n*len(items), "item-draw", repeat=3, min_time=0)
+
+
+def _columnar_case(m, f, opts, n: int, what: str) -> Dict[str, Any]:
+    """Muestras MC (what='mc') o desglose de cartera (what='chapters') en un dataset mapeado; se mide la consulta."""
+    from src.columnar import ColumnarWriter, ColumnarStore, append_chapters
+    with tempfile.TemporaryDirectory() as td:
+        with ColumnarWriter(Path(td) / "d.cols") as w:
+            if what == "mc":
+                spec = build_spec(m, "obra_nueva_edificio", "mid", 2000, 500, f, options=opts)
+                run_monte_carlo(spec, MonteCarloConfig(n_iter=n, seed=1), sink=w)
+            else:
+                p = make_portfolio(n, {"obra_nueva_edificio": 0, "reforma_piso": 0}, seed=4)
+                p.index = [f"P{i:06d}" for i in range(n)]
+                append_chapters(w, estimate_portfolio(m, p, with_chapters=True))
+        st = ColumnarStore(Path(td) / "d.cols")
+        if what == "mc":
+            return measure(lambda: st.quantiles("total", (0.5, 0.8, 0.9), where={"plazo": (1.05, None)}),
+                           st.rows, "sample", repeat=5, min_time=0)
+        pick = [f"P{i:06d}" for i in range(0, n, max(1, n//20))]
+        return measure(lambda: st.read(["chapter_key", "cost_direct"], where={"project": pick, "scenario": "mid"}),
+                       st.rows, "row", repeat=5, min_time=0)
+
+
+def _variance_case(m, n: int) -> Dict[str, Any]:
+    """Cartera de n proyectos antes/después (una tarifa del YAML y 1 de cada 7 superficies): Δ por causa."""
+    import copy
+    from src.variance import decompose, drivers_from_portfolio
+    cd = copy.deepcopy(m.cost_data)
+    cd["modules"]["obra_nueva_edificio"]["chapters"][1]["above"]["mid"] *= 1.05
+    new = dataclasses.replace(m, fingerprint=m.fingerprint + "-bench", cost_data=cd, modules=compile_cost_data(cd))
+    p0 = make_portfolio(n, {"obra_nueva_edificio": 0, "reforma_piso": 0}, seed=7)
+    p0.index = [f"P{i:06d}" for i in range(n)]
+    p1 = p0.copy()
+    p1.iloc[::7, p1.columns.get_loc("m2_above")] *= 1.1
+    return measure(lambda: decompose(drivers_from_portfolio(m, p0), drivers_from_portfolio(new, p1)),
+                   n, "project", repeat=3, min_time=0)
+
+
+def _cube_case(m, modules, n: int) -> Dict[str, Any]:
+    """Totales de una cartera estándar (factores globales, usos, niveles) por búsqueda en el cubo €/m²."""
+    p = make_portfolio(n, modules, seed=8)
+    cube_for(m)  # built once per data version, outside the measurement
+    return measure(lambda: estimate_totals(m, p), n, "project", repeat=3, min_time=0)
+
+
+def _calibration_case(m, n: int) -> Dict[str, Any]:
+    from src.calibration import calibrate
+    p = make_portfolio(n, {"obra_nueva_edificio": 0, "reforma_piso": 0, "reposicionamiento_edificio": 0}, seed=3)
+    rng = np.random.default_rng(3)
+    p["actual_direct"] = estimate_portfolio(m, p).totals["direct"].to_numpy()*np.exp(rng.normal(0.03, 0.08, n))
+    return measure(lambda: calibrate(m, p), n, "project", repeat=3, min_time=0)
+
+
+def _cold_case(repeat: int) -> Dict[str, Any]:
+    times = [_cold_start() for _ in range(repeat)]
+    med = statistics.median(times)
+    return {"median_s": med, "min_s": min(times), "runs": repeat, "items": 1, "unit": "process", "rate_per_s": 1/med}
+
+
+def run_suite(quick: bool = False, pattern: Optional[str] = None, log=sys.stderr) -> Dict[str, Any]:
+    results = {}
+    for name, case in cases(quick).items():
+        if pattern and pattern not in name:
+            continue
+        r = case()
+        results[name] = r
+        if log is not None:
+            print(f"{name:32s} {r['median_s']*1000:10.3f} ms  {r['rate_per_s']:14,.0f} {r['unit']}/s", file=log)
+    return {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "quick": quick,
+                     "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+                     "platform": platform.platform(), "machine": platform.machine()},
+            "results": results}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.25) -> pd.DataFrame:
+    """Casos comunes con ratio = mediana actual / mediana base; regression si ratio > 1 + threshold."""
+    rows = []
+    for name, r in current["results"].items():
+        b = baseline["results"].get(name)
+        if b is None:
+            continue
+        ratio = r["median_s"]/b["median_s"] if b["median_s"] > 0 else float("inf")
+        rows.append({"case": name, "baseline_ms": b["median_s"]*1000, "current_ms": r["median_s"]*1000,
+                     "ratio": ratio, "regression": ratio > 1.0 + threshold})
+    return pd.DataFrame(rows, columns=["case","baseline_ms","current_ms","ratio","regression"])
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-o", "--output", help="fichero JSON de resultados")
+    ap.add_argument("--baseline", help="JSON de referencia con el que comparar")
+    ap.add_argument("--from", dest="from_file", help="comparar un JSON existente en vez de ejecutar")
+    ap.add_argument("--threshold", type=float, default=0.25, help="ralentización tolerada (0.25 = +25%%)")
+    ap.add_argument("--quick", action="store_true", help="tamaños reducidos")
+    ap.add_argument("-k", dest="pattern", help="ejecutar solo los casos cuyo nombre contiene este texto")
+    args = ap.parse_args(argv)
+
+    if args.from_file:
+        current = json.loads(Path(args.from_file).read_text(encoding="utf-8"))
+    else:
+        current = run_suite(args.quick, args.pattern)
+    if args.output:
+        Path(args.output).write_text(json.dumps(current, indent=2), encoding="utf-8")
+    if not args.baseline:
+        return 0
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    if baseline.get("meta", {}).get("quick") != current.get("meta", {}).get("quick"):
+        print("aviso: línea base y resultados con distinto --quick", file=sys.stderr)
+    cmp = compare(current, baseline, args.threshold)
+    print(cmp.to_string(index=False, float_format=lambda v: f"{v:,.3f}"))
+    slow = cmp[cmp["regression"]]
+    if len(slow):
+        print(f"{len(slow)} regresión(es) > {args.threshold:.0%}: {', '.join(slow['case'])}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
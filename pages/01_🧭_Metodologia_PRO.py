@@ -1,16 +1,13 @@
 
 import streamlit as st
-from pathlib import Path
-import pandas as pd
-from src.io import load_yaml, load_csv
+from src import resources
 
 st.set_page_config(page_title="Costes Construcción España - Metodología", page_icon="🧭", layout="wide")
 st.title("🧭 Metodología")
 
-data_dir = Path(__file__).parent.parent / "data"
-cost = load_yaml(data_dir / "cost_ranges.yaml")
-bench = load_csv(data_dir / "benchmarks.csv")
-sources = load_csv(data_dir / "sources_matrix.csv")
+# only the two CSVs shown here (the compiled model is reused if the main page already loaded it)
+bench = resources.frame("benchmarks")
+sources = resources.frame("sources")
 
 st.markdown("""
 ### Cómo funciona el modelo
@@ -20,8 +17,9 @@ st.markdown("""
 4) **Top-down (benchmarks)**: ratios €/m² por tipología.  
    - Opcional: **auto-calibración** para alinear el coste directo al benchmark del escenario.
 
-> Nota: en esta versión no se realiza import automático de BC3 (BCCA/Madrid/Ayto) por compatibilidad/licencias.  
-> El modelo está preparado para incorporar un parser propio si se dispone de los ficheros y permisos.
+> Nota: los bancos de precios BC3 (BCCA/Madrid/Ayto) no se incluyen por licencias. Si se dispone de los ficheros,
+> `python -m src.bc3 import` los carga en un almacén SQLite local y `python -m src.bc3 rollup` convierte un
+> presupuesto BC3 en €/m² por capítulo para contrastar los rangos de `cost_ranges.yaml`.
 """)
 
 st.subheader("Benchmarks")
@@ -0,0 +1,345 @@
+"""
+Estimación por lotes sin Streamlit.
+
+    python -m src.batch proyectos.csv -o totales.csv [--chapters capitulos.parquet] [--workers 4]
+    python -m src.batch proyectos.csv -o totales.cols --chapters capitulos.cols   (columnar mapeable)
+    python -m src.batch proyectos.csv -o totales.csv --reports informes/ --report-pdf cartera.pdf
+
+Entrada CSV/JSONL (una fila por proyecto): module, scenario (opcional: si falta o está vacío se evalúan los tres),
+m2_above, m2_below, city (municipio, código INE o provincia; con province opcional para desambiguar),
+ine_code, factores (`Factors`), opciones (building_use, intervention_level, reform_level,
+use, include_furniture), auto_calibrate, soft_items_pct / cont_items_pct (fracción), project (id opcional),
+price_date (nivel de precios de la fila, para --index-to).
+Se lee y escribe por bloques, así que la memoria no crece con el tamaño de la entrada.
+"""
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from src.calculations import SCENARIOS
+from src.model import CostModel, load_model
+from src.portfolio import estimate_portfolio, BUILDING_MODULES
+from src.cube import estimate_totals
+from src.indexation import reprice, base_date
+from src.locations import index_for
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+def _format_of(path: str | Path) -> str:
+    suffix = Path(path).suffix.lower()
+    if suffix in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    if suffix in (".parquet", ".pq"):
+        return "parquet"
+    if suffix == ".cols":
+        return "columnar"
+    return "csv"
+
+
+def read_chunks(path: str | Path, chunksize: int) -> Iterator[pd.DataFrame]:
+    fmt = _format_of(path)
+    if fmt == "jsonl":
+        reader = pd.read_json(path, lines=True, chunksize=chunksize)
+    elif fmt == "csv":
+        reader = pd.read_csv(path, chunksize=chunksize)
+    else:
+        raise ValueError("entrada: usa CSV o JSONL")
+    offset = 0
+    for chunk in reader:
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+
+def benchmark_keys(df: pd.DataFrame) -> pd.Series:
+    """Fila de benchmark: uso para edificios completos, fit-out C&W (Barcelona/Madrid) para oficinas."""
+    modules = df["module"].astype(str)
+    bench_key = pd.Series([None]*len(df), index=df.index, dtype=object)
+    if "benchmark_key" in df.columns:
+        return df["benchmark_key"].astype(object)
+    if "building_use" in df.columns:
+        bench_key = bench_key.where(~modules.isin(BUILDING_MODULES), df["building_use"])
+    barcelona = (df["city"] == "Barcelona") if "city" in df.columns else False
+    office = np.where(barcelona, "fitout_oficinas_barcelona", "fitout_oficinas")
+    return bench_key.where(modules != "fitout_oficinas", pd.Series(office, index=df.index))
+
+
+def _fill_scenarios(df: pd.DataFrame) -> pd.DataFrame:
+    """Escenario vacío → los tres (como si faltara la columna); desconocido → fila descartada y contada en attrs."""
+    raw = df["scenario"].astype(object)
+    sc = raw.astype(str).str.strip()
+    blank = (raw.isna() | (sc == "")).to_numpy()
+    unknown = ~blank & ~sc.isin(SCENARIOS).to_numpy()
+    if not blank.any() and not unknown.any() and (sc == raw).all():
+        return df
+    keep = np.flatnonzero(~unknown)
+    reps = np.where(blank[keep], len(SCENARIOS), 1)
+    idx = np.repeat(keep, reps)
+    within = np.arange(len(idx)) - np.repeat(np.cumsum(reps) - reps, reps)
+    out = df.iloc[idx].copy()
+    out["scenario"] = np.where(blank[idx], np.asarray(SCENARIOS, dtype=object)[within % len(SCENARIOS)],
+                               sc.to_numpy()[idx])
+    out.attrs["unknown_scenarios"] = sc[unknown].value_counts().to_dict()
+    return out
+
+
+def prepare_projects(model: CostModel, df: pd.DataFrame, use_items: bool = True) -> pd.DataFrame:
+    """Resuelve ciudad → localización, fila de benchmark y % soft/contingencia como hace app.py."""
+    df = df.copy()
+    if "project" in df.columns:
+        df.index = df["project"].to_numpy()
+    if "scenario" in df.columns:
+        df = _fill_scenarios(df)
+    if "city" in df.columns or "ine_code" in df.columns:
+        # municipality / INE code / province → factor with province → region → national fallback
+        where = df["ine_code"].astype(object) if "ine_code" in df.columns else None
+        if "city" in df.columns:
+            where = df["city"].astype(object) if where is None else where.where(where.notna(), df["city"])
+        province = df["province"] if "province" in df.columns else None
+        found = index_for(model).resolve(where, province)
+        city_factor = found["factor"].to_numpy(dtype=float)
+        # how each given location resolved (municipio/provincia/region/ambiguo/ninguno = national factor)
+        given = where.notna().to_numpy() & (where.astype(str).str.strip() != "").to_numpy()
+        if province is not None:
+            given |= province.notna().to_numpy()
+        df["location_match"] = np.where(given, found["match"].to_numpy(dtype=object), None)
+        loc = pd.to_numeric(df["localizacion"], errors="coerce").fillna(1.0).to_numpy(dtype=float) \
+            if "localizacion" in df.columns else np.ones(len(df))
+        df["localizacion"] = loc * city_factor
+
+    bench_key = benchmark_keys(df)
+    for sc in SCENARIOS:
+        col = "pem_"+sc
+        if col not in df.columns:
+            df[col] = bench_key.map(lambda k: model.benchmark_rows.get(k, {}).get(col)).astype(float)
+
+    if use_items:
+        soft_default = float(model.soft_items["pct_sobre_directo"].sum())/100.0
+        cont_default = float(model.cont_items["pct_sobre_directo"].sum())/100.0
+        for col, default in (("soft_items_pct", soft_default), ("cont_items_pct", cont_default)):
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(default) if col in df.columns else default
+    return df
+
+
+def estimate_chunk(data_dir: str, df: pd.DataFrame, chapters: bool, use_items: bool,
+                   index_to: Optional[str] = None) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    model = load_model(data_dir)  # cached per worker process
+    projects = prepare_projects(model, df, use_items)
+    if chapters or index_to:
+        res = estimate_portfolio(model, projects, with_chapters=True)
+        totals = res.totals
+    else:  # totals only: standard rows straight from the precomputed €/m² cube
+        totals = estimate_totals(model, projects)
+    area = pd.DataFrame({c: (pd.to_numeric(projects[c], errors="coerce") if c in projects.columns else 0.0)
+                         for c in ("m2_above","m2_below")}, index=projects.index).fillna(0.0)
+    if len(totals) != len(projects):  # scenarios were expanded
+        area = area.iloc[np.repeat(np.arange(len(projects)), len(SCENARIOS))]
+    split = np.array([model.module(m).area_split for m in totals["module"]], dtype=bool)
+    area_ref = np.where(split, area["m2_above"].to_numpy() + area["m2_below"].to_numpy(), area["m2_above"].to_numpy())
+    totals.insert(3, "area_ref_m2", area_ref)
+    if "location_match" in projects.columns:
+        match = projects["location_match"].to_numpy(dtype=object)
+        totals["location_match"] = np.repeat(match, len(totals)//max(1, len(projects)))
+    totals.attrs["unknown_scenarios"] = projects.attrs.get("unknown_scenarios", {})
+    with np.errstate(divide="ignore", invalid="ignore"):
+        totals["eur_m2"] = np.where(area_ref > 0, totals["total"].to_numpy()/area_ref, np.nan)
+    if index_to:
+        # price level of each row: price_date column if present, else the YAML base date
+        base = projects["price_date"].fillna(base_date(model)).astype(str).to_numpy() \
+            if "price_date" in projects.columns else None
+        if base is not None and len(totals) != len(projects):
+            base = np.repeat(base, len(SCENARIOS))
+        rep = reprice(model, res, index_to, base_dates=base)
+        totals["index_factor"] = rep["factor"].to_numpy()
+        totals["total_indexed"] = rep["total_indexed"].to_numpy()
+        totals["eur_m2_indexed"] = totals["eur_m2"].to_numpy()*rep["factor"].to_numpy()
+    return totals, (res.chapter_frame() if chapters else None)
+
+
+class _Writer:
+    """Escritura incremental en CSV / JSONL / Parquet (pyarrow opcional) / columnar mapeable (`.cols`)."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.fmt = _format_of(path)
+        self._first = True
+        self._pq = None
+        if self.fmt == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+                import pyarrow.parquet  # noqa: F401
+            except ImportError as e:
+                raise SystemExit("Parquet requiere pyarrow (pip install pyarrow)") from e
+        elif self.fmt == "columnar":
+            from src.columnar import ColumnarWriter
+            self._cols = ColumnarWriter(self.path)
+        else:
+            self._fh = open(self.path, "w", encoding="utf-8", newline="")
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.fmt == "csv":
+            df.to_csv(self._fh, index=False, header=self._first)
+        elif self.fmt == "jsonl":
+            for rec in df.to_dict("records"):
+                self._fh.write(json.dumps(rec, ensure_ascii=False, default=_json_default) + "\n")
+        elif self.fmt == "columnar":
+            self._cols.append(df)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._pq is None:
+                self._pq = pq.ParquetWriter(str(self.path), table.schema)
+            self._pq.write_table(table.cast(self._pq.schema))
+        self._first = False
+
+    def close(self) -> None:
+        if self._pq is not None:
+            self._pq.close()
+        elif self.fmt == "columnar":
+            self._cols.close()
+        elif self.fmt != "parquet":
+            self._fh.close()
+
+
+def _json_default(v):
+    if isinstance(v, (np.integer,)):
+        return int(v)
+    if isinstance(v, (np.floating,)):
+        return float(v)
+    if isinstance(v, np.bool_):
+        return bool(v)
+    return str(v)
+
+
+def run(input_path: str | Path, output_path: str | Path, chapters_path: str | Path | None = None,
+        data_dir: str | Path = DATA_DIR, chunksize: int = 50_000, workers: int = 1,
+        use_items: bool = True, index_to: Optional[str] = None, log=sys.stderr,
+        progress: Optional[Callable[[int, int], None]] = None) -> dict:
+    """`progress(proyectos leídos, filas escritas)` tras cada bloque escrito (si lanza, se detiene)."""
+    data_dir = str(Path(data_dir).resolve())
+    out = _Writer(output_path)
+    chap_out = _Writer(chapters_path) if chapters_path else None
+    with_chapters = chap_out is not None
+    n_in = n_out = 0
+    unresolved: Dict[str, int] = {}
+    unknown_scenarios: Dict[str, int] = {}
+    t0 = time.perf_counter()
+
+    def _emit(result):
+        nonlocal n_out
+        totals, chap = result
+        for v, k in totals.attrs.get("unknown_scenarios", {}).items():
+            unknown_scenarios[v] = unknown_scenarios.get(v, 0) + k
+        if "location_match" in totals.columns:
+            for m in ("ninguno", "ambiguo"):
+                unresolved[m] = unresolved.get(m, 0) + int((totals["location_match"] == m).sum())
+        out.write(totals)
+        if chap_out is not None and chap is not None:
+            chap_out.write(chap)
+        n_out += len(totals)
+        if progress is not None:
+            progress(n_in, n_out)
+
+    try:
+        if workers <= 1:
+            for chunk in read_chunks(input_path, chunksize):
+                n_in += len(chunk)
+                _emit(estimate_chunk(data_dir, chunk, with_chapters, use_items, index_to))
+        else:
+            # bounded in-flight queue keeps memory flat and output in input order
+            pending: deque = deque()
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                for chunk in read_chunks(input_path, chunksize):
+                    n_in += len(chunk)
+                    pending.append(ex.submit(estimate_chunk, data_dir, chunk, with_chapters, use_items, index_to))
+                    if len(pending) >= 2*workers:
+                        _emit(pending.popleft().result())
+                while pending:
+                    _emit(pending.popleft().result())
+    finally:
+        out.close()
+        if chap_out is not None:
+            chap_out.close()
+
+    elapsed = time.perf_counter() - t0
+    stats = {"projects": n_in, "rows_out": n_out, "seconds": elapsed,
+             "rows_per_second": (n_in/elapsed if elapsed > 0 else float("inf")),
+             "unresolved_locations": unresolved.get("ninguno", 0), "ambiguous_locations": unresolved.get("ambiguo", 0),
+             "skipped_rows": sum(unknown_scenarios.values())}
+    if log is not None:
+        print(f"{n_in:,} proyectos → {n_out:,} filas en {elapsed:.2f} s ({stats['rows_per_second']:,.0f} proyectos/s)", file=log)
+        if stats["unresolved_locations"] or stats["ambiguous_locations"]:
+            print(f"aviso: {stats['unresolved_locations']:,} filas con ciudad sin resolver (factor nacional) y "
+                  f"{stats['ambiguous_locations']:,} ambiguas (factor de provincia/comunidad); ver columna "
+                  "location_match o añade province / ine_code", file=log)
+        if unknown_scenarios:
+            print(f"aviso: {stats['skipped_rows']:,} filas omitidas por escenario desconocido "
+                  f"({', '.join(f'{v!r} ×{k:,}' for v, k in unknown_scenarios.items())}); válidos: {', '.join(SCENARIOS)}",
+                  file=log)
+    return stats
+
+
+def report_jobs(input_path: str | Path, data_dir: str | Path = DATA_DIR, chunksize: int = 50_000,
+                use_items: bool = True):
+    """ReportJob por proyecto × escenario, leyendo la entrada por bloques."""
+    from src.reports import jobs_from_portfolio
+    model = load_model(data_dir)
+    for chunk in read_chunks(input_path, chunksize):
+        yield from jobs_from_portfolio(model, prepare_projects(model, chunk, use_items))
+
+
+def run_reports(input_path: str | Path, reports_dir: str | Path | None = None, report_pdf: str | Path | None = None,
+                data_dir: str | Path = DATA_DIR, chunksize: int = 50_000, workers: int = 1,
+                use_items: bool = True, log=sys.stderr) -> dict:
+    from src.reports import export_many, export_consolidated
+    sources = load_model(data_dir).sources
+    stats = {}
+    if reports_dir:
+        stats["reports"] = export_many(report_jobs(input_path, data_dir, chunksize, use_items), reports_dir, sources,
+                                       workers=workers)
+    if report_pdf:
+        stats["consolidated"] = export_consolidated(report_pdf, report_jobs(input_path, data_dir, chunksize, use_items),
+                                                    sources)
+    if log is not None:
+        for name, r in stats.items():
+            print(f"{name}: {r['reports']:,} informes, {r['pages']:,} páginas en {r['seconds']:.2f} s "
+                  f"({r['pages_per_second']:,.0f} páginas/s)", file=log)
+    return stats
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.batch", description="Estimación CAPEX por lotes (CSV/JSONL → CSV/JSONL/Parquet).")
+    ap.add_argument("input", help="CSV o JSONL de proyectos")
+    ap.add_argument("-o", "--output", required=True, help="totales por proyecto (.csv, .jsonl, .parquet o .cols)")
+    ap.add_argument("--chapters", help="desglose por capítulos (.csv, .jsonl, .parquet o .cols: columnar mapeable, "
+                                       "ver src/columnar.py)")
+    ap.add_argument("--data-dir", default=str(DATA_DIR))
+    ap.add_argument("--chunksize", type=int, default=50_000)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--module-defaults", action="store_true",
+                    help="usar %% soft/contingencia por defecto del módulo en vez de la suma de data/*_items.csv")
+    ap.add_argument("--index-to", help="fecha objetivo (YYYY-MM-DD): añade total indexado con data/cost_indices.csv "
+                                       "desde meta.date_built o la columna price_date")
+    ap.add_argument("--reports", help="carpeta donde generar un PDF por proyecto × escenario")
+    ap.add_argument("--report-pdf", help="PDF consolidado de la cartera (portada, proyectos y resumen)")
+    args = ap.parse_args(argv)
+    run(args.input, args.output, args.chapters, data_dir=args.data_dir, chunksize=args.chunksize,
+        workers=args.workers, use_items=not args.module_defaults, index_to=args.index_to)
+    if args.reports or args.report_pdf:
+        run_reports(args.input, args.reports, args.report_pdf, data_dir=args.data_dir, chunksize=args.chunksize,
+                    workers=args.workers, use_items=not args.module_defaults)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
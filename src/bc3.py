@@ -0,0 +1,371 @@
+"""
+Importador FIEBDC-3 (BC3) en streaming → almacén SQLite indexado.
+
+    python -m src.bc3 import BCCA2024.bc3 -o data/.cache/bcca.sqlite
+    python -m src.bc3 lookup data/.cache/bcca.sqlite E04CM040
+    python -m src.bc3 rollup presupuesto.sqlite --area 2500 --module obra_nueva_edificio [--map mapa.csv]
+
+Se leen bloques de bytes y se separan registros por '~' (un registro puede ocupar varias líneas), así que la
+memoria no depende del tamaño del fichero. Registros usados: ~V (juego de caracteres), ~C (conceptos: código,
+unidad, resumen, precio, fecha, tipo), ~D (descomposiciones: hijo, factor, rendimiento) y ~T (texto, opcional).
+Los códigos se guardan sin '#'; `is_chapter` vale 1 para capítulos ('#') y 2 para la raíz ('##').
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple, BinaryIO
+import argparse
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+import pandas as pd
+
+from src.instrument import timed, count
+
+CHARSETS = {"850": "cp850", "437": "cp437", "ANSI": "cp1252", "1252": "cp1252", "UTF-8": "utf-8", "UTF8": "utf-8"}
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS concepts (
+    code TEXT PRIMARY KEY, unit TEXT, summary TEXT, price REAL, date TEXT, type TEXT,
+    is_chapter INTEGER NOT NULL DEFAULT 0, chapter TEXT
+);
+CREATE TABLE IF NOT EXISTS decomposition (
+    parent TEXT NOT NULL, child TEXT NOT NULL, factor REAL NOT NULL, yield REAL NOT NULL, pos INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS texts (code TEXT PRIMARY KEY, text TEXT);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS ix_dec_parent ON decomposition(parent);
+CREATE INDEX IF NOT EXISTS ix_dec_child ON decomposition(child);
+CREATE INDEX IF NOT EXISTS ix_concepts_chapter ON concepts(chapter);
+"""
+
+
+def _float(s: str, default: float = 0.0) -> float:
+    s = s.strip()
+    if not s:
+        return default
+    try:
+        return float(s)
+    except ValueError:
+        try:
+            return float(s.replace(".", "").replace(",", "."))
+        except ValueError:
+            return default
+
+
+def _code(raw: str) -> Tuple[str, int]:
+    """'01#' → ('01', 1); '0##' → ('0', 2); sinónimos 'A\\B' → 'A'."""
+    code = raw.split("\\", 1)[0].strip()
+    level = 2 if code.endswith("##") else 1 if code.endswith("#") else 0
+    return code.rstrip("#"), level
+
+
+def iter_records(fh: BinaryIO, block_size: int = 1 << 20) -> Iterator[Tuple[str, List[str]]]:
+    """(tipo, campos) por registro, decodificando con el juego de caracteres del registro ~V (defecto 850)."""
+    encoding = "cp850"
+    buf = b""
+    first = True
+    while True:
+        block = fh.read(block_size)
+        if block:
+            buf += block
+            parts = buf.split(b"~")
+            buf = parts.pop()
+        else:
+            parts, buf = [buf], b""
+        for raw in parts:
+            if first:  # bytes before the first '~' (BOM, blank lines)
+                first = False
+                continue
+            raw = raw.rstrip(b"\r\n\x1a ")
+            if not raw:
+                continue
+            if raw[:1] == b"V":
+                fields = raw.decode("latin-1").split("|")
+                cs = fields[5].strip().upper() if len(fields) > 5 else ""
+                encoding = CHARSETS.get(cs, encoding)
+            fields = raw.decode(encoding, errors="replace").split("|")
+            yield fields[0].strip().upper(), fields[1:]
+        if not block:
+            break
+
+
+@timed()
+def import_bc3(bc3_path: str | Path, db_path: str | Path, texts: bool = False, batch: int = 20_000,
+               log=None) -> Dict[str, Any]:
+    """Parsea `bc3_path` en streaming y (re)crea el almacén SQLite `db_path`. Devuelve estadísticas."""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    if db_path.exists():
+        db_path.unlink()
+    con = sqlite3.connect(str(db_path))
+    con.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF; PRAGMA temp_store=MEMORY;" + _SCHEMA)
+    stats = {"concepts": 0, "decompositions": 0, "texts": 0, "records": 0, "bytes": Path(bc3_path).stat().st_size}
+    concepts: List[tuple] = []
+    decomp: List[tuple] = []
+    txt: List[tuple] = []
+    meta: Dict[str, str] = {}
+    root = None
+    t0 = time.perf_counter()
+
+    def _flush():
+        if concepts:
+            con.executemany("INSERT OR REPLACE INTO concepts(code,unit,summary,price,date,type,is_chapter) "
+                            "VALUES (?,?,?,?,?,?,?)", concepts)
+            concepts.clear()
+        if decomp:
+            con.executemany("INSERT INTO decomposition VALUES (?,?,?,?,?)", decomp)
+            decomp.clear()
+        if txt:
+            con.executemany("INSERT OR REPLACE INTO texts VALUES (?,?)", txt)
+            txt.clear()
+
+    with open(bc3_path, "rb") as fh:
+        for kind, f in iter_records(fh):
+            stats["records"] += 1
+            if kind == "C" and f:
+                code, level = _code(f[0])
+                price = _float(f[3].split("\\", 1)[0]) if len(f) > 3 else 0.0
+                concepts.append((code, f[1].strip() if len(f) > 1 else "", f[2].strip() if len(f) > 2 else "",
+                                 price, f[4].split("\\", 1)[0].strip() if len(f) > 4 else "",
+                                 f[5].strip() if len(f) > 5 else "", level))
+                if level == 2 and root is None:
+                    root = code
+                stats["concepts"] += 1
+            elif kind == "D" and len(f) > 1:
+                parent, _ = _code(f[0])
+                items = f[1].split("\\")
+                for pos, i in enumerate(range(0, len(items) - 2, 3)):
+                    child, _ = _code(items[i])
+                    if child:
+                        decomp.append((parent, child, _float(items[i + 1], 1.0), _float(items[i + 2], 1.0), pos))
+                        stats["decompositions"] += 1
+            elif kind == "T" and texts and len(f) > 1:
+                txt.append((_code(f[0])[0], f[1]))
+                stats["texts"] += 1
+            elif kind == "V":
+                meta.update({"owner": f[0] if f else "", "format": f[1] if len(f) > 1 else "",
+                             "program": f[2] if len(f) > 2 else "", "header": f[3] if len(f) > 3 else "",
+                             "charset": f[4] if len(f) > 4 else ""})
+            if len(concepts) + len(decomp) + len(txt) >= batch:
+                _flush()
+    _flush()
+    con.executescript(_INDEXES)
+    if root is None:
+        row = con.execute("SELECT code FROM concepts WHERE is_chapter = 2 LIMIT 1").fetchone()
+        root = row[0] if row else None
+    _assign_chapters(con, root)
+    meta.update({"source": str(bc3_path), "root": root or "", "imported": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    con.executemany("INSERT OR REPLACE INTO meta VALUES (?,?)", meta.items())
+    con.commit()
+    con.close()
+    stats["seconds"] = time.perf_counter() - t0
+    stats["mb_per_second"] = stats["bytes"]/1e6/stats["seconds"] if stats["seconds"] > 0 else float("inf")
+    count("bc3_concepts", stats["concepts"])
+    if log is not None:
+        print(f"{stats['concepts']:,} conceptos, {stats['decompositions']:,} descomposiciones en "
+              f"{stats['seconds']:.2f} s ({stats['mb_per_second']:.1f} MB/s)", file=log)
+    return stats
+
+
+def _assign_chapters(con: sqlite3.Connection, root: Optional[str]) -> None:
+    """concepts.chapter = capítulo de primer nivel (hijo de la raíz) del que cuelga cada concepto."""
+    if root:
+        top = "SELECT child, child FROM decomposition WHERE parent = :root"
+    else:  # no root: chapters that are nobody's child
+        top = ("SELECT code, code FROM concepts WHERE is_chapter = 1 "
+               "AND code NOT IN (SELECT child FROM decomposition)")
+    con.executescript("DROP TABLE IF EXISTS _tree;")
+    con.execute(f"""
+        CREATE TEMP TABLE _tree AS
+        WITH RECURSIVE tree(code, chapter) AS (
+            {top}
+            UNION
+            SELECT d.child, t.chapter FROM decomposition d JOIN tree t ON d.parent = t.code
+        )
+        SELECT code, MIN(chapter) AS chapter FROM tree GROUP BY code""", {"root": root})
+    con.execute("CREATE INDEX _ix_tree ON _tree(code)")
+    con.execute("UPDATE concepts SET chapter = (SELECT chapter FROM _tree WHERE _tree.code = concepts.code)")
+    con.execute("DROP TABLE _tree")
+
+
+@dataclass
+class Concept:
+    code: str
+    unit: str
+    summary: str
+    price: float
+    date: str
+    type: str
+    is_chapter: int
+    chapter: Optional[str]
+
+
+class Bc3Store:
+    """Consultas sobre el almacén SQLite (búsqueda por código O(log n) con la clave primaria)."""
+
+    def __init__(self, db_path: str | Path):
+        self.path = Path(db_path)
+        self.con = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+
+    def close(self) -> None:
+        self.con.close()
+
+    def meta(self) -> Dict[str, str]:
+        return dict(self.con.execute("SELECT key, value FROM meta"))
+
+    def concept(self, code: str) -> Optional[Concept]:
+        row = self.con.execute("SELECT code,unit,summary,price,date,type,is_chapter,chapter FROM concepts WHERE code = ?",
+                               (code.rstrip("#"),)).fetchone()
+        return Concept(*row) if row else None
+
+    def text(self, code: str) -> Optional[str]:
+        row = self.con.execute("SELECT text FROM texts WHERE code = ?", (code.rstrip("#"),)).fetchone()
+        return row[0] if row else None
+
+    def children(self, code: str) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT d.child AS code, c.unit, c.summary, c.price, d.factor, d.yield, c.is_chapter "
+            "FROM decomposition d LEFT JOIN concepts c ON c.code = d.child WHERE d.parent = ? ORDER BY d.pos",
+            self.con, params=(code.rstrip("#"),))
+
+    def chapters(self) -> pd.DataFrame:
+        root = self.meta().get("root", "")
+        if root:
+            return pd.read_sql_query(
+                "SELECT c.code, c.summary, (SELECT COUNT(*) FROM concepts x WHERE x.chapter = c.code) AS items "
+                "FROM decomposition d JOIN concepts c ON c.code = d.child WHERE d.parent = ? ORDER BY d.pos",
+                self.con, params=(root,))
+        return pd.read_sql_query("SELECT code, summary, 0 AS items FROM concepts WHERE is_chapter = 1 ORDER BY code", self.con)
+
+    def chapter_items(self, chapter: str) -> pd.DataFrame:
+        return pd.read_sql_query("SELECT code, unit, summary, price, type FROM concepts WHERE chapter = ? "
+                                 "AND is_chapter = 0 ORDER BY code", self.con, params=(chapter.rstrip("#"),))
+
+    def search(self, text: str, limit: int = 50) -> pd.DataFrame:
+        return pd.read_sql_query("SELECT code, unit, summary, price, chapter FROM concepts WHERE summary LIKE ? LIMIT ?",
+                                 self.con, params=(f"%{text}%", int(limit)))
+
+    def chapter_amounts(self) -> pd.DataFrame:
+        """
+        Importe de cada capítulo de primer nivel: Σ rendimiento × factor × precio, bajando por subcapítulos.
+        Los conceptos con precio propio (~C) no se descomponen (su precio ya incluye sus hijos).
+        """
+        price = dict(self.con.execute("SELECT code, price FROM concepts WHERE is_chapter = 0"))
+        is_chap = {c for (c,) in self.con.execute("SELECT code FROM concepts WHERE is_chapter > 0")}
+        lines: Dict[str, List[Tuple[str, float]]] = {}
+        q = ("SELECT d.parent, d.child, d.factor * d.yield FROM decomposition d "
+             "JOIN concepts p ON p.code = d.parent WHERE p.is_chapter > 0")
+        for parent, child, qty in self.con.execute(q):
+            lines.setdefault(parent, []).append((child, qty))
+        memo: Dict[str, float] = {}
+
+        def amount(code: str, depth: int = 0) -> float:
+            if code in memo:
+                return memo[code]
+            memo[code] = 0.0  # guards against cycles
+            total = 0.0
+            for child, qty in lines.get(code, ()):
+                if child in is_chap and depth < 50:
+                    total += qty*amount(child, depth + 1)
+                else:
+                    total += qty*price.get(child, 0.0)
+            memo[code] = total
+            return total
+
+        ch = self.chapters()
+        ch["amount"] = [amount(c) for c in ch["code"]]
+        return ch
+
+
+def _norm(s: str) -> str:
+    s = unicodedata.normalize("NFKD", str(s)).encode("ascii", "ignore").decode().lower()
+    return re.sub(r"[^a-z0-9 ]+", " ", s)
+
+
+def guess_mapping(chapters: pd.DataFrame, module_def: Dict[str, Any]) -> Dict[str, str]:
+    """Asigna capítulos BC3 → claves del módulo por palabras en común (≥ 4 letras) entre resumen y etiqueta."""
+    targets = []
+    for ch in module_def["chapters"]:
+        words = {w for w in _norm(ch["label"] + " " + ch["key"].replace("_", " ")).split() if len(w) >= 4}
+        targets.append((ch["key"], words))
+    out = {}
+    for code, summary in zip(chapters["code"], chapters["summary"]):
+        words = {w for w in _norm(summary).split() if len(w) >= 4}
+        best = max(targets, key=lambda t: len(words & t[1]), default=None)
+        if best is not None and words & best[1]:
+            out[str(code)] = best[0]
+    return out
+
+
+def rollup(store: Bc3Store, area_m2: float, cost_data: Dict[str, Any] | None = None, module_key: str | None = None,
+           mapping: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    €/m² por capítulo de un presupuesto BC3 (importe / superficie). Con `module_key` agrega por clave de
+    cost_ranges.yaml (mapping explícito o guess_mapping) y compara con los rangos Bajo/Medio/Alto (sobre rasante
+    o único): status = bajo / en_rango / alto.
+    """
+    ch = store.chapter_amounts()
+    ch["eur_m2"] = ch["amount"]/float(area_m2) if area_m2 > 0 else float("nan")
+    if not module_key or cost_data is None:
+        return ch
+    module_def = cost_data["modules"][module_key]
+    mapping = mapping if mapping is not None else guess_mapping(ch, module_def)
+    ch["chapter_key"] = ch["code"].astype(str).map(mapping)
+    agg = ch.dropna(subset=["chapter_key"]).groupby("chapter_key", as_index=False) \
+        .agg(amount=("amount", "sum"), eur_m2=("eur_m2", "sum"), bc3_chapters=("code", lambda s: ",".join(map(str, s))))
+    rates = {c["key"]: c.get("above", c.get("single")) for c in module_def["chapters"]}
+    for sc in ("low", "mid", "high"):
+        agg["yaml_"+sc] = agg["chapter_key"].map(lambda k: (rates.get(k) or {}).get(sc))
+    agg["status"] = [("bajo" if v < lo else "alto" if v > hi else "en_rango") if lo is not None and hi is not None else ""
+                     for v, lo, hi in zip(agg["eur_m2"], agg["yaml_low"], agg["yaml_high"])]
+    return agg
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.bc3", description="Importador FIEBDC-3 (BC3) → SQLite.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("import", help="parsear un .bc3 a un almacén SQLite")
+    p.add_argument("bc3")
+    p.add_argument("-o", "--output", required=True)
+    p.add_argument("--texts", action="store_true", help="guardar también los textos largos (~T)")
+    p = sub.add_parser("lookup", help="concepto y descomposición por código")
+    p.add_argument("db")
+    p.add_argument("code")
+    p = sub.add_parser("rollup", help="€/m² por capítulo de un presupuesto")
+    p.add_argument("db")
+    p.add_argument("--area", type=float, required=True, help="superficie construida de referencia (m²)")
+    p.add_argument("--module", help="módulo de cost_ranges.yaml con el que comparar")
+    p.add_argument("--map", help="CSV code,chapter_key con la correspondencia de capítulos")
+    p.add_argument("--data-dir", default=str(Path(__file__).resolve().parent.parent / "data"))
+    args = ap.parse_args(argv)
+
+    if args.cmd == "import":
+        import_bc3(args.bc3, args.output, texts=args.texts, log=sys.stderr)
+        return 0
+    store = Bc3Store(args.db)
+    if args.cmd == "lookup":
+        c = store.concept(args.code)
+        if c is None:
+            print(f"{args.code}: no encontrado", file=sys.stderr)
+            return 1
+        print(c)
+        print(store.children(args.code).to_string(index=False))
+        return 0
+    cost_data = None
+    if args.module:
+        from src.model import load_model
+        cost_data = load_model(args.data_dir).cost_data
+    mapping = None
+    if args.map:
+        m = pd.read_csv(args.map, dtype=str)
+        mapping = dict(zip(m["code"], m["chapter_key"]))
+    print(rollup(store, args.area, cost_data, args.module, mapping).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,6 +5,8 @@ from typing import Dict, Any, Tuple, Optional
 import math
 import pandas as pd
 
+from src.instrument import timed, count
+
 SCENARIOS = ["low","mid","high"]
 SCENARIO_LABELS = {"low":"Bajo","mid":"Medio","high":"Alto"}
 
@@ -24,12 +26,25 @@ class Factors:
         return float(self.complejidad * self.altura * self.localizacion * self.intensidad_mep *
                      self.acabados * self.certificacion * self.plazo * self.estado_previo * self.indexacion_temporal)
 
+# slider bounds in the app (localizacion: additional adjustment, multiplied by the city factor)
+FACTOR_RANGES = {
+    "complejidad": (0.85, 1.25), "altura": (0.95, 1.20), "localizacion": (0.90, 1.20),
+    "intensidad_mep": (0.90, 1.30), "acabados": (0.90, 1.30), "certificacion": (1.00, 1.12),
+    "plazo": (0.95, 1.15), "estado_previo": (0.85, 1.35), "indexacion_temporal": (0.85, 1.35),
+}
+FACTOR_LABELS = {
+    "complejidad":"Complejidad","altura":"Altura","localizacion":"Localización","intensidad_mep":"Intensidad MEP",
+    "acabados":"Nivel acabados","certificacion":"Certificación/ESG","plazo":"Plazo","estado_previo":"Estado previo",
+    "indexacion_temporal":"Indexación temporal",
+}
+
 def _is_mep(ch_key: str) -> bool:
     return ch_key.startswith("mep_") or ch_key in ("mep","mep_renov","mep_interiores")
 
 def _is_arch_finish(ch_key: str) -> bool:
     return ch_key in ("acabados","particiones","carpinterias","envolvente","envolvente_mej","techos","obra_civil","albanileria")
 
+@timed()
 def sum_chapters(module_def: Dict[str, Any], scenario: str, m2_above: float, m2_below: float,
                  intensity_mep: float, finishes: float) -> pd.DataFrame:
     rows = []
@@ -54,8 +69,10 @@ def sum_chapters(module_def: Dict[str, Any], scenario: str, m2_above: float, m2_
             cost = single*(m2_above)
             rows.append([key,label,basis,single,None,m2_above,0.0,cost*factor,factor,"chapter_rate"])
 
+    count("rows_built", len(rows))
     return pd.DataFrame(rows, columns=["chapter_key","capitulo","basis","eur_m2_above","eur_m2_below","m2_above","m2_below","cost_direct","factor_capitulo","source_mode"])
 
+@timed()
 def apply_building_use(df: pd.DataFrame, module_def: Dict[str, Any], building_use: Optional[str]) -> Tuple[pd.DataFrame, Dict[str,float]]:
     if not building_use:
         return df, {"arch":1.0,"mep":1.0,"overall":1.0}
@@ -75,6 +92,7 @@ def apply_building_use(df: pd.DataFrame, module_def: Dict[str, Any], building_us
     df["cost_direct"] *= overall_m
     return df, {"arch":arch_m,"mep":mep_m,"overall":overall_m}
 
+@timed()
 def estimate_module(cost_data: Dict[str, Any], module_key: str, scenario: str,
                     m2_above: float, m2_below: float,
                     factors: Factors,
@@ -91,6 +109,7 @@ def estimate_module(cost_data: Dict[str, Any], module_key: str, scenario: str,
     """
     options = options or {}
     module_def = cost_data["modules"][module_key]
+    count("estimates")
 
     df = sum_chapters(module_def, scenario, m2_above, m2_below, factors.intensidad_mep, factors.acabados)
 
@@ -157,6 +176,7 @@ def estimate_module(cost_data: Dict[str, Any], module_key: str, scenario: str,
     return df, {"direct":direct,"indirects":indirects,"gg_bi":gg_bi,"soft_costs":soft, "soft_pct_used":soft_pct, "soft_pct_default":soft_pct_default,"contingency":contingency, "cont_pct_used":cont_pct, "cont_pct_default":cont_pct_default,"total":total,
                 "calibration":calib, "use_arch":use_mults["arch"], "use_mep":use_mults["mep"], "use_overall":use_mults["overall"], "module_mult":mult}
 
+@timed()
 def totals_table(totals_by_scenario: Dict[str, Dict[str,float]], area_ref: float) -> pd.DataFrame:
     rows=[]
     for sc, t in totals_by_scenario.items():
@@ -0,0 +1,338 @@
+"""
+Calibración multi-proyecto de cost_ranges.yaml contra costes reales de obras cerradas.
+
+    python -m src.calibration reales.csv -o cost_ranges.calibrado.yaml [--report diag.json] [--residuals res.csv]
+
+Entrada: columnas de estimate_portfolio / src.batch (module, scenario — por defecto mid —, m2_above, m2_below,
+city, factores, building_use, intervention_level, reform_level, use, include_furniture, price_date opcional)
+y el coste real: `actual_direct` (PEM) o `actual_total` (se pasa a directo con los % del módulo).
+
+Se ajustan multiplicadores (en log, partiendo de 1 = YAML actual) de:
+- tarifa de cada capítulo (se aplica por igual a low/mid/high),
+- use_profiles arch / mep / overall de los módulos de edificio,
+- tablas intervention/level/use multiplier.
+Predicción por proyecto = Σ capítulos coste_base × exp(θ); se minimiza Σ w·((pred − real)/real)² + ridge·Σθ²
+con Gauss-Newton sobre la matriz de diseño completa (proyectos × parámetros) y pesos Huber (IRLS) para
+que las obras atípicas no arrastren el ajuste. Los parámetros colineales (p. ej. overall frente a arch+mep)
+los reparte el término ridge.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+import argparse
+import copy
+import json
+import sys
+import time
+import warnings
+import numpy as np
+import pandas as pd
+import yaml
+
+from src.calculations import SCENARIOS
+from src.instrument import timed, count
+from src.model import CostModel, load_model
+from src.portfolio import estimate_portfolio, BUILDING_MODULES, option_table, _level_column
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+@dataclass
+class _Block:
+    """Filas de un módulo: coste base por capítulo y columnas de parámetros que les afectan."""
+    module: str
+    rows: np.ndarray       # positions into the actuals table
+    cost: np.ndarray       # (rows, chapters) direct cost with the current YAML
+    mep: np.ndarray        # bool (chapters,)
+    chapter_params: np.ndarray            # (chapters,) parameter index
+    row_params: List[Tuple[int, np.ndarray, Optional[np.ndarray]]]  # (param, row mask, chapter mask or None)
+
+
+@dataclass
+class CalibrationResult:
+    params: pd.DataFrame       # kind, module, key, current, factor, proposed, se_log, rows
+    diagnostics: Dict[str, Any]
+    by_module: pd.DataFrame
+    residuals: pd.DataFrame
+    cost_data: Dict[str, Any]  # proposed cost_ranges.yaml
+
+    def to_yaml(self, path: str | Path) -> None:
+        write_yaml(self.cost_data, path)
+
+
+def _param_frame(model: CostModel) -> Tuple[pd.DataFrame, Dict[Tuple[str, str, str], int]]:
+    rows = []
+    for module_key, cm in model.modules.items():
+        rows += [("chapter", module_key, k, 1.0) for k in cm.keys]
+        if module_key in BUILDING_MODULES:
+            for use, (a, m, o) in cm.use_profiles.items():
+                rows += [("use_arch", module_key, use, a), ("use_mep", module_key, use, m),
+                         ("use_overall", module_key, use, o)]
+        for table, levels in cm.multipliers.items():
+            rows += [("multiplier", module_key, f"{table}:{lv}", v) for lv, v in levels.items()]
+    df = pd.DataFrame(rows, columns=["kind", "module", "key", "current"])
+    return df, {(k, m, key): i for i, (k, m, key) in enumerate(zip(df["kind"], df["module"], df["key"]))}
+
+
+def _blocks(model: CostModel, projects: pd.DataFrame, index: Dict[Tuple[str, str, str], int]) -> List[_Block]:
+    res = estimate_portfolio(model, projects.drop(columns=["auto_calibrate"], errors="ignore"), with_chapters=True)
+    out = []
+    for module_key, mc in res.chapters.items():
+        cm = model.module(module_key)
+        sub = projects.iloc[mc.rows]
+        row_params = []
+        if module_key in BUILDING_MODULES and "building_use" in sub.columns:
+            bu = sub["building_use"].astype(object).to_numpy()
+            for use in cm.use_profiles:
+                sel = bu == use
+                if sel.any():
+                    row_params += [(index[("use_arch", module_key, use)], sel, ~cm.mep),
+                                   (index[("use_mep", module_key, use)], sel, cm.mep),
+                                   (index[("use_overall", module_key, use)], sel, None)]
+        spec = option_table(module_key)
+        if spec is not None:
+            col, default, table = spec
+            levels = _level_column(sub, col, default).to_numpy()
+            for lv in cm.multipliers.get(table, {}):
+                sel = levels == lv
+                if sel.any():
+                    row_params.append((index[("multiplier", module_key, f"{table}:{lv}")], sel, None))
+        out.append(_Block(module_key, mc.rows, np.where(mc.included, mc.cost, 0.0), cm.mep,
+                          np.array([index[("chapter", module_key, k)] for k in cm.keys]), row_params))
+    return out
+
+
+def _predict(blocks: List[_Block], theta: np.ndarray, n: int, n_params: int,
+             jacobian: bool = True) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Predicción de directo por fila y jacobiano d pred / d θ (n × params, denso)."""
+    pred = np.zeros(n)
+    J = np.zeros((n, n_params)) if jacobian else None
+    for b in blocks:
+        log_mult = np.broadcast_to(theta[b.chapter_params], b.cost.shape).copy()
+        for p, rows, chap in b.row_params:
+            if chap is None:
+                log_mult[rows] += theta[p]
+            else:
+                log_mult[np.ix_(rows, chap)] += theta[p]
+        P = b.cost*np.exp(log_mult)
+        total = P.sum(axis=1)
+        pred[b.rows] = total
+        if J is not None:
+            J[np.ix_(b.rows, b.chapter_params)] += P
+            for p, rows, chap in b.row_params:
+                J[b.rows[rows], p] += (P[rows] if chap is None else P[np.ix_(rows, chap)]).sum(axis=1)
+    return pred, J
+
+
+def _huber(r: np.ndarray, c: float) -> Tuple[np.ndarray, float]:
+    # centred residuals: a common bias (still being fitted) must not mark every row as an outlier
+    centred = r - np.median(r)
+    scale = 1.4826*float(np.median(np.abs(centred))) or 1e-9
+    a = np.abs(centred)/scale
+    return np.where(a <= c, 1.0, c/np.maximum(a, 1e-12)), scale
+
+
+def _metrics(pred: np.ndarray, actual: np.ndarray) -> Dict[str, float]:
+    rel = pred/actual - 1.0
+    lr = np.log(pred/actual)
+    la = np.log(actual)
+    ss_tot = float(((la - la.mean())**2).sum())
+    return {"mape": float(np.mean(np.abs(rel))), "median_ape": float(np.median(np.abs(rel))),
+            "bias": float(np.mean(rel)), "rmse_log": float(np.sqrt(np.mean(lr**2))),
+            "r2_log": float(1.0 - (lr**2).sum()/ss_tot) if ss_tot > 0 else float("nan"),
+            "within_10pct": float(np.mean(np.abs(rel) <= 0.10))}
+
+
+def prepare_actuals(model: CostModel, df: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Proyectos listos para estimate_portfolio (ciudad, escenario mid por defecto) y coste directo real."""
+    from src.batch import prepare_projects
+    if "actual_direct" not in df.columns and "actual_total" not in df.columns:
+        raise ValueError("reales: falta la columna actual_direct o actual_total")
+    projects = prepare_projects(model, df, use_items=False)
+    projects["auto_calibrate"] = False
+    if "scenario" not in projects.columns:
+        projects["scenario"] = "mid"
+    projects["scenario"] = projects["scenario"].fillna("mid")
+    actual = pd.to_numeric(projects["actual_direct"], errors="coerce").to_numpy(dtype=float) \
+        if "actual_direct" in projects.columns else np.full(len(projects), np.nan)
+    if "actual_total" in projects.columns:
+        # total = direct × (1 + indirects + GG/BI + soft + contingency) of the row
+        sci = pd.Index(SCENARIOS).get_indexer(projects["scenario"].astype(str))
+        cms = [model.module(m) for m in projects["module"].astype(str)]
+        pcts = {name: np.array([getattr(cm, name)[s] for cm, s in zip(cms, sci)])
+                for name in ("indirects_pct", "soft_pct", "cont_pct")}
+        for col, name in (("soft_items_pct", "soft_pct"), ("cont_items_pct", "cont_pct")):
+            if col in projects.columns:  # explicit % per project replaces the module default
+                pct = pd.to_numeric(projects[col], errors="coerce").to_numpy(dtype=float)
+                pcts[name] = np.where(np.isnan(pct), pcts[name], pct)
+        markup = 1.0 + pcts["indirects_pct"] + np.array([cm.gg_bi_pct for cm in cms]) + pcts["soft_pct"] + pcts["cont_pct"]
+        from_total = pd.to_numeric(projects["actual_total"], errors="coerce").to_numpy(dtype=float)/markup
+        actual = np.where(np.isnan(actual), from_total, actual)
+    return projects, actual
+
+
+def _index_to_price_dates(model: CostModel, projects: pd.DataFrame, blocks: List[_Block]) -> None:
+    """Lleva el coste base (meta.date_built) a la `price_date` de cada obra, por grupo de capítulos."""
+    from src.indexation import GROUPS, index_table, group_factors, base_date, _group_matrix
+    table = index_table(model)
+    if table.empty or "price_date" not in projects.columns:
+        return
+    dates = projects["price_date"].fillna(base_date(model)).astype(str).to_numpy()
+    fac = group_factors(model, table, base_date(model), dates)  # (n, groups)
+    for b in blocks:
+        g = _group_matrix(model.module(b.module))               # (chapters, groups)
+        b.cost = b.cost*(fac[b.rows] @ g.T)
+    count("calibration_indexed_rows", len(dates))
+
+
+@timed()
+def calibrate(model: CostModel, actuals: pd.DataFrame, ridge: float = 1.0, huber: float = 1.345,
+              bounds: Tuple[float, float] = (0.5, 2.0), max_iter: int = 50, tol: float = 1e-6,
+              min_rows: int = 1) -> CalibrationResult:
+    """
+    Ajuste conjunto sobre todas las obras de `actuals` (ver docstring del módulo). `ridge` es la penalización
+    de cada log-multiplicador (en unidades de obras con error relativo 1), `huber` el umbral en escalas MAD,
+    `bounds` el rango admitido de cada multiplicador y `min_rows` las obras mínimas para mover un parámetro.
+    """
+    t0 = time.perf_counter()
+    projects, actual = prepare_actuals(model, actuals)
+    params, index = _param_frame(model)
+    ok = np.isfinite(actual) & (actual > 0)
+    projects, actual = projects.iloc[np.flatnonzero(ok)], actual[ok]
+    n, k = len(projects), len(params)
+    if n == 0:
+        raise ValueError("reales: ninguna fila con coste real > 0")
+    blocks = _blocks(model, projects, index)
+    _index_to_price_dates(model, projects, blocks)
+
+    theta = np.zeros(k)
+    base_pred, J = _predict(blocks, theta, n, k)
+    support = (J > 0).sum(axis=0)
+    free = support >= max(1, min_rows)
+    lo, hi = np.log(bounds[0]), np.log(bounds[1])
+    w = np.ones(n)
+    scale = 1.0
+    it = 0
+    converged, last_step = False, float("inf")
+    for it in range(1, max_iter + 1):
+        pred, J = _predict(blocks, theta, n, k)
+        r = (pred - actual)/actual
+        w, scale = _huber(r, huber) if huber else (np.ones(n), 1.0)
+        Jr = J[:, free]/actual[:, None]
+        A = (Jr*w[:, None]).T @ Jr + ridge*np.eye(int(free.sum()))
+        g = (Jr*w[:, None]).T @ r + ridge*theta[free]
+        new = np.clip(theta[free] - np.linalg.solve(A, g), lo, hi)
+        step = new - theta[free]
+        theta[free] = new
+        last_step = float(np.max(np.abs(step)))
+        if last_step < tol:
+            converged = True
+            break
+    if not converged:
+        warnings.warn(f"calibración: sin converger tras max_iter={max_iter} iteraciones "
+                      f"(último paso {last_step:.2e} > tol={tol:g})", RuntimeWarning, stacklevel=2)
+    pred, J = _predict(blocks, theta, n, k)
+    r = pred/actual - 1.0
+    Jr = J[:, free]/actual[:, None]
+    A = (Jr*w[:, None]).T @ Jr + ridge*np.eye(int(free.sum()))
+    dof = max(1, n - int(free.sum()))
+    sigma2 = float((w*r**2).sum())/dof
+    se = np.full(k, np.nan)
+    se[free] = np.sqrt(np.maximum(np.diag(np.linalg.inv(A))*sigma2, 0.0))
+
+    factor = np.exp(theta)
+    params["factor"] = factor
+    params["proposed"] = params["current"]*factor
+    params["se_log"] = se
+    params["rows"] = support
+    params = params[support > 0].reset_index(drop=True)
+
+    modules = projects["module"].astype(str).to_numpy()
+    by_module = []
+    for m in pd.unique(modules):
+        sel = modules == m
+        before, after = _metrics(base_pred[sel], actual[sel]), _metrics(pred[sel], actual[sel])
+        by_module.append({"module": m, "rows": int(sel.sum()), **{f"{k_}_before": v for k_, v in before.items()},
+                          **{f"{k_}_after": v for k_, v in after.items()}})
+    residuals = pd.DataFrame({"project": projects.index.to_numpy(), "module": modules,
+                              "scenario": projects["scenario"].to_numpy(), "actual_direct": actual,
+                              "predicted_before": base_pred, "predicted_after": pred,
+                              "rel_error_before": base_pred/actual - 1.0, "rel_error_after": r, "weight": w})
+    diagnostics = {"rows": n, "rows_dropped": int((~ok).sum()), "parameters": int(free.sum()),
+                   "n_iter": it, "converged": converged, "ridge": ridge, "huber": huber, "residual_scale": scale,
+                   "downweighted": int((w < 1.0).sum()), "at_bounds": int(((theta <= lo + 1e-12) | (theta >= hi - 1e-12))[free].sum()),
+                   "before": _metrics(base_pred, actual), "after": _metrics(pred, actual),
+                   "seconds": time.perf_counter() - t0}
+    count("calibration_rows", n)
+    return CalibrationResult(params, diagnostics, pd.DataFrame(by_module), residuals,
+                             calibrated_cost_data(model.cost_data, params))
+
+
+def _round(v: float, like: Any) -> float | int:
+    if isinstance(like, int) and not isinstance(like, bool):
+        return int(round(v))
+    return round(float(v), 3)
+
+
+def calibrated_cost_data(cost_data: Dict[str, Any], params: pd.DataFrame) -> Dict[str, Any]:
+    """Copia de cost_data con los multiplicadores `factor` aplicados (tarifas × factor en low/mid/high)."""
+    out = copy.deepcopy(cost_data)
+    for kind, module_key, key, fac in zip(params["kind"], params["module"], params["key"], params["factor"]):
+        mdef = out["modules"][module_key]
+        if kind == "chapter":
+            ch = next(c for c in mdef["chapters"] if c["key"] == key)
+            for basis in ("above", "below", "single"):
+                if basis in ch:
+                    ch[basis] = {sc: _round(v*fac, v) for sc, v in ch[basis].items()}
+        elif kind.startswith("use_"):
+            up = mdef["use_profiles"][key]
+            field = kind[4:]
+            up[field] = _round(float(up.get(field, 1.0))*fac, 1.0)
+        else:
+            table, level = key.split(":", 1)
+            tbl = mdef["use_multipliers"] if table == "use_multipliers" else mdef["defaults"][table]
+            tbl[level] = _round(float(tbl[level])*fac, 1.0)
+    return out
+
+
+def write_yaml(cost_data: Dict[str, Any], path: str | Path) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(cost_data, f, sort_keys=False, allow_unicode=True)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.calibration",
+                                 description="Calibra cost_ranges.yaml con costes reales de obras cerradas.")
+    ap.add_argument("input", help="CSV/JSONL de obras con actual_direct o actual_total")
+    ap.add_argument("-o", "--output", required=True, help="YAML calibrado propuesto")
+    ap.add_argument("--report", help="diagnósticos del ajuste (JSON)")
+    ap.add_argument("--params", help="multiplicadores ajustados (CSV)")
+    ap.add_argument("--residuals", help="error por obra antes/después (CSV)")
+    ap.add_argument("--ridge", type=float, default=1.0)
+    ap.add_argument("--huber", type=float, default=1.345, help="0 = mínimos cuadrados sin pesos robustos")
+    ap.add_argument("--min-rows", type=int, default=1)
+    ap.add_argument("--data-dir", default=str(DATA_DIR))
+    args = ap.parse_args(argv)
+
+    from src.batch import _format_of
+    model = load_model(args.data_dir)
+    df = pd.read_json(args.input, lines=True) if _format_of(args.input) == "jsonl" else pd.read_csv(args.input)
+    res = calibrate(model, df, ridge=args.ridge, huber=args.huber, min_rows=args.min_rows)
+    res.to_yaml(args.output)
+    if args.report:
+        Path(args.report).write_text(json.dumps({"diagnostics": res.diagnostics,
+                                                 "by_module": res.by_module.to_dict("records")}, indent=2))
+    if args.params:
+        res.params.to_csv(args.params, index=False)
+    if args.residuals:
+        res.residuals.to_csv(args.residuals, index=False)
+    d = res.diagnostics
+    print(f"{d['rows']:,} obras, {d['parameters']} parámetros, {d['n_iter']} iteraciones"
+          f"{'' if d['converged'] else ' (sin converger)'}, {d['seconds']:.2f} s | "
+          f"MAPE {d['before']['mape']:.1%} → {d['after']['mape']:.1%} | atípicas {d['downweighted']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
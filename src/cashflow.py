@@ -0,0 +1,340 @@
+"""
+Flujo de caja mensual (curva S) de una estimación o de una cartera.
+
+Cada capítulo se reparte en el plazo de obra con su perfil de `data/cashflow_profiles.yaml` (forma beta,
+uniforme o tabla acumulada dentro de una ventana de la fase); indirectos, GG+BI, soft costs y contingencia
+con el suyo (o siguiendo al directo), y la retención se descuenta mes a mes y se devuelve `release_months`
+después del fin de obra. Plazo y preconstrucción salen de la superficie por módulo o de las columnas
+`duration_months` / `preconstruction_months`.
+
+Los proyectos se agrupan por (preconstrucción, plazo): cada grupo es un producto (proyectos × capítulos) ·
+(capítulos × meses) y la suma de la cartera por mes un bincount, sin DataFrames por proyecto.
+
+    python -m src.cashflow proyectos.csv -o flujo.csv [--scenario mid] [--by-project matriz.csv]
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Any, Tuple, Optional, List
+import argparse
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+from src.instrument import timed, count
+from src.model import CostModel
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+PROFILES_FILE = "cashflow_profiles.yaml"
+COMPONENTS = ("direct","indirects","gg_bi","soft_costs","contingency")
+COMPONENT_LABELS = {"direct":"Directo","indirects":"Indirectos","gg_bi":"GG+BI","soft_costs":"Soft costs",
+                    "contingency":"Contingencia","retention":"Retención"}
+PHASES = ("preconstruction","construction","total")
+_GRID = 1025
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Parte `share` de un coste repartida con `shape` entre las fracciones start–end de `phase`."""
+    share: float
+    shape: str
+    phase: str
+    start: float
+    end: float
+
+
+def _segments(spec, shapes: Dict[str, np.ndarray], what: str) -> Tuple[Segment, ...]:
+    items = spec if isinstance(spec, list) else [spec]
+    segs = []
+    for it in items:
+        seg = Segment(float(it.get("share", 1.0)), str(it.get("shape", "s_curve")), str(it.get("phase", "construction")),
+                      float(it.get("start", 0.0)), float(it.get("end", 1.0)))
+        if seg.shape not in shapes:
+            raise ValueError(f"{what}: forma desconocida {seg.shape!r}")
+        if seg.phase not in PHASES:
+            raise ValueError(f"{what}: fase desconocida {seg.phase!r}")
+        if not 0.0 <= seg.start < seg.end <= 1.0:
+            raise ValueError(f"{what}: ventana {seg.start}–{seg.end} fuera de 0–1")
+        segs.append(seg)
+    if abs(sum(s.share for s in segs) - 1.0) > 1e-6:
+        raise ValueError(f"{what}: las partes (share) deben sumar 1")
+    return tuple(segs)
+
+
+def _shape_cdf(spec: Dict[str, Any]) -> np.ndarray:
+    """CDF tabulada en _GRID puntos de [0, 1]; beta por trapecios (sin scipy)."""
+    x = np.linspace(0.0, 1.0, _GRID)
+    kind = spec.get("type", "beta")
+    if kind == "uniform":
+        cdf = x.copy()
+    elif kind == "beta":
+        a, b = float(spec["a"]), float(spec["b"])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logpdf = (a - 1.0)*np.log(x) + (b - 1.0)*np.log1p(-x)
+        finite = np.isfinite(logpdf)
+        pdf = np.zeros_like(x)
+        pdf[finite] = np.exp(logpdf[finite] - logpdf[finite].max())
+        cdf = np.concatenate([[0.0], np.cumsum(0.5*(pdf[1:] + pdf[:-1]))])
+        cdf /= cdf[-1]
+    elif kind == "table":
+        cum = np.asarray(spec["cum"], dtype=float)
+        if cum[0] != 0.0 or cum[-1] != 1.0 or (np.diff(cum) < 0).any():
+            raise ValueError("forma 'table': cum debe crecer de 0 a 1")
+        cdf = np.interp(x, np.linspace(0.0, 1.0, len(cum)), cum)
+    else:
+        raise ValueError(f"tipo de forma desconocido {kind!r}")
+    cdf.setflags(write=False)
+    return cdf
+
+
+class CashflowProfiles:
+    """Perfiles de cashflow_profiles.yaml ya validados, con los pesos mensuales memorizados por plazo."""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.spec = spec
+        self.shapes = {k: _shape_cdf(v) for k, v in spec["shapes"].items()}
+        chapters = dict(spec.get("chapters", {}))
+        self.default = _segments(chapters.pop("default", {"shape": "s_curve"}), self.shapes, "chapters.default")
+        self.exact = {k: _segments(v, self.shapes, f"chapters.{k}") for k, v in chapters.items() if "*" not in k}
+        self.patterns = [(k, _segments(v, self.shapes, f"chapters.{k}")) for k, v in chapters.items() if "*" in k]
+        self.components: Dict[str, Any] = {}
+        for name in COMPONENTS[1:]:
+            c = spec.get("components", {}).get(name, {"follow": "direct"})
+            self.components[name] = "direct" if isinstance(c, dict) and c.get("follow") == "direct" \
+                else _segments(c, self.shapes, f"components.{name}")
+        ret = spec.get("retention") or {}
+        self.retention_pct = float(ret.get("pct", 0.0))
+        self.retention_applies = tuple(ret.get("applies_to", ("direct",)))
+        self.release_months = int(ret.get("release_months", 0))
+        self.durations = spec.get("durations", {})
+        self._weights = lru_cache(maxsize=4096)(self._segment_weights)
+
+    def chapter(self, key: str) -> Tuple[Segment, ...]:
+        if key in self.exact:
+            return self.exact[key]
+        for pattern, segs in self.patterns:
+            if fnmatchcase(key, pattern):
+                return segs
+        return self.default
+
+    def schedule(self, module_keys: np.ndarray, area: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Plazo de obra y meses de preconstrucción (enteros ≥ 1 / ≥ 0) por superficie y módulo."""
+        dur = np.ones(len(module_keys))
+        pre = np.zeros(len(module_keys))
+        for mk in pd.unique(module_keys):
+            d = self.durations.get(mk)
+            if not d:
+                continue
+            sel = module_keys == mk
+            raw = float(d.get("base_months", 1)) + float(d.get("months_per_1000m2", 0.0))*area[sel]/1000.0
+            dur[sel] = np.clip(raw, float(d.get("min_months", 1)), float(d.get("max_months", 120)))
+            pre[sel] = float(d.get("preconstruction_months", 0))
+        return np.maximum(np.rint(dur), 1).astype(np.int64), np.maximum(np.rint(pre), 0).astype(np.int64)
+
+    def length(self, pre: int, dur: int) -> int:
+        return pre + dur + (self.release_months if self.retention_pct > 0 else 0)
+
+    def _segment_weights(self, segs: Tuple[Segment, ...], pre: int, dur: int) -> np.ndarray:
+        w = np.zeros(self.length(pre, dur))
+        for s in segs:
+            if s.phase == "preconstruction" and pre == 0:
+                w[0] += s.share  # no preconstruction: lump into the first construction month
+                continue
+            lo, n = {"preconstruction": (0, pre), "construction": (pre, dur), "total": (0, pre + dur)}[s.phase]
+            t = np.arange(n + 1)/n
+            x = np.clip((t - s.start)/(s.end - s.start), 0.0, 1.0)
+            w[lo:lo + n] += s.share*np.diff(np.interp(x, np.linspace(0.0, 1.0, _GRID), self.shapes[s.shape]))
+        w.setflags(write=False)
+        return w
+
+    def weights(self, segs: Tuple[Segment, ...], pre: int, dur: int) -> np.ndarray:
+        return self._weights(segs, int(pre), int(dur))
+
+    def chapter_weights(self, keys: Tuple[str, ...], pre: int, dur: int) -> np.ndarray:
+        """(capítulos × meses) para un plazo; filas que suman 1."""
+        return np.stack([self.weights(self.chapter(k), pre, dur) for k in keys])
+
+
+_lock = threading.Lock()
+_profiles: Dict[Tuple[str, int, int], CashflowProfiles] = {}
+
+
+def load_profiles(data_dir: str | Path = DATA_DIR) -> CashflowProfiles:
+    """Perfiles de `data_dir`/cashflow_profiles.yaml, en caché del proceso por mtime/tamaño."""
+    path = Path(data_dir).resolve() / PROFILES_FILE
+    st = os.stat(path)
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    prof = _profiles.get(key)
+    if prof is None:
+        with _lock:
+            prof = _profiles.get(key)
+            if prof is None:
+                from src.io import load_yaml
+                prof = _profiles[key] = CashflowProfiles(load_yaml(path))
+                count("cashflow_profiles_loaded")
+    return prof
+
+
+@dataclass
+class Cashflow:
+    """Importes por mes (salida de caja) de cada componente; `retention` es −retenido +devuelto."""
+    months: np.ndarray                  # month ordinals (año*12 + mes-1) if dated, else offsets
+    dated: bool
+    components: Dict[str, np.ndarray]   # name → (T,)
+    per_project: Optional[np.ndarray] = None   # (rows, T) total per estimate row
+    project: Optional[np.ndarray] = None       # project id of each row of per_project
+
+    @property
+    def total(self) -> np.ndarray:
+        return sum(self.components.values())
+
+    def labels(self) -> List[str]:
+        if not self.dated:
+            return [int(m) for m in self.months]
+        return [f"{m//12:04d}-{m % 12 + 1:02d}" for m in self.months]
+
+    def frame(self) -> pd.DataFrame:
+        total = self.total
+        cum = np.cumsum(total)
+        out = pd.DataFrame({"month": self.labels(), **self.components, "total": total, "cumulative": cum})
+        out["cumulative_pct"] = cum/cum[-1] if len(cum) and cum[-1] else 0.0
+        return out
+
+
+def _spread(prof: CashflowProfiles, keys: Tuple[str, ...], cost: np.ndarray, comps: Dict[str, np.ndarray],
+            pre: int, dur: int) -> Dict[str, np.ndarray]:
+    """Reparte un grupo de filas con el mismo plazo: (n, meses) por componente + retención."""
+    direct = cost @ prof.chapter_weights(keys, pre, dur)
+    out = {"direct": direct}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        share = np.where(comps["direct"][:, None] > 0, direct/comps["direct"][:, None], 0.0)
+    for name in COMPONENTS[1:]:
+        segs = prof.components[name]
+        out[name] = share*comps[name][:, None] if segs == "direct" else comps[name][:, None]*prof.weights(segs, pre, dur)
+    if prof.retention_pct > 0:
+        ret = np.zeros_like(direct)
+        for name in prof.retention_applies:
+            ret -= prof.retention_pct*out[name]
+        ret[:, pre + dur - 1 + prof.release_months] -= ret.sum(axis=1)
+        out["retention"] = ret
+    return out
+
+
+def _month_ordinal(dates: pd.Series) -> np.ndarray:
+    d = pd.to_datetime(dates, errors="coerce")
+    return (d.dt.year*12 + d.dt.month - 1).to_numpy(dtype=float)
+
+
+@timed()
+def portfolio_cashflow(model: CostModel, projects: pd.DataFrame, scenario: str = "mid",
+                       profiles: CashflowProfiles | None = None, per_project: bool = False) -> Cashflow:
+    """
+    Flujo mensual agregado de una cartera (columnas de estimate_portfolio + start_date "AAAA-MM[-DD]" o
+    start_month entero, duration_months, preconstruction_months; NaN = valor por defecto).
+    Sin columna scenario se usa `scenario`. `per_project=True` añade la matriz filas × meses del total.
+    """
+    from src.portfolio import estimate_portfolio
+    prof = profiles or load_profiles()
+    if "scenario" not in projects.columns:
+        projects = projects.assign(scenario=scenario)
+    est = estimate_portfolio(model, projects, with_chapters=True)
+    n = len(projects)
+    col = lambda c: pd.to_numeric(projects[c], errors="coerce").to_numpy(dtype=float) if c in projects.columns \
+        else np.full(n, np.nan)
+    area = np.nan_to_num(col("m2_above")) + np.nan_to_num(col("m2_below"))
+    dur, pre = prof.schedule(projects["module"].astype(str).to_numpy(), area)
+    d_in, p_in = col("duration_months"), col("preconstruction_months")
+    dur = np.where(np.isnan(d_in), dur, np.maximum(np.rint(d_in), 1)).astype(np.int64)
+    pre = np.where(np.isnan(p_in), pre, np.maximum(np.rint(p_in), 0)).astype(np.int64)
+    dated = "start_date" in projects.columns
+    if dated:
+        start = _month_ordinal(projects["start_date"])
+        start = np.where(np.isnan(start), np.nanmin(start) if (~np.isnan(start)).any() else 0.0, start)
+    else:
+        start = np.nan_to_num(col("start_month"))
+    first = start.astype(np.int64) - pre
+    lengths = np.array([prof.length(p, d) for p, d in zip(pre, dur)], dtype=np.int64) if n else np.zeros(0, np.int64)
+    origin = int(first.min()) if n else 0
+    T = int((first + lengths).max() - origin) if n else 0
+
+    totals = est.totals
+    names = COMPONENTS + (("retention",) if prof.retention_pct > 0 else ())
+    agg = {k: np.zeros(T) for k in names}
+    matrix = np.zeros((n, T)) if per_project else None
+    for mc in est.chapters.values():
+        group = pre[mc.rows]*100_000 + dur[mc.rows]
+        for code in np.unique(group):
+            sel = group == code
+            rows = mc.rows[sel]
+            p, d = int(pre[rows[0]]), int(dur[rows[0]])
+            comps = {k: totals[k].to_numpy()[rows] for k in COMPONENTS}
+            parts = _spread(prof, mc.keys, mc.cost[sel], comps, p, d)
+            cols = (first[rows] - origin)[:, None] + np.arange(prof.length(p, d))
+            flat = cols.ravel()
+            for k, v in parts.items():
+                agg[k] += np.bincount(flat, weights=v.ravel(), minlength=T)
+            if matrix is not None:
+                matrix[rows[:, None], cols] = sum(parts.values())
+    count("cashflow_rows", n)
+    return Cashflow(months=np.arange(origin, origin + T), dated=dated, components=agg, per_project=matrix,
+                    project=totals["project"].to_numpy() if per_project else None)
+
+
+def estimate_cashflow(res, profiles: CashflowProfiles | None = None, duration_months: int | None = None,
+                      preconstruction_months: int | None = None, start_month: int = 0,
+                      dated: bool = False) -> Cashflow:
+    """Flujo mensual de un EstimateResult (capítulos incluidos y totales tal como salen de la app)."""
+    prof = profiles or load_profiles()
+    area = np.array([res.m2_above + res.m2_below])
+    dur, pre = prof.schedule(np.array([res.module.key]), area)
+    d = int(duration_months) if duration_months else int(dur[0])
+    p = int(preconstruction_months) if preconstruction_months is not None else int(pre[0])
+    t = res.totals()
+    comps = {k: np.array([float(t[k])]) for k in COMPONENTS}
+    parts = _spread(prof, res.module.keys, np.where(res.mask, res.cost, 0.0)[None, :], comps, p, d)
+    first = int(start_month) - p
+    return Cashflow(months=np.arange(first, first + prof.length(p, d)), dated=dated,
+                    components={k: v[0] for k, v in parts.items()})
+
+
+def default_schedule(module_key: str, area_m2: float, profiles: CashflowProfiles | None = None) -> Tuple[int, int]:
+    """(plazo de obra, meses de preconstrucción) por defecto para un módulo y superficie."""
+    dur, pre = (profiles or load_profiles()).schedule(np.array([module_key]), np.array([float(area_m2)]))
+    return int(dur[0]), int(pre[0])
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.cashflow",
+                                 description="Flujo de caja mensual (curva S) de una cartera de proyectos.")
+    ap.add_argument("input", help="CSV/JSONL de proyectos (columnas de src.batch + start_date/start_month, "
+                                  "duration_months, preconstruction_months)")
+    ap.add_argument("-o", "--output", required=True, help="flujo mensual agregado (CSV)")
+    ap.add_argument("--scenario", default="mid", choices=["low","mid","high"])
+    ap.add_argument("--by-project", help="matriz proyecto × mes del total (CSV)")
+    ap.add_argument("--data-dir", default=str(DATA_DIR))
+    args = ap.parse_args(argv)
+
+    from src.batch import _format_of, prepare_projects
+    from src.model import load_model
+    model = load_model(args.data_dir)
+    df = pd.read_json(args.input, lines=True) if _format_of(args.input) == "jsonl" else pd.read_csv(args.input)
+    projects = prepare_projects(model, df)
+    cf = portfolio_cashflow(model, projects, args.scenario, load_profiles(args.data_dir),
+                            per_project=bool(args.by_project))
+    out = cf.frame()
+    out.to_csv(args.output, index=False)
+    if args.by_project:
+        pd.DataFrame(cf.per_project, index=pd.Index(cf.project, name="project"),
+                     columns=[str(m) for m in cf.labels()]).to_csv(args.by_project)
+    peak = out.loc[out["total"].idxmax()] if len(out) else None
+    print(f"{len(projects):,} proyectos, {len(out)} meses, total {out['total'].sum():,.0f} €"
+          + (f" | pico {peak['total']:,.0f} € en {peak['month']}" if peak is not None else ""), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,426 @@
+"""
+Almacén columnar en disco, leído por memory-map: muestras de Monte Carlo y desgloses por capítulo.
+
+Un dataset es un directorio con `manifest.json` y un `.npy` por columna (cabecera fija de 128 bytes que se
+reescribe al cerrar, así que `np.load(..., mmap_mode="r")` también lo abre). Las columnas de texto se
+guardan como códigos int32 + diccionario en el manifiesto. Se escribe por bloques (`append`) y cada bloque
+guarda min/máx por columna, con lo que los filtros (proyecto, módulo, escenario, capítulo, rangos)
+saltan bloques enteros sin leerlos. Los percentiles e histogramas se recalculan recorriendo los bloques
+mapeados con `StreamingHistogram`, sin cargar la columna entera en memoria.
+
+    with ColumnarWriter("mc.cols", meta={...}) as w:
+        w.append({"total": t, "direct": d})
+    st = ColumnarStore("mc.cols")
+    st.quantiles("total", (0.5, 0.8, 0.9), where={"plazo": (1.05, None)})
+    st.read(["project","chapter_key","cost_direct"], where={"module": "reforma_piso", "scenario": ["mid","high"]})
+
+    python -m src.columnar capitulos.cols -w project=P7 -w scenario=mid,high [-q cost_direct] [-o sel.csv]
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Any, List, Iterable, Iterator, Mapping, Sequence, Tuple
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import secrets
+import shutil
+import sys
+import numpy as np
+import pandas as pd
+
+from src.risk import StreamingHistogram, MonteCarloConfig, MonteCarloResult, run_monte_carlo
+
+MANIFEST = "manifest.json"
+VERSION = 1
+MC_ROOT = Path(__file__).resolve().parent.parent / "data" / ".cache" / "mc"
+_HEADER = 128   # fixed .npy header: rewritten in place when the column grows
+
+
+def _npy_header(dtype: np.dtype, rows: int) -> bytes:
+    d = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.dtype(dtype).str, rows)
+    body = d.encode("latin1")
+    pad = _HEADER - 10 - len(body) - 1
+    if pad < 0:
+        raise ValueError("cabecera .npy demasiado larga")
+    return b"\x93NUMPY\x01\x00" + (_HEADER - 10).to_bytes(2, "little") + body + b" "*pad + b"\n"
+
+
+def _is_text(values: np.ndarray) -> bool:
+    return values.dtype.kind in "OUS" or isinstance(values.dtype, pd.CategoricalDtype)
+
+
+def _json_value(v):
+    if isinstance(v, (np.integer,)):
+        return int(v)
+    if isinstance(v, (np.floating,)):
+        return float(v)
+    if isinstance(v, (np.bool_,)):
+        return bool(v)
+    return v
+
+
+class ColumnarWriter:
+    """Escribe un dataset por bloques; el esquema lo fija el primer `append` (texto → diccionario)."""
+
+    def __init__(self, path: str | Path, meta: Dict[str, Any] | None = None, overwrite: bool = True):
+        self.path = Path(path)
+        if self.path.exists():
+            if not overwrite:
+                raise FileExistsError(str(self.path))
+            shutil.rmtree(self.path)
+        self.path.mkdir(parents=True)
+        self.meta = dict(meta or {})
+        self.rows = 0
+        self.columns: Dict[str, Dict[str, Any]] = {}
+        self.chunks: List[Dict[str, Any]] = []
+        self._codes: Dict[str, Dict[Any, int]] = {}
+        self._fh: Dict[str, Any] = {}
+        self.closed = False
+
+    def _open(self, name: str, kind: str, dtype: np.dtype) -> None:
+        fh = open(self.path / f"{name}.npy", "w+b")
+        fh.write(_npy_header(dtype, 0))
+        self._fh[name] = fh
+        self.columns[name] = {"kind": kind, "dtype": np.dtype(dtype).str}
+        if kind == "dict":
+            self.columns[name]["dictionary"] = []
+            self._codes[name] = {}
+
+    def _encode(self, name: str, values) -> np.ndarray:
+        codes, uniques = pd.factorize(pd.Series(values, copy=False).astype(object), use_na_sentinel=True)
+        table, dictionary = self._codes[name], self.columns[name]["dictionary"]
+        remap = np.empty(len(uniques), dtype=np.int32)
+        for i, u in enumerate(uniques):
+            u = _json_value(u)
+            c = table.get(u)
+            if c is None:
+                c = table[u] = len(dictionary)
+                dictionary.append(u)
+            remap[i] = c
+        out = np.full(len(codes), -1, dtype=np.int32)   # -1 = missing
+        ok = codes >= 0
+        out[ok] = remap[codes[ok]]
+        return out
+
+    def append(self, data: Mapping[str, Any] | pd.DataFrame) -> None:
+        if self.closed:
+            raise ValueError("dataset cerrado")
+        cols = {c: data[c] for c in data.columns} if isinstance(data, pd.DataFrame) else dict(data)
+        if not cols:
+            return
+        arrays = {}
+        for name, v in cols.items():
+            a = v.to_numpy() if isinstance(v, pd.Series) else np.asarray(v)
+            if name not in self.columns:
+                if self.rows:
+                    raise KeyError(f"columna nueva tras el primer bloque: {name!r}")
+                text = _is_text(a) or (isinstance(v, pd.Series) and _is_text(v))
+                self._open(name, "dict" if text else "num", np.int32 if text else a.dtype)
+            spec = self.columns[name]
+            arrays[name] = self._encode(name, v) if spec["kind"] == "dict" else \
+                np.ascontiguousarray(a, dtype=np.dtype(spec["dtype"]))
+        missing = set(self.columns) - set(arrays)
+        if missing:
+            raise KeyError(f"faltan columnas: {sorted(missing)}")
+        n = {len(a) for a in arrays.values()}
+        if len(n) != 1:
+            raise ValueError("columnas de distinta longitud")
+        n = n.pop()
+        if not n:
+            return
+        stats = {}
+        for name, a in arrays.items():
+            self._fh[name].write(a.tobytes())
+            valid = a[a >= 0] if self.columns[name]["kind"] == "dict" else a
+            if valid.dtype.kind == "f":
+                valid = valid[~np.isnan(valid)]
+            stats[name] = [_json_value(valid.min()), _json_value(valid.max())] if len(valid) else None
+        self.chunks.append({"start": self.rows, "rows": n, "stats": stats})
+        self.rows += n
+
+    def _manifest(self) -> Dict[str, Any]:
+        columns = {}
+        for name, spec in self.columns.items():
+            st = [c["stats"][name] for c in self.chunks if c["stats"][name] is not None]
+            columns[name] = {**spec, "min": min(s[0] for s in st) if st else None,
+                             "max": max(s[1] for s in st) if st else None}
+        return {"version": VERSION, "rows": self.rows, "columns": columns, "chunks": self.chunks, "meta": self.meta}
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        for name, fh in self._fh.items():
+            fh.seek(0)
+            fh.write(_npy_header(np.dtype(self.columns[name]["dtype"]), self.rows))
+            fh.close()
+        tmp = self.path / (MANIFEST + ".tmp")
+        tmp.write_text(json.dumps(self._manifest(), ensure_ascii=False, default=_json_value), encoding="utf-8")
+        os.replace(tmp, self.path / MANIFEST)   # the dataset is readable only once complete
+        self.closed = True
+
+    def abort(self) -> None:
+        for fh in self._fh.values():
+            fh.close()
+        self.closed = True
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self) -> "ColumnarWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.abort() if exc_type is not None else self.close()
+
+
+class ColumnarStore:
+    """Dataset abierto por memory-map (sin copiar); filtros por valor, lista de valores o rango (lo, hi)."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        man = json.loads((self.path / MANIFEST).read_text(encoding="utf-8"))
+        if man.get("version") != VERSION:
+            raise ValueError(f"versión de dataset no soportada: {man.get('version')}")
+        self.rows: int = man["rows"]
+        self.spec: Dict[str, Dict[str, Any]] = man["columns"]
+        self.chunks: List[Dict[str, Any]] = man["chunks"]
+        self.meta: Dict[str, Any] = man.get("meta", {})
+        self._maps: Dict[str, np.ndarray] = {}
+        self._index: Dict[str, Dict[Any, int]] = {}
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.spec)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def raw(self, name: str) -> np.ndarray:
+        """Columna mapeada (códigos int32 en las de diccionario)."""
+        m = self._maps.get(name)
+        if m is None:
+            if name not in self.spec:
+                raise KeyError(f"columna desconocida: {name!r}")
+            dtype = np.dtype(self.spec[name]["dtype"])
+            m = np.memmap(self.path / f"{name}.npy", dtype=dtype, mode="r", offset=_HEADER, shape=(self.rows,)) \
+                if self.rows else np.zeros(0, dtype=dtype)
+            self._maps[name] = m
+        return m
+
+    def dictionary(self, name: str) -> List[Any]:
+        return self.spec[name].get("dictionary", [])
+
+    def _codes(self, name: str, values) -> np.ndarray:
+        idx = self._index.get(name)
+        if idx is None:
+            idx = self._index[name] = {v: i for i, v in enumerate(self.dictionary(name))}
+        vals = values if isinstance(values, (list, tuple, set, frozenset, np.ndarray, pd.Index)) else [values]
+        return np.array(sorted({idx[v] for v in vals if v in idx}), dtype=np.int32)
+
+    def _conditions(self, where: Mapping[str, Any] | None):
+        conds = []
+        for name, cond in (where or {}).items():
+            spec = self.spec.get(name)
+            if spec is None:
+                raise KeyError(f"columna desconocida: {name!r}")
+            if spec["kind"] == "dict":
+                conds.append((name, "in", self._codes(name, cond)))
+            elif isinstance(cond, tuple) and len(cond) == 2:
+                lo, hi = cond
+                conds.append((name, "range", (-np.inf if lo is None else lo, np.inf if hi is None else hi)))
+            else:
+                vals = cond if isinstance(cond, (list, set, frozenset, np.ndarray)) else [cond]
+                try:
+                    conds.append((name, "in", np.asarray(sorted(vals), dtype=np.dtype(spec["dtype"]))))
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"filtro no numérico para la columna {name!r}: {cond!r}") from e
+        return conds
+
+    def _chunk_may_match(self, chunk: Dict[str, Any], conds) -> bool:
+        for name, op, arg in conds:
+            st = chunk["stats"].get(name)
+            if st is None:
+                return False
+            lo, hi = st
+            if op == "in":
+                if not len(arg) or not ((arg >= lo) & (arg <= hi)).any():
+                    return False
+            elif arg[0] > hi or arg[1] < lo:
+                return False
+        return True
+
+    def iter_chunks(self, columns: Sequence[str] | None = None, where: Mapping[str, Any] | None = None,
+                    decode: bool = False) -> Iterator[Dict[str, np.ndarray]]:
+        """Bloques filtrados {columna: array}; sin filtro, vistas del memory-map (sin copia)."""
+        columns = list(columns or self.columns)
+        conds = self._conditions(where)
+        for chunk in self.chunks:
+            if conds and not self._chunk_may_match(chunk, conds):
+                continue
+            sl = slice(chunk["start"], chunk["start"] + chunk["rows"])
+            mask = None
+            for name, op, arg in conds:
+                a = self.raw(name)[sl]
+                m = np.isin(a, arg) if op == "in" else (a >= arg[0]) & (a <= arg[1])
+                mask = m if mask is None else mask & m
+            if mask is not None and not mask.any():
+                continue
+            out = {}
+            for name in columns:
+                a = self.raw(name)[sl]
+                a = a if mask is None else a[mask]
+                if decode and self.spec[name]["kind"] == "dict":
+                    a = self._decode(name, a)
+                out[name] = a
+            yield out
+
+    def _decode(self, name: str, codes: np.ndarray) -> pd.Categorical:
+        cats = self.dictionary(name)
+        return pd.Categorical.from_codes(np.asarray(codes, dtype=np.int32), categories=pd.Index(cats, dtype=object)) \
+            if len(set(map(type, cats))) <= 1 else np.asarray(cats + [None], dtype=object)[codes]
+
+    def read(self, columns: Sequence[str] | None = None, where: Mapping[str, Any] | None = None) -> pd.DataFrame:
+        """Filas que cumplen `where` (texto como Categorical); copia solo lo seleccionado."""
+        columns = list(columns or self.columns)
+        parts = list(self.iter_chunks(columns, where))
+        data = {}
+        for name in columns:
+            dtype = np.dtype(self.spec[name]["dtype"])
+            a = np.concatenate([p[name] for p in parts]) if parts else np.zeros(0, dtype=dtype)
+            data[name] = self._decode(name, a) if self.spec[name]["kind"] == "dict" else np.asarray(a)
+        return pd.DataFrame(data)
+
+    def count(self, where: Mapping[str, Any] | None = None) -> int:
+        if not where:
+            return self.rows
+        first = next(iter(where))
+        return sum(len(c[first]) for c in self.iter_chunks([first], where))
+
+    def distribution(self, column: str, where: Mapping[str, Any] | None = None, bins: int = 8192) -> StreamingHistogram:
+        """Histograma + momentos de `column` recorriendo los bloques mapeados (memoria acotada)."""
+        spec = self.spec[column]
+        lo, hi = spec.get("min"), spec.get("max")
+        h = StreamingHistogram(0.0 if lo is None else float(lo), 0.0 if hi is None else float(hi), bins)
+        for c in self.iter_chunks([column], where):
+            a = c[column]
+            h.add(a[~np.isnan(a)] if a.dtype.kind == "f" else a)
+        return h
+
+    def quantiles(self, column: str, qs: Iterable[float] = (0.5, 0.8, 0.9),
+                  where: Mapping[str, Any] | None = None, bins: int = 8192) -> Dict[str, float]:
+        h = self.distribution(column, where, bins)
+        return {f"P{q*100:g}": h.quantile(q) for q in qs}
+
+    def histogram(self, column: str, bins: int = 40, where: Mapping[str, Any] | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        return self.distribution(column, where).coarse(bins)
+
+
+def is_dataset(path: str | Path) -> bool:
+    return (Path(path) / MANIFEST).is_file()
+
+
+def append_chapters(writer: ColumnarWriter, est, chunk_rows: int = 250_000) -> int:
+    """Desglose por capítulo de un PortfolioEstimate (columnas de chapter_frame()) por bloques, sin concatenar."""
+    totals = est.totals
+    project = totals["project"].to_numpy()
+    scenario = totals["scenario"].to_numpy()
+    n = 0
+    for module_key, mc in est.chapters.items():
+        keys, labels, basis = (np.asarray(v, dtype=object) for v in (mc.keys, mc.labels, mc.basis))
+        step = max(1, chunk_rows // max(len(mc.keys), 1))
+        for s in range(0, len(mc.rows), step):
+            r, c = np.nonzero(mc.included[s:s + step])
+            rows = mc.rows[s:s + step][r]
+            writer.append({"project": project[rows], "module": np.full(len(r), module_key, dtype=object),
+                           "scenario": scenario[rows], "chapter_key": keys[c], "capitulo": labels[c],
+                           "basis": basis[c], "cost_direct": mc.cost[s:s + step][r, c]})
+            n += len(r)
+    return n
+
+
+def monte_carlo_samples(spec, config: MonteCarloConfig | None = None, root: str | Path | None = None,
+                        keep: int = 8, progress=None) -> Tuple[MonteCarloResult, ColumnarStore, bool]:
+    """
+    Monte Carlo con las muestras guardadas en `root/<hash>` (spec + n_iter + semilla + chunk). Si ya existe
+    se reabre mapeado y los histogramas se recalculan del disco sin simular. Devuelve (resultado, store, reusado).
+    Se conservan los `keep` datasets más recientes. Raíz: CAPEX_MC_STORE o data/.cache/mc.
+    `progress` como en `run_monte_carlo` (no se llama si se reutiliza).
+    """
+    cfg = config or MonteCarloConfig()
+    root = Path(root or os.environ.get("CAPEX_MC_STORE") or MC_ROOT)
+    salt = secrets.token_hex(8) if cfg.seed is None else ""   # unseeded runs are never reused
+    key = hashlib.sha256(pickle.dumps((VERSION, spec, int(cfg.n_iter), cfg.seed, int(cfg.chunk_size), salt))).hexdigest()[:32]
+    path = root / key
+    reused = is_dataset(path)
+    if reused:
+        os.utime(path / MANIFEST)
+    else:
+        _simulate_to(path, spec, cfg, progress)
+        _prune(root, keep)
+    # histograms over the stored samples' own range: a fresh run and a reopened one report the same figures
+    store = ColumnarStore(path)
+    total, direct = store.distribution("total", bins=spec.bins), store.distribution("direct", bins=spec.bins)
+    return MonteCarloResult(n=total.n, total=total, direct=direct, seed=cfg.seed), store, reused
+
+
+def _simulate_to(path: Path, spec, cfg: MonteCarloConfig, progress=None) -> None:
+    tmp = path.parent / f".{path.name}.{os.getpid()}.{secrets.token_hex(4)}"
+    with ColumnarWriter(tmp, meta={"kind": "monte_carlo", "n_iter": int(cfg.n_iter), "seed": cfg.seed,
+                                   "chapters": list(spec.chapter_keys), "pcts": spec.pcts}) as w:
+        run_monte_carlo(spec, cfg, sink=w, progress=progress)
+    try:
+        os.replace(tmp, path)
+    except OSError:   # another session stored the same run first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _prune(root: Path, keep: int) -> None:
+    done = sorted((p for p in root.iterdir() if is_dataset(p) and not p.name.startswith(".")),
+                  key=lambda p: (p / MANIFEST).stat().st_mtime, reverse=True)
+    for p in done[keep:]:
+        shutil.rmtree(p, ignore_errors=True)
+
+
+def _parse_where(items: Sequence[str]) -> Dict[str, Any]:
+    where: Dict[str, Any] = {}
+    for it in items or ():
+        name, _, val = it.partition("=")
+        if ".." in val:
+            lo, hi = val.split("..", 1)
+            where[name] = (float(lo) if lo else None, float(hi) if hi else None)
+        else:
+            where[name] = val.split(",")
+    return where
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.columnar", description="Consulta un dataset columnar (.cols).")
+    ap.add_argument("path")
+    ap.add_argument("-w", "--where", action="append", default=[],
+                    help="filtro col=valor[,valor…] o col=lo..hi (repetible)")
+    ap.add_argument("-q", "--quantiles", metavar="COLUMNA", help="percentiles P5…P95 de la columna (streaming)")
+    ap.add_argument("-c", "--columns", help="columnas a volcar (separadas por comas)")
+    ap.add_argument("-o", "--output", help="CSV con las filas seleccionadas")
+    args = ap.parse_args(argv)
+
+    st = ColumnarStore(args.path)
+    where = _parse_where(args.where)
+    for name, cond in list(where.items()):
+        if st.spec.get(name, {}).get("kind") == "num" and isinstance(cond, list):
+            where[name] = [float(v) for v in cond]
+    if args.quantiles:
+        h = st.distribution(args.quantiles, where)
+        qs = {f"P{p}": h.quantile(p/100) for p in (5, 10, 25, 50, 75, 80, 90, 95)}
+        print(pd.Series({"n": h.n, "mean": h.mean, "std": h.std, "min": h.min, "max": h.max, **qs}).to_string())
+    if args.output or args.columns or not args.quantiles:
+        df = st.read(args.columns.split(",") if args.columns else None, where)
+        if args.output:
+            df.to_csv(args.output, index=False)
+        else:
+            print(df.head(50).to_string(index=False))
+        print(f"{len(df):,} de {st.rows:,} filas", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
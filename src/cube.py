@@ -0,0 +1,381 @@
+"""
+Cubo precalculado de €/m² para las tipologías estándar: módulo × uso × nivel de opción × escenario, por
+capítulo y por componente del total (directo, indirectos, GG+BI, soft costs, contingencia).
+
+El modelo es lineal en las superficies y multiplicativo en los factores globales, así que una consulta con
+intensidad MEP y acabados a 1 y sin auto-calibración es una búsqueda por índice y un escalado:
+
+    coste capítulo = (€/m² sobre · m² sobre + €/m² bajo · m² bajo) · Factors.combined()
+
+Las celdas se calculan con el propio pipeline (m² = 1 sobre / bajo rasante), así que coinciden con
+`estimate_module`. La ciudad queda factorizada (cities.csv → factor de localización): multiplicar el cubo
+por cada ciudad solo repetiría los mismos números; `frame(cities=True)` los materializa para exportar.
+Se reconstruye cuando cambia la huella de los datos (`cube_for(model)`).
+
+    cube = cube_for(model)
+    cube.lookup("obra_nueva_edificio", "mid", 2000, 500, city="Madrid", building_use="hotel")
+    cube.estimate_result(model, ...)        # EstimateResult o None (entrada no estándar → cálculo completo)
+    estimate_totals(model, proyectos)       # como estimate_portfolio(...).totals, por búsqueda en el cubo
+
+    python -m src.cube -o cubo.csv [--cities]
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Any, Iterable, Optional, Tuple
+import argparse
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+from src.calculations import Factors, SCENARIOS
+from src.model import CostModel, CompiledModule
+from src.instrument import count, span
+from src.portfolio import (BUILDING_MODULES, FACTOR_FIELDS, TOTAL_COLUMNS, _bool_column, _column, _expand_scenarios,
+                           _optional_column, estimate_portfolio, option_table)
+
+COMPONENTS = ("direct","indirects","gg_bi","soft_costs","contingency","total")
+
+
+@dataclass(frozen=True)
+class ModuleCube:
+    """€/m² de un módulo: ejes (uso, nivel, escenario[, capítulo]); índice 0 de uso = sin perfil de uso."""
+    key: str
+    uses: Tuple[Optional[str], ...]
+    option: Optional[str]                 # column of the level axis (reform_level, use, include_furniture…)
+    levels: Tuple[Any, ...]
+    default_level: Any
+    chapter_a: np.ndarray                 # (uses, levels, scenarios, chapters) €/m² above (or single)
+    chapter_b: np.ndarray                 # (uses, levels, scenarios, chapters) €/m² below
+    included: np.ndarray                  # bool (levels, chapters): furniture out of fit-out without it
+    components: np.ndarray                # (uses, levels, scenarios, COMPONENTS, 2) €/m² above / below
+    use_mults: np.ndarray                 # (uses, 3) arch, mep, overall
+    module_mult: np.ndarray               # (levels,)
+    soft_pct: np.ndarray                  # (scenarios,) module defaults
+    cont_pct: np.ndarray
+
+    def use_index(self, building_use: Optional[str]) -> int:
+        """Uso desconocido o vacío = sin perfil (como estimate_module)."""
+        try:
+            return self.uses.index(building_use) if building_use else 0
+        except ValueError:
+            return 0
+
+    def level_index(self, options: Dict[str, Any]) -> int:
+        """-1 si el nivel no está en la tabla (lo resuelve el cálculo completo)."""
+        if self.option is None:
+            return 0
+        value = options.get(self.option, self.default_level)
+        if self.option == "include_furniture":
+            value = bool(value)
+        try:
+            return self.levels.index(value)
+        except ValueError:
+            return -1
+
+
+class PriceCube:
+    """Cubo de un CostModel (una huella de datos)."""
+
+    def __init__(self, fingerprint: str, modules: Dict[str, ModuleCube], city_factors: Dict[str, float]):
+        self.fingerprint = fingerprint
+        self.modules = modules
+        self.city_factors = dict(city_factors)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()   # one cube per data fingerprint, shared by every session/thread
+        # all modules flattened: cell = offset[module] + (use·levels + level)·scenarios + scenario
+        self.offsets: Dict[str, int] = {}
+        flat = {"components": [], "use_mults": [], "module_mult": [], "soft_pct": [], "cont_pct": []}
+        for key, mc in modules.items():
+            nu, nl, ns = mc.components.shape[:3]
+            self.offsets[key] = sum(len(a) for a in flat["components"])
+            u, lv, sc = (a.ravel() for a in np.meshgrid(np.arange(nu), np.arange(nl), np.arange(ns), indexing="ij"))
+            flat["components"].append(mc.components.reshape(nu*nl*ns, len(COMPONENTS), 2))
+            flat["use_mults"].append(mc.use_mults[u])
+            flat["module_mult"].append(mc.module_mult[lv])
+            flat["soft_pct"].append(mc.soft_pct[sc])
+            flat["cont_pct"].append(mc.cont_pct[sc])
+        self._flat = {k: np.concatenate(v) if v else np.zeros((0,)) for k, v in flat.items()}
+
+    @property
+    def cells(self) -> int:
+        return int(sum(mc.components[..., 0, 0].size for mc in self.modules.values()))
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(a.nbytes for mc in self.modules.values()
+                       for a in (mc.chapter_a, mc.chapter_b, mc.included, mc.components)))
+
+    def _tally(self, hits: int, misses: int) -> None:
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+        if hits:
+            count("cube_hits", hits)
+        if misses:
+            count("cube_misses", misses)
+
+    def _miss(self) -> None:
+        self._tally(0, 1)
+
+    # --- single estimate --------------------------------------------------------------------
+    def lookup(self, module_key: str, scenario: str, m2_above: float, m2_below: float,
+               city: Optional[str] = None, factors: Factors | None = None, building_use: Optional[str] = None,
+               **options) -> Optional[Dict[str, float]]:
+        """Componentes del total (€) de una tipología estándar; None si no está en el cubo."""
+        factors = factors or Factors()
+        mc = self.modules.get(module_key)
+        if mc is None or factors.intensidad_mep != 1.0 or factors.acabados != 1.0 or scenario not in SCENARIOS:
+            self._miss()
+            return None
+        li = mc.level_index(options)
+        if li < 0 or (city is not None and city not in self.city_factors):
+            self._miss()
+            return None
+        scale = factors.combined() * (self.city_factors[city] if city is not None else 1.0)
+        comp = mc.components[mc.use_index(building_use), li, SCENARIOS.index(scenario)]
+        got = dict(zip(COMPONENTS, (comp[:, 0]*m2_above + comp[:, 1]*m2_below) * scale))
+        # soft/contingency overrides: % of direct, as in totals() and estimate_result()
+        for name, opt in (("soft_costs", "soft_items_pct"), ("contingency", "cont_items_pct")):
+            if options.get(opt) is not None:
+                got[name] = got["direct"]*float(options[opt])
+        got["total"] = got["direct"] + got["indirects"] + got["gg_bi"] + got["soft_costs"] + got["contingency"]
+        self._tally(1, 0)
+        return got
+
+    def estimate_result(self, model: CostModel, module_key: str, scenario: str, m2_above: float, m2_below: float,
+                        factors: Factors, options: Dict[str, Any] | None = None,
+                        benchmark_row: Dict[str, Any] | None = None,
+                        auto_calibrate_to_benchmark: bool = False,
+                        include_optional: bool = True,
+                        chapters: Iterable[str] | None = None):
+        """
+        Mismo EstimateResult que `EstimatePipeline.run_result` para entradas estándar, por búsqueda y escalado;
+        None si hay factores de capítulo, calibración o un nivel fuera de tabla (usar el cálculo completo).
+        """
+        from src.result import EstimateResult
+        options = options or {}
+        mc = self.modules.get(module_key)
+        calibrate = auto_calibrate_to_benchmark and benchmark_row and benchmark_row.get("pem_"+scenario) is not None
+        if mc is None or model.fingerprint != self.fingerprint or calibrate \
+                or factors.intensidad_mep != 1.0 or factors.acabados != 1.0:
+            self._miss()
+            return None
+        li = mc.level_index(options)
+        if li < 0:
+            self._miss()
+            return None
+        ui = mc.use_index(options.get("building_use"))
+        sci = SCENARIOS.index(scenario)
+        cm = model.module(module_key)
+        combined = factors.combined()
+        cost = (mc.chapter_a[ui, li, sci]*float(m2_above) + mc.chapter_b[ui, li, sci]*float(m2_below)) * combined
+        keep = mc.included[li].copy()
+        if not include_optional:
+            keep &= ~cm.optional
+        if chapters is not None:
+            chapters = set(chapters)
+            keep &= np.fromiter((k in chapters for k in cm.keys), bool, len(cm.keys))
+        mult = float(mc.module_mult[li])
+        self._tally(1, 0)
+        return EstimateResult(cm, sci, scenario, m2_above, m2_below, cost, np.ones(len(cm.keys)), keep,
+                              combined*mult, tuple(float(x) for x in mc.use_mults[ui]), mult, 1.0, False,
+                              float(options.get("soft_items_pct", cm.soft_pct[sci])),
+                              float(options.get("cont_items_pct", cm.cont_pct[sci])))
+
+    # --- portfolio --------------------------------------------------------------------------
+    def cells_for(self, projects: pd.DataFrame) -> np.ndarray:
+        """Celda del cubo de cada fila (con columna scenario); -1 = no estándar (factor de capítulo, calibración, nivel)."""
+        n = len(projects)
+        cells = np.full(n, -1, dtype=np.int64)
+        sci = pd.Index(SCENARIOS).get_indexer(projects["scenario"].astype(str))
+        standard = (_column(projects, "intensidad_mep", 1.0) == 1.0) & (_column(projects, "acabados", 1.0) == 1.0)
+        standard &= sci >= 0
+        calib = _bool_column(projects, "auto_calibrate")
+        if calib.any():
+            pem = np.column_stack([_optional_column(projects, "pem_"+sc) for sc in SCENARIOS])
+            standard &= ~(calib & ~np.isnan(pem[np.arange(n), np.maximum(sci, 0)]))
+        codes, uniques = pd.factorize(projects["module"].astype(str))
+        for code, module_key in enumerate(uniques):
+            mc = self.modules.get(module_key)
+            rows = np.flatnonzero((codes == code) & standard)
+            if mc is None or not len(rows):
+                continue
+            ui = np.zeros(len(rows), dtype=np.int64)
+            if len(mc.uses) > 1 and "building_use" in projects.columns:
+                ui = pd.Index(mc.uses[1:]).get_indexer(projects["building_use"].to_numpy()[rows]) + 1  # unknown → 0
+            if mc.option is None:
+                li = np.zeros(len(rows), dtype=np.int64)
+            elif mc.option == "include_furniture":
+                li = pd.Index(mc.levels).get_indexer(_bool_column(projects.iloc[rows], "include_furniture"))
+            else:
+                col = pd.Series(projects[mc.option].to_numpy()[rows] if mc.option in projects.columns else None,
+                                index=np.arange(len(rows)), dtype=object)
+                li = pd.Index(mc.levels).get_indexer(col.where(col.notna() & (col != ""), mc.default_level))
+            ok = li >= 0
+            cells[rows[ok]] = self.offsets[module_key] + (ui[ok]*len(mc.levels) + li[ok])*len(SCENARIOS) + sci[rows[ok]]
+        return cells
+
+    def totals(self, projects: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+        """Totales de las filas estándar (mismas columnas que `estimate_portfolio`) y máscara de esas filas."""
+        cells = self.cells_for(projects)
+        hit = cells >= 0
+        n, rows = len(projects), np.flatnonzero(hit)
+        c, f = cells[rows], self._flat
+        combined = _column(projects, FACTOR_FIELDS[0], 1.0)[rows]
+        for name in FACTOR_FIELDS[1:]:
+            combined = combined * _column(projects, name, 1.0)[rows]
+        comp = f["components"][c]                                   # (rows, COMPONENTS, above/below)
+        value = (comp[..., 0]*_column(projects, "m2_above", 0.0)[rows, None]
+                 + comp[..., 1]*_column(projects, "m2_below", 0.0)[rows, None]) * combined[:, None]
+        direct = value[:, 0]
+        so, co = _optional_column(projects, "soft_items_pct")[rows], _optional_column(projects, "cont_items_pct")[rows]
+        soft = np.where(np.isnan(so), value[:, 3], direct*so)
+        cont = np.where(np.isnan(co), value[:, 4], direct*co)
+        soft_default, cont_default = f["soft_pct"][c], f["cont_pct"][c]
+        got = {"direct": direct, "indirects": value[:, 1], "gg_bi": value[:, 2], "soft_costs": soft,
+               "soft_pct_used": np.where(np.isnan(so), soft_default, so), "soft_pct_default": soft_default,
+               "contingency": cont, "cont_pct_used": np.where(np.isnan(co), cont_default, co),
+               "cont_pct_default": cont_default, "total": direct + value[:, 1] + value[:, 2] + soft + cont,
+               "calibration": 1.0, "use_arch": f["use_mults"][c, 0], "use_mep": f["use_mults"][c, 1],
+               "use_overall": f["use_mults"][c, 2], "module_mult": f["module_mult"][c]}
+        out = {}
+        for name in TOTAL_COLUMNS:
+            out[name] = np.full(n, np.nan)
+            out[name][rows] = got[name]
+        self._tally(len(rows), n - len(rows))
+        totals = pd.DataFrame({"project": projects.index.to_numpy(), "module": projects["module"].astype(str).to_numpy(),
+                               "scenario": projects["scenario"].astype(str).to_numpy(), **out})
+        return totals, hit
+
+    # --- export -----------------------------------------------------------------------------
+    def frame(self, cities: bool = False) -> pd.DataFrame:
+        """Cubo en formato largo: una fila por módulo × uso × nivel × escenario (× ciudad) con €/m² por componente."""
+        parts = []
+        for key, mc in self.modules.items():
+            u, lv, s = np.meshgrid(np.arange(len(mc.uses)), np.arange(len(mc.levels)), np.arange(len(SCENARIOS)),
+                                   indexing="ij")
+            u, lv, s = u.ravel(), lv.ravel(), s.ravel()
+            comp = mc.components[u, lv, s]
+            part = pd.DataFrame({"module": key, "building_use": [mc.uses[i] or "" for i in u],
+                                 "option": mc.option or "", "level": [mc.levels[i] for i in lv],
+                                 "scenario": np.asarray(SCENARIOS, dtype=object)[s]})
+            for ci, c in enumerate(COMPONENTS):
+                part[f"{c}_eur_m2_above"] = comp[:, ci, 0]
+                part[f"{c}_eur_m2_below"] = comp[:, ci, 1]
+            parts.append(part)
+        df = pd.concat(parts, ignore_index=True)
+        if not cities:
+            return df
+        city = pd.DataFrame({"city": list(self.city_factors), "location_factor": list(self.city_factors.values())})
+        df = df.merge(city, how="cross")
+        eur = [c for c in df.columns if c.endswith(("_above","_below"))]
+        df[eur] = df[eur].to_numpy() * df[["location_factor"]].to_numpy()
+        return df
+
+
+# --- build -----------------------------------------------------------------------------------
+
+def _axes(model: CostModel, module_key: str, cm: CompiledModule):
+    uses: Tuple[Optional[str], ...] = (None,)
+    if module_key in BUILDING_MODULES:
+        uses += tuple(cm.use_profiles)
+    opt = option_table(module_key)
+    if module_key == "fitout_oficinas":
+        return uses, "include_furniture", (False, True), False
+    if opt is None:
+        return uses, None, (None,), None
+    col, default, table = opt
+    return uses, col, tuple(cm.multipliers.get(table, {})), default
+
+
+def build_cube(model: CostModel) -> PriceCube:
+    """Evalúa el pipeline en cada celda con 1 m² sobre y bajo rasante y factores neutros."""
+    from src.pipeline import estimate_result
+    modules: Dict[str, ModuleCube] = {}
+    with span("cube.build"):
+        for key, cm in model.modules.items():
+            uses, option, levels, default = _axes(model, key, cm)
+            k, nu, nl, ns = len(cm.keys), len(uses), len(levels), len(SCENARIOS)
+            ch = np.zeros((2, nu, nl, ns, k))
+            comp = np.zeros((nu, nl, ns, len(COMPONENTS), 2))
+            included = np.ones((nl, k), dtype=bool)
+            use_mults = np.ones((nu, 3))
+            module_mult = np.ones(nl)
+            for ui, use in enumerate(uses):
+                for li, level in enumerate(levels):
+                    opts = {"building_use": use} if use else {}
+                    if option is not None:
+                        opts[option] = level
+                    for sci, sc in enumerate(SCENARIOS):
+                        for side, m2 in enumerate(((1.0, 0.0), (0.0, 1.0))):
+                            res = estimate_result(model, key, sc, m2[0], m2[1], Factors(), options=opts)
+                            t = res.totals()
+                            ch[side, ui, li, sci] = np.where(res.mask, res.cost, 0.0)
+                            comp[ui, li, sci, :, side] = [t[c] for c in COMPONENTS]
+                    included[li] = res.mask
+                    use_mults[ui] = res.use_mults
+                    module_mult[li] = res.module_mult
+            for a in (ch, comp, included, use_mults, module_mult):
+                a.setflags(write=False)  # shared across sessions
+            modules[key] = ModuleCube(key=key, uses=uses, option=option, levels=levels, default_level=default,
+                                      chapter_a=ch[0], chapter_b=ch[1], included=included, components=comp,
+                                      use_mults=use_mults, module_mult=module_mult, soft_pct=cm.soft_pct,
+                                      cont_pct=cm.cont_pct)
+    cube = PriceCube(model.fingerprint, modules, model.city_factors)
+    count("cube_builds")
+    return cube
+
+
+_lock = threading.Lock()
+_cubes: Dict[str, PriceCube] = {}
+
+
+def cube_for(model: CostModel) -> PriceCube:
+    """Cubo del modelo, construido una vez por huella de datos (al cambiar los ficheros se rehace)."""
+    cube = _cubes.get(model.fingerprint)
+    if cube is None:
+        with _lock:
+            cube = _cubes.get(model.fingerprint)
+            if cube is None:
+                cube = build_cube(model)
+                _cubes.clear()  # only the current data version is kept
+                _cubes[model.fingerprint] = cube
+    return cube
+
+
+def estimate_totals(model: CostModel, projects: pd.DataFrame, scenarios=None) -> pd.DataFrame:
+    """`estimate_portfolio(model, projects).totals` resolviendo las filas estándar en el cubo y el resto completo."""
+    if "scenario" not in projects.columns:
+        projects = _expand_scenarios(projects, list(scenarios or SCENARIOS))
+    totals, hit = cube_for(model).totals(projects)
+    if not hit.all():
+        miss = np.flatnonzero(~hit)
+        rest = estimate_portfolio(model, projects.iloc[miss]).totals
+        totals.loc[totals.index[miss], TOTAL_COLUMNS] = rest[TOTAL_COLUMNS].to_numpy()
+    return totals
+
+
+def main(argv=None) -> int:
+    from src.model import load_model
+    from src.batch import DATA_DIR
+    ap = argparse.ArgumentParser(prog="python -m src.cube", description="Exporta el cubo de €/m² precalculado.")
+    ap.add_argument("-o", "--output", help="CSV (por defecto, resumen por pantalla)")
+    ap.add_argument("--cities", action="store_true", help="materializa también el eje de ciudades (cities.csv)")
+    ap.add_argument("--data-dir", default=str(DATA_DIR))
+    args = ap.parse_args(argv)
+    cube = cube_for(load_model(args.data_dir))
+    df = cube.frame(cities=args.cities)
+    if args.output:
+        df.to_csv(args.output, index=False)
+    else:
+        cols = ["module","building_use","level","scenario","direct_eur_m2_above","direct_eur_m2_below","total_eur_m2_above"]
+        with pd.option_context("display.width", 160, "display.max_rows", 40, "display.float_format", "{:,.0f}".format):
+            print(df[cols].to_string(index=False))
+    print(f"{cube.cells:,} celdas, {len(df):,} filas, {cube.nbytes/1e3:,.0f} kB", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
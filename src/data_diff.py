@@ -0,0 +1,219 @@
+"""
+Diferencias entre dos versiones de los datos de coste (dos CostModel), entrada a entrada.
+
+`diff_models(old, new)` compara los módulos compilados de `cost_ranges.yaml` (tarifa de cada capítulo ×
+escenario × sobre/bajo rasante, perfiles de uso, multiplicadores, % por defecto, estructura de capítulos,
+textos) y las tablas que usan las estimaciones (`benchmarks.csv`, `cities.csv`, desgloses de soft costs y
+contingencia). Cada cambio es una fila con su `kind`; `affects` indica si puede mover una estimación.
+
+    python -m src.data_diff datos_v3/ datos_v4/ [-o cambios.csv]
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Set
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+
+from src.calculations import SCENARIOS
+from src.model import CostModel, CompiledModule
+
+COLUMNS = ["source","module","kind","item","scenario","field","old","new","affects"]
+KIND_LABELS = {
+    "rate": "Tarifa €/m²", "structure": "Capítulos (estructura)", "use_profile": "Perfil de uso",
+    "multiplier": "Multiplicador", "pct": "% por defecto", "label": "Texto/etiqueta", "module_added": "Módulo nuevo",
+    "module_removed": "Módulo eliminado", "benchmark": "Benchmark", "city": "Factor de ciudad",
+    "items": "Desglose soft/contingencia", "other": "Otros datos",
+}
+# tables that feed prepare_projects (city factor, benchmark PEM, default soft/contingency %)
+INPUT_SOURCES = ("benchmarks.csv","cities.csv","soft_cost_items.csv","contingency_items.csv")
+
+
+@dataclass
+class ModuleChanges:
+    """Resumen por módulo de lo que hay que recalcular."""
+    structural: bool = False
+    rates: Optional[np.ndarray] = None      # bool (chapters, scenarios) in the new module's order
+    uses: Set[str] = None                   # building_use keys whose profile changed
+    levels: Set[Tuple[str, str]] = None     # (multiplier table, level) changed
+    pcts: bool = False                      # indirects / gg_bi / soft / contingency defaults
+    labels: bool = False
+
+    def __post_init__(self):
+        self.uses = set() if self.uses is None else self.uses
+        self.levels = set() if self.levels is None else self.levels
+
+    @property
+    def any_cost(self) -> bool:
+        return self.structural or self.pcts or bool(self.uses) or bool(self.levels) or \
+            (self.rates is not None and bool(self.rates.any()))
+
+
+@dataclass
+class DataDiff:
+    old_fingerprint: str
+    new_fingerprint: str
+    changes: pd.DataFrame                 # COLUMNS
+    modules: Dict[str, ModuleChanges]     # only modules with some change
+    removed_modules: Tuple[str, ...]
+    inputs_changed: bool                  # some INPUT_SOURCES table changed
+
+    @property
+    def empty(self) -> bool:
+        return self.changes.empty
+
+    def summary(self) -> pd.DataFrame:
+        """Cambios por fichero × módulo × tipo."""
+        if self.changes.empty:
+            return pd.DataFrame(columns=["source","module","kind","changes","affects"])
+        g = self.changes.assign(module=self.changes["module"].fillna(""))
+        out = g.groupby(["source","module","kind"], sort=False).agg(changes=("kind","size"), affects=("affects","any"))
+        return out.reset_index()
+
+
+def _row(rows: List[Dict[str, Any]], source: str, kind: str, module=None, item=None, scenario=None, field=None,
+         old=None, new=None, affects: bool = True) -> None:
+    rows.append({"source": source, "module": module, "kind": kind, "item": item, "scenario": scenario,
+                 "field": field, "old": old, "new": new, "affects": affects})
+
+
+def _num(v) -> Optional[float]:
+    return None if v is None else float(v)
+
+
+def _structure(cm: CompiledModule) -> Tuple:
+    return (cm.keys, tuple(cm.single.tolist()), tuple(cm.mep.tolist()), tuple(cm.finish.tolist()))
+
+
+def _diff_module(rows: List[Dict[str, Any]], key: str, a: CompiledModule, b: CompiledModule,
+                 raw_a: Dict[str, Any], raw_b: Dict[str, Any]) -> ModuleChanges:
+    src = "cost_ranges.yaml"
+    mc = ModuleChanges()
+    if _structure(a) != _structure(b):
+        mc.structural = True
+        for k in sorted(set(b.keys) - set(a.keys), key=b.keys.index):
+            _row(rows, src, "structure", key, k, field="añadido")
+        for k in sorted(set(a.keys) - set(b.keys), key=a.keys.index):
+            _row(rows, src, "structure", key, k, field="eliminado")
+        if set(a.keys) == set(b.keys):
+            _row(rows, src, "structure", key, field="orden/tipo de capítulos")
+    else:
+        changed = (a.above != b.above) | (a.below != b.below)
+        mc.rates = changed
+        for i, j in zip(*np.nonzero(changed)):
+            for fld, x, y in (("single" if b.single[i] else "above", a.above, b.above), ("below", a.below, b.below)):
+                if x[i, j] != y[i, j]:
+                    _row(rows, src, "rate", key, b.keys[i], SCENARIOS[j], fld, float(x[i, j]), float(y[i, j]))
+        if a.labels != b.labels or a.basis != b.basis:
+            mc.labels = True
+            for k, la, lb, ba, bb in zip(b.keys, a.labels, b.labels, a.basis, b.basis):
+                if la != lb:
+                    _row(rows, src, "label", key, k, field="label", old=la, new=lb, affects=False)
+                if ba != bb:
+                    _row(rows, src, "label", key, k, field="basis", old=ba, new=bb, affects=False)
+
+    for use in sorted(set(a.use_profiles) | set(b.use_profiles)):
+        pa, pb = a.use_profiles.get(use), b.use_profiles.get(use)
+        if pa != pb:
+            mc.uses.add(use)
+            for f, x, y in zip(("arch","mep","overall"), pa or (None,)*3, pb or (None,)*3):
+                if x != y:
+                    _row(rows, src, "use_profile", key, use, field=f, old=_num(x), new=_num(y))
+    for table in sorted(set(a.multipliers) | set(b.multipliers)):
+        ta, tb = a.multipliers.get(table, {}), b.multipliers.get(table, {})
+        for level in sorted(set(ta) | set(tb)):
+            if ta.get(level) != tb.get(level):
+                mc.levels.add((table, level))
+                _row(rows, src, "multiplier", key, level, field=table, old=ta.get(level), new=tb.get(level))
+    for f, x, y in (("indirects_pct", a.indirects_pct, b.indirects_pct), ("soft_costs_pct", a.soft_pct, b.soft_pct),
+                    ("contingency_pct", a.cont_pct, b.cont_pct)):
+        for j in np.flatnonzero(x != y):
+            mc.pcts = True
+            _row(rows, src, "pct", key, scenario=SCENARIOS[j], field=f, old=float(x[j]), new=float(y[j]))
+    if a.gg_bi_pct != b.gg_bi_pct:
+        mc.pcts = True
+        _row(rows, src, "pct", key, field="gg_bi_pct", old=a.gg_bi_pct, new=b.gg_bi_pct)
+
+    if not (mc.any_cost or mc.labels) and raw_a != raw_b:
+        mc.labels = True
+        _row(rows, src, "label", key, field="textos del módulo", affects=False)  # measurement, notes, sources…
+    return mc
+
+
+def _diff_keyed(rows, source: str, kind: str, a: pd.DataFrame, b: pd.DataFrame, key: str, fields: List[str]) -> bool:
+    ia = a.drop_duplicates(key).set_index(key)
+    ib = b.drop_duplicates(key).set_index(key)
+    changed = False
+    for k in list(ia.index) + [k for k in ib.index if k not in ia.index]:
+        for f in fields:
+            x = ia.at[k, f] if k in ia.index and f in ia.columns else None
+            y = ib.at[k, f] if k in ib.index and f in ib.columns else None
+            if pd.isna(x) and pd.isna(y) or x == y:
+                continue
+            changed = True
+            _row(rows, source, kind, item=str(k), field=f,
+                 old=None if pd.isna(x) else x, new=None if pd.isna(y) else y)
+    return changed
+
+
+def diff_models(old: CostModel, new: CostModel) -> DataDiff:
+    rows: List[Dict[str, Any]] = []
+    modules: Dict[str, ModuleChanges] = {}
+    for key in new.modules:
+        if key not in old.modules:
+            _row(rows, "cost_ranges.yaml", "module_added", key, affects=False)
+            continue
+        mc = _diff_module(rows, key, old.modules[key], new.modules[key],
+                          old.cost_data["modules"][key], new.cost_data["modules"][key])
+        if mc.any_cost or mc.labels:
+            modules[key] = mc
+    removed = tuple(k for k in old.modules if k not in new.modules)
+    for key in removed:
+        _row(rows, "cost_ranges.yaml", "module_removed", key)
+    rest_a = {k: v for k, v in old.cost_data.items() if k != "modules"}
+    rest_b = {k: v for k, v in new.cost_data.items() if k != "modules"}
+    if rest_a != rest_b:
+        _row(rows, "cost_ranges.yaml", "other", field="meta", affects=False)
+
+    pem = ["pem_"+sc for sc in SCENARIOS]
+    inputs = _diff_keyed(rows, "benchmarks.csv", "benchmark", old.benchmarks, new.benchmarks, "key", pem)
+    inputs |= _diff_keyed(rows, "cities.csv", "city", old.cities, new.cities, "city", ["location_factor"])
+    for name, attr in (("soft_cost_items.csv", "soft_items"), ("contingency_items.csv", "cont_items")):
+        a, b = getattr(old, attr), getattr(new, attr)
+        fa, fb = a["pct_sobre_directo"].sum(), b["pct_sobre_directo"].sum()
+        if fa != fb:
+            inputs = True
+            _row(rows, name, "items", field="pct_sobre_directo (suma)", old=float(fa), new=float(fb))
+        elif not a.equals(b):
+            _row(rows, name, "items", field="desglose", affects=False)
+    for name, attr in (("sources_matrix.csv", "sources"), ("cost_indices.csv", "indices")):
+        if not getattr(old, attr).equals(getattr(new, attr)):
+            _row(rows, name, "other", affects=False)
+
+    changes = pd.DataFrame(rows, columns=COLUMNS)
+    return DataDiff(old_fingerprint=old.fingerprint, new_fingerprint=new.fingerprint, changes=changes,
+                    modules=modules, removed_modules=removed, inputs_changed=bool(inputs))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.data_diff",
+                                 description="Cambios entre dos versiones de los datos de coste.")
+    ap.add_argument("old", help="directorio de datos (versión anterior)")
+    ap.add_argument("new", help="directorio de datos (versión nueva)")
+    ap.add_argument("-o", "--output", help="cambios entrada a entrada (CSV)")
+    args = ap.parse_args(argv)
+
+    from src.model import build_model
+    diff = diff_models(build_model(Path(args.old)), build_model(Path(args.new)))
+    if args.output:
+        diff.changes.to_csv(args.output, index=False)
+    with pd.option_context("display.width", 160, "display.max_rows", 200):
+        print(diff.summary().to_string(index=False) if not diff.empty else "sin cambios")
+    print(f"{len(diff.changes):,} cambios, {int(diff.changes['affects'].sum()):,} afectan a estimaciones", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
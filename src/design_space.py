@@ -0,0 +1,291 @@
+"""
+Búsqueda en el espacio de diseño: qué combinaciones de opciones y factores quedan por debajo de X €/m².
+
+El coste de un módulo se factoriza por grupos de capítulos (resto / acabados / MEP), así que cada
+configuración cuesta unas pocas operaciones sobre arrays:
+
+    directo = Π factores × mult_módulo × overall_uso × (arch_uso·(S_resto + acabados·S_acab) + mep_uso·mep·S_mep)
+
+con S_* = Σ tarifa × superficie de los capítulos incluidos (por valor de include_furniture). Se evalúa la
+rejilla completa (producto cartesiano de dimensiones) o una muestra aleatoria, por lotes, y se mantiene el
+frente de Pareto coste (mín) × especificación (máx) por grupo de programa (building_use / use).
+Sin auto-calibración: la calibración a benchmark fijaría el coste y anularía la búsqueda.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field, fields, replace
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+import time
+import numpy as np
+import pandas as pd
+
+from src.calculations import Factors, SCENARIOS, FACTOR_RANGES, FACTOR_LABELS
+from src.instrument import timed, count
+from src.model import CostModel
+from src.portfolio import BUILDING_MODULES, option_table
+
+SPEC_FACTORS = ("acabados", "intensidad_mep", "certificacion")  # higher = better specification
+OPTION_LABELS = {"building_use": "Uso del edificio", "use": "Uso del local", "intervention_level": "Intervención",
+                 "reform_level": "Nivel de reforma", "include_furniture": "Mobiliario"}
+_GROUPS = 3  # other, finish, mep
+
+
+@dataclass(frozen=True)
+class Dimension:
+    """Un eje de la rejilla: valores posibles y su nivel de especificación normalizado (0–1)."""
+    name: str
+    label: str
+    values: Tuple[Any, ...]
+    score: np.ndarray
+    weight: float = 1.0
+    program: bool = False  # program choice (use): Pareto front computed per value, no score
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+@dataclass
+class DesignSpace:
+    module_key: str
+    scenario: str
+    area_ref: float
+    dims: List[Dimension]
+    factors: Factors                 # fixed values of the factors that are not searched
+    sums: np.ndarray                 # (furniture 0/1, groups) Σ rate × area of included chapters
+    markup: float                    # 1 + indirects + GG/BI + soft + contingency
+    use_table: Dict[str, Tuple[float, float, float]]
+    use_fixed: Tuple[float, float, float]
+    mult_table: Dict[str, float]
+    mult_fixed: float
+    furniture_fixed: bool
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(len(d) for d in self.dims)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) if self.dims else 1
+
+    def dim(self, name: str) -> Optional[Dimension]:
+        return next((d for d in self.dims if d.name == name), None)
+
+
+def _factor_dim(name: str, lo: float, hi: float, step: float, weight: float) -> Dimension:
+    values = np.round(np.arange(lo, hi + step/2, step), 4)
+    score = (values - lo)/(hi - lo) if hi > lo else np.zeros(len(values))
+    return Dimension(name, FACTOR_LABELS.get(name, name), tuple(map(float, values)), score, weight)
+
+
+def _option_dim(name: str, table: Dict[str, float], weight: float, program: bool = False) -> Dimension:
+    keys = tuple(table)
+    vals = np.array([table[k] for k in keys], dtype=float)
+    span = vals.max() - vals.min()
+    score = (vals - vals.min())/span if span > 0 else np.zeros(len(keys))
+    return Dimension(name, OPTION_LABELS.get(name, name), keys, score, 0.0 if program else weight, program)
+
+
+def build_space(model: CostModel, module_key: str, m2_above: float, m2_below: float, factors: Factors,
+                options: Dict[str, Any] | None = None, scenario: str = "mid",
+                vary: Sequence[str] = SPEC_FACTORS + ("intervention_level", "reform_level", "include_furniture"),
+                step: float | Dict[str, float] = 0.01, ranges: Dict[str, Tuple[float, float]] | None = None,
+                weights: Dict[str, float] | None = None, include_optional: bool = True,
+                chapters: Iterable[str] | None = None) -> DesignSpace:
+    """
+    Espacio de búsqueda de un proyecto. `vary`: factores de `Factors` (rango de los sliders, FACTOR_RANGES,
+    con paso `step`) y opciones del módulo (intervention_level, reform_level, use, building_use,
+    include_furniture); lo que no aplica al módulo se ignora y el resto queda fijo en `factors` / `options`.
+    `weights` pondera el nivel de especificación de cada dimensión (por defecto 1 en SPEC_FACTORS y niveles de
+    intervención/mobiliario, 0 en el resto de factores; los usos son de programa y agrupan el frente).
+    """
+    options = options or {}
+    weights = weights or {}
+    ranges = {**FACTOR_RANGES, **(ranges or {})}
+    if min(step.values(), default=1.0) <= 0 if isinstance(step, dict) else step <= 0:
+        raise ValueError("step debe ser > 0")
+    cm = model.module(module_key)
+    sci = SCENARIOS.index(scenario)
+    dims: List[Dimension] = []
+
+    for name in vary:
+        if name in FACTOR_RANGES:
+            lo, hi = ranges[name]
+            st = step.get(name, 0.01) if isinstance(step, dict) else step
+            dims.append(_factor_dim(name, lo, hi, st, weights.get(name, 1.0 if name in SPEC_FACTORS else 0.0)))
+    spec = option_table(module_key)
+    mult_table: Dict[str, float] = {}
+    mult_fixed = 1.0
+    if spec is not None:
+        col, default, table = spec
+        mult_table = cm.multipliers.get(table, {})
+        mult_fixed = mult_table.get(options.get(col, default), 1.0)
+        if col in vary and mult_table:
+            dims.append(_option_dim(col, mult_table, weights.get(col, 1.0 if col != "use" else 0.0), program=col == "use"))
+    use_table: Dict[str, Tuple[float, float, float]] = {}
+    use_fixed = (1.0, 1.0, 1.0)
+    if module_key in BUILDING_MODULES:
+        use_table = dict(cm.use_profiles)
+        use_fixed = use_table.get(options.get("building_use"), (1.0, 1.0, 1.0))
+        if "building_use" in vary and use_table:
+            dims.append(Dimension("building_use", OPTION_LABELS["building_use"], tuple(use_table),
+                                  np.zeros(len(use_table)), 0.0, True))
+    furniture_fixed = bool(options.get("include_furniture", False))
+    if module_key == "fitout_oficinas" and "include_furniture" in vary:
+        dims.append(Dimension("include_furniture", OPTION_LABELS["include_furniture"], (False, True),
+                              np.array([0.0, 1.0]), weights.get("include_furniture", 1.0)))
+
+    keep = np.ones(len(cm.keys), dtype=bool)
+    if not include_optional:
+        keep &= ~cm.optional
+    if chapters is not None:
+        chap_set = set(chapters)
+        keep &= np.array([k in chap_set for k in cm.keys], dtype=bool)
+    base = cm.above[:, sci]*float(m2_above) + cm.below[:, sci]*float(m2_below)
+    finish = cm.finish & ~cm.mep
+    group = np.column_stack([~cm.mep & ~finish, finish, cm.mep]).astype(float)
+    furniture = np.array([k == "mobiliario" for k in cm.keys], dtype=bool) if module_key == "fitout_oficinas" \
+        else np.zeros(len(cm.keys), dtype=bool)
+    sums = np.vstack([(base*(keep & ~furniture)) @ group, (base*keep) @ group])
+
+    soft = float(options.get("soft_items_pct", cm.soft_pct[sci]))
+    cont = float(options.get("cont_items_pct", cm.cont_pct[sci]))
+    markup = 1.0 + float(cm.indirects_pct[sci]) + cm.gg_bi_pct + soft + cont
+    area_ref = float(m2_above) + float(m2_below) if cm.area_split else float(m2_above)
+    return DesignSpace(module_key, scenario, area_ref, dims, factors, sums, markup, use_table, use_fixed,
+                       mult_table, mult_fixed, furniture_fixed)
+
+
+def evaluate(space: DesignSpace, flat: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(total €, nivel de especificación 0–1, grupo de programa) de las configuraciones `flat` (índices planos)."""
+    n = len(flat)
+    idx = np.unravel_index(flat, space.shape) if space.dims else ()
+    pos = {d.name: i for i, d in enumerate(space.dims)}
+
+    def values(name: str, fixed: float) -> np.ndarray | float:
+        if name in pos:
+            return np.asarray(space.dims[pos[name]].values, dtype=float)[idx[pos[name]]]
+        return fixed
+
+    g = np.ones(n)
+    for f in fields(Factors):
+        g = g*values(f.name, getattr(space.factors, f.name))
+    acab = values("acabados", space.factors.acabados)
+    mep = values("intensidad_mep", space.factors.intensidad_mep)
+
+    furn = idx[pos["include_furniture"]] if "include_furniture" in pos else int(space.furniture_fixed)
+    s_other, s_finish, s_mep = (space.sums[furn, j] for j in range(_GROUPS))
+
+    if "building_use" in pos:
+        table = np.array([space.use_table[u] for u in space.dims[pos["building_use"]].values])
+        ua, um, uo = table[idx[pos["building_use"]]].T
+    else:
+        ua, um, uo = space.use_fixed
+    opt = next((d for d in space.dims if d.name in ("intervention_level", "reform_level", "use")), None)
+    if opt is not None:
+        mult = np.array([space.mult_table[k] for k in opt.values])[idx[pos[opt.name]]]
+    else:
+        mult = space.mult_fixed
+
+    direct = g*mult*uo*(ua*(s_other + acab*s_finish) + um*mep*s_mep)
+    total = np.broadcast_to(direct*space.markup, (n,))
+
+    score = np.zeros(n)
+    wsum = sum(d.weight for d in space.dims if not d.program)
+    group = np.zeros(n, dtype=np.int64)
+    for i, d in enumerate(space.dims):
+        if d.program:
+            group = group*len(d) + idx[i]
+        elif d.weight:
+            score += d.weight*d.score[idx[i]]
+    if wsum > 0:
+        score /= wsum
+    return total, score, group
+
+
+def pareto_mask(cost: np.ndarray, score: np.ndarray, group: np.ndarray | None = None) -> np.ndarray:
+    """Configuraciones no dominadas (coste menor o igual con especificación estrictamente mayor) por grupo."""
+    n = len(cost)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    group = np.zeros(n, dtype=np.int64) if group is None else group
+    order = np.lexsort((-score, cost, group))
+    s = score[order] + 2.0*group[order]  # score in [0, 1]: offsets keep groups apart in the running max
+    prev = np.maximum.accumulate(np.concatenate([[-np.inf], s[:-1]]))
+    mask = np.zeros(n, dtype=bool)
+    mask[order] = s > prev
+    return mask
+
+
+@dataclass
+class SearchResult:
+    space: DesignSpace
+    front: pd.DataFrame        # Pareto front: dimension values, total, eur_m2, score, within_budget
+    best: pd.DataFrame         # per program group: highest specification within budget
+    evaluated: int
+    feasible: int              # configurations under budget (of those evaluated)
+    sampled: bool
+    seconds: float
+    stats: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def configs_per_second(self) -> float:
+        return self.evaluated/self.seconds if self.seconds > 0 else float("inf")
+
+
+def _describe(space: DesignSpace, flat: np.ndarray, total: np.ndarray, score: np.ndarray,
+              budget: Optional[float]) -> pd.DataFrame:
+    idx = np.unravel_index(flat, space.shape) if space.dims else ()
+    cols = {d.name: np.asarray(d.values, dtype=object)[idx[i]] for i, d in enumerate(space.dims)}
+    eur_m2 = total/space.area_ref if space.area_ref > 0 else np.full(len(total), np.nan)
+    df = pd.DataFrame({**cols, "total": total, "eur_m2": eur_m2, "score": score})
+    df["within_budget"] = (eur_m2 <= budget) if budget is not None else True
+    return df
+
+
+@timed()
+def search(space: DesignSpace, budget_eur_m2: float | None = None, max_configs: int = 2_000_000,
+           batch: int = 1 << 18, seed: int = 0) -> SearchResult:
+    """
+    Evalúa la rejilla completa si cabe en `max_configs`; si no, una muestra uniforme sin reemplazo de ese
+    tamaño. Mantiene el frente de Pareto por lotes (memoria acotada) y cuenta las configuraciones bajo
+    `budget_eur_m2` (€/m² totales sobre la superficie de referencia del módulo).
+    """
+    t0 = time.perf_counter()
+    size = space.size
+    sampled = size > max_configs
+    if sampled:
+        flat_all = np.sort(np.random.default_rng(seed).choice(size, max_configs, replace=False))
+        chunks = (flat_all[i:i + batch] for i in range(0, len(flat_all), batch))
+        evaluated = max_configs
+    else:
+        chunks = (np.arange(i, min(i + batch, size), dtype=np.int64) for i in range(0, size, batch))
+        evaluated = size
+    limit = budget_eur_m2*space.area_ref if budget_eur_m2 is not None else np.inf
+    f_flat = np.zeros(0, dtype=np.int64)
+    f_total = f_score = np.zeros(0)
+    f_group = np.zeros(0, dtype=np.int64)
+    feasible = 0
+    for flat in chunks:
+        total, score, group = evaluate(space, flat)
+        feasible += int((total <= limit).sum())
+        flat = np.concatenate([f_flat, flat])
+        total = np.concatenate([f_total, total])
+        score = np.concatenate([f_score, score])
+        group = np.concatenate([f_group, group])
+        keep = pareto_mask(total, score, group)
+        f_flat, f_total, f_score, f_group = flat[keep], total[keep], score[keep], group[keep]
+    order = np.lexsort((f_total, f_group))
+    front = _describe(space, f_flat[order], f_total[order], f_score[order], budget_eur_m2)
+    front.insert(0, "group", f_group[order])
+    ok = front[front["within_budget"]]
+    best = ok.sort_values(["group", "score", "total"], ascending=[True, False, True]).groupby("group").head(1)
+    elapsed = time.perf_counter() - t0
+    count("design_configs", evaluated)
+    return SearchResult(space, front.reset_index(drop=True), best.reset_index(drop=True), evaluated, feasible,
+                        sampled, elapsed, {"size": size, "front": len(front)})
+
+
+def config_factors(space: DesignSpace, row: Dict[str, Any]) -> Tuple[Factors, Dict[str, Any]]:
+    """Factors y opciones de una fila del frente (para recalcular con el pipeline o la app)."""
+    fac = replace(space.factors, **{f.name: float(row[f.name]) for f in fields(Factors) if f.name in row})
+    opts = {d.name: row[d.name] for d in space.dims if d.name not in FACTOR_RANGES}
+    return fac, opts
@@ -0,0 +1,375 @@
+"""
+Caché de estimaciones direccionada por contenido, compartida entre sesiones, usuarios y reinicios.
+
+La clave es un sha256 de la entrada canónica: huella de `cost_ranges.yaml` (contenido, no mtime), módulo,
+escenario, superficies, `Factors`, solo las opciones que afectan al módulo, el PEM del escenario si se
+calibra a benchmark, y el filtro de capítulos. Dos niveles:
+
+- memoria: LRU con presupuesto en bytes (tamaño real de arrays/DataFrames), por proceso;
+- disco (opcional): SQLite en `data/.cache/estimates.sqlite`, sobrevive a reinicios; se poda por último uso.
+
+Si cambian los datos cambia la huella: las entradas antiguas dejan de ser alcanzables y `retain()` las borra
+de ambos niveles. `stats()` da aciertos por nivel, fallos, tasa de acierto, entradas y bytes.
+
+    cache = estimate_cache.shared()
+    df, totals = cache.estimate_module(model, "obra_nueva_edificio", "mid", 2000, 500, Factors())
+    res = cache.estimate_result(model, ..., compute=pipeline.run_result)
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Any, Tuple, Optional, Callable, Iterable
+import hashlib
+import json
+import math
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from src.calculations import Factors, estimate_module
+from src.instrument import count, span
+
+DEFAULT_PATH = Path(__file__).resolve().parent.parent / "data" / ".cache" / "estimates.sqlite"
+KEY_VERSION = 1
+
+# options that change the result of each module (the rest are ignored in the key)
+_MODULE_OPTIONS = {
+    "obra_nueva_edificio": ("building_use",),
+    "reposicionamiento_edificio": ("building_use","intervention_level"),
+    "reforma_piso": ("reform_level",),
+    "reforma_local": ("intervention_level",),
+    "fitout_oficinas": ("include_furniture",),
+    "fitout_local_por_uso": ("use",),
+}
+
+_fp_lock = threading.Lock()
+_fps: Dict[int, Tuple[dict, str]] = {}
+
+
+def data_fingerprint(cost_data) -> str:
+    """sha256 del contenido de cost_ranges.yaml (dict del YAML o CostModel); memorizado por objeto."""
+    cost_data = getattr(cost_data, "cost_data", cost_data)
+    hit = _fps.get(id(cost_data))
+    if hit is not None and hit[0] is cost_data:
+        return hit[1]
+    fp = hashlib.sha256(json.dumps(cost_data, sort_keys=True, default=str, separators=(",",":")).encode()).hexdigest()
+    with _fp_lock:
+        if len(_fps) >= 16:
+            _fps.clear()
+        _fps[id(cost_data)] = (cost_data, fp)  # holds a reference so the id is not reused
+    return fp
+
+
+def _num(v) -> Optional[float]:
+    if v is None:
+        return None
+    v = float(v)
+    return None if math.isnan(v) else v + 0.0  # -0.0 → 0.0
+
+
+def canonical_input(module_key: str, scenario: str, m2_above: float, m2_below: float, factors: Factors,
+                    options: Dict[str, Any] | None = None, benchmark_row: Dict[str, Any] | None = None,
+                    auto_calibrate_to_benchmark: bool = False, include_optional: bool = True,
+                    chapters: Iterable[str] | None = None) -> Dict[str, Any]:
+    """Entrada normalizada: entradas equivalentes (opciones irrelevantes, filas de benchmark sin usar) coinciden."""
+    options = options or {}
+    opts = {k: options[k] for k in _MODULE_OPTIONS.get(module_key, ()) if options.get(k) is not None}
+    if "include_furniture" in opts:
+        opts["include_furniture"] = bool(opts["include_furniture"])
+    for k in ("soft_items_pct","cont_items_pct"):
+        if options.get(k) is not None:
+            opts[k] = _num(options[k])
+    pem = None
+    if auto_calibrate_to_benchmark and benchmark_row:
+        pem = _num(benchmark_row.get("pem_"+scenario))
+    return {"module": module_key, "scenario": scenario, "m2": [_num(m2_above), _num(m2_below)],
+            "factors": {k: _num(v) for k, v in asdict(factors).items()}, "options": opts, "pem": pem,
+            "include_optional": bool(include_optional),
+            "chapters": sorted(chapters) if chapters is not None else None}
+
+
+def cache_key(fingerprint: str, kind: str, inp: Dict[str, Any]) -> str:
+    payload = json.dumps({"v": KEY_VERSION, "fp": fingerprint, "kind": kind, **inp}, sort_keys=True,
+                         separators=(",",":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --- stored values ------------------------------------------------------------------------------
+def _frame_value(df, totals) -> Tuple[Tuple, int]:
+    return ("frame", df, dict(totals)), int(df.memory_usage(deep=True).sum()) + 64*len(totals) + 256
+
+
+def _result_value(res) -> Tuple[Tuple, int]:
+    state = ("result", res.module.key, res.sci, res.scenario, res.m2_above, res.m2_below, res.cost,
+             res.factor_chapter, res.mask, res.factor_global, tuple(res.use_mults), res.module_mult,
+             res.calibration, res.calibrated, res.soft_pct, res.cont_pct, dict(res.totals()))
+    return state, int(res.cost.nbytes + res.factor_chapter.nbytes + res.mask.nbytes) + 64*len(state[-1]) + 512
+
+
+def _restore(value: Tuple, model=None):
+    if value[0] == "frame":
+        return value[1].copy(), dict(value[2])
+    from src.result import EstimateResult
+    (_, key, sci, scenario, m2a, m2b, cost, factor_chapter, mask, factor_global, use_mults, module_mult,
+     calibration, calibrated, soft_pct, cont_pct, totals) = value
+    res = EstimateResult(model.module(key), sci, scenario, m2a, m2b, cost, factor_chapter, mask, factor_global,
+                         use_mults, module_mult, calibration, calibrated, soft_pct, cont_pct)
+    res._totals = dict(totals)
+    return res
+
+
+class _DiskTier:
+    """SQLite: key → (huella, valor pickle, tamaño, último uso). Best-effort: los errores se cuentan y se sigue en memoria."""
+
+    def __init__(self, path: str | Path, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(str(self.path), timeout=5.0, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, fp TEXT NOT NULL, "
+                         "value BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries(used)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS entries_fp ON entries(fp)")
+        self.bytes = self.con.execute("SELECT COALESCE(SUM(size),0) FROM entries").fetchone()[0]
+
+    def get(self, key: str):
+        with self._lock:
+            row = self.con.execute("SELECT value FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.con.execute("UPDATE entries SET used=? WHERE key=?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key: str, fp: str, value) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            old = self.con.execute("SELECT size FROM entries WHERE key=?", (key,)).fetchone()
+            self.con.execute("INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?)", (key, fp, blob, len(blob), time.time()))
+            self.bytes += len(blob) - (old[0] if old else 0)
+            if self.bytes > self.max_bytes:
+                self._prune(int(self.max_bytes*0.9))
+
+    def _prune(self, target: int) -> None:
+        freed = 0
+        victims = []
+        for key, size in self.con.execute("SELECT key, size FROM entries ORDER BY used"):
+            if self.bytes - freed <= target:
+                break
+            victims.append((key,))
+            freed += size
+        self.con.executemany("DELETE FROM entries WHERE key=?", victims)
+        self.bytes -= freed
+        count("estimate_cache_disk_evictions", len(victims))
+
+    def retain(self, fp: str) -> int:
+        with self._lock:
+            n = self.con.execute("DELETE FROM entries WHERE fp<>?", (fp,)).rowcount
+            self.bytes = self.con.execute("SELECT COALESCE(SUM(size),0) FROM entries").fetchone()[0]
+        return n
+
+    def clear(self) -> None:
+        with self._lock:
+            self.con.execute("DELETE FROM entries")
+            self.bytes = 0
+
+    def entries(self) -> int:
+        with self._lock:
+            return self.con.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self.con.close()
+
+
+class EstimateCache:
+    """
+    LRU en memoria con presupuesto `max_bytes` + nivel SQLite opcional (`path`, hasta `max_disk_bytes`).
+    Seguro entre hilos (sesiones de Streamlit, servicio HTTP). Los valores se devuelven como copias o
+    resultados nuevos, así que los llamadores pueden modificarlos.
+    """
+
+    def __init__(self, max_bytes: int = 64 << 20, path: str | Path | None = None, max_disk_bytes: int = 512 << 20):
+        self.max_bytes = int(max_bytes)
+        self.data: OrderedDict = OrderedDict()  # key → (fp, value, size)
+        self.bytes = 0
+        self.hits_memory = self.hits_disk = self.misses = self.evictions = self.disk_errors = 0
+        self._lock = threading.Lock()
+        self._fp: Optional[str] = None
+        self.disk: Optional[_DiskTier] = None
+        if path is not None:
+            try:
+                self.disk = _DiskTier(path, max_disk_bytes)
+            except (OSError, sqlite3.Error):
+                self.disk_errors += 1  # read-only deployment: memory only
+
+    # --- tiers ------------------------------------------------------------------------------
+    def _get(self, key: str):
+        with self._lock:
+            hit = self.data.get(key)
+            if hit is not None:
+                self.data.move_to_end(key)
+                self.hits_memory += 1
+                count("estimate_cache_hits")
+                return hit[1]
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except (sqlite3.Error, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                value = None
+                self.disk_errors += 1
+            if value is not None:
+                self.hits_disk += 1
+                count("estimate_cache_hits")
+                count("estimate_cache_disk_hits")
+                return value
+        self.misses += 1
+        count("estimate_cache_misses")
+        return None
+
+    def _put_memory(self, key: str, fp: str, value, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self.data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.data[key] = (fp, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, s) = self.data.popitem(last=False)
+                self.bytes -= s
+                self.evictions += 1
+                count("estimate_cache_evictions")
+
+    def _lookup(self, fp: str, kind: str, inp: Dict[str, Any], compute: Callable[[], Tuple[Tuple, int]]):
+        self._check_fingerprint(fp)
+        key = cache_key(fp, kind, inp)
+        value = self._get(key)
+        if value is not None:
+            if key not in self.data:  # promote disk hit
+                self._put_memory(key, fp, value, _value_size(value))
+            return value
+        with span("estimate_cache.miss", kind=kind):
+            value, size = compute()
+        self._put_memory(key, fp, value, size)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, fp, value)
+            except sqlite3.Error:
+                self.disk_errors += 1
+        return value
+
+    def _check_fingerprint(self, fp: str) -> None:
+        if fp != self._fp:
+            self._fp = fp
+            self.retain(fp)  # data changed (now or since the last run): drop entries of the old files
+
+    # --- public -----------------------------------------------------------------------------
+    def estimate_module(self, cost_data, module_key: str, scenario: str, m2_above: float, m2_below: float,
+                        factors: Factors, options: Dict[str, Any] | None = None,
+                        benchmark_row: Dict[str, Any] | None = None,
+                        auto_calibrate_to_benchmark: bool = False) -> Tuple[Any, Dict[str, float]]:
+        """Mismo resultado que calculations.estimate_module (acepta el dict del YAML o un CostModel)."""
+        raw = getattr(cost_data, "cost_data", cost_data)
+        inp = canonical_input(module_key, scenario, m2_above, m2_below, factors, options, benchmark_row,
+                              auto_calibrate_to_benchmark)
+        value = self._lookup(data_fingerprint(raw), "frame", inp, lambda: _frame_value(*estimate_module(
+            raw, module_key, scenario, m2_above, m2_below, factors, options, benchmark_row, auto_calibrate_to_benchmark)))
+        return _restore(value)
+
+    def estimate_result(self, model, module_key: str, scenario: str, m2_above: float, m2_below: float,
+                        factors: Factors, options: Dict[str, Any] | None = None,
+                        benchmark_row: Dict[str, Any] | None = None,
+                        auto_calibrate_to_benchmark: bool = False,
+                        include_optional: bool = True,
+                        chapters: Iterable[str] | None = None,
+                        compute: Callable[..., Any] | None = None):
+        """
+        EstimateResult de pipeline.estimate_result (o de `compute`, p.ej. `EstimatePipeline.run_result`
+        de la sesión, con la misma firma) a través de la caché.
+        """
+        if compute is None:
+            from src.pipeline import estimate_result
+            compute = lambda *a: estimate_result(model, *a)
+        chapters = frozenset(chapters) if chapters is not None else None
+        inp = canonical_input(module_key, scenario, m2_above, m2_below, factors, options, benchmark_row,
+                              auto_calibrate_to_benchmark, include_optional, chapters)
+        value = self._lookup(data_fingerprint(model), "result", inp, lambda: _result_value(compute(
+            module_key, scenario, m2_above, m2_below, factors, options, benchmark_row, auto_calibrate_to_benchmark,
+            include_optional, chapters)))
+        return _restore(value, model)
+
+    def retain(self, fp: str) -> int:
+        """Borra las entradas de otras huellas (datos antiguos) en memoria y disco; devuelve cuántas."""
+        with self._lock:
+            stale = [k for k, (f, _, _) in self.data.items() if f != fp]
+            for k in stale:
+                self.bytes -= self.data.pop(k)[2]
+        n = len(stale)
+        if self.disk is not None:
+            try:
+                n += self.disk.retain(fp)
+            except sqlite3.Error:
+                self.disk_errors += 1
+        count("estimate_cache_invalidated", n)
+        return n
+
+    def clear(self) -> None:
+        with self._lock:
+            self.data.clear()
+            self.bytes = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    def reset_stats(self) -> None:
+        self.hits_memory = self.hits_disk = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.hits_memory + self.hits_disk
+        total = hits + self.misses
+        out = {"hits_memory": self.hits_memory, "hits_disk": self.hits_disk, "misses": self.misses,
+               "hit_rate": hits/total if total else 0.0, "entries": len(self.data), "bytes": self.bytes,
+               "max_bytes": self.max_bytes, "evictions": self.evictions, "disk": None}
+        if self.disk is not None:
+            try:
+                out["disk"] = {"path": str(self.disk.path), "entries": self.disk.entries(), "bytes": self.disk.bytes,
+                               "max_bytes": self.disk.max_bytes, "errors": self.disk_errors}
+            except sqlite3.Error:
+                self.disk_errors += 1
+        return out
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
+def _value_size(value: Tuple) -> int:
+    if value[0] == "frame":
+        return _frame_value(value[1], value[2])[1]
+    return int(value[6].nbytes + value[7].nbytes + value[8].nbytes) + 64*len(value[-1]) + 512
+
+
+_shared: Optional[EstimateCache] = None
+_shared_lock = threading.Lock()
+
+
+def shared() -> EstimateCache:
+    """
+    Caché del proceso. CAPEX_ESTIMATE_CACHE: ruta del SQLite (por defecto data/.cache/estimates.sqlite;
+    "0" o vacío = solo memoria). CAPEX_ESTIMATE_CACHE_MB: presupuesto en memoria (64 MB).
+    """
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                path = os.environ.get("CAPEX_ESTIMATE_CACHE", str(DEFAULT_PATH))
+                mb = float(os.environ.get("CAPEX_ESTIMATE_CACHE_MB", "64"))
+                _shared = EstimateCache(int(mb*(1 << 20)), path if path not in ("", "0") else None)
+    return _shared
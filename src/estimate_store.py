@@ -0,0 +1,419 @@
+"""
+Almacén persistente de estimaciones de cartera y repricing incremental cuando cambian los datos.
+
+Cada cartera guardada conserva sus entradas (crudas y preparadas), los totales y la matriz de costes por
+capítulo de `estimate_portfolio`, junto con la huella del CostModel con el que se calculó; el modelo
+(YAML + CSV compilados) se guarda una vez por huella. Al cambiar los datos, `reprice()` compara la versión
+guardada con la actual (`src.data_diff`) y recalcula solo lo afectado:
+
+- tarifa de un capítulo × escenario: solo esas celdas de las filas del módulo y escenario, reescalando el
+  coste guardado por (tarifa nueva · m²) / (tarifa antigua · m²), y después sus totales;
+- % por defecto (indirectos, GG+BI, soft, contingencia): solo los totales;
+- perfil de uso, multiplicador de nivel, factor de ciudad, PEM de benchmark con auto-calibración o
+  estructura de capítulos: la fila completa (o el módulo) con `estimate_portfolio`;
+- textos y etiquetas: sin recalcular.
+
+El informe da el delta por estimación, por módulo × escenario y por capítulo.
+
+    python -m src.estimate_store save proyectos.csv --store cartera.sqlite [--name cartera]
+    python -m src.estimate_store diff --store cartera.sqlite [--name cartera]
+    python -m src.estimate_store reprice --store cartera.sqlite [--name cartera] [-o impacto.csv] [--dry-run]
+    python -m src.estimate_store list --store cartera.sqlite
+"""
+from __future__ import annotations
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, Any, Tuple
+import argparse
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from src.calculations import SCENARIOS
+from src.data_diff import DataDiff, diff_models
+from src.instrument import count, span, timed
+from src.model import CostModel
+from src.portfolio import (PortfolioEstimate, ModuleChapters, TOTAL_COLUMNS, FACTOR_FIELDS, estimate_portfolio,
+                           markup_totals, option_table, _column, _optional_column, _bool_column, _level_column,
+                           _expand_scenarios)
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+REASONS = ("tarifa", "estructura", "perfil de uso", "multiplicador", "% por defecto", "datos de entrada")
+_RATE, _STRUCT, _USE, _LEVEL, _PCT, _INPUT = (1 << i for i in range(len(REASONS)))
+_INPUT_COLUMNS = FACTOR_FIELDS + ["soft_items_pct","cont_items_pct"]
+
+
+@dataclass
+class StoredPortfolio:
+    name: str
+    fingerprint: str
+    raw: pd.DataFrame          # input rows as saved
+    projects: pd.DataFrame     # prepare_projects + scenario expansion: one row per estimate
+    estimate: PortfolioEstimate
+    use_items: bool = True
+    updated: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self.projects)
+
+
+def prepare(model: CostModel, raw: pd.DataFrame, use_items: bool = True) -> pd.DataFrame:
+    from src.batch import prepare_projects
+    projects = prepare_projects(model, raw, use_items)
+    if "scenario" not in projects.columns:
+        projects = _expand_scenarios(projects, SCENARIOS)
+    return projects
+
+
+@dataclass
+class RepriceReport:
+    diff: DataDiff
+    rows: pd.DataFrame         # affected estimates: old/new total, delta, reasons
+    by_module: pd.DataFrame    # module × scenario
+    by_chapter: pd.DataFrame   # module × chapter_key
+    old_total: float
+    new_total: float
+    stats: Dict[str, Any]
+
+    @property
+    def delta(self) -> float:
+        return self.new_total - self.old_total
+
+    def summary(self) -> Dict[str, Any]:
+        return {"old_total": self.old_total, "new_total": self.new_total, "delta": self.delta,
+                "delta_pct": self.delta/self.old_total if self.old_total else float("nan"), **self.stats}
+
+
+def _copy_chapters(est: PortfolioEstimate) -> Dict[str, ModuleChapters]:
+    return {k: replace(mc, cost=mc.cost.copy(), included=mc.included.copy()) for k, mc in est.chapters.items()}
+
+
+def _same(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+def _input_changes(old_p: pd.DataFrame, new_p: pd.DataFrame) -> np.ndarray:
+    """Filas cuyas entradas preparadas (factores, % de items, PEM con auto-calibración) cambian."""
+    changed = np.zeros(len(old_p), dtype=bool)
+    for c in _INPUT_COLUMNS:
+        if c in old_p.columns or c in new_p.columns:
+            changed |= ~_same(_optional_column(old_p, c), _optional_column(new_p, c))
+    calib = _bool_column(new_p, "auto_calibrate")
+    if calib.any():
+        for sc in SCENARIOS:
+            changed |= calib & ~_same(_optional_column(old_p, "pem_"+sc), _optional_column(new_p, "pem_"+sc))
+    return changed
+
+
+@timed("estimate_store.reprice")
+def reprice_portfolio(sp: StoredPortfolio, old: CostModel, new: CostModel,
+                      diff: DataDiff | None = None) -> Tuple[StoredPortfolio, RepriceReport]:
+    """Cartera recalculada con `new` (solo lo afectado por el diff old → new) e informe de impacto."""
+    t0 = time.perf_counter()
+    diff = diff or diff_models(old, new)
+    projects = sp.projects
+    n = len(projects)
+    totals = sp.estimate.totals
+    modules = totals["module"].to_numpy(dtype=object).astype(str)
+    sci_all = pd.Index(SCENARIOS).get_indexer(totals["scenario"].astype(str))
+    gone = sorted(set(diff.removed_modules) & set(modules))
+    if gone:
+        raise ValueError(f"la cartera usa módulos eliminados de los datos: {', '.join(gone)}")
+
+    reasons = np.zeros(n, dtype=np.int64)
+    full = np.zeros(n, dtype=bool)
+    markup = np.zeros(n, dtype=bool)      # recompute totals from (possibly new) direct
+    out = {c: totals[c].to_numpy(dtype=float).copy() for c in TOTAL_COLUMNS}
+    chapters = _copy_chapters(sp.estimate)
+    cells = 0
+
+    new_projects = projects
+    if diff.inputs_changed:
+        new_projects = prepare(new, sp.raw, sp.use_items)
+        hit = _input_changes(projects, new_projects)
+        full |= hit
+        reasons[hit] |= _INPUT
+
+    m2a, m2b = _column(projects, "m2_above", 0.0), _column(projects, "m2_below", 0.0)
+    calibrated = out["calibration"] != 1.0
+    structural = set()
+    for key, mc in diff.modules.items():
+        in_mod = modules == key
+        if not in_mod.any():
+            continue
+        arr_o, arr_n = old.module(key), new.module(key)
+        if mc.structural:
+            structural.add(key)
+            full |= in_mod
+            reasons[in_mod] |= _STRUCT
+            continue
+        if mc.labels and key in chapters:
+            chapters[key] = replace(chapters[key], labels=arr_n.labels, basis=arr_n.basis)
+        if mc.uses and "building_use" in projects.columns:
+            hit = in_mod & projects["building_use"].astype(object).isin(mc.uses).to_numpy()
+            full |= hit
+            reasons[hit] |= _USE
+        opt = option_table(key)
+        if mc.levels and opt:
+            col, default, table = opt
+            levels = {lv for t, lv in mc.levels if t == table}
+            hit = in_mod & _level_column(projects, col, default).isin(levels).to_numpy()
+            full |= hit
+            reasons[hit] |= _LEVEL
+        if mc.pcts:
+            markup |= in_mod
+            reasons[in_mod] |= _PCT
+        if mc.rates is None or not mc.rates.any() or key not in chapters:
+            continue
+
+        # rate entries: rescale only the changed cells by new/old area-weighted rate
+        mch = chapters[key]
+        rows = mch.rows
+        sci = sci_all[rows]
+        hit_cells = mc.rates[:, sci].T & mch.included
+        touched = hit_cells.any(axis=1)
+        redo = touched & (calibrated[rows] | full[rows])   # calibration spreads over every chapter
+        full[rows[redo]] = True
+        reasons[rows[touched]] |= _RATE
+        r, c = np.nonzero(hit_cells & ~redo[:, None])
+        g, s = rows[r], sci[r]
+        old_rate = arr_o.above[c, s]*m2a[g] + arr_o.below[c, s]*m2b[g]
+        new_rate = arr_n.above[c, s]*m2a[g] + arr_n.below[c, s]*m2b[g]
+        ok = old_rate != 0
+        mch.cost[r[ok], c[ok]] *= new_rate[ok]/old_rate[ok]
+        unknown = ~ok & (new_rate != 0)        # old rate 0: the per-row scale is not recoverable
+        full[g[unknown]] = True
+        cells += int(ok.sum())
+        upd = np.unique(r)
+        out["direct"][rows[upd]] = mch.cost[upd].sum(axis=1)
+        markup[rows[upd]] = True
+
+    # totals of rows whose direct or default percentages changed
+    rest = markup & ~full
+    if rest.any():
+        soft_o, cont_o = _optional_column(projects, "soft_items_pct"), _optional_column(projects, "cont_items_pct")
+        for key in pd.unique(modules[rest]):
+            sel = np.flatnonzero(rest & (modules == key))
+            for c, v in markup_totals(new.module(key), sci_all[sel], out["direct"][sel], soft_o[sel], cont_o[sel]).items():
+                out[c][sel] = v
+
+    # full rows (and whole modules whose chapter list changed) through the vectorized estimator
+    rows_full = np.flatnonzero(full)
+    if len(rows_full):
+        with span("estimate_store.full_rows", rows=len(rows_full)):
+            res = estimate_portfolio(new, new_projects.iloc[rows_full], with_chapters=True)
+        for c in TOTAL_COLUMNS:
+            out[c][rows_full] = res.totals[c].to_numpy(dtype=float)
+        for key, mcs in res.chapters.items():
+            g = rows_full[mcs.rows]
+            if key in structural or key not in chapters:
+                chapters[key] = replace(mcs, rows=g)
+                continue
+            pos = np.empty(n, dtype=np.int64)
+            pos[chapters[key].rows] = np.arange(len(chapters[key].rows))
+            chapters[key].cost[pos[g]] = mcs.cost
+            chapters[key].included[pos[g]] = mcs.included
+        count("estimate_store_full_rows", len(rows_full))
+    count("estimate_store_cells", cells)
+
+    new_totals = totals.copy()
+    for c in TOTAL_COLUMNS:
+        new_totals[c] = out[c]
+    new_sp = StoredPortfolio(name=sp.name, fingerprint=new.fingerprint, raw=sp.raw, projects=new_projects,
+                             estimate=PortfolioEstimate(totals=new_totals, chapters=chapters),
+                             use_items=sp.use_items, updated=time.time())
+    report = _report(diff, totals, new_totals, reasons, sp.estimate.chapters, chapters, {
+        "estimates": n, "affected": int((reasons != 0).sum()), "full_rows": len(rows_full), "chapter_cells": cells,
+        "totals_only": int((markup & ~full & (reasons & _RATE == 0)).sum()), "seconds": time.perf_counter() - t0})
+    return new_sp, report
+
+
+def _report(diff: DataDiff, old: pd.DataFrame, new: pd.DataFrame, reasons: np.ndarray,
+            old_ch: Dict[str, ModuleChapters], new_ch: Dict[str, ModuleChapters], stats: Dict[str, Any]) -> RepriceReport:
+    o, w = old["total"].to_numpy(dtype=float), new["total"].to_numpy(dtype=float)
+    aff = np.flatnonzero(reasons != 0)
+    labels = np.array(["; ".join(r for i, r in enumerate(REASONS) if m >> i & 1) for m in range(1 << len(REASONS))],
+                      dtype=object)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rows = pd.DataFrame({
+            "project": old["project"].to_numpy()[aff], "module": old["module"].to_numpy()[aff],
+            "scenario": old["scenario"].to_numpy()[aff], "reasons": labels[reasons[aff]],
+            "old_direct": old["direct"].to_numpy()[aff], "new_direct": new["direct"].to_numpy()[aff],
+            "old_total": o[aff], "new_total": w[aff], "delta": w[aff] - o[aff],
+            "delta_pct": np.where(o[aff] != 0, (w[aff] - o[aff])/o[aff], np.nan),
+        })
+    g = pd.DataFrame({"module": old["module"], "scenario": old["scenario"], "affected": reasons != 0,
+                      "old_total": o, "new_total": w})
+    by_module = g.groupby(["module","scenario"], sort=False).agg(
+        estimates=("affected","size"), affected=("affected","sum"), old_total=("old_total","sum"),
+        new_total=("new_total","sum")).reset_index()
+    by_module["delta"] = by_module["new_total"] - by_module["old_total"]
+    by_module["delta_pct"] = by_module["delta"]/by_module["old_total"].where(by_module["old_total"] != 0)
+
+    parts = []
+    for key in dict.fromkeys(list(old_ch) + list(new_ch)):
+        a = pd.Series(old_ch[key].cost.sum(axis=0), index=list(old_ch[key].keys)) if key in old_ch else pd.Series(dtype=float)
+        b = pd.Series(new_ch[key].cost.sum(axis=0), index=list(new_ch[key].keys)) if key in new_ch else pd.Series(dtype=float)
+        both = pd.concat([a.rename("old_direct"), b.rename("new_direct")], axis=1).fillna(0.0)
+        both = both[both["old_direct"] != both["new_direct"]]
+        if len(both):
+            parts.append(both.rename_axis("chapter_key").reset_index().assign(module=key))
+    by_chapter = pd.concat(parts, ignore_index=True) if parts else \
+        pd.DataFrame(columns=["chapter_key","old_direct","new_direct","module"])
+    by_chapter["delta"] = by_chapter["new_direct"] - by_chapter["old_direct"]
+    by_chapter = by_chapter[["module","chapter_key","old_direct","new_direct","delta"]]
+    return RepriceReport(diff=diff, rows=rows, by_module=by_module, by_chapter=by_chapter,
+                         old_total=float(o.sum()), new_total=float(w.sum()), stats=stats)
+
+
+class EstimateStore:
+    """SQLite con carteras guardadas (estado pickle) y un CostModel por huella para poder comparar versiones."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(str(self.path), timeout=30.0, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS snapshots (fp TEXT PRIMARY KEY, created REAL NOT NULL, "
+                         "model BLOB NOT NULL)")
+        self.con.execute("CREATE TABLE IF NOT EXISTS portfolios (name TEXT PRIMARY KEY, fp TEXT NOT NULL, "
+                         "updated REAL NOT NULL, n INTEGER NOT NULL, state BLOB NOT NULL)")
+
+    # --- rows --------------------------------------------------------------------------------
+    def _put_model(self, model: CostModel) -> None:
+        if self.con.execute("SELECT 1 FROM snapshots WHERE fp=?", (model.fingerprint,)).fetchone():
+            return
+        blob = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+        self.con.execute("INSERT OR IGNORE INTO snapshots VALUES (?,?,?)", (model.fingerprint, time.time(), blob))
+
+    def _write(self, sp: StoredPortfolio, model: CostModel) -> None:
+        state = pickle.dumps({"raw": sp.raw, "projects": sp.projects, "estimate": sp.estimate, "use_items": sp.use_items},
+                             protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self.con.execute("BEGIN")
+            try:
+                self._put_model(model)
+                self.con.execute("INSERT OR REPLACE INTO portfolios VALUES (?,?,?,?,?)",
+                                 (sp.name, sp.fingerprint, sp.updated, len(sp), state))
+                self.con.execute("DELETE FROM snapshots WHERE fp NOT IN (SELECT fp FROM portfolios)")
+                self.con.execute("COMMIT")
+            except BaseException:
+                self.con.execute("ROLLBACK")
+                raise
+
+    # --- public ------------------------------------------------------------------------------
+    def save(self, name: str, model: CostModel, raw: pd.DataFrame, use_items: bool = True) -> StoredPortfolio:
+        """Estima `raw` (columnas de src.batch) con `model` y lo guarda como `name` (reemplaza si existe)."""
+        projects = prepare(model, raw, use_items)
+        with span("estimate_store.save", rows=len(projects)):
+            est = estimate_portfolio(model, projects, with_chapters=True)
+        sp = StoredPortfolio(name=name, fingerprint=model.fingerprint, raw=raw.copy(), projects=projects,
+                             estimate=est, use_items=use_items, updated=time.time())
+        self._write(sp, model)
+        return sp
+
+    def load(self, name: str) -> StoredPortfolio:
+        with self._lock:
+            row = self.con.execute("SELECT fp, updated, state FROM portfolios WHERE name=?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"cartera no guardada: {name!r}")
+        state = pickle.loads(row[2])
+        return StoredPortfolio(name=name, fingerprint=row[0], updated=row[1], **state)
+
+    def model(self, fingerprint: str) -> CostModel:
+        with self._lock:
+            row = self.con.execute("SELECT model FROM snapshots WHERE fp=?", (fingerprint,)).fetchone()
+        if row is None:
+            raise KeyError(f"versión de datos no guardada: {fingerprint[:12]}")
+        return pickle.loads(row[0])
+
+    def names(self) -> pd.DataFrame:
+        with self._lock:
+            rows = self.con.execute("SELECT name, fp, n, updated FROM portfolios ORDER BY name").fetchall()
+        out = pd.DataFrame(rows, columns=["name","fingerprint","estimates","updated"])
+        out["updated"] = pd.to_datetime(out["updated"], unit="s")
+        return out
+
+    def diff(self, name: str, model: CostModel) -> DataDiff:
+        """Cambios entre los datos con que se guardó `name` y `model`."""
+        with self._lock:
+            row = self.con.execute("SELECT fp FROM portfolios WHERE name=?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"cartera no guardada: {name!r}")
+        return diff_models(self.model(row[0]), model)
+
+    def reprice(self, name: str, model: CostModel, dry_run: bool = False) -> RepriceReport:
+        """Recalcula lo afectado por el cambio de datos, guarda la cartera al día (salvo dry_run) e informa."""
+        sp = self.load(name)
+        old = model if sp.fingerprint == model.fingerprint else self.model(sp.fingerprint)
+        new_sp, report = reprice_portfolio(sp, old, model)
+        if not dry_run and sp.fingerprint != model.fingerprint:
+            self._write(new_sp, model)
+        return report
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            self.con.execute("DELETE FROM portfolios WHERE name=?", (name,))
+            self.con.execute("DELETE FROM snapshots WHERE fp NOT IN (SELECT fp FROM portfolios)")
+
+    def close(self) -> None:
+        with self._lock:
+            self.con.close()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.estimate_store",
+                                 description="Carteras guardadas y repricing incremental al cambiar los datos.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for cmd in ("save","diff","reprice","list"):
+        p = sub.add_parser(cmd)
+        p.add_argument("--store", required=True, help="fichero SQLite del almacén")
+        p.add_argument("--data-dir", default=str(DATA_DIR))
+        if cmd != "list":
+            p.add_argument("--name", default="cartera")
+        if cmd == "save":
+            p.add_argument("input", help="CSV/JSONL de proyectos (columnas de src.batch)")
+            p.add_argument("--no-items", action="store_true", help="no aplicar soft costs/contingencia de los CSV")
+        if cmd in ("diff","reprice"):
+            p.add_argument("-o", "--output", help="CSV: cambios (diff) o impacto por estimación (reprice)")
+        if cmd == "reprice":
+            p.add_argument("--dry-run", action="store_true", help="informa sin guardar la cartera recalculada")
+    args = ap.parse_args(argv)
+
+    store = EstimateStore(args.store)
+    if args.cmd == "list":
+        print(store.names().to_string(index=False))
+        return 0
+    from src.model import load_model
+    model = load_model(args.data_dir)
+    if args.cmd == "save":
+        from src.batch import _format_of
+        df = pd.read_json(args.input, lines=True) if _format_of(args.input) == "jsonl" else pd.read_csv(args.input)
+        sp = store.save(args.name, model, df, use_items=not args.no_items)
+        print(f"{args.name}: {len(sp):,} estimaciones, total {sp.estimate.totals['total'].sum():,.0f} €", file=sys.stderr)
+        return 0
+    if args.cmd == "diff":
+        diff = store.diff(args.name, model)
+        if args.output:
+            diff.changes.to_csv(args.output, index=False)
+        print(diff.summary().to_string(index=False) if not diff.empty else "sin cambios")
+        return 0
+    rep = store.reprice(args.name, model, dry_run=args.dry_run)
+    if args.output:
+        rep.rows.to_csv(args.output, index=False)
+    with pd.option_context("display.width", 160):
+        print(rep.by_module.to_string(index=False))
+    s = rep.summary()
+    print(f"{s['affected']:,}/{s['estimates']:,} estimaciones afectadas ({s['full_rows']:,} completas, "
+          f"{s['chapter_cells']:,} celdas de capítulo, {s['totals_only']:,} solo totales) en {s['seconds']:.2f} s | "
+          f"cartera {s['old_total']:,.0f} → {s['new_total']:,.0f} € ({s['delta']:+,.0f} €)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,200 @@
+"""
+Indexación temporal con series locales (MITMA índice de costes de la construcción, INE materiales / mano de obra).
+
+data/cost_indices.csv en formato largo: fecha (YYYY-MM o YYYY-MM-DD), serie, valor[, fuente].
+Las series se interpolan linealmente a un array diario (fuera de su rango se mantiene el valor extremo).
+`meta.indexation.groups` en cost_ranges.yaml asigna a cada grupo de capítulos (other / mep / finish,
+según _is_mep / _is_arch_finish) una mezcla ponderada de series; el factor de un grupo entre dos fechas
+es Σ w·I(destino)/I(origen). Sin datos en el CSV los factores valen 1.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Tuple, Optional
+import threading
+import numpy as np
+import pandas as pd
+
+from src.calculations import SCENARIOS
+from src.model import CostModel, CompiledModule
+from src.portfolio import PortfolioEstimate
+
+GROUPS = ("other", "mep", "finish")
+GROUP_LABELS = {"other": "Arquitectura/estructura", "mep": "Instalaciones (MEP)", "finish": "Acabados"}
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def _days(dates) -> np.ndarray:
+    """Fechas (str "YYYY-MM" o "YYYY-MM-DD" mezclados, date, datetime64, Series…) → días desde 1970 (int64)."""
+    # ISO8601: each value parsed on its own (the inferred format of the first one would reject the rest)
+    arr = pd.to_datetime(pd.Series(np.atleast_1d(np.asarray(dates, dtype=object))), format="ISO8601", errors="raise")
+    return (arr.to_numpy().astype("datetime64[D]") - _EPOCH).astype(np.int64)
+
+
+@dataclass(frozen=True)
+class IndexTable:
+    """Series interpoladas a un array diario: values[día - start, serie]."""
+    series: Tuple[str, ...]
+    start: int                          # first day (days since 1970)
+    values: np.ndarray                  # (days, series)
+    coverage: Dict[str, Tuple[int, int]]  # first / last observation per series
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "IndexTable":
+        if df is None or df.empty:
+            return cls((), 0, np.zeros((0, 0)), {})
+        d = pd.DataFrame({"day": _days(df["fecha"]), "serie": df["serie"].astype(str).str.strip(),
+                          "valor": pd.to_numeric(df["valor"], errors="coerce")}).dropna()
+        d = d[d["valor"] > 0].sort_values(["serie", "day"]).drop_duplicates(["serie", "day"], keep="last")
+        if d.empty:
+            return cls((), 0, np.zeros((0, 0)), {})
+        series = tuple(pd.unique(d["serie"]))
+        start, end = int(d["day"].min()), int(d["day"].max())
+        grid = np.arange(start, end + 1)
+        values = np.empty((len(grid), len(series)))
+        coverage = {}
+        for j, s in enumerate(series):
+            g = d[d["serie"] == s]
+            values[:, j] = np.interp(grid, g["day"].to_numpy(), g["valor"].to_numpy(dtype=float))
+            coverage[s] = (int(g["day"].iloc[0]), int(g["day"].iloc[-1]))
+        values.setflags(write=False)
+        return cls(series, start, values, coverage)
+
+    @property
+    def empty(self) -> bool:
+        return not self.series
+
+    def date_range(self) -> Tuple[Optional[np.datetime64], Optional[np.datetime64]]:
+        if self.empty:
+            return None, None
+        return _EPOCH + self.start, _EPOCH + self.start + len(self.values) - 1
+
+    def at(self, dates) -> np.ndarray:
+        """Valores (n, series) en `dates`; O(1) por fecha (acotado al rango de la tabla)."""
+        idx = np.clip(_days(dates) - self.start, 0, len(self.values) - 1)
+        return self.values[idx]
+
+    def extrapolated(self, dates, series: str) -> np.ndarray:
+        lo, hi = self.coverage[series]
+        d = _days(dates)
+        return (d < lo) | (d > hi)
+
+
+def group_weights(model: CostModel, table: IndexTable) -> np.ndarray:
+    """(3 grupos, series): pesos de meta.indexation.groups sobre las series disponibles (renormalizados)."""
+    cfg = (model.cost_data.get("meta", {}) or {}).get("indexation", {}) or {}
+    groups = cfg.get("groups", {}) or {}
+    fallback = cfg.get("fallback")
+    w = np.zeros((len(GROUPS), len(table.series)))
+    pos = {s: j for j, s in enumerate(table.series)}
+    for gi, g in enumerate(GROUPS):
+        for s, wt in (groups.get(g) or {}).items():
+            if s in pos:
+                w[gi, pos[s]] += float(wt)
+        if w[gi].sum() <= 0 and fallback in pos:
+            w[gi, pos[fallback]] = 1.0
+        if w[gi].sum() > 0:
+            w[gi] /= w[gi].sum()
+    return w
+
+
+def group_factors(model: CostModel, table: IndexTable, base_dates, target_dates) -> np.ndarray:
+    """(n, 3) factores other / mep / finish de base_dates a target_dates (escalares o arrays)."""
+    base = np.atleast_1d(np.asarray(base_dates, dtype=object))
+    target = np.atleast_1d(np.asarray(target_dates, dtype=object))
+    n = max(len(base), len(target))
+    if table.empty:
+        return np.ones((n, len(GROUPS)))
+    w = group_weights(model, table)
+    ratio = table.at(np.broadcast_to(target, n)) / table.at(np.broadcast_to(base, n))
+    out = ratio @ w.T
+    out[:, w.sum(axis=1) == 0] = 1.0  # group without any series: not indexed
+    return out
+
+
+def _group_matrix(cm: CompiledModule) -> np.ndarray:
+    """(chapters, 3) pertenencia a other / mep / finish."""
+    mep = cm.mep
+    finish = cm.finish & ~mep
+    return np.column_stack([~mep & ~finish, mep, finish]).astype(float)
+
+
+def group_split(model: CostModel, res: PortfolioEstimate) -> np.ndarray:
+    """(n, 3) coste directo por grupo de capítulos de cada fila de `res` (requiere with_chapters=True)."""
+    n = len(res.totals)
+    if n and not res.chapters:
+        raise ValueError("group_split necesita estimate_portfolio(..., with_chapters=True)")
+    out = np.zeros((n, len(GROUPS)))
+    for module_key, mc in res.chapters.items():
+        cost = np.where(mc.included, mc.cost, 0.0)
+        out[mc.rows] = cost @ _group_matrix(model.module(module_key))
+    return out
+
+
+def base_date(model: CostModel) -> str:
+    return str((model.cost_data.get("meta", {}) or {}).get("date_built"))
+
+
+def reprice(model: CostModel, res: PortfolioEstimate, target_date, base_dates=None,
+            table: IndexTable | None = None) -> pd.DataFrame:
+    """
+    Re-base de una cartera estimada (estimate_portfolio con capítulos) a `target_date` en una pasada:
+    directo_g × factor_g por grupo; indirectos, GG+BI, soft y contingencia escalan con el directo.
+    `base_dates` (escalar o uno por fila) es el nivel de precios de cada estimación; por defecto meta.date_built.
+    """
+    table = table if table is not None else index_table(model)
+    n = len(res.totals)
+    base = np.broadcast_to(np.atleast_1d(np.asarray(base_dates if base_dates is not None else base_date(model),
+                                                    dtype=object)), n)
+    split = group_split(model, res)
+    fac = group_factors(model, table, base, target_date) if n else np.ones((0, len(GROUPS)))
+    direct = split.sum(axis=1)
+    direct_new = (split*fac).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = np.where(direct > 0, direct_new/direct, 1.0)
+    extrapolated = np.zeros(n, dtype=bool)
+    if n and not table.empty:
+        used = group_weights(model, table).sum(axis=0) > 0
+        for s in np.asarray(table.series)[used]:
+            extrapolated |= table.extrapolated(base, s) | table.extrapolated(np.broadcast_to(target_date, n), s)
+    t = res.totals
+    return pd.DataFrame({
+        "project": t["project"].to_numpy(), "module": t["module"].to_numpy(), "scenario": t["scenario"].to_numpy(),
+        "base_date": base, "target_date": str(pd.Timestamp(target_date).date()),
+        **{f"factor_{g}": fac[:, i] for i, g in enumerate(GROUPS)},
+        "factor": factor,
+        "direct": t["direct"].to_numpy(), "direct_indexed": t["direct"].to_numpy()*factor,
+        "total": t["total"].to_numpy(), "total_indexed": t["total"].to_numpy()*factor,
+        "extrapolated": extrapolated,
+    })
+
+
+def blended_factor(model: CostModel, module_key: str, scenario: str, m2_above: float, m2_below: float,
+                   target_date, base=None, table: IndexTable | None = None) -> Tuple[float, Dict[str, float]]:
+    """
+    Factor único equivalente para `Factors.indexacion_temporal` de un proyecto: media de los factores de grupo
+    ponderada por el peso de cada grupo en el coste base del módulo. Devuelve (factor, factores por grupo).
+    """
+    table = table if table is not None else index_table(model)
+    cm = model.module(module_key)
+    sci = SCENARIOS.index(scenario)
+    base_cost = cm.above[:, sci]*float(m2_above) + cm.below[:, sci]*float(m2_below)
+    split = base_cost @ _group_matrix(cm)
+    fac = group_factors(model, table, base if base is not None else base_date(model), target_date)[0]
+    total = split.sum()
+    factor = float((split*fac).sum()/total) if total > 0 else 1.0
+    return factor, dict(zip(GROUPS, map(float, fac)))
+
+
+_tables: Dict[str, IndexTable] = {}
+_tables_lock = threading.Lock()
+
+
+def index_table(model: CostModel) -> IndexTable:
+    """IndexTable del modelo, compilada una vez por fingerprint de los datos."""
+    table = _tables.get(model.fingerprint)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(model.fingerprint)
+            if table is None:
+                table = _tables[model.fingerprint] = IndexTable.from_frame(model.indices)
+    return table
@@ -0,0 +1,160 @@
+"""
+Instrumentación ligera: spans con nombre, contadores y volcado JSON / Chrome trace.
+
+Desactivada por defecto; se activa con la variable de entorno CAPEX_PROFILE=1 (se lee al importar).
+Desactivada, `timed` devuelve la función sin envolver y `span` / `count` / `phase` retornan enseguida.
+Cada hilo (cada rerun de Streamlit) registra en su propio `Recorder`; `start_run()` lo reinicia
+(también al empezar cada trabajo del pool) y guarda como mucho MAX_SPANS spans (los más recientes).
+"""
+from __future__ import annotations
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from functools import wraps
+from pathlib import Path
+from typing import Deque, Dict, Any, List, Optional, Callable
+import json
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("CAPEX_PROFILE", "").strip().lower() not in ("", "0", "false", "no", "off")
+
+MAX_SPANS = 100_000   # ring buffer per recorder: long-lived worker threads do not grow without bound
+
+_NULL = nullcontext()
+_local = threading.local()
+
+
+@dataclass
+class Span:
+    name: str
+    start: float          # s desde el inicio del run
+    duration: float = 0.0
+    depth: int = 0
+    tid: int = 0
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+
+class Recorder:
+    def __init__(self, label: str = "run"):
+        self.label = label
+        self.t0 = time.perf_counter()
+        self.spans: Deque[Span] = deque(maxlen=MAX_SPANS)
+        self.counters: Dict[str, float] = {}
+        self._depth = 0
+        self._phase: Optional[Span] = None
+
+    def open(self, name: str, attrs: Dict[str, Any]) -> Span:
+        s = Span(name, time.perf_counter() - self.t0, depth=self._depth, tid=threading.get_ident(), attrs=attrs)
+        self.spans.append(s)
+        self._depth += 1
+        return s
+
+    def close(self, s: Span) -> None:
+        s.duration = time.perf_counter() - self.t0 - s.start
+        self._depth -= 1
+
+    def phase(self, name: str) -> None:
+        if self._phase is not None:
+            self.close(self._phase)
+        self._phase = self.open(name, {"phase": True}) if name else None
+
+    def finish(self) -> None:
+        self.phase("")
+
+    # --- export -----------------------------------------------------------------------------
+    def summary(self) -> List[Dict[str, Any]]:
+        """Por nombre: llamadas, ms totales y medios; ordenado por tiempo total."""
+        agg: Dict[str, Dict[str, Any]] = {}
+        for s in self.spans:
+            a = agg.setdefault(s.name, {"span": s.name, "calls": 0, "total_ms": 0.0})
+            a["calls"] += 1
+            a["total_ms"] += s.duration*1000
+        rows = sorted(agg.values(), key=lambda a: -a["total_ms"])
+        for a in rows:
+            a["mean_ms"] = a["total_ms"]/a["calls"]
+        return rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"label": self.label, "counters": dict(self.counters),
+                "spans": [{"name": s.name, "start_ms": s.start*1000, "duration_ms": s.duration*1000,
+                           "depth": s.depth, "tid": s.tid, **({"attrs": s.attrs} if s.attrs else {})}
+                          for s in self.spans]}
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Formato de chrome://tracing / Perfetto (eventos completos 'X', µs)."""
+        pid = os.getpid()
+        events = [{"name": s.name, "ph": "X", "ts": s.start*1e6, "dur": s.duration*1e6, "pid": pid, "tid": s.tid,
+                   "args": {k: str(v) for k, v in s.attrs.items()}} for s in self.spans]
+        events += [{"name": k, "ph": "C", "ts": 0, "pid": pid, "args": {k: v}} for k, v in self.counters.items()]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"label": self.label}}
+
+    def dump(self, path: str | Path, fmt: str = "json") -> Path:
+        """fmt: 'json' (spans + contadores) o 'chrome' (trace event format)."""
+        data = self.to_chrome_trace() if fmt == "chrome" else self.to_dict()
+        path = Path(path)
+        path.write_text(json.dumps(data, ensure_ascii=False, default=str), encoding="utf-8")
+        return path
+
+
+def current() -> Recorder:
+    rec = getattr(_local, "rec", None)
+    if rec is None:
+        rec = _local.rec = Recorder()
+    return rec
+
+
+def start_run(label: str = "run") -> Recorder:
+    _local.rec = Recorder(label)
+    return _local.rec
+
+
+@contextmanager
+def _span(name: str, attrs: Dict[str, Any]):
+    rec = current()
+    s = rec.open(name, attrs)
+    try:
+        yield s
+    finally:
+        rec.close(s)
+
+
+def span(name: str, **attrs):
+    """`with span("pdf"):` — no-op si la instrumentación está desactivada."""
+    return _span(name, attrs) if ENABLED else _NULL
+
+
+def timed(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """Decorador: span con el nombre de la función (o `name`). Desactivado no envuelve nada."""
+    def deco(fn: Callable) -> Callable:
+        if not ENABLED:
+            return fn
+        label = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _span(label, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def count(name: str, n: float = 1) -> None:
+    if ENABLED:
+        c = current().counters
+        c[name] = c.get(name, 0) + n
+
+
+def phase(name: str) -> None:
+    """Fases secuenciales de un script (p.ej. app.py): cierra la anterior y abre `name`."""
+    if ENABLED:
+        current().phase(name)
+
+
+def finish_run() -> Optional[Recorder]:
+    if not ENABLED:
+        return None
+    rec = current()
+    rec.finish()
+    return rec
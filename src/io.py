@@ -4,9 +4,13 @@ from pathlib import Path
 import yaml
 import pandas as pd
 
+from src.instrument import timed
+
+@timed()
 def load_yaml(path: str | Path) -> dict:
     with open(path,"r",encoding="utf-8") as f:
         return yaml.safe_load(f)
 
+@timed()
 def load_csv(path: str | Path) -> pd.DataFrame:
     return pd.read_csv(path)
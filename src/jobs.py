@@ -0,0 +1,298 @@
+"""
+Trabajos en segundo plano para la app (Monte Carlo, Sobol, PDF, carteras por lotes).
+
+Pool local de hilos con registro por huella de entradas: `submit(kind, inputs, fn, ...)` devuelve el trabajo
+ya lanzado (en cola, en marcha o terminado) con la misma clave en vez de repetirlo, así que un rerun de
+Streamlit —o otra sesión con las mismas entradas— se re-engancha a él. `fn(ctx, *args)` recibe un
+`JobContext` para publicar progreso y resultados parciales; `ctx.update()` lanza `JobCancelled` si se ha
+cancelado. Con `owner=(sesión, hueco)` el trabajo anterior de ese hueco se cancela al lanzar otro si nadie
+más lo espera (cambiar un widget no deja simulaciones huérfanas ocupando el servidor).
+
+Límites (servidor compartido): CAPEX_JOB_WORKERS trabajos simultáneos (2 por defecto) y CAPEX_JOB_QUEUE en
+cola (16); por encima `submit` lanza `JobQueueFull`. Se conservan los últimos `keep` trabajos terminados.
+
+    job = jobs.shared().submit("monte_carlo", (spec, cfg), jobs.monte_carlo_job, spec, cfg, owner=(sid, "mc"))
+    job.status, job.progress, job.partial, job.result
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable, Tuple
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+import pandas as pd
+
+from src.instrument import count, span, start_run
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL = (DONE, FAILED, CANCELLED)
+STATUS_LABELS = {QUEUED: "En cola", RUNNING: "En marcha", DONE: "Terminado", FAILED: "Error", CANCELLED: "Cancelado"}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueueFull(RuntimeError):
+    pass
+
+
+def job_key(kind: str, inputs: Any) -> str:
+    """sha256 de (kind, entradas); pickle para arrays/dataclasses, repr si no se puede serializar."""
+    try:
+        payload = pickle.dumps((kind, inputs), protocol=4)
+    except Exception:
+        payload = repr((kind, inputs)).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    key: str
+    label: str = ""
+    status: str = QUEUED
+    progress: float = 0.0
+    message: str = ""
+    partial: Any = None
+    result: Any = None
+    error: Optional[str] = None
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    owners: set = field(default_factory=set)
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+    _finished: threading.Event = field(default_factory=threading.Event, repr=False)
+    _future: Any = field(default=None, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def cancel(self) -> bool:
+        """Pide la cancelación; un trabajo en cola no llega a empezar, uno en marcha para en su próximo `update`."""
+        if self.done:
+            return False
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():
+            self._finish(CANCELLED)
+        return True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def _finish(self, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        self.status, self.result, self.error = status, result, error
+        self.finished = time.time()
+        if status == DONE:
+            self.progress = 1.0
+        self._finished.set()
+
+
+class JobContext:
+    """Lo que ve la función del trabajo: progreso, parciales y cancelación."""
+
+    def __init__(self, job: Job):
+        self._job = job
+
+    @property
+    def cancelled(self) -> bool:
+        return self._job._cancel.is_set()
+
+    def check(self) -> None:
+        if self._job._cancel.is_set():
+            raise JobCancelled(self._job.id)
+
+    def update(self, progress: Optional[float] = None, message: Optional[str] = None, partial: Any = None) -> None:
+        self.check()
+        if progress is not None:
+            self._job.progress = min(max(float(progress), 0.0), 1.0)
+        if message is not None:
+            self._job.message = message
+        if partial is not None:
+            self._job.partial = partial
+
+
+class JobManager:
+    def __init__(self, max_workers: int = 2, max_pending: int = 16, keep: int = 32):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(0, int(max_pending))
+        self.keep = int(keep)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="capex-job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}          # id → job (insertion order)
+        self._by_key: Dict[str, str] = {}        # key → id of the latest job
+        self._slots: Dict[Tuple[str, str], str] = {}  # owner (session, slot) → job id
+
+    def submit(self, kind: str, inputs: Any, fn: Callable[..., Any], *args, label: str = "",
+               owner: Optional[Tuple[str, str]] = None, restart: bool = False, **kwargs) -> Job:
+        """Trabajo con esas entradas: el existente (en curso, terminado o, para quien aún lo sigue,
+        fallido/cancelado salvo con `restart`) o uno nuevo."""
+        key = job_key(kind, inputs)
+        with self._lock:
+            job = self._jobs.get(self._by_key.get(key, ""))
+            if job is not None and job.done and job.status != DONE and owner not in job.owners:
+                job = None   # superseded or failed for someone else: do not hand back a dead job
+            if job is not None and not (restart and job.done):
+                count("jobs.reattach")
+                self._own(job, owner)
+                return job
+            running = sum(j.status == RUNNING for j in self._jobs.values())
+            queued = sum(j.status == QUEUED for j in self._jobs.values())
+            if queued >= self.max_pending + max(0, self.max_workers - running):
+                raise JobQueueFull(f"demasiados trabajos en cola (máx. {self.max_pending})")
+            job = Job(id=uuid.uuid4().hex[:12], kind=kind, key=key, label=label or kind)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            self._own(job, owner)
+            job._future = self._pool.submit(self._run, job, fn, args, kwargs)
+            self._prune()
+        count("jobs.submitted")
+        return job
+
+    def _own(self, job: Job, owner: Optional[Tuple[str, str]]) -> None:
+        if owner is None:
+            return
+        prev = self._jobs.get(self._slots.get(owner, ""))
+        self._slots[owner] = job.id
+        job.owners.add(owner)
+        if prev is not None and prev is not job:
+            prev.owners.discard(owner)
+            if not prev.owners and not prev.done:   # nobody is waiting for it any more
+                prev.cancel()
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs) -> None:
+        if job._cancel.is_set():
+            job._finish(CANCELLED)
+            return
+        job.status, job.started = RUNNING, time.time()
+        start_run("job."+job.kind)   # fresh recorder per task: pool threads live as long as the process
+        try:
+            with span("job."+job.kind):
+                result = fn(JobContext(job), *args, **kwargs)
+        except JobCancelled:
+            job._finish(CANCELLED)
+        except Exception as e:  # surfaced in the UI, the worker thread keeps serving
+            job._finish(FAILED, error=f"{type(e).__name__}: {e}")
+        else:
+            job._finish(CANCELLED if job._cancel.is_set() else DONE, result=result)
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j.done]
+        # unowned first, then oldest: sessions that went away never release their slots
+        finished.sort(key=lambda j: (bool(j.owners), j.finished))
+        for j in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[j.id]
+            if self._by_key.get(j.key) == j.id:
+                del self._by_key[j.key]
+            for owner in j.owners:
+                if self._slots.get(owner) == j.id:
+                    del self._slots[owner]
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        return self._jobs.get(job_id or "")
+
+    def find(self, kind: str, inputs: Any) -> Optional[Job]:
+        return self._jobs.get(self._by_key.get(job_key(kind, inputs), ""))
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        return job.cancel() if job is not None else False
+
+    def release(self, owner: Tuple[str, str]) -> None:
+        """La sesión deja de esperar ese hueco (cancela el trabajo si nadie más lo espera)."""
+        with self._lock:
+            job = self._jobs.get(self._slots.pop(owner, ""))
+            if job is not None:
+                job.owners.discard(owner)
+                if not job.owners and not job.done:
+                    job.cancel()
+
+    def jobs(self, kind: Optional[str] = None) -> List[Job]:
+        return [j for j in list(self._jobs.values()) if kind is None or j.kind == kind]
+
+    def stats(self) -> Dict[str, int]:
+        jobs = self.jobs()
+        return {"workers": self.max_workers, "running": sum(j.status == RUNNING for j in jobs),
+                "queued": sum(j.status == QUEUED for j in jobs), "finished": sum(j.done for j in jobs)}
+
+    def frame(self) -> pd.DataFrame:
+        rows = [{"trabajo": j.label, "estado": STATUS_LABELS[j.status], "progreso": j.progress,
+                 "segundos": round(j.elapsed, 1), "sesiones": len(j.owners), "error": j.error or ""}
+                for j in reversed(self.jobs())]
+        return pd.DataFrame(rows, columns=["trabajo","estado","progreso","segundos","sesiones","error"])
+
+    def shutdown(self, cancel: bool = True) -> None:
+        if cancel:
+            for j in self.jobs():
+                j.cancel()
+        self._pool.shutdown(wait=True)
+
+
+_shared: Optional[JobManager] = None
+_shared_lock = threading.Lock()
+
+
+def shared() -> JobManager:
+    """Pool del proceso (compartido por todas las sesiones de Streamlit)."""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = JobManager(int(os.environ.get("CAPEX_JOB_WORKERS", "2")),
+                                     int(os.environ.get("CAPEX_JOB_QUEUE", "16")))
+    return _shared
+
+
+# --- job functions used by the app -------------------------------------------------------------------------
+
+def monte_carlo_job(ctx: JobContext, spec, cfg, keep_samples: bool = False):
+    """MonteCarloResult (o (resultado, store, reusado) con muestras guardadas); parciales P50/P80/P90."""
+    def _progress(done: int, n: int, hist) -> None:
+        ctx.update(done/n, f"{done:,} / {n:,} iteraciones",
+                   {"n": done, **{f"P{p}": hist.quantile(p/100) for p in (50, 80, 90)}})
+
+    if keep_samples:
+        from src.columnar import monte_carlo_samples
+        return monte_carlo_samples(spec, cfg, progress=_progress)
+    from src.risk import run_monte_carlo
+    return run_monte_carlo(spec, cfg, progress=_progress)
+
+
+def sobol_job(ctx: JobContext, sens, n: int, seed: Optional[int] = 0) -> pd.DataFrame:
+    from src.sensitivity import sobol
+    return sobol(sens, n=n, seed=seed, progress=lambda done, total: ctx.update(done/total, f"{done:,} / {total:,} evaluaciones"))
+
+
+def pdf_job(ctx: JobContext, inputs, breakdown: pd.DataFrame, totals: Dict[str, Any], sources: pd.DataFrame,
+            bench_row, file_name: str, variance: Optional[Dict[str, Any]] = None) -> bytes:
+    from src.pdf_report import export_pdf
+    ctx.update(0.05, "maquetando PDF")
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td) / file_name
+        export_pdf(path, inputs, breakdown, totals, sources, bench_row, variance)
+        return path.read_bytes()
+
+
+def batch_job(ctx: JobContext, data: bytes, suffix: str, n_projects: int, use_items: bool = True) -> Dict[str, Any]:
+    """Cartera subida (CSV/JSONL) → totales CSV; progreso por bloques de `src.batch.run`."""
+    from src.batch import run
+    with tempfile.TemporaryDirectory() as td:
+        src_path, out_path = Path(td) / f"cartera{suffix}", Path(td) / "totales.csv"
+        src_path.write_bytes(data)
+        stats = run(src_path, out_path, chunksize=5_000, use_items=use_items, log=None,
+                    progress=lambda n_in, n_out: ctx.update(n_in/max(n_projects, 1), f"{n_in:,} / {n_projects:,} proyectos"))
+        return {"stats": stats, "csv": out_path.read_bytes()}
@@ -0,0 +1,369 @@
+"""
+Factor de localización por municipio (código INE) con respaldo jerárquico municipio → provincia → comunidad
+autónoma → nacional.
+
+- `data/municipalities.csv`: ine_code, name (forma INE, p.ej. "Coruña, A"), province_code, aliases (";"),
+  factor (opcional). Se puede ampliar a los ~8.100 municipios con `python -m src.locations import-ine`.
+- `data/provinces.csv`: provincia → comunidad autónoma, con factores opcionales de provincia/comunidad.
+- `data/cities.csv` sigue siendo la lista rápida de la app: sus factores se asignan al municipio del mismo
+  nombre. Sin factor propio, la provincia toma la media de sus municipios con factor y la comunidad la de
+  sus provincias; si no hay ninguno, 1.0.
+
+Los nombres se comparan normalizados (minúsculas, sin tildes ni signos, artículo INE delante, cada variante
+"A/B"). `resolve()` resuelve una columna entera (solo se buscan los valores distintos) y `search()` busca por
+prefijo de palabra con bisección sobre un índice ordenado de palabras, sin recorrer la tabla.
+
+    python -m src.locations lookup Getafe "san sebastian" 08019 Girona
+    python -m src.locations import-ine 26codmun.csv        # CSV del INE (CPRO, CMUN, NOMBRE)
+"""
+from __future__ import annotations
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Any, Tuple, Optional, List
+import argparse
+import os
+import re
+import sys
+import threading
+import unicodedata
+import numpy as np
+import pandas as pd
+
+from src.instrument import timed, count
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+MUNICIPALITIES_FILE = "municipalities.csv"
+PROVINCES_FILE = "provinces.csv"
+LEVELS = ("municipio","provincia","region","nacional")
+LEVEL_LABELS = {"municipio":"municipio","provincia":"provincia","region":"comunidad autónoma","nacional":"nacional"}
+NATIONAL_FACTOR = 1.0
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_name(name: Any) -> str:
+    """'Coruña, A' → 'a coruna'; 'L'Hospitalet' → 'l hospitalet' (minúsculas, sin tildes ni signos)."""
+    s = unicodedata.normalize("NFKD", str(name).strip().lower())
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", s).strip()
+
+
+def name_variants(name: str, aliases: Any = None) -> List[str]:
+    """Claves normalizadas de un nombre INE: completo, 'Artículo Nombre', cada parte de 'A/B' y alias."""
+    raw = [str(name)]
+    if aliases is not None and not (isinstance(aliases, float) and np.isnan(aliases)):
+        raw += [a for a in str(aliases).split(";") if a.strip()]
+    out: List[str] = []
+    for r in raw:
+        for part in [r] + (r.split("/") if "/" in r else []):
+            if "," in part:
+                head, _, tail = part.partition(",")
+                out += [f"{tail.strip()} {head.strip()}", head]
+            out.append(part)
+    keys = []
+    for v in out:
+        k = normalize_name(v)
+        if k and k not in keys:
+            keys.append(k)
+    return keys
+
+
+def display_name(name: str) -> str:
+    """'Palmas de Gran Canaria, Las' → 'Las Palmas de Gran Canaria'."""
+    head, sep, tail = str(name).partition(",")
+    return f"{tail.strip()} {head.strip()}".replace("' ", "'") if sep else str(name)
+
+
+def _code(v, width: int) -> Optional[int]:
+    s = str(v).strip()
+    if s.endswith(".0"):
+        s = s[:-2]
+    return int(s) if s.isdigit() and len(s) <= width else None
+
+
+class LocationIndex:
+    """Municipios, provincias y comunidades como arrays + tablas hash de nombre normalizado."""
+
+    def __init__(self, municipalities: pd.DataFrame, provinces: pd.DataFrame,
+                 city_factors: Dict[str, float] | None = None, national_factor: float = NATIONAL_FACTOR):
+        self.national_factor = float(national_factor)
+        prov = provinces.assign(_p=[_code(c, 2) for c in provinces["province_code"]],
+                                _r=[_code(c, 2) for c in provinces["region_code"]])
+        self.prov_name = {int(p): str(n) for p, n in zip(prov["_p"], prov["province"])}
+        self.prov_region = {int(p): int(r) for p, r in zip(prov["_p"], prov["_r"])}
+        self.region_name = {int(r): str(n) for r, n in zip(prov["_r"], prov["region"])}
+
+        muni = municipalities.reset_index(drop=True)
+        n = len(muni)
+        self.code = np.array([_code(c, 5) for c in muni["ine_code"]], dtype=np.int64)
+        self.name = muni["name"].astype(str).to_numpy(dtype=object)
+        self.province = np.array([_code(c, 2) if pd.notna(c) else int(code)//1000
+                                  for c, code in zip(muni.get("province_code", [None]*n), self.code)], dtype=np.int64)
+        aliases = muni["aliases"] if "aliases" in muni.columns else pd.Series([None]*n)
+        explicit = pd.to_numeric(muni["factor"], errors="coerce").to_numpy(dtype=float) if "factor" in muni.columns \
+            else np.full(n, np.nan)
+
+        variants = [name_variants(nm, al) for nm, al in zip(self.name, aliases)]
+        self.muni_keys: Dict[str, List[int]] = {}
+        for i in range(n):
+            for k in variants[i]:
+                self.muni_keys.setdefault(k, []).append(i)
+        self.code_row = {int(c): i for i, c in enumerate(self.code)}
+        self.unmatched_cities: List[str] = []
+        for city, f in (city_factors or {}).items():  # quick list of the app: factor of the same-name municipality
+            rows = self.muni_keys.get(normalize_name(city), [])
+            if len(rows) == 1 and np.isnan(explicit[rows[0]]):
+                explicit[rows[0]] = float(f)
+            elif not rows:
+                self.unmatched_cities.append(city)
+
+        # province/region factors: explicit, else mean of the level below; effective factor walks up the tree
+        pf = pd.to_numeric(prov["province_factor"], errors="coerce") if "province_factor" in prov else pd.Series(np.nan, prov.index)
+        rf = pd.to_numeric(prov["region_factor"], errors="coerce") if "region_factor" in prov else pd.Series(np.nan, prov.index)
+        known = ~np.isnan(explicit)
+        by_prov = pd.Series(explicit[known]).groupby(self.province[known]).mean().to_dict()
+        self.prov_factor = {p: (float(f) if pd.notna(f) else by_prov.get(p, np.nan)) for p, f in zip(prov["_p"], pf)}
+        by_region = pd.Series(self.prov_factor).dropna().groupby(lambda p: self.prov_region[p]).mean().to_dict()
+        reg_explicit = {int(r): float(f) for r, f in zip(prov["_r"], rf) if pd.notna(f)}
+        self.region_factor = {r: reg_explicit.get(r, by_region.get(r, np.nan)) for r in self.region_name}
+
+        self.explicit = explicit
+        self.factor = np.empty(n)
+        self.level = np.empty(n, dtype=object)
+        for i in range(n):
+            self.factor[i], self.level[i] = self._province_chain(int(self.province[i])) if np.isnan(explicit[i]) \
+                else (float(explicit[i]), "municipio")
+
+        self.prov_keys: Dict[str, int] = {}
+        for p, nm in self.prov_name.items():
+            for k in name_variants(nm):
+                self.prov_keys.setdefault(k, p)
+        self.region_keys: Dict[str, int] = {}
+        for r, nm in self.region_name.items():
+            for k in name_variants(nm):
+                self.region_keys.setdefault(k, r)
+
+        # word index for search: sorted tokens → entry ids (municipalities 0..n-1, then provinces, then regions)
+        self._entries: List[Tuple[str, int]] = [("m", i) for i in range(n)] + \
+            [("p", p) for p in self.prov_name] + [("r", r) for r in self.region_name]
+        self._entry_keys: List[List[str]] = variants + \
+            [name_variants(nm) for nm in self.prov_name.values()] + [name_variants(nm) for nm in self.region_name.values()]
+        pairs = sorted({(tok, e) for e, keys in enumerate(self._entry_keys) for k in keys for tok in k.split()})
+        self._tokens = [t for t, _ in pairs]
+        self._token_entry = np.array([e for _, e in pairs], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+    def _province_chain(self, p: int) -> Tuple[float, str]:
+        f = self.prov_factor.get(p, np.nan)
+        if not np.isnan(f):
+            return float(f), "provincia"
+        return self._region_chain(self.prov_region.get(p))
+
+    def _region_chain(self, r: Optional[int]) -> Tuple[float, str]:
+        f = self.region_factor.get(r, np.nan) if r is not None else np.nan
+        if not np.isnan(f):
+            return float(f), "region"
+        return self.national_factor, "nacional"
+
+    # --- single value ---------------------------------------------------------------------------
+    def _province_of(self, hint: Any) -> Optional[int]:
+        if hint is None or (isinstance(hint, float) and np.isnan(hint)) or str(hint).strip() == "":
+            return None
+        p = _code(hint, 2)
+        return p if p in self.prov_name else self.prov_keys.get(normalize_name(hint))
+
+    def lookup(self, value: Any, province: Any = None) -> Tuple[float, str, str, Optional[int], str]:
+        """(factor, nivel del factor, tipo de coincidencia, código, nombre) de un municipio/provincia/comunidad."""
+        p_hint = self._province_of(province)
+        if value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == "":
+            rows = []
+        else:
+            code = _code(value, 5)
+            if code is not None and code in self.code_row and len(str(value).strip().removesuffix(".0")) >= 4:
+                rows = [self.code_row[code]]
+            else:
+                rows = self.muni_keys.get(normalize_name(value), [])
+            if p_hint is not None:
+                rows = [i for i in rows if self.province[i] == p_hint]
+        if len(rows) == 1:
+            i = rows[0]
+            return float(self.factor[i]), self.level[i], "municipio", int(self.code[i]), display_name(self.name[i])
+        if len(rows) > 1:  # same name in several provinces: common ancestor
+            provs = {int(self.province[i]) for i in rows}
+            if len(provs) == 1:
+                p = provs.pop()
+                return (*self._province_chain(p), "ambiguo", p, self.prov_name.get(p, ""))
+            regions = {self.prov_region.get(p) for p in provs}
+            r = regions.pop() if len(regions) == 1 else None
+            return (*self._region_chain(r), "ambiguo", r, self.region_name.get(r, "España"))
+        key = normalize_name(value) if value is not None else ""
+        p = self.prov_keys.get(key) if key else None
+        if p is None and key and _code(value, 2) is not None and len(str(value).strip()) <= 2:
+            p = _code(value, 2) if _code(value, 2) in self.prov_name else None
+        if p is not None:
+            return (*self._province_chain(p), "provincia", p, display_name(self.prov_name[p]))
+        r = self.region_keys.get(key) if key else None
+        if r is not None:
+            return (*self._region_chain(r), "region", r, display_name(self.region_name[r]))
+        if p_hint is not None:
+            return (*self._province_chain(p_hint), "provincia", p_hint, display_name(self.prov_name[p_hint]))
+        return self.national_factor, "nacional", "ninguno", None, ""
+
+    # --- batch ----------------------------------------------------------------------------------
+    @timed("locations.resolve")
+    def resolve(self, values, province=None) -> pd.DataFrame:
+        """
+        Factor de toda una columna de municipios / códigos INE / provincias (y provincia opcional para
+        desambiguar). Se busca cada par distinto una sola vez. Devuelve factor, level, match, code, name.
+        """
+        vals = pd.Series(values, dtype=object).reset_index(drop=True)
+        provs = pd.Series(province, dtype=object).reset_index(drop=True) if province is not None else None
+        keys = vals if provs is None else pd.Series(list(zip(vals, provs)), dtype=object)
+        inv, _ = pd.factorize(keys, use_na_sentinel=False)
+        first = np.full(inv.max() + 1 if len(inv) else 0, -1)
+        first[inv[::-1]] = np.arange(len(inv))[::-1]  # first row of each distinct pair
+        found = [self.lookup(vals.iat[i], None if provs is None else provs.iat[i]) for i in first]
+        count("locations_resolved", len(vals))
+        count("locations_unique", len(found))
+        factor, level, match, code, name = (np.array(c, dtype=object) for c in zip(*found)) if found \
+            else (np.empty(0, dtype=object),)*5
+        code = np.array([-1 if c is None else c for c in code], dtype=np.int64)[inv]
+        return pd.DataFrame({"factor": factor.astype(float)[inv], "level": level[inv], "match": match[inv],
+                             "code": pd.arrays.IntegerArray(code, code < 0), "name": name[inv]})
+
+    # --- search ---------------------------------------------------------------------------------
+    def search(self, query: str, limit: int = 20) -> pd.DataFrame:
+        """
+        Municipios, provincias y comunidades cuyas palabras empiezan por las de `query` (acentos y
+        mayúsculas indiferentes). Bisección en el índice de palabras: coste ∝ coincidencias, no tabla.
+        """
+        cols = ["kind","code","name","province","factor","level","label"]
+        q = normalize_name(query).split()
+        if not q:
+            return pd.DataFrame(columns=cols)
+        last = q[-1]
+        lo = bisect_left(self._tokens, last)
+        hi = bisect_left(self._tokens, last + "\x7f")
+        cands = np.unique(self._token_entry[lo:hi])
+        qkey = " ".join(q)
+        scored = []
+        for e in cands:
+            keys = self._entry_keys[e]
+            toks = {t for k in keys for t in k.split()}
+            if not all(any(t.startswith(w) for t in toks) for w in q[:-1]):
+                continue
+            rank = 0 if qkey in keys else 1 if any(k.startswith(qkey) for k in keys) else 2
+            kind, ident = self._entries[e]
+            known = kind == "m" and not np.isnan(self.explicit[ident])
+            scored.append((rank, {"m": 1, "p": 0, "r": 2}[kind] if rank == 0 else 1, not known, self._label(e), e))
+        scored.sort()
+        rows = []
+        for *_, e in scored[:limit]:
+            kind, ident = self._entries[e]
+            if kind == "m":
+                p = int(self.province[ident])
+                rows.append(("municipio", int(self.code[ident]), display_name(self.name[ident]),
+                             self.prov_name.get(p, ""), float(self.factor[ident]), self.level[ident]))
+            elif kind == "p":
+                f, lvl = self._province_chain(ident)
+                rows.append(("provincia", ident, display_name(self.prov_name[ident]), display_name(self.prov_name[ident]), f, lvl))
+            else:
+                f, lvl = self._region_chain(ident)
+                rows.append(("region", ident, display_name(self.region_name[ident]), "", f, lvl))
+        out = pd.DataFrame(rows, columns=cols[:-1])
+        out["label"] = [self._row_label(r) for r in out.itertuples()]
+        return out
+
+    def _label(self, e: int) -> str:
+        kind, ident = self._entries[e]
+        return display_name(self.name[ident] if kind == "m" else self.prov_name[ident] if kind == "p"
+                            else self.region_name[ident])
+
+    @staticmethod
+    def _row_label(r) -> str:
+        where = f" ({display_name(r.province)})" if r.kind == "municipio" and r.province else \
+            " (provincia)" if r.kind == "provincia" else " (comunidad)" if r.kind == "region" else ""
+        return f"{r.name}{where}"
+
+
+_lock = threading.Lock()
+_indexes: Dict[Tuple, LocationIndex] = {}
+
+
+def _read(path: Path) -> pd.DataFrame:
+    return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[""])
+
+
+def load_index(data_dir: str | Path = DATA_DIR, city_factors: Dict[str, float] | None = None) -> LocationIndex:
+    """Índice de `data_dir` (+ factores de cities.csv), en caché del proceso por mtime/tamaño de los CSV."""
+    data_dir = Path(data_dir).resolve()
+    sig = []
+    for fn in (MUNICIPALITIES_FILE, PROVINCES_FILE):
+        st = os.stat(data_dir / fn)
+        sig.append((fn, st.st_mtime_ns, st.st_size))
+    key = (str(data_dir), tuple(sig), tuple(sorted((city_factors or {}).items())))
+    idx = _indexes.get(key)
+    if idx is None:
+        with _lock:
+            idx = _indexes.get(key)
+            if idx is None:
+                idx = LocationIndex(_read(data_dir / MUNICIPALITIES_FILE), _read(data_dir / PROVINCES_FILE), city_factors)
+                _indexes.clear()  # one live index per process is enough
+                _indexes[key] = idx
+                count("location_index_built")
+    return idx
+
+
+def index_for(model, data_dir: str | Path = DATA_DIR) -> LocationIndex:
+    """Índice con los factores de cities.csv del CostModel."""
+    return load_index(data_dir, model.city_factors)
+
+
+def import_ine(src: str | Path, dest: str | Path = DATA_DIR / MUNICIPALITIES_FILE) -> Dict[str, int]:
+    """
+    Fusiona la relación de municipios del INE (CPRO, CMUN, NOMBRE; o ine_code, name) con `dest`,
+    conservando alias y factores ya existentes. Devuelve cuántos había, cuántos se añaden y el total.
+    """
+    raw = pd.read_csv(src, dtype=str, sep=None, engine="python", keep_default_na=False)
+    cols = {c.strip().lower(): c for c in raw.columns}
+    if "cpro" in cols and "cmun" in cols:
+        code = raw[cols["cpro"]].str.strip().str.zfill(2) + raw[cols["cmun"]].str.strip().str.zfill(3)
+        name = raw[cols.get("nombre", cols.get("name"))].str.strip()
+    elif "ine_code" in cols:
+        code, name = raw[cols["ine_code"]].str.strip().str.zfill(5), raw[cols["name"]].str.strip()
+    else:
+        raise ValueError("se esperan columnas CPRO, CMUN, NOMBRE o ine_code, name")
+    new = pd.DataFrame({"ine_code": code, "name": name, "province_code": code.str[:2]})
+    old = _read(dest) if Path(dest).exists() else pd.DataFrame(columns=["ine_code","name","province_code","aliases","factor"])
+    add = new[~new["ine_code"].isin(old["ine_code"])].assign(aliases=None, factor=None)
+    out = pd.concat([old, add], ignore_index=True)[["ine_code","name","province_code","aliases","factor"]]
+    out.sort_values("ine_code").to_csv(dest, index=False)
+    return {"before": len(old), "added": len(add), "total": len(out)}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.locations", description="Índice de factores de localización.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    lk = sub.add_parser("lookup", help="resolver municipios, códigos INE o provincias")
+    lk.add_argument("values", nargs="+")
+    lk.add_argument("--province", help="provincia para desambiguar")
+    im = sub.add_parser("import-ine", help="añadir la relación de municipios del INE a data/municipalities.csv")
+    im.add_argument("file")
+    im.add_argument("-o", "--output", default=str(DATA_DIR / MUNICIPALITIES_FILE))
+    ap.add_argument("--data-dir", default=str(DATA_DIR))
+    args = ap.parse_args(argv)
+    if args.cmd == "import-ine":
+        print(import_ine(args.file, args.output), file=sys.stderr)
+        return 0
+    from src.model import load_model
+    idx = load_index(args.data_dir, load_model(args.data_dir).city_factors)
+    res = idx.resolve(args.values, [args.province]*len(args.values) if args.province else None)
+    res.insert(0, "input", args.values)
+    print(res.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
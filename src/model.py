@@ -0,0 +1,234 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Any, Tuple, Optional
+from pathlib import Path
+import hashlib
+import os
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+
+from src.io import load_yaml, load_csv
+from src.calculations import SCENARIOS, _is_mep, _is_arch_finish
+from src.instrument import count, span
+
+DATA_FILES = {
+    "cost_data": "cost_ranges.yaml",
+    "sources": "sources_matrix.csv",
+    "benchmarks": "benchmarks.csv",
+    "cities": "cities.csv",
+    "soft_items": "soft_cost_items.csv",
+    "cont_items": "contingency_items.csv",
+    "indices": "cost_indices.csv",
+}
+CACHE_VERSION = 2
+
+
+@dataclass(frozen=True)
+class CompiledModule:
+    """Un módulo de cost_ranges.yaml en forma de arrays densos (capítulos × escenarios low/mid/high)."""
+    key: str
+    label: str
+    keys: Tuple[str, ...]
+    labels: Tuple[str, ...]
+    basis: Tuple[str, ...]
+    above: np.ndarray      # (chapters, scenarios); 'single' rates live here
+    below: np.ndarray      # (chapters, scenarios); 0 for 'single' chapters
+    single: np.ndarray     # bool (chapters,)
+    mep: np.ndarray        # bool (chapters,)
+    finish: np.ndarray     # bool (chapters,)
+    optional: np.ndarray   # bool (chapters,)
+    use_profiles: Dict[str, Tuple[float, float, float]]  # use -> (arch, mep, overall)
+    multipliers: Dict[str, Dict[str, float]]              # intervention/level/use tables
+    indirects_pct: np.ndarray  # (scenarios,)
+    gg_bi_pct: float
+    soft_pct: np.ndarray       # (scenarios,)
+    cont_pct: np.ndarray       # (scenarios,)
+
+    @property
+    def area_split(self) -> bool:
+        """True si el módulo mide sobre/bajo rasante (área de calibración = total construido)."""
+        return not bool(self.single[0])
+
+    def chapter_index(self, key: str) -> int:
+        return self.keys.index(key)
+
+
+def compile_module(module_key: str, module_def: Dict[str, Any]) -> CompiledModule:
+    chapters = module_def["chapters"]
+    n = len(chapters)
+    above = np.zeros((n, len(SCENARIOS)))
+    below = np.zeros((n, len(SCENARIOS)))
+    single = np.zeros(n, dtype=bool)
+    for i, ch in enumerate(chapters):
+        if "above" in ch:
+            above[i] = [ch["above"][sc] for sc in SCENARIOS]
+            below[i] = [ch["below"][sc] for sc in SCENARIOS]
+        else:
+            above[i] = [ch["single"][sc] for sc in SCENARIOS]
+            single[i] = True
+    keys = tuple(ch["key"] for ch in chapters)
+    basis = tuple(ch.get("basis","base") for ch in chapters)
+    defaults = module_def["defaults"]
+    multipliers = {k: {lv: float(v) for lv, v in t.items()}
+                   for k, t in defaults.items() if k.endswith("_multiplier")}
+    if "use_multipliers" in module_def:
+        multipliers["use_multipliers"] = {k: float(v) for k, v in module_def["use_multipliers"].items()}
+    cm = CompiledModule(
+        key=module_key, label=module_def.get("label", module_key),
+        keys=keys, labels=tuple(ch["label"] for ch in chapters), basis=basis,
+        above=above, below=below, single=single,
+        mep=np.array([_is_mep(k) for k in keys], dtype=bool),
+        finish=np.array([_is_arch_finish(k) for k in keys], dtype=bool),
+        optional=np.array([b == "optional" for b in basis], dtype=bool),
+        use_profiles={k: (float(up.get("arch",1.0)), float(up.get("mep",1.0)), float(up.get("overall",1.0)))
+                      for k, up in module_def.get("use_profiles",{}).items() if up},
+        multipliers=multipliers,
+        indirects_pct=np.array([float(defaults["indirects_pct"][sc]) for sc in SCENARIOS]),
+        gg_bi_pct=float(defaults["gg_bi_pct"]),
+        soft_pct=np.array([float(defaults["soft_costs_pct"][sc]) for sc in SCENARIOS]),
+        cont_pct=np.array([float(defaults["contingency_pct"][sc]) for sc in SCENARIOS]),
+    )
+    for arr in (cm.above, cm.below, cm.single, cm.mep, cm.finish, cm.optional,
+                cm.indirects_pct, cm.soft_pct, cm.cont_pct):
+        arr.setflags(write=False)  # shared across sessions
+    return cm
+
+
+def compile_cost_data(cost_data: Dict[str, Any]) -> Dict[str, CompiledModule]:
+    return {k: compile_module(k, m) for k, m in cost_data["modules"].items()}
+
+
+@dataclass(frozen=True)
+class CostModel:
+    """Datos cargados una vez (YAML + CSVs) y compilados; compartido entre sesiones y páginas."""
+    fingerprint: str
+    cost_data: Dict[str, Any]
+    modules: Dict[str, CompiledModule]
+    sources: pd.DataFrame
+    benchmarks: pd.DataFrame
+    cities: pd.DataFrame
+    soft_items: pd.DataFrame
+    cont_items: pd.DataFrame
+    indices: pd.DataFrame      # long format: fecha, serie, valor (MITMA/INE, local)
+    city_factors: Dict[str, float]
+    benchmark_rows: Dict[str, Dict[str, Any]]
+
+    def module(self, key: str) -> CompiledModule:
+        return self.modules[key]
+
+
+def compiled_modules(cost_data: Dict[str, Any] | CostModel) -> Dict[str, CompiledModule]:
+    """Acepta el dict crudo del YAML o un CostModel ya compilado."""
+    if isinstance(cost_data, CostModel):
+        return cost_data.modules
+    return compile_cost_data(cost_data)
+
+
+def build_model(data_dir: str | Path, fingerprint: str = "") -> CostModel:
+    data_dir = Path(data_dir)
+    cost_data = load_yaml(data_dir / DATA_FILES["cost_data"])
+    frames = {name: load_csv(data_dir / fn) for name, fn in DATA_FILES.items() if name != "cost_data"}
+    cities = frames["cities"]
+    bench = frames["benchmarks"]
+    return CostModel(
+        fingerprint=fingerprint or content_fingerprint(data_dir),
+        cost_data=cost_data,
+        modules=compile_cost_data(cost_data),
+        city_factors=dict(zip(cities["city"].astype(str), cities["location_factor"].astype(float))),
+        benchmark_rows={str(r["key"]): r for r in bench.to_dict("records")},
+        **frames,
+    )
+
+
+def _stat_signature(data_dir: Path) -> Tuple:
+    sig = []
+    for fn in DATA_FILES.values():
+        st = os.stat(data_dir / fn)
+        sig.append((fn, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def content_fingerprint(data_dir: str | Path) -> str:
+    h = hashlib.sha256()
+    for fn in DATA_FILES.values():
+        h.update(fn.encode())
+        h.update((Path(data_dir) / fn).read_bytes())
+    return h.hexdigest()
+
+
+def _read_cache_file(cache_file: Path, fingerprint: str) -> Optional[CostModel]:
+    try:
+        with open(cache_file, "rb") as f:
+            version, fp, model = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+        return None
+    if version != CACHE_VERSION or fp != fingerprint:
+        return None
+    return model
+
+
+def _write_cache_file(cache_file: Path, model: CostModel) -> None:
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_suffix(cache_file.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump((CACHE_VERSION, model.fingerprint, model), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass  # cache is best-effort (read-only deployments)
+
+
+_lock = threading.Lock()
+_models: Dict[str, Tuple[Tuple, CostModel]] = {}
+
+
+def load_model(data_dir: str | Path, cache_file: str | Path | None = None) -> CostModel:
+    """
+    Devuelve el CostModel de `data_dir`, compartido por todo el proceso.
+    Se invalida si cambia mtime/tamaño de algún fichero y el hash de contenido es distinto.
+    `cache_file` (opcional): pickle del modelo compilado para arranques en frío sin parsear YAML.
+    """
+    data_dir = Path(data_dir).resolve()
+    key = str(data_dir)
+    sig = _stat_signature(data_dir)
+    cached = _models.get(key)
+    if cached and cached[0] == sig:
+        count("model_cache_hits")
+        return cached[1]
+    count("model_cache_misses")
+    with _lock:
+        cached = _models.get(key)
+        if cached and cached[0] == sig:
+            return cached[1]
+        fp = content_fingerprint(data_dir)
+        model = None
+        if cached and cached[1].fingerprint == fp:
+            model = cached[1]  # touched but unchanged
+        if model is None and cache_file is not None:
+            model = _read_cache_file(Path(cache_file), fp)
+        if model is None:
+            with span("model.build"):
+                model = build_model(data_dir, fp)
+            if cache_file is not None:
+                _write_cache_file(Path(cache_file), model)
+        _models[key] = (sig, model)
+        return model
+
+
+def peek_model(data_dir: str | Path) -> Optional[CostModel]:
+    """El CostModel de `data_dir` si ya está cargado y al día (sin construirlo ni leer ficheros)."""
+    data_dir = Path(data_dir).resolve()
+    cached = _models.get(str(data_dir))
+    try:
+        if cached and cached[0] == _stat_signature(data_dir):
+            return cached[1]
+    except OSError:
+        pass
+    return None
+
+
+def clear_model_cache() -> None:
+    with _lock:
+        _models.clear()
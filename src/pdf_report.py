@@ -1,13 +1,15 @@
-
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Dict
+from typing import Any, Dict, List, Sequence, Tuple
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import cm
 
+from src.instrument import timed, count
+
 @dataclass
 class ReportInputs:
     title: str
@@ -21,19 +23,84 @@ class ReportInputs:
     options: Dict[str, str]
     notes: str
 
-def export_pdf(filepath: str | Path, inputs: ReportInputs, df_breakdown: pd.DataFrame, totals: Dict[str,float],
-               sources_df: pd.DataFrame, bench_row: dict | None) -> None:
-    c = canvas.Canvas(str(filepath), pagesize=A4)
-    width, height = A4
-    x0 = 2*cm
-    y = height - 2*cm
+class PageWriter:
+    """Cursor sobre un canvas A4: solo cambia de fuente cuando hace falta y salta de página al llegar al pie."""
+
+    def __init__(self, c: canvas.Canvas):
+        self.c = c
+        self.width, self.height = A4
+        self.x0 = 2*cm
+        self.y = self.height - 2*cm
+        self._font: Tuple[str, float] | None = None
+
+    def font(self, name: str, size: float) -> None:
+        if self._font != (name, size):
+            self.c.setFont(name, size)
+            self._font = (name, size)
+
+    def new_page(self) -> None:
+        self.c.showPage()
+        self.y = self.height - 2*cm
+        self._font = None  # reportlab resets the font on every page
+
+    def draw(self, txt: str, dy: float = 14, font=("Helvetica",10)) -> None:
+        if self.y < 2*cm:
+            self.new_page()
+        self.font(*font)
+        self.c.drawString(self.x0, self.y, txt)
+        self.y -= dy
 
-    def draw(txt, dy=14, font=("Helvetica",10)):
-        nonlocal y
-        c.setFont(font[0], font[1])
-        c.drawString(x0, y, txt)
-        y -= dy
+    def rows(self, left: Sequence[str], right: Sequence[str] | None, dy: float, font=("Helvetica",9),
+             right_x: float = 16*cm) -> None:
+        """Filas texto | importe a partir de listas ya formateadas (sin iterrows ni setFont por línea)."""
+        c, x0 = self.c, self.x0
+        self.font(*font)
+        for i, txt in enumerate(left):
+            c.drawString(x0, self.y, txt)
+            if right is not None:
+                c.drawRightString(x0 + right_x, self.y, right[i])
+            self.y -= dy
+            if self.y < 2.5*cm:
+                self.new_page()
+                self.font(*font)
 
+def chapter_lines(df_breakdown: pd.DataFrame) -> Tuple[List[str], List[str]]:
+    """Etiquetas e importes formateados del desglose, desde arrays de columna."""
+    n = len(df_breakdown)
+    labels = df_breakdown["capitulo"].astype(str).to_numpy() if "capitulo" in df_breakdown.columns else [""]*n
+    values = pd.to_numeric(df_breakdown["cost_direct"], errors="coerce").fillna(0.0).to_numpy(dtype=float) \
+        if "cost_direct" in df_breakdown.columns else np.zeros(n)
+    return format_chapters(labels, values)
+
+def format_chapters(labels: Sequence[str], values: np.ndarray) -> Tuple[List[str], List[str]]:
+    return [str(s)[:78] for s in labels], [f"{v:,.0f} €" for v in np.asarray(values, dtype=float)]
+
+def source_lines(sources_df: pd.DataFrame, n: int = 12) -> List[str]:
+    head = sources_df.head(n)
+    out = []
+    for f, t, d, e in zip(*(head[col].to_numpy() for col in ("fuente","tipo","fecha_consulta","enlace"))):
+        txt = f"- {f} | {t} | {d} | {e}"
+        out.append(txt[:132] + "..." if len(txt) > 135 else txt)
+    return out
+
+def draw_variance(w: PageWriter, variance: Dict[str, Any]) -> None:
+    """Sección de variaciones (`variance.report_section`): Δ total, causas y capítulos con más Δ."""
+    old, new = variance["old"], variance["new"]
+    w.draw("")
+    w.draw(f"Variación respecto a {variance['title']}", dy=16, font=("Helvetica-Bold",11))
+    pct = f" ({(new - old)/old:+.1%})" if old else ""
+    w.draw(f"Total: {old:,.0f} € -> {new:,.0f} € | Δ {new - old:+,.0f} €{pct}")
+    if variance["drivers"]:
+        w.rows([f"- {k}" for k, _ in variance["drivers"]], [f"{v:+,.0f} €" for _, v in variance["drivers"]], dy=11)
+    if variance["chapters"]:
+        w.draw("Capítulos con mayor Δ (directo)", dy=12, font=("Helvetica-Oblique",9))
+        w.rows([str(k)[:78] for k, _ in variance["chapters"]], [f"{v:+,.0f} €" for _, v in variance["chapters"]], dy=11)
+
+def draw_report(w: PageWriter, inputs: ReportInputs, chapters: Tuple[List[str], List[str]],
+                totals: Dict[str,float], sources: List[str], bench_row: dict | None,
+                variance: Dict[str, Any] | None = None) -> None:
+    """Dibuja un informe completo a partir de la posición actual del cursor."""
+    draw = w.draw
     draw(inputs.title, dy=18, font=("Helvetica-Bold",14))
     draw(f"Módulo: {inputs.module_label}")
     if inputs.building_use:
@@ -48,33 +115,21 @@ def export_pdf(filepath: str | Path, inputs: ReportInputs, df_breakdown: pd.Data
 
     draw("")
     draw("Factores", dy=16, font=("Helvetica-Bold",11))
-    for k,v in inputs.factors.items():
-        draw(f"- {k}: {v:.3f}", dy=12, font=("Helvetica",10))
+    w.rows([f"- {k}: {v:.3f}" for k, v in inputs.factors.items()], None, dy=12, font=("Helvetica",10))
 
     if inputs.options:
         draw("")
         draw("Opciones", dy=16, font=("Helvetica-Bold",11))
-        for k,v in inputs.options.items():
-            draw(f"- {k}: {v}", dy=12, font=("Helvetica",10))
+        w.rows([f"- {k}: {v}" for k, v in inputs.options.items()], None, dy=12, font=("Helvetica",10))
 
     draw("")
     draw("Desglose directo (capítulos)", dy=16, font=("Helvetica-Bold",11))
-    c.setFont("Helvetica", 9)
-    y -= 2
-    c.drawString(x0, y, "Capítulo")
-    c.drawRightString(x0 + 16*cm, y, "Coste")
-    y -= 12
-
-    for _, row in df_breakdown.iterrows():
-        cap = str(row.get("capitulo",""))[:78]
-        val = float(row.get("cost_direct",0.0))
-        c.drawString(x0, y, cap)
-        c.drawRightString(x0 + 16*cm, y, f"{val:,.0f} €")
-        y -= 11
-        if y < 2.5*cm:
-            c.showPage()
-            y = height - 2*cm
-            c.setFont("Helvetica", 9)
+    w.font("Helvetica", 9)
+    w.y -= 2
+    w.c.drawString(w.x0, w.y, "Capítulo")
+    w.c.drawRightString(w.x0 + 16*cm, w.y, "Coste")
+    w.y -= 12
+    w.rows(chapters[0], chapters[1], dy=11)
 
     draw("")
     draw("Resumen", dy=16, font=("Helvetica-Bold",11))
@@ -84,20 +139,19 @@ def export_pdf(filepath: str | Path, inputs: ReportInputs, df_breakdown: pd.Data
     draw(f"Soft costs: {totals['soft_costs']:,.0f} €")
     draw(f"Contingencia: {totals['contingency']:,.0f} €")
     draw(f"TOTAL: {totals['total']:,.0f} €", font=("Helvetica-Bold",10))
+    if variance:
+        draw_variance(w, variance)
     draw("")
     draw("Fuentes (resumen)", dy=16, font=("Helvetica-Bold",11))
-    c.setFont("Helvetica", 8)
-    for _, s in sources_df.head(12).iterrows():
-        txt = f"- {s['fuente']} | {s['tipo']} | {s['fecha_consulta']} | {s['enlace']}"
-        if len(txt) > 135:
-            txt = txt[:132] + "..."
-        c.drawString(x0, y, txt)
-        y -= 10
-        if y < 2.5*cm:
-            c.showPage()
-            y = height - 2*cm
-            c.setFont("Helvetica", 8)
+    w.rows(sources, None, dy=10, font=("Helvetica",8))
 
     draw("")
     draw("Aviso: estimación paramétrica orientativa. No sustituye un presupuesto por medición.", dy=12, font=("Helvetica-Oblique",8))
+
+@timed()
+def export_pdf(filepath: str | Path, inputs: ReportInputs, df_breakdown: pd.DataFrame, totals: Dict[str,float],
+               sources_df: pd.DataFrame, bench_row: dict | None, variance: Dict[str, Any] | None = None) -> None:
+    c = canvas.Canvas(str(filepath), pagesize=A4)
+    draw_report(PageWriter(c), inputs, chapter_lines(df_breakdown), totals, source_lines(sources_df), bench_row, variance)
+    count("pdf_pages", c.getPageNumber())
     c.save()
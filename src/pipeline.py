@@ -0,0 +1,177 @@
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import astuple
+from typing import Dict, Any, Tuple, Optional, Callable, Iterable, FrozenSet
+import numpy as np
+import pandas as pd
+
+from src.calculations import Factors, SCENARIOS
+from src.model import CostModel, CompiledModule
+from src.portfolio import module_multiplier, use_profile
+from src.instrument import count
+from src.result import EstimateResult
+
+STAGES = ["base","chapter_factors","use_profile","module","global_factors","calibration","chapter_filter","totals"]
+
+
+class _Memo:
+    """LRU pequeño por etapa con contadores de aciertos/fallos."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple, compute: Callable[[], Any]) -> Any:
+        if key in self.data:
+            self.hits += 1
+            count("pipeline_cache_hits")
+            self.data.move_to_end(key)
+            return self.data[key]
+        self.misses += 1
+        count("pipeline_cache_misses")
+        value = compute()
+        if self.maxsize <= 0:
+            return value
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+
+
+class EstimatePipeline:
+    """
+    estimate_module por etapas con salidas memorizadas por las entradas de cada etapa:
+    tarifas base → factores de capítulo → perfil de uso → multiplicador de módulo → factores globales
+    → calibración → filtro de capítulos → indirectos/soft/contingencia.
+    Cambiar p.ej. `plazo` solo recalcula desde la etapa de factores globales.
+    """
+
+    def __init__(self, model: CostModel, maxsize: int = 32):
+        self.model = model
+        self._memo = {s: _Memo(maxsize) for s in STAGES}
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {s: {"hits": m.hits, "misses": m.misses} for s, m in self._memo.items()}
+
+    def stats_frame(self) -> pd.DataFrame:
+        return pd.DataFrame([{"etapa": s, **v} for s, v in self.stats().items()])
+
+    def reset_stats(self) -> None:
+        for m in self._memo.values():
+            m.hits = m.misses = 0
+
+    # --- stages -----------------------------------------------------------------------------
+    def _base(self, cm: CompiledModule, sci: int, m2a: float, m2b: float) -> np.ndarray:
+        return cm.above[:, sci]*m2a + cm.below[:, sci]*m2b
+
+    def _chapter_factors(self, cm: CompiledModule, base: np.ndarray, imep: float, acab: float):
+        factor = np.where(cm.mep, imep, 1.0) * np.where(cm.finish, acab, 1.0)
+        return base*factor, factor
+
+    def _use_profile(self, cm: CompiledModule, module_key: str, cost: np.ndarray, building_use: Optional[str]):
+        up = use_profile(cm, module_key, building_use)
+        if not up:
+            return cost, (1.0, 1.0, 1.0)
+        arch_m, mep_m, overall_m = up
+        return cost*np.where(cm.mep, mep_m, arch_m)*overall_m, up
+
+    def _module(self, cm: CompiledModule, module_key: str, cost: np.ndarray, opts: Tuple):
+        options = dict(opts)
+        included = np.ones(len(cm.keys), dtype=bool)
+        if module_key == "fitout_oficinas" and not options.get("include_furniture", False):
+            included &= np.array([k != "mobiliario" for k in cm.keys], dtype=bool)
+        return np.where(included, cost, 0.0), included, module_multiplier(cm, module_key, options)
+
+    # --- public -----------------------------------------------------------------------------
+    def run_result(self, module_key: str, scenario: str, m2_above: float, m2_below: float,
+                   factors: Factors, options: Dict[str, Any] | None = None,
+                   benchmark_row: Dict[str, Any] | None = None,
+                   auto_calibrate_to_benchmark: bool = False,
+                   include_optional: bool = True,
+                   chapters: Iterable[str] | None = None) -> EstimateResult:
+        """Como `run`, pero devuelve un EstimateResult (arrays; el DataFrame se crea solo si se pide)."""
+        options = options or {}
+        cm = self.model.module(module_key)
+        sci = SCENARIOS.index(scenario)
+        m = self._memo
+
+        k_base = (module_key, sci, float(m2_above), float(m2_below))
+        base = m["base"].get(k_base, lambda: self._base(cm, sci, m2_above, m2_below))
+
+        k_chf = (k_base, factors.intensidad_mep, factors.acabados)
+        cost_chf, ch_factor = m["chapter_factors"].get(
+            k_chf, lambda: self._chapter_factors(cm, base, factors.intensidad_mep, factors.acabados))
+
+        k_use = (k_chf, options.get("building_use"))
+        cost_use, use_mults = m["use_profile"].get(
+            k_use, lambda: self._use_profile(cm, module_key, cost_chf, options.get("building_use")))
+
+        opts = tuple(sorted((k, options[k]) for k in ("include_furniture","intervention_level","reform_level","use")
+                            if k in options))
+        k_mod = (k_use, opts)
+        cost_mod, included, mult = m["module"].get(k_mod, lambda: self._module(cm, module_key, cost_use, opts))
+
+        combined = factors.combined() * mult
+        k_glob = (k_mod, astuple(factors))
+
+        def _global():
+            cost = cost_mod*combined
+            return cost, float(cost.sum())
+        cost_glob, direct_raw = m["global_factors"].get(k_glob, _global)
+
+        pem = None
+        if auto_calibrate_to_benchmark and benchmark_row and benchmark_row.get("pem_"+scenario) is not None:
+            pem = float(benchmark_row["pem_"+scenario])
+        k_cal = (k_glob, pem)
+
+        def _calibrate():
+            area = (m2_above + m2_below) if cm.area_split else m2_above
+            if pem is not None and area > 0 and direct_raw > 0:
+                calib = pem*float(area) / direct_raw
+                return cost_glob*calib, calib, True
+            return cost_glob, 1.0, False
+        cost_cal, calib, calibrated = m["calibration"].get(k_cal, _calibrate)
+
+        chap_set: Optional[FrozenSet[str]] = frozenset(chapters) if chapters is not None else None
+        k_filt = (k_cal, bool(include_optional), chap_set)
+
+        def _filter():
+            keep = included.copy()
+            if not include_optional:
+                keep &= ~cm.optional
+            if chap_set is not None:
+                keep &= np.array([k in chap_set for k in cm.keys], dtype=bool)
+            return keep, float(cost_cal[keep].sum())
+        keep, _ = m["chapter_filter"].get(k_filt, _filter)
+
+        soft_pct = float(options.get("soft_items_pct", cm.soft_pct[sci]))
+        cont_pct = float(options.get("cont_items_pct", cm.cont_pct[sci]))
+        res = EstimateResult(cm, sci, scenario, m2_above, m2_below, cost_cal, ch_factor, keep, combined,
+                             use_mults, mult, calib, calibrated, soft_pct, cont_pct)
+        res._totals = m["totals"].get((k_filt, soft_pct, cont_pct), res.totals)
+        return res
+
+    def run(self, module_key: str, scenario: str, m2_above: float, m2_below: float,
+            factors: Factors, options: Dict[str, Any] | None = None,
+            benchmark_row: Dict[str, Any] | None = None,
+            auto_calibrate_to_benchmark: bool = False,
+            include_optional: bool = True,
+            chapters: Iterable[str] | None = None) -> Tuple[pd.DataFrame, Dict[str, float]]:
+        """Mismo resultado que estimate_module (+ filtro de opcionales y de capítulos aplicables)."""
+        res = self.run_result(module_key, scenario, m2_above, m2_below, factors, options, benchmark_row,
+                              auto_calibrate_to_benchmark, include_optional, chapters)
+        return res.to_frame(), res.totals()
+
+
+def estimate_result(model: CostModel, module_key: str, scenario: str, m2_above: float, m2_below: float,
+                    factors: Factors, options: Dict[str, Any] | None = None,
+                    benchmark_row: Dict[str, Any] | None = None,
+                    auto_calibrate_to_benchmark: bool = False,
+                    include_optional: bool = True,
+                    chapters: Iterable[str] | None = None) -> EstimateResult:
+    """estimate_module sin DataFrame ni memoización: devuelve un EstimateResult."""
+    return EstimatePipeline(model, maxsize=0).run_result(module_key, scenario, m2_above, m2_below, factors, options,
+                                                         benchmark_row, auto_calibrate_to_benchmark,
+                                                         include_optional, chapters)
@@ -0,0 +1,260 @@
+from __future__ import annotations
+from dataclasses import dataclass, field, fields
+from typing import Dict, Any, Tuple, Optional, Sequence
+import numpy as np
+import pandas as pd
+
+from src.calculations import Factors, SCENARIOS
+from src.model import CostModel, CompiledModule, compiled_modules
+
+FACTOR_FIELDS = [f.name for f in fields(Factors)]
+BUILDING_MODULES = ("obra_nueva_edificio","reposicionamiento_edificio")
+
+# option column -> default level, per module (mirrors estimate_module)
+_LEVEL_OPTIONS = {
+    "reposicionamiento_edificio": ("intervention_level", "medio", "intervention_multiplier"),
+    "reforma_piso": ("reform_level", "integral", "level_multiplier"),
+    "reforma_local": ("intervention_level", "media", "intervention_multiplier"),
+}
+
+
+def option_table(module_key: str) -> Optional[Tuple[str, str, str]]:
+    """(opción, nivel por defecto, tabla de multiplicadores) del multiplicador de módulo, o None."""
+    if module_key in _LEVEL_OPTIONS:
+        return _LEVEL_OPTIONS[module_key]
+    if module_key == "fitout_local_por_uso":
+        return ("use", "otros", "use_multipliers")
+    return None
+
+
+def module_multiplier(cm: CompiledModule, module_key: str, options: Dict[str, Any]) -> float:
+    """Multiplicador de módulo de un proyecto (nivel de intervención/reforma, uso del local); 1.0 si no aplica."""
+    spec = option_table(module_key)
+    if spec is None:
+        return 1.0
+    col, default, table = spec
+    levels = cm.multipliers.get(table, {})
+    if table == "use_multipliers":   # unknown premises use: neutral
+        return float(levels.get(options.get(col, default), 1.0))
+    return float(levels[options.get(col, default)])
+
+
+def use_profile(cm: CompiledModule, module_key: str, building_use: Optional[str]) -> Optional[Tuple[float, float, float]]:
+    """(arq, MEP, global) del uso del edificio; None fuera de los módulos de edificio o sin perfil."""
+    if module_key not in BUILDING_MODULES or not building_use:
+        return None
+    return cm.use_profiles.get(building_use)
+
+
+TOTAL_COLUMNS = ["direct","indirects","gg_bi","soft_costs","soft_pct_used","soft_pct_default",
+                 "contingency","cont_pct_used","cont_pct_default","total",
+                 "calibration","use_arch","use_mep","use_overall","module_mult"]
+
+
+@dataclass
+class ModuleChapters:
+    """Costes por capítulo (directo) de todas las filas de un módulo."""
+    keys: Tuple[str, ...]
+    labels: Tuple[str, ...]
+    basis: Tuple[str, ...]
+    rows: np.ndarray       # positions into PortfolioEstimate.totals
+    cost: np.ndarray       # (len(rows), chapters), 0.0 where the chapter is excluded
+    included: np.ndarray   # bool (len(rows), chapters)
+
+
+@dataclass
+class PortfolioEstimate:
+    totals: pd.DataFrame
+    chapters: Dict[str, ModuleChapters] = field(default_factory=dict)
+
+    def chapter_frame(self) -> pd.DataFrame:
+        """Desglose largo (una fila por proyecto × capítulo incluido)."""
+        parts = []
+        for module_key, mc in self.chapters.items():
+            r, c = np.nonzero(mc.included)
+            rows = mc.rows[r]
+            parts.append(pd.DataFrame({
+                "project": self.totals["project"].to_numpy()[rows],
+                "module": module_key,
+                "scenario": self.totals["scenario"].to_numpy()[rows],
+                "chapter_key": np.asarray(mc.keys, dtype=object)[c],
+                "capitulo": np.asarray(mc.labels, dtype=object)[c],
+                "basis": np.asarray(mc.basis, dtype=object)[c],
+                "cost_direct": mc.cost[r, c],
+            }))
+        if not parts:
+            return pd.DataFrame(columns=["project","module","scenario","chapter_key","capitulo","basis","cost_direct"])
+        return pd.concat(parts, ignore_index=True)
+
+
+def _column(df: pd.DataFrame, name: str, default: float) -> np.ndarray:
+    if name not in df.columns:
+        return np.full(len(df), default, dtype=float)
+    return pd.to_numeric(df[name], errors="coerce").fillna(default).to_numpy(dtype=float)
+
+
+def _optional_column(df: pd.DataFrame, name: str) -> np.ndarray:
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=float)
+
+
+_TRUE_STRINGS = ("1","true","yes","si","sí","y")
+_FALSE_STRINGS = ("0","false","no","n")
+
+
+def _bool_column(df: pd.DataFrame, name: str) -> np.ndarray:
+    if name not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    s = df[name]
+    if s.dtype == bool:
+        return s.to_numpy()
+    s = s.astype(object).where(s.notna(), False)
+    return s.map(lambda v: str(v).strip().lower() in _TRUE_STRINGS).to_numpy(dtype=bool)
+
+
+def _level_column(df: pd.DataFrame, name: str, default: str) -> pd.Series:
+    if name not in df.columns:
+        return pd.Series([default]*len(df), index=df.index, dtype=object)
+    s = df[name].astype(object)
+    return s.where(s.notna() & (s != ""), default)
+
+
+def _lookup(levels: pd.Series, table: Dict[str, Any], what: str, fallback: Optional[float] = None) -> np.ndarray:
+    out = levels.map(lambda v: table.get(v, fallback)).to_numpy(dtype=object)
+    missing = pd.isna(out)
+    if missing.any():
+        raise KeyError(f"{what}: valor desconocido {levels[missing].iloc[0]!r}")
+    return out.astype(float)
+
+
+def markup_totals(arr: CompiledModule, sci: np.ndarray, direct: np.ndarray,
+                  soft_override: np.ndarray, cont_override: np.ndarray) -> Dict[str, np.ndarray]:
+    """Indirectos, GG+BI, soft costs, contingencia y total a partir del directo (NaN en override = defecto)."""
+    soft_default = arr.soft_pct[sci]
+    cont_default = arr.cont_pct[sci]
+    soft_pct = np.where(np.isnan(soft_override), soft_default, soft_override)
+    cont_pct = np.where(np.isnan(cont_override), cont_default, cont_override)
+    indirects = direct * arr.indirects_pct[sci]
+    gg_bi = direct * arr.gg_bi_pct
+    soft = direct * soft_pct
+    contingency = direct * cont_pct
+    return {"direct": direct, "indirects": indirects, "gg_bi": gg_bi, "soft_costs": soft,
+            "soft_pct_used": soft_pct, "soft_pct_default": soft_default,
+            "contingency": contingency, "cont_pct_used": cont_pct, "cont_pct_default": cont_default,
+            "total": direct + indirects + gg_bi + soft + contingency}
+
+
+def _expand_scenarios(projects: pd.DataFrame, scenarios: Sequence[str]) -> pd.DataFrame:
+    n = len(projects)
+    idx = np.repeat(np.arange(n), len(scenarios))
+    out = projects.iloc[idx].copy()
+    out["scenario"] = np.tile(np.asarray(scenarios, dtype=object), n)
+    return out
+
+
+def estimate_portfolio(cost_data: Dict[str, Any] | CostModel, projects: pd.DataFrame,
+                       scenarios: Sequence[str] | None = None,
+                       with_chapters: bool = False) -> PortfolioEstimate:
+    """
+    Versión vectorizada de estimate_module para una tabla de proyectos.
+
+    Columnas: module, scenario (si falta se evalúan todos los `scenarios`), m2_above, m2_below,
+    campos de Factors (por defecto 1.0), building_use, intervention_level, reform_level, use,
+    include_furniture, soft_items_pct / cont_items_pct (NaN = defecto del módulo),
+    auto_calibrate + pem_low/pem_mid/pem_high (benchmark; NaN = sin benchmark).
+    Devuelve una fila de totales por proyecto (× escenario) con las mismas claves que estimate_module.
+    """
+    if "scenario" not in projects.columns:
+        projects = _expand_scenarios(projects, list(scenarios or SCENARIOS))
+    n = len(projects)
+    project_ids = projects.index.to_numpy()
+    modules = projects["module"].astype(str).to_numpy()
+    scen = projects["scenario"].astype(str).to_numpy()
+    sc_idx = pd.Index(SCENARIOS).get_indexer(scen)
+    if (sc_idx < 0).any():
+        raise KeyError(f"escenario desconocido {scen[sc_idx < 0][0]!r}")
+
+    m2_above = _column(projects, "m2_above", 0.0)
+    m2_below = _column(projects, "m2_below", 0.0)
+    fac = {name: _column(projects, name, 1.0) for name in FACTOR_FIELDS}
+    soft_override = _optional_column(projects, "soft_items_pct")
+    cont_override = _optional_column(projects, "cont_items_pct")
+    auto_calib = _bool_column(projects, "auto_calibrate")
+    pem = np.column_stack([_optional_column(projects, "pem_"+sc) for sc in SCENARIOS])
+
+    # Factors.combined(), same multiplication order
+    combined_factors = fac[FACTOR_FIELDS[0]].copy()
+    for name in FACTOR_FIELDS[1:]:
+        combined_factors *= fac[name]
+
+    out = {c: np.empty(n) for c in TOTAL_COLUMNS}
+    chapters: Dict[str, ModuleChapters] = {}
+    compiled = compiled_modules(cost_data)
+
+    for module_key in pd.unique(modules):
+        arr = compiled[module_key]
+        rows = np.flatnonzero(modules == module_key)
+        sub = projects.iloc[rows]
+        sci = sc_idx[rows]
+        m2a = m2_above[rows][:, None]
+        m2b = m2_below[rows][:, None]
+
+        cost = arr.above[:, sci].T * m2a + arr.below[:, sci].T * m2b
+        ch_factor = np.where(arr.mep, fac["intensidad_mep"][rows][:, None], 1.0)
+        ch_factor = ch_factor * np.where(arr.finish, fac["acabados"][rows][:, None], 1.0)
+        cost *= ch_factor
+
+        included = np.ones(cost.shape, dtype=bool)
+        if module_key == "fitout_oficinas":
+            furniture = _bool_column(sub, "include_furniture")
+            drop = np.array([k == "mobiliario" for k in arr.keys], dtype=bool)
+            included[np.ix_(~furniture, drop)] = False
+            cost[~included] = 0.0
+
+        use_arch = np.ones(len(rows)); use_mep = np.ones(len(rows)); use_overall = np.ones(len(rows))
+        if module_key in BUILDING_MODULES and "building_use" in sub.columns:
+            bu = sub["building_use"].astype(object)
+            for use_key in pd.unique(bu[bu.notna()]):
+                up = arr.use_profiles.get(use_key)
+                if not up:
+                    continue
+                sel = (bu == use_key).to_numpy()
+                use_arch[sel], use_mep[sel], use_overall[sel] = up
+            cost *= np.where(arr.mep, use_mep[:, None], use_arch[:, None])
+            cost *= use_overall[:, None]
+
+        mult = np.ones(len(rows))
+        spec = option_table(module_key)
+        if spec is not None:   # same rule as module_multiplier(), per row
+            col, default, table = spec
+            mult *= _lookup(_level_column(sub, col, default), arr.multipliers.get(table, {}), col,
+                            1.0 if table == "use_multipliers" else None)
+
+        combined = combined_factors[rows] * mult
+        cost *= combined[:, None]
+        direct = cost.sum(axis=1)
+
+        calib = np.ones(len(rows))
+        target_pem = pem[rows, sci]
+        area = (m2_above[rows] + m2_below[rows]) if arr.area_split else m2_above[rows]
+        do_calib = auto_calib[rows] & ~np.isnan(target_pem) & (area > 0) & (direct > 0)
+        if do_calib.any():
+            calib[do_calib] = target_pem[do_calib] * area[do_calib] / direct[do_calib]
+            cost[do_calib] *= calib[do_calib][:, None]
+            direct[do_calib] = cost[do_calib].sum(axis=1)
+
+        for c, v in markup_totals(arr, sci, direct, soft_override[rows], cont_override[rows]).items():
+            out[c][rows] = v
+        out["calibration"][rows] = calib
+        out["use_arch"][rows] = use_arch
+        out["use_mep"][rows] = use_mep
+        out["use_overall"][rows] = use_overall
+        out["module_mult"][rows] = mult
+
+        if with_chapters:
+            chapters[module_key] = ModuleChapters(keys=arr.keys, labels=arr.labels, basis=arr.basis,
+                                                  rows=rows, cost=cost, included=included)
+
+    totals = pd.DataFrame({"project": project_ids, "module": modules, "scenario": scen, **out})
+    return PortfolioEstimate(totals=totals, chapters=chapters)
@@ -0,0 +1,326 @@
+"""
+Informes PDF de cartera: muchos PDF en paralelo (pool de procesos) o un único PDF consolidado
+(portada, una sección por proyecto y tabla resumen) que se escribe a disco por bloques de proyectos.
+"""
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, BinaryIO, Iterable, Iterator, List, Optional, Tuple
+import io
+import re
+import time
+import numpy as np
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfgen import canvas
+
+from src.calculations import SCENARIO_LABELS
+from src.instrument import timed, count
+from src.model import CostModel
+from src.pdf_report import ReportInputs, PageWriter, draw_report, format_chapters, chapter_lines, source_lines
+from src.portfolio import estimate_portfolio, FACTOR_FIELDS, BUILDING_MODULES
+from src.batch import benchmark_keys
+
+_OPTION_COLUMNS = ("building_use","intervention_level","reform_level","use","include_furniture")
+
+
+@dataclass
+class ReportJob:
+    """Un informe listo para dibujar: capítulos ya formateados (listas de str), sin DataFrames."""
+    filename: str
+    inputs: ReportInputs
+    chapters: Tuple[List[str], List[str]]
+    totals: Dict[str, float]
+    bench_row: Optional[dict] = None
+    project: str = ""
+    area_ref: float = 0.0
+
+    @classmethod
+    def from_breakdown(cls, filename: str, inputs: ReportInputs, df_breakdown: pd.DataFrame,
+                       totals: Dict[str, float], bench_row: dict | None = None, project: str = "",
+                       area_ref: float = 0.0) -> "ReportJob":
+        return cls(filename, inputs, chapter_lines(df_breakdown), dict(totals), bench_row, project, area_ref)
+
+
+def _safe_name(s: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", s).strip("_") or "proyecto"
+
+
+def jobs_from_portfolio(model: CostModel, projects: pd.DataFrame, chunksize: int = 2000,
+                        title: str = "Informe CAPEX PRO") -> Iterator[ReportJob]:
+    """
+    Estima `projects` (columnas de estimate_portfolio, ya preparadas: ciudad → localización, benchmark…)
+    por bloques y produce un ReportJob por proyecto × escenario; la memoria no crece con la cartera.
+    """
+    for start in range(0, len(projects), chunksize):
+        chunk = projects.iloc[start:start + chunksize]
+        res = estimate_portfolio(model, chunk, with_chapters=True)
+        tot = res.totals
+        n_sc = len(tot)//max(1, len(chunk))
+        src_rows = np.repeat(np.arange(len(chunk)), n_sc)
+        totals_cols = {c: tot[c].to_numpy() for c in ("direct","indirects","gg_bi","soft_costs","contingency","total")}
+        fac_cols = {f: (pd.to_numeric(chunk[f], errors="coerce").fillna(1.0).to_numpy(dtype=float)
+                        if f in chunk.columns else np.ones(len(chunk))) for f in FACTOR_FIELDS}
+        m2a = pd.to_numeric(chunk["m2_above"], errors="coerce").fillna(0.0).to_numpy(dtype=float) \
+            if "m2_above" in chunk.columns else np.zeros(len(chunk))
+        m2b = pd.to_numeric(chunk["m2_below"], errors="coerce").fillna(0.0).to_numpy(dtype=float) \
+            if "m2_below" in chunk.columns else np.zeros(len(chunk))
+        opt_cols = {c: chunk[c].to_numpy() for c in _OPTION_COLUMNS if c in chunk.columns}
+        bench = benchmark_keys(chunk).to_numpy()   # same row as the single-project PDF
+
+        lines: Dict[int, Tuple[List[str], List[str]]] = {}
+        for mc in res.chapters.values():
+            labels = np.asarray(mc.labels, dtype=object)
+            for r, cost, inc in zip(mc.rows, mc.cost, mc.included):
+                lines[int(r)] = format_chapters(labels[inc], cost[inc])
+
+        modules, scen, pids = tot["module"].to_numpy(), tot["scenario"].to_numpy(), tot["project"].to_numpy()
+        for i in range(len(tot)):
+            j = src_rows[i]
+            module_key = str(modules[i])
+            module_def = model.cost_data["modules"][module_key]
+            cm_ = model.module(module_key)
+            options = {k: str(v[j]) for k, v in opt_cols.items() if not pd.isna(v[j])}
+            use = options.get("building_use") if module_key in BUILDING_MODULES else None
+            inp = ReportInputs(
+                title=f"{title} - {pids[i]}",
+                module_label=module_def["label"],
+                area_label="m² construidos" if cm_.area_split else "m²",
+                m2_above=float(m2a[j]), m2_below=float(m2b[j]),
+                scenario_label=SCENARIO_LABELS[scen[i]],
+                building_use=module_def.get("use_profiles",{}).get(use,{}).get("label","") if use else "",
+                factors={f: float(fac_cols[f][j]) for f in FACTOR_FIELDS},
+                options=options,
+                notes="Estimación paramétrica orientativa.",
+            )
+            area = float(m2a[j] + m2b[j]) if cm_.area_split else float(m2a[j])
+            yield ReportJob(filename=f"capex_{_safe_name(str(pids[i]))}_{scen[i]}.pdf", inputs=inp,
+                            chapters=lines.get(i, ([], [])), totals={k: float(v[i]) for k, v in totals_cols.items()},
+                            bench_row=model.benchmark_rows.get(bench[j]) if bench[j] else None,
+                            project=str(pids[i]), area_ref=area)
+
+
+def _render_jobs(jobs: List[ReportJob], out_dir: str, sources: List[str]) -> List[Tuple[str, int]]:
+    out = []
+    for job in jobs:
+        path = Path(out_dir) / job.filename
+        c = canvas.Canvas(str(path), pagesize=A4)
+        draw_report(PageWriter(c), job.inputs, job.chapters, job.totals, sources, job.bench_row)
+        pages = c.getPageNumber()
+        c.save()
+        out.append((str(path), pages))
+    return out
+
+
+def _unique_names(jobs: Iterable[ReportJob]) -> Iterator[ReportJob]:
+    """Nombres de fichero únicos: un id de proyecto repetido recibe sufijo _2, _3… en vez de sobrescribir."""
+    seen: Dict[str, int] = {}
+    for job in jobs:
+        name = job.filename
+        while name in seen:
+            seen[job.filename] += 1
+            stem, dot, ext = job.filename.rpartition(".")
+            name = f"{stem}_{seen[job.filename]}{dot}{ext}"
+        seen[name] = 1
+        if name != job.filename:
+            count("pdf_renamed")
+            job.filename = name
+        yield job
+
+
+def _batched(it: Iterable[ReportJob], size: int) -> Iterator[List[ReportJob]]:
+    batch: List[ReportJob] = []
+    for job in it:
+        batch.append(job)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@timed()
+def export_many(jobs: Iterable[ReportJob], out_dir: str | Path, sources_df: pd.DataFrame,
+                workers: int = 1, per_task: int = 16) -> Dict[str, Any]:
+    """
+    Un PDF por trabajo en `out_dir`. Con workers > 1 se reparten lotes de `per_task` informes en un pool
+    de procesos con cola acotada (los trabajos pueden venir de un generador). Los ids de proyecto
+    repetidos no se sobrescriben: el segundo fichero lleva sufijo _2 (y así sucesivamente).
+    """
+    jobs = _unique_names(jobs)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sources = source_lines(sources_df)
+    files: List[str] = []
+    pages = 0
+    t0 = time.perf_counter()
+
+    def _collect(result):
+        nonlocal pages
+        for path, n in result:
+            files.append(path)
+            pages += n
+
+    if workers <= 1:
+        for batch in _batched(jobs, per_task):
+            _collect(_render_jobs(batch, str(out_dir), sources))
+    else:
+        pending: deque = deque()
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for batch in _batched(jobs, per_task):
+                pending.append(ex.submit(_render_jobs, batch, str(out_dir), sources))
+                if len(pending) >= 2*workers:
+                    _collect(pending.popleft().result())
+            while pending:
+                _collect(pending.popleft().result())
+    elapsed = time.perf_counter() - t0
+    count("pdf_reports", len(files))
+    count("pdf_pages", pages)
+    return {"files": files, "reports": len(files), "pages": pages, "seconds": elapsed,
+            "pages_per_second": pages/elapsed if elapsed > 0 else float("inf")}
+
+
+class _PdfAppender:
+    """
+    PDF de salida al que se añaden PDF de ReportLab ya cerrados (un bloque de páginas cada vez): sus objetos
+    se renumeran y se escriben a disco al momento; en memoria solo quedan los offsets y la lista de páginas.
+    """
+    _OBJ = re.compile(rb"(\d+) 0 obj")
+    _REF = re.compile(rb"(\d+) 0 R")
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.offsets: List[int] = [0, 0]     # 1 = Pages, 2 = Catalog (written on close)
+        self.kids: List[int] = []
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def pages(self) -> int:
+        return len(self.kids)
+
+    def append(self, pdf: bytes) -> None:
+        xref = int(pdf[pdf.rindex(b"startxref")+9:].split()[0])
+        tok = pdf[xref:pdf.index(b"trailer", xref)].split()     # xref 0 N, then offset/gen/flag triplets
+        at = {num: int(tok[3 + 3*num]) for num in range(1, int(tok[2])) if tok[5 + 3*num] == b"n"}
+        starts = sorted(at.values())
+        end = dict(zip(starts, starts[1:] + [xref]))
+        objs: Dict[int, Tuple[bytes, bytes]] = {}   # num -> (dictionary, stream + endobj)
+        for num, start in at.items():
+            body = pdf[start:end[start]]
+            cut = body.find(b"\nstream")
+            objs[num] = (body, b"") if cut < 0 else (body[:cut], body[cut:])
+        root = next(n for n, (head, _) in objs.items() if b"/Type /Pages" in head and b"/Parent" not in head)
+        # ReportLab keeps the pages in one flat /Kids array under the root /Pages
+        order = [int(k) for k in self._REF.findall(objs[root][0].split(b"/Kids", 1)[1].split(b"]", 1)[0])]
+        pages = set(order)
+        # catalog, page tree, info and outlines are dropped: the output has a single catalog and page tree
+        skip = {n for n, (head, _) in objs.items()
+                if n == root or b"/Type /Catalog" in head or b"/Producer" in head or b"/Type /Outlines" in head
+                or (b"/Parent" in head and n not in pages)}
+        new: Dict[int, int] = {}
+        for n in sorted(objs):
+            if n not in skip:
+                new[n] = len(self.offsets) + len(new) + 1
+        new[root] = 1
+
+        def _ref(m) -> bytes:
+            num = new.get(int(m.group(1)))
+            return b"%d 0 R" % num if num is not None else b"null"
+
+        for n in sorted(objs):
+            if n in skip:
+                continue
+            head, tail = objs[n]
+            head = self._REF.sub(_ref, self._OBJ.sub(b"%d 0 obj" % new[n], head, count=1))
+            self.offsets.append(self.f.tell())
+            self.f.write(head + tail)
+        self.kids.extend(new[k] for k in order)
+
+    def close(self) -> None:
+        f = self.f
+        self.offsets[0] = f.tell()
+        f.write(b"1 0 obj\n<< /Type /Pages /Count %d /Kids [" % len(self.kids)
+                + b" ".join(b"%d 0 R" % k for k in self.kids) + b"] >>\nendobj\n")
+        self.offsets[1] = f.tell()
+        f.write(b"2 0 obj\n<< /Type /Catalog /Pages 1 0 R >>\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.offsets) + 1))
+        f.write(b"".join(b"%010d 00000 n \n" % o for o in self.offsets))
+        f.write(b"trailer\n<< /Size %d /Root 2 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(self.offsets) + 1, xref))
+
+
+@timed()
+def export_consolidated(filepath: str | Path, jobs: Iterable[ReportJob], sources_df: pd.DataFrame,
+                        title: str = "Informe CAPEX PRO - Cartera", notes: str = "", flush_every: int = 64) -> Dict[str, Any]:
+    """
+    Un único PDF: portada, un informe por trabajo (cada uno desde página nueva) y tabla resumen final.
+    Los trabajos se consumen de uno en uno y cada `flush_every` informes sus páginas se escriben en
+    `filepath` y se liberan; solo se guarda una fila de resumen por proyecto.
+    """
+    sources = source_lines(sources_df)
+    summary: List[Tuple[str, str, str, float, float, int]] = []
+    t0 = time.perf_counter()
+    with open(filepath, "wb") as f:
+        out = _PdfAppender(f)
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=A4, pageCompression=1)
+        w = PageWriter(c)
+        w.y = w.height*0.6
+        w.draw(title, dy=24, font=("Helvetica-Bold",20))
+        w.draw(time.strftime("%Y-%m-%d"), dy=16, font=("Helvetica",11))
+        if notes:
+            w.draw(notes, dy=14, font=("Helvetica",10))
+        in_part = 0
+
+        def _flush():
+            nonlocal buf, c, w, in_part
+            c.save()
+            out.append(buf.getvalue())
+            buf = io.BytesIO()
+            c = canvas.Canvas(buf, pagesize=A4, pageCompression=1)
+            w, in_part = PageWriter(c), 0
+
+        for job in jobs:
+            if in_part >= flush_every:
+                _flush()
+            elif in_part or not summary:   # after the cover / the previous report
+                w.new_page()
+            summary.append((job.project or job.inputs.title, job.inputs.module_label, job.inputs.scenario_label,
+                            job.area_ref, job.totals["total"], out.pages + c.getPageNumber()))
+            draw_report(w, job.inputs, job.chapters, job.totals, sources, job.bench_row)
+            in_part += 1
+        _flush()
+
+        w.draw("Resumen de cartera", dy=18, font=("Helvetica-Bold",14))
+        w.draw(f"{len(summary)} informes | Total: {sum(r[4] for r in summary):,.0f} €", dy=16, font=("Helvetica",10))
+        cols = (("Proyecto", 0.0, False), ("Módulo", 4.0*cm, False), ("Esc.", 10.0*cm, False),
+                ("Total", 14.0*cm, True), ("€/m²", 16.0*cm, True), ("Pág.", 17.0*cm, True))
+
+        def _header():
+            w.font("Helvetica-Bold", 8)
+            for name, x, right in cols:
+                (w.c.drawRightString if right else w.c.drawString)(w.x0 + x, w.y, name)
+            w.y -= 12
+            w.font("Helvetica", 8)
+
+        _header()
+        for i, (proj, module, scen, area, total, page) in enumerate(summary):
+            cells = (proj[:22], module[:34], scen, f"{total:,.0f} €", f"{total/area:,.0f}" if area > 0 else "-", str(page))
+            for (_, x, right), txt in zip(cols, cells):
+                (w.c.drawRightString if right else w.c.drawString)(w.x0 + x, w.y, txt)
+            w.y -= 10
+            if w.y < 2.5*cm and i + 1 < len(summary):
+                w.new_page()
+                if c.getPageNumber() > flush_every:
+                    _flush()
+                _header()
+        _flush()
+        out.close()
+    pages = out.pages
+    elapsed = time.perf_counter() - t0
+    count("pdf_pages", pages)
+    return {"file": str(filepath), "reports": len(summary), "pages": pages, "seconds": elapsed,
+            "pages_per_second": pages/elapsed if elapsed > 0 else float("inf")}
@@ -0,0 +1,63 @@
+"""
+Acceso compartido y perezoso para app.py y pages/: cada recurso (modelo compilado, CSV de data/, módulo
+pesado como reportlab) se carga la primera vez que se pide y queda en caché del proceso.
+
+    from src import resources
+    model = resources.model()                      # YAML + CSV compilados (pickle en data/.cache)
+    sources = resources.frame("sources")           # solo ese CSV, sin construir el modelo
+    pdf = resources.module("src.pdf_report")       # importa reportlab al exportar, no al arrancar
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Tuple
+import importlib
+import os
+import sys
+import threading
+
+from src.instrument import span, count
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+CACHE_FILE = DATA_DIR / ".cache" / "cost_model.pkl"
+
+_lock = threading.Lock()
+_frames: Dict[str, Tuple[int, int, object]] = {}   # path -> (mtime_ns, size, DataFrame); one version per file
+
+
+def model(data_dir: str | Path = DATA_DIR, cache_file: str | Path | None = CACHE_FILE):
+    """CostModel compartido (src.model.load_model: invalidación por mtime/tamaño y hash de contenido)."""
+    from src.model import load_model
+    return load_model(data_dir, cache_file=cache_file)
+
+
+def frame(name: str, data_dir: str | Path = DATA_DIR):
+    """
+    Copia del DataFrame de un CSV de DATA_FILES ("sources", "benchmarks", "cities"…). Si el modelo de
+    `data_dir` ya está cargado y al día se copia su tabla; si no, se lee solo ese fichero (caché por
+    mtime/tamaño; al cambiar el fichero se sustituye la versión anterior). Las copias evitan que una sesión
+    que modifique la tabla la cambie para las demás.
+    """
+    from src.model import DATA_FILES, peek_model
+    loaded = peek_model(data_dir)
+    if loaded is not None:
+        return getattr(loaded, name).copy()
+    path = str(Path(data_dir).resolve() / DATA_FILES[name])
+    st = os.stat(path)
+    hit = _frames.get(path)
+    if hit is None or hit[:2] != (st.st_mtime_ns, st.st_size):
+        with _lock:
+            hit = _frames.get(path)
+            if hit is None or hit[:2] != (st.st_mtime_ns, st.st_size):
+                from src.io import load_csv
+                hit = _frames[path] = (st.st_mtime_ns, st.st_size, load_csv(path))
+                count("frames_loaded")
+    return hit[2].copy()
+
+
+def module(name: str):
+    """importlib.import_module con un span la primera vez (para ver el coste en el perfilado)."""
+    mod = sys.modules.get(name)
+    if mod is None:
+        with span("import."+name):
+            mod = importlib.import_module(name)
+    return mod
@@ -0,0 +1,140 @@
+from __future__ import annotations
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from src.model import CompiledModule
+
+FRAME_COLUMNS = ["chapter_key","capitulo","basis","eur_m2_above","eur_m2_below","m2_above","m2_below","cost_direct",
+                 "factor_capitulo","source_mode","factor_global","factor_use_arch","factor_use_mep","factor_use_overall",
+                 "factor_module","factor_calibration"]
+
+
+class EstimateResult:
+    """
+    Resultado de una estimación como arrays por capítulo (sin DataFrame).
+    `mask` marca los capítulos incluidos; se puede filtrar y re-totalizar en sitio, y `to_frame()`
+    construye (y guarda) el DataFrame de estimate_module solo cuando se pide (tablas, CSV, PDF).
+    Las tarifas y etiquetas son vistas del CompiledModule, no copias.
+    """
+    __slots__ = ("module", "sci", "scenario", "m2_above", "m2_below", "cost", "factor_chapter", "mask",
+                 "factor_global", "use_mults", "module_mult", "calibration", "calibrated",
+                 "soft_pct", "cont_pct", "_totals", "_frame")
+
+    def __init__(self, module: CompiledModule, sci: int, scenario: str, m2_above: float, m2_below: float,
+                 cost: np.ndarray, factor_chapter: np.ndarray, mask: np.ndarray, factor_global: float,
+                 use_mults: Tuple[float, float, float], module_mult: float, calibration: float, calibrated: bool,
+                 soft_pct: float, cont_pct: float):
+        self.module = module
+        self.sci = sci
+        self.scenario = scenario
+        self.m2_above = float(m2_above)
+        self.m2_below = float(m2_below)
+        self.cost = cost
+        self.factor_chapter = factor_chapter
+        self.mask = mask
+        self.factor_global = float(factor_global)
+        self.use_mults = use_mults
+        self.module_mult = float(module_mult)
+        self.calibration = float(calibration)
+        self.calibrated = bool(calibrated)
+        self.soft_pct = float(soft_pct)
+        self.cont_pct = float(cont_pct)
+        self._totals: Optional[Dict[str, float]] = None
+        self._frame: Optional[pd.DataFrame] = None
+
+    def __len__(self) -> int:
+        return int(self.mask.sum())
+
+    def __repr__(self) -> str:
+        return f"EstimateResult({self.module.key!r}, {self.scenario!r}, chapters={len(self)}, total={self.total:,.0f})"
+
+    # --- in-place edits ---------------------------------------------------------------------
+    def _changed(self) -> None:
+        self._totals = None
+        self._frame = None
+
+    def keep_chapters(self, keys: Iterable[str]) -> "EstimateResult":
+        """Deja solo los capítulos de `keys` (entre los ya incluidos)."""
+        keys = set(keys)
+        self.mask = self.mask & np.fromiter((k in keys for k in self.module.keys), bool, len(self.module.keys))
+        self._changed()
+        return self
+
+    def drop_chapters(self, keys: Iterable[str]) -> "EstimateResult":
+        keys = set(keys)
+        self.mask = self.mask & ~np.fromiter((k in keys for k in self.module.keys), bool, len(self.module.keys))
+        self._changed()
+        return self
+
+    def set_pcts(self, soft_pct: float | None = None, cont_pct: float | None = None) -> "EstimateResult":
+        """Cambia % soft costs / contingencia (fracción) sin tocar los capítulos."""
+        if soft_pct is not None:
+            self.soft_pct = float(soft_pct)
+        if cont_pct is not None:
+            self.cont_pct = float(cont_pct)
+        self._totals = None
+        return self
+
+    # --- totals -----------------------------------------------------------------------------
+    @property
+    def direct(self) -> float:
+        return float(self.cost[self.mask].sum())
+
+    @property
+    def total(self) -> float:
+        return self.totals()["total"]
+
+    def totals(self) -> Dict[str, float]:
+        """Mismas claves que estimate_module."""
+        if self._totals is None:
+            cm, sci = self.module, self.sci
+            direct = self.direct
+            indirects = direct * float(cm.indirects_pct[sci])
+            gg_bi = direct * cm.gg_bi_pct
+            soft = direct * self.soft_pct
+            contingency = direct * self.cont_pct
+            self._totals = {"direct":direct,"indirects":indirects,"gg_bi":gg_bi,"soft_costs":soft,
+                            "soft_pct_used":self.soft_pct,"soft_pct_default":float(cm.soft_pct[sci]),
+                            "contingency":contingency,"cont_pct_used":self.cont_pct,"cont_pct_default":float(cm.cont_pct[sci]),
+                            "total":direct + indirects + gg_bi + soft + contingency,
+                            "calibration":self.calibration,"use_arch":self.use_mults[0],"use_mep":self.use_mults[1],
+                            "use_overall":self.use_mults[2],"module_mult":self.module_mult}
+        return dict(self._totals)
+
+    # --- views ------------------------------------------------------------------------------
+    def chapters(self) -> Tuple[Tuple[str, ...], np.ndarray]:
+        """(etiquetas, coste directo) de los capítulos incluidos."""
+        idx = np.flatnonzero(self.mask)
+        return tuple(self.module.labels[i] for i in idx), self.cost[idx]
+
+    def by_label(self) -> pd.Series:
+        """Coste directo por etiqueta de capítulo, de mayor a menor (para tablas y gráficos)."""
+        labels, cost = self.chapters()
+        return pd.Series(cost, index=pd.Index(labels, name="capitulo"), name="cost_direct") \
+            .groupby(level=0, sort=False).sum().sort_values(ascending=False)
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame con las columnas de estimate_module (se construye una vez y se reutiliza)."""
+        if self._frame is None:
+            cm, sci = self.module, self.sci
+            idx = np.flatnonzero(self.mask)
+            self._frame = pd.DataFrame({
+                "chapter_key": [cm.keys[i] for i in idx],
+                "capitulo": [cm.labels[i] for i in idx],
+                "basis": [cm.basis[i] for i in idx],
+                "eur_m2_above": cm.above[idx, sci],
+                "eur_m2_below": [None if cm.single[i] else cm.below[i, sci] for i in idx],
+                "m2_above": self.m2_above,
+                "m2_below": np.where(cm.single[idx], 0.0, self.m2_below),
+                "cost_direct": self.cost[idx],
+                "factor_capitulo": self.factor_chapter[idx],
+                "source_mode": "calibrated_to_benchmark" if self.calibrated else "chapter_rate",
+                "factor_global": self.factor_global,
+                "factor_use_arch": self.use_mults[0],
+                "factor_use_mep": self.use_mults[1],
+                "factor_use_overall": self.use_mults[2],
+                "factor_module": self.module_mult,
+                "factor_calibration": self.calibration,
+            }, columns=FRAME_COLUMNS)
+        return self._frame
@@ -0,0 +1,433 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from functools import lru_cache
+from dataclasses import dataclass, field, fields
+from typing import Dict, Any, List, Optional, Sequence, Iterable, Tuple, Callable
+import math
+import numpy as np
+
+from src.calculations import Factors, SCENARIOS
+from src.model import CostModel, CompiledModule
+from src.portfolio import module_multiplier, use_profile
+
+FACTOR_FIELDS = [f.name for f in fields(Factors)]
+PERCENTILES = (5, 10, 25, 50, 75, 80, 90, 95)
+_PERT_GRID = 1025
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """Φ(x) vectorizado (Abramowitz-Stegun 26.2.17, error < 7.5e-8); numpy no trae erf."""
+    x = np.asarray(x, dtype=float)
+    ax = np.abs(x)
+    t = 1.0 / (1.0 + 0.2316419*ax)
+    poly = t*(0.319381530 + t*(-0.356563782 + t*(1.781477937 + t*(-1.821255978 + t*1.330274429))))
+    upper = np.exp(-0.5*ax*ax) / math.sqrt(2*math.pi) * poly
+    return np.where(x >= 0, 1.0 - upper, upper)
+
+
+@dataclass(frozen=True)
+class Dist:
+    """Distribución acotada low/mode/high: 'triangular' o 'pert' (beta-PERT)."""
+    low: float
+    mode: float
+    high: float
+    kind: str = "triangular"
+
+    def ppf(self, u: np.ndarray) -> np.ndarray:
+        if self.kind == "pert" and self.high > self.low:
+            return np.interp(u, _U_GRID, _pert_quantiles(float(self.low), float(self.mode), float(self.high)))
+        return tri_ppf(np.asarray(u, dtype=float), self.low, self.mode, self.high)
+
+
+def tri_ppf(u: np.ndarray, a, c, b) -> np.ndarray:
+    """Inversa de la triangular; a/c/b pueden ser arrays que se difunden por columnas."""
+    a, c, b = (np.asarray(x, dtype=float) for x in (a, c, b))
+    width = b - a
+    fc = np.divide(c - a, width, out=np.zeros(np.broadcast(a, b).shape), where=width > 0)
+    # standard form on [0, 1]: sqrt(u·fc) left of the mode, 1 - sqrt((1-u)(1-fc)) right of it
+    left = u < fc
+    v = np.subtract(1.0, u)
+    np.copyto(v, u, where=left)
+    v *= np.where(left, fc, 1.0 - fc)
+    np.sqrt(v, out=v)
+    np.subtract(1.0, v, out=v, where=~left)
+    v *= width
+    v += a
+    return v
+
+
+_U_GRID = np.linspace(0.0, 1.0, _PERT_GRID)
+
+
+@lru_cache(maxsize=1024)
+def _pert_quantiles(a: float, c: float, b: float) -> np.ndarray:
+    """Cuantiles de la beta-PERT (λ=4) en _U_GRID; CDF por trapecios (sin scipy)."""
+    alpha = 1.0 + 4.0*(c - a)/(b - a)
+    beta = 1.0 + 4.0*(b - c)/(b - a)
+    t = np.linspace(0.0, 1.0, 8*_PERT_GRID)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logpdf = (alpha - 1.0)*np.log(t) + (beta - 1.0)*np.log1p(-t)
+    finite = np.isfinite(logpdf)
+    pdf = np.zeros_like(t)
+    pdf[finite] = np.exp(logpdf[finite] - logpdf[finite].max())
+    cdf = np.concatenate([[0.0], np.cumsum(0.5*(pdf[1:] + pdf[:-1]))])
+    cdf /= cdf[-1]
+    q = a + np.interp(_U_GRID, cdf, t)*(b - a)
+    q.setflags(write=False)
+    return q
+
+
+def table_ppf(u: np.ndarray, tables: np.ndarray) -> np.ndarray:
+    """Inversa por tabla de cuantiles: u (n, k), tables (k, G) sobre _U_GRID."""
+    k, g = tables.shape
+    pos = u*(g - 1)
+    i = np.minimum(pos.astype(np.int64), g - 2)
+    frac = pos - i
+    i += np.arange(k)*g
+    flat = tables.ravel()
+    lo = flat[i]
+    return lo + frac*(flat[i + 1] - lo)
+
+
+class StreamingHistogram:
+    """Histograma de bins fijos sobre [lo, hi] + momentos; fusionable entre chunks/procesos."""
+
+    def __init__(self, lo: float, hi: float, bins: int = 8192):
+        if not hi > lo:
+            hi = lo + max(abs(lo)*1e-9, 1e-9)
+        self.lo, self.hi, self.bins = float(lo), float(hi), int(bins)
+        self.counts = np.zeros(self.bins + 2, dtype=np.int64)  # [under, bins..., over]
+        self.n = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def edges(self) -> np.ndarray:
+        return np.linspace(self.lo, self.hi, self.bins + 1)
+
+    def add(self, x: np.ndarray) -> None:
+        x = np.asarray(x, dtype=float).ravel()
+        if x.size == 0:
+            return
+        idx = np.floor((x - self.lo) * (self.bins / (self.hi - self.lo))).astype(np.int64) + 1
+        np.clip(idx, 0, self.bins + 1, out=idx)
+        idx[x == self.hi] = self.bins
+        self.counts += np.bincount(idx, minlength=self.bins + 2)
+        self.n += x.size
+        self.total += float(x.sum())
+        self.total_sq += float(np.dot(x, x))
+        self.min = min(self.min, float(x.min()))
+        self.max = max(self.max, float(x.max()))
+
+    def merge(self, other: "StreamingHistogram") -> None:
+        if (other.lo, other.hi, other.bins) != (self.lo, self.hi, self.bins):
+            raise ValueError("histogramas con rangos distintos")
+        self.counts += other.counts
+        self.n += other.n
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.n if self.n else math.nan
+
+    @property
+    def std(self) -> float:
+        if self.n < 2:
+            return math.nan
+        var = (self.total_sq - self.total*self.total/self.n) / (self.n - 1)
+        return math.sqrt(max(var, 0.0))
+
+    def quantile(self, q: float) -> float:
+        """Cuantil interpolado dentro del bin (error ≤ ancho de bin)."""
+        if not self.n:
+            return math.nan
+        target = q * self.n
+        cum = np.cumsum(self.counts)
+        i = int(np.searchsorted(cum, target, side="left"))
+        if i == 0:
+            return self.min
+        if i == self.bins + 1:
+            return self.max
+        prev = cum[i - 1]
+        width = (self.hi - self.lo) / self.bins
+        frac = (target - prev) / self.counts[i] if self.counts[i] else 0.0
+        return min(max(self.lo + (i - 1 + frac)*width, self.min), self.max)
+
+    def coarse(self, bins: int = 40):
+        """(edges, counts) re-agrupado para gráficos."""
+        inner = self.counts[1:-1]
+        step = max(1, self.bins // bins)
+        counts = inner[: (self.bins // step)*step].reshape(-1, step).sum(axis=1)
+        edges = self.edges[::step][: len(counts) + 1]
+        counts[0] += self.counts[0]
+        counts[-1] += self.counts[-1]
+        return edges, counts
+
+
+@dataclass
+class MonteCarloConfig:
+    n_iter: int = 100_000
+    seed: Optional[int] = None
+    chunk_size: int = 100_000
+    workers: int = 1
+    rate_dist: str = "triangular"           # 'triangular' | 'pert'
+    rate_correlation: float = 0.0           # common-shock correlation between chapter rates
+    factor_spread: float = 0.05             # ± relative spread around the chosen factor value
+    factor_dists: Dict[str, Dist] = field(default_factory=dict)  # overrides per Factors field
+    factor_correlation: Optional[np.ndarray] = None              # (9, 9), FACTOR_FIELDS order
+    bins: int = 8192
+
+
+@dataclass
+class _Spec:
+    """Todo lo que necesita un worker para simular (picklable)."""
+    rates_a: np.ndarray        # (3, chapters): low / mode / high, above (or single)
+    rates_b: np.ndarray        # (3, chapters): below; unused when has_below is False
+    tables_a: Optional[np.ndarray]  # PERT quantile tables (chapters, G)
+    tables_b: Optional[np.ndarray]
+    weights_a: np.ndarray      # (chapters, 4): m2 × use multiplier into groups other/mep/finish/both
+    weights_b: np.ndarray
+    has_below: bool
+    module_mult: float
+    calibration: float
+    markup: float              # 1 + indirects + gg_bi + soft + contingency
+    pcts: Dict[str, float]     # indirects / gg_bi / soft / contingency fractions behind markup
+    chapter_keys: Tuple[str, ...]
+    rate_rho: float
+    factor_params: np.ndarray  # (3, 9): low / mode / high
+    factor_tables: Optional[np.ndarray]  # (9, G) when some factor is PERT
+    factor_chol: Optional[np.ndarray]
+    lo: float = 0.0
+    hi: float = 0.0
+    lo_direct: float = 0.0
+    hi_direct: float = 0.0
+    bins: int = 8192
+
+
+@dataclass
+class MonteCarloResult:
+    n: int
+    total: StreamingHistogram
+    direct: StreamingHistogram
+    seed: Optional[int]
+
+    def percentiles(self, ps: Iterable[float] = PERCENTILES) -> Dict[str, float]:
+        return {f"P{int(p)}": self.total.quantile(p/100.0) for p in ps}
+
+    def summary(self) -> Dict[str, float]:
+        return {"n": self.n, "mean": self.total.mean, "std": self.total.std,
+                "min": self.total.min, "max": self.total.max, **self.percentiles()}
+
+
+def _factor_dists(factors: Factors, cfg: MonteCarloConfig) -> List[Dist]:
+    out = []
+    for name in FACTOR_FIELDS:
+        if name in cfg.factor_dists:
+            out.append(cfg.factor_dists[name])
+            continue
+        v = float(getattr(factors, name))
+        out.append(Dist(v*(1.0 - cfg.factor_spread), v, v*(1.0 + cfg.factor_spread)))
+    return out
+
+
+def build_spec(model: CostModel, module_key: str, scenario: str, m2_above: float, m2_below: float,
+               factors: Factors, options: Dict[str, Any] | None = None,
+               chapters: Iterable[str] | None = None, include_optional: bool = True,
+               calibration: float = 1.0, config: MonteCarloConfig | None = None) -> _Spec:
+    cfg = config or MonteCarloConfig()
+    options = options or {}
+    cm: CompiledModule = model.module(module_key)
+    sci = SCENARIOS.index(scenario)
+
+    keep = np.ones(len(cm.keys), dtype=bool)
+    if module_key == "fitout_oficinas" and not options.get("include_furniture", False):
+        keep &= np.array([k != "mobiliario" for k in cm.keys], dtype=bool)
+    if not include_optional:
+        keep &= ~cm.optional
+    if chapters is not None:
+        chap_set = set(chapters)
+        keep &= np.array([k in chap_set for k in cm.keys], dtype=bool)
+
+    use_arch, use_mep, use_overall = use_profile(cm, module_key, options.get("building_use")) or (1.0, 1.0, 1.0)
+    mult = module_multiplier(cm, module_key, options)
+
+    soft = float(options.get("soft_items_pct", cm.soft_pct[sci]))
+    cont = float(options.get("cont_items_pct", cm.cont_pct[sci]))
+    pcts = {"indirects": float(cm.indirects_pct[sci]), "gg_bi": cm.gg_bi_pct, "soft": soft, "contingency": cont}
+    markup = 1.0 + pcts["indirects"] + pcts["gg_bi"] + soft + cont
+
+    dists = _factor_dists(factors, cfg)
+    chol = None
+    if cfg.factor_correlation is not None:
+        corr = np.asarray(cfg.factor_correlation, dtype=float)
+        if corr.shape != (len(FACTOR_FIELDS),)*2:
+            raise ValueError(f"factor_correlation debe ser {len(FACTOR_FIELDS)}×{len(FACTOR_FIELDS)}")
+        try:
+            chol = np.linalg.cholesky(corr)
+        except np.linalg.LinAlgError as e:
+            raise ValueError("factor_correlation no es definida positiva") from e
+    if not 0.0 <= cfg.rate_correlation < 1.0:
+        raise ValueError("rate_correlation debe estar en [0, 1)")
+
+    lo_s, hi_s = 0, len(SCENARIOS) - 1
+    mep, fin = cm.mep[keep], cm.finish[keep]
+    groups = np.column_stack([~mep & ~fin, mep & ~fin, fin & ~mep, mep & fin]).astype(float)
+    use_mult = np.where(mep, use_mep, use_arch)*use_overall
+    rates_a = np.stack([cm.above[keep, lo_s], cm.above[keep, sci], cm.above[keep, hi_s]])
+    rates_b = np.stack([cm.below[keep, lo_s], cm.below[keep, sci], cm.below[keep, hi_s]])
+    has_below = bool(m2_below) and bool(rates_b.any())
+
+    def _tables(r):
+        if cfg.rate_dist != "pert":
+            return None
+        return np.stack([_pert_quantiles(*map(float, r[:, j])) if r[2, j] > r[0, j] else np.full(_PERT_GRID, r[1, j])
+                         for j in range(r.shape[1])]) if r.shape[1] else np.zeros((0, _PERT_GRID))
+
+    factor_tables = None
+    if any(d.kind == "pert" for d in dists):
+        factor_tables = np.stack([_pert_quantiles(d.low, d.mode, d.high) if d.kind == "pert" and d.high > d.low
+                                  else d.ppf(_U_GRID) for d in dists])
+    spec = _Spec(
+        rates_a=rates_a, rates_b=rates_b, tables_a=_tables(rates_a), tables_b=_tables(rates_b) if has_below else None,
+        weights_a=groups*(use_mult*float(m2_above))[:, None], weights_b=groups*(use_mult*float(m2_below))[:, None],
+        has_below=has_below, module_mult=float(mult), calibration=float(calibration), markup=markup,
+        pcts=pcts, chapter_keys=tuple(k for k, kp in zip(cm.keys, keep) if kp),
+        rate_rho=float(cfg.rate_correlation),
+        factor_params=np.array([[d.low for d in dists], [d.mode for d in dists], [d.high for d in dists]]),
+        factor_tables=factor_tables, factor_chol=chol, bins=int(cfg.bins),
+    )
+    # exact bounds: every input is positive and bounded, the formula is monotone in each of them
+    fp = spec.factor_params
+    spec.lo_direct = float(direct_cost(spec, rates_a[:1], rates_b[:1], fp[:1])[0])
+    spec.hi_direct = float(direct_cost(spec, rates_a[2:], rates_b[2:], fp[2:])[0])
+    spec.lo, spec.hi = spec.lo_direct*markup, spec.hi_direct*markup
+    return spec
+
+
+_IMEP = FACTOR_FIELDS.index("intensidad_mep")
+_ACAB = FACTOR_FIELDS.index("acabados")
+
+
+def direct_cost(spec: _Spec, rates_a: np.ndarray, rates_b: np.ndarray, fac: np.ndarray) -> np.ndarray:
+    """Coste directo por iteración; rates (n, chapters), fac (n, 9) en orden FACTOR_FIELDS."""
+    g = rates_a @ spec.weights_a
+    if spec.has_below:
+        g += rates_b @ spec.weights_b
+    imep, acab = fac[:, _IMEP], fac[:, _ACAB]
+    combined = np.prod(fac, axis=1) * (spec.module_mult * spec.calibration)
+    return (g[:, 0] + g[:, 1]*imep + g[:, 2]*acab + g[:, 3]*(imep*acab)) * combined
+
+
+def _uniforms(rng: np.random.Generator, n: int, k: int, rho: float = 0.0, chol: Optional[np.ndarray] = None) -> np.ndarray:
+    if not rho and chol is None:
+        return rng.random((n, k))
+    z = rng.standard_normal((n, k))
+    if chol is not None:
+        z = z @ chol.T
+    if rho:
+        z *= math.sqrt(1.0 - rho)
+        z += math.sqrt(rho)*rng.standard_normal((n, 1))
+    return norm_cdf(z)
+
+
+def _sample_chunk(spec: _Spec, n: int, rng: np.random.Generator):
+    u = _uniforms(rng, n, spec.rates_a.shape[1], rho=spec.rate_rho)
+    if spec.tables_a is not None:
+        ra = table_ppf(u, spec.tables_a)
+        rb = table_ppf(u, spec.tables_b) if spec.has_below else None
+    else:
+        ra = tri_ppf(u, *spec.rates_a)
+        rb = tri_ppf(u, *spec.rates_b) if spec.has_below else None
+    uf = _uniforms(rng, n, len(FACTOR_FIELDS), chol=spec.factor_chol)
+    fac = table_ppf(uf, spec.factor_tables) if spec.factor_tables is not None else tri_ppf(uf, *spec.factor_params)
+    return ra, rb, fac
+
+
+def _simulate_chunk(spec: _Spec, n: int, seed_seq: np.random.SeedSequence) -> np.ndarray:
+    ra, rb, fac = _sample_chunk(spec, n, np.random.default_rng(seed_seq))
+    return direct_cost(spec, ra, rb, fac)
+
+
+def _run_block(spec: _Spec, sizes: Sequence[int], seeds: Sequence[np.random.SeedSequence]):
+    total = StreamingHistogram(spec.lo, spec.hi, spec.bins)
+    direct = StreamingHistogram(spec.lo_direct, spec.hi_direct, spec.bins)
+    for n, ss in zip(sizes, seeds):
+        d = _simulate_chunk(spec, n, ss)
+        direct.add(d)
+        total.add(d*spec.markup)
+    return total, direct
+
+
+def _sample_columns(spec: _Spec, n: int, seed_seq: np.random.SeedSequence) -> Dict[str, np.ndarray]:
+    """Muestras de un chunk por columna: total, directo y los 9 factores (para guardarlas)."""
+    ra, rb, fac = _sample_chunk(spec, n, np.random.default_rng(seed_seq))
+    d = direct_cost(spec, ra, rb, fac)
+    return {"total": d*spec.markup, "direct": d, **{name: fac[:, i] for i, name in enumerate(FACTOR_FIELDS)}}
+
+
+def _chunk_hists(spec: _Spec, n: int, seed_seq: np.random.SeedSequence):
+    return _run_block(spec, [n], [seed_seq])
+
+
+def _chunk_stream(fn, spec: _Spec, sizes: Sequence[int], seeds, workers: int):
+    """fn(spec, n, seed) por chunk y en orden; con workers > 1 en procesos, con pocos chunks en vuelo."""
+    if workers == 1 or len(sizes) == 1:
+        for n, ss in zip(sizes, seeds):
+            yield fn(spec, n, ss)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending = deque()
+        try:
+            for n, ss in zip(sizes, seeds):
+                pending.append(ex.submit(fn, spec, n, ss))
+                if len(pending) >= 2*workers:   # keep chunk order and bounded memory
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:   # consumer stopped early (cancelled): drop what has not started
+            for f in pending:
+                f.cancel()
+
+
+def run_monte_carlo(spec: _Spec, config: MonteCarloConfig | None = None, sink=None,
+                    progress: Optional[Callable[[int, int, StreamingHistogram], None]] = None) -> MonteCarloResult:
+    """
+    Simula en chunks vectorizados y acumula histogramas (memoria acotada, independiente de n_iter).
+    Con la misma semilla los percentiles no dependen de `workers` (una SeedSequence por chunk).
+    `sink` (p. ej. un `columnar.ColumnarWriter`) recibe cada chunk de muestras en orden vía `append`;
+    `progress(hechas, n_iter, histograma_total)` se llama tras cada chunk (si lanza, la simulación se detiene).
+    """
+    cfg = config or MonteCarloConfig()
+    n_iter, chunk = int(cfg.n_iter), max(1, int(cfg.chunk_size))
+    sizes = [chunk]*(n_iter // chunk) + ([n_iter % chunk] if n_iter % chunk else [])
+    seeds = np.random.SeedSequence(cfg.seed).spawn(len(sizes))
+    total = StreamingHistogram(spec.lo, spec.hi, spec.bins)
+    direct = StreamingHistogram(spec.lo_direct, spec.hi_direct, spec.bins)
+
+    workers = max(1, int(cfg.workers))
+    if sink is not None or progress is not None:
+        for out in _chunk_stream(_sample_columns if sink is not None else _chunk_hists, spec, sizes, seeds, workers):
+            if sink is not None:
+                direct.add(out["direct"]); total.add(out["total"])
+                sink.append(out)
+            else:
+                total.merge(out[0]); direct.merge(out[1])
+            if progress is not None:
+                progress(total.n, n_iter, total)
+    elif workers == 1 or len(sizes) == 1:
+        t, d = _run_block(spec, sizes, seeds)
+        total.merge(t); direct.merge(d)
+    else:
+        blocks = np.array_split(np.arange(len(sizes)), min(workers, len(sizes)))
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = [ex.submit(_run_block, spec, [sizes[i] for i in b], [seeds[i] for i in b]) for b in blocks]
+            for f in futures:
+                t, d = f.result()
+                total.merge(t); direct.merge(d)
+    return MonteCarloResult(n=total.n, total=total, direct=direct, seed=cfg.seed)
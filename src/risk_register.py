@@ -0,0 +1,356 @@
+"""
+Registro de riesgos: contingencia simulada a partir de `data/contingency_items.csv`.
+
+Cada concepto es un evento discreto: ocurre con `probabilidad` y, si ocurre, cuesta un % del directo
+muestreado entre `impacto_min_pct` / `impacto_moda_pct` / `impacto_max_pct` (triangular o PERT). Columnas
+vacías = comportamiento plano (probabilidad 1, impacto = `pct_sobre_directo`). Dependencias opcionales:
+  - `grupo`: los conceptos del mismo grupo ocurren a la vez con más frecuencia (cópula gaussiana,
+    correlación `RegisterConfig.group_correlation` entre las latentes de ocurrencia);
+  - `depende_de` / `prob_si_depende`: la probabilidad pasa a `prob_si_depende` cuando ocurre el concepto padre.
+
+Se simula en chunks (latentes n × k, impactos solo de los eventos ocurridos) y se acumula un histograma
+del total más el reparto por concepto en bins gruesos del total, con lo que P50/P80/P90 y la aportación
+de cada concepto (esperanza condicionada a la cola, reescalada al percentil) no guardan las iteraciones.
+
+    python -m src.risk_register [data/contingency_items.csv] --n 1000000 --direct 2500000
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Iterable, Tuple
+from pathlib import Path
+import argparse
+import math
+import sys
+import numpy as np
+import pandas as pd
+
+from src.instrument import timed
+from src.risk import StreamingHistogram, norm_cdf, tri_ppf, _pert_quantiles, _PERT_GRID
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+LEVELS = (50, 80, 90)
+
+
+@dataclass(frozen=True)
+class RiskItem:
+    """Evento de riesgo; impactos en % sobre directo."""
+    name: str
+    probability: float
+    low: float
+    mode: float
+    high: float
+    kind: str = "triangular"
+    group: str = ""
+    parent: str = ""
+    probability_if_parent: Optional[float] = None
+
+
+@dataclass
+class RegisterConfig:
+    n_iter: int = 200_000
+    seed: Optional[int] = None
+    chunk_elements: int = 2_000_000     # latent draws (iterations × items) per chunk
+    group_correlation: float = 0.5
+    bins: int = 8192
+    contribution_bins: int = 1024
+    levels: Tuple[int, ...] = LEVELS
+
+
+def _num(row, col, default: float) -> float:
+    v = row.get(col, None)
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return default
+    return default if math.isnan(v) else v
+
+
+def _text(row, col) -> str:
+    v = row.get(col, "")
+    return "" if v is None or (isinstance(v, float) and math.isnan(v)) else str(v).strip()
+
+
+def items_from_frame(df: pd.DataFrame) -> List[RiskItem]:
+    """Conceptos de contingency_items.csv (o del editor de la app); filas con aplica=False fuera."""
+    if "aplica" in df.columns:
+        df = df[df["aplica"].fillna(False).astype(bool)]
+    rows = df.to_dict("records")
+    names = {_text(r, "concepto") for r in rows}
+    items = []
+    for r in rows:
+        name = _text(r, "concepto")
+        if not name:
+            continue
+        pct = _num(r, "pct_sobre_directo", 0.0)
+        p = _num(r, "probabilidad", 1.0)
+        parent = _text(r, "depende_de")
+        items.append(RiskItem(
+            name=name, probability=p,
+            low=_num(r, "impacto_min_pct", pct), mode=_num(r, "impacto_moda_pct", pct), high=_num(r, "impacto_max_pct", pct),
+            kind=_text(r, "distribucion").lower() or "triangular", group=_text(r, "grupo"),
+            parent=parent if parent in names else "",   # parent switched off in the editor: plain item
+            probability_if_parent=_num(r, "prob_si_depende", p),
+        ))
+    return items
+
+
+def _norm_ppf(p: np.ndarray) -> np.ndarray:
+    """Φ⁻¹ por bisección sobre norm_cdf (solo umbrales, k valores)."""
+    p = np.clip(np.asarray(p, dtype=float), 0.0, 1.0)
+    lo, hi = np.full(p.shape, -9.0), np.full(p.shape, 9.0)
+    for _ in range(60):
+        mid = 0.5*(lo + hi)
+        below = norm_cdf(mid) < p
+        lo = np.where(below, mid, lo)
+        hi = np.where(below, hi, mid)
+    out = 0.5*(lo + hi)
+    out[p <= 0.0] = -np.inf
+    out[p >= 1.0] = np.inf
+    return out
+
+
+@dataclass
+class _Register:
+    names: Tuple[str, ...]
+    low: np.ndarray
+    mode: np.ndarray
+    high: np.ndarray
+    pert: np.ndarray            # indices of PERT items
+    tables: Optional[np.ndarray]  # (len(pert), G)
+    table_row: np.ndarray       # item -> row in tables (-1 if triangular)
+    order: np.ndarray           # internal position -> input position (plain items first, then grouped)
+    n_free: int                 # items [0, n_free) use uniforms, the rest a gaussian latent
+    group_idx: np.ndarray       # (k - n_free,) group of each grouped item
+    n_groups: int
+    thr: np.ndarray             # (k, 1) occurrence thresholds in latent space (uniform or normal)
+    thr_parent: np.ndarray
+    parent: np.ndarray          # parent index or -1
+    levels: List[np.ndarray]    # topological layers of dependent items (depth ≥ 1)
+    probability: np.ndarray
+    rho: float
+
+
+def _compile(items: Sequence[RiskItem], rho: float) -> _Register:
+    if not 0.0 <= rho < 1.0:
+        raise ValueError("group_correlation debe estar en [0, 1)")
+    grouped_flag = [bool(it.group) and rho > 0.0 for it in items]
+    order = np.array(sorted(range(len(items)), key=grouped_flag.__getitem__), dtype=np.int64)
+    items = [items[i] for i in order]
+    names = tuple(it.name for it in items)
+    if len(set(names)) != len(names):
+        raise ValueError("conceptos repetidos en el registro de riesgos")
+    pos = {n: i for i, n in enumerate(names)}
+    k = len(items)
+    low = np.array([it.low for it in items], dtype=float)
+    mode = np.array([it.mode for it in items], dtype=float)
+    high = np.array([it.high for it in items], dtype=float)
+    p = np.array([it.probability for it in items], dtype=float)
+    pp = np.array([it.probability if it.probability_if_parent is None else it.probability_if_parent for it in items], dtype=float)
+    for it, a, c, b, x, y in zip(items, low, mode, high, p, pp):
+        if not 0.0 <= a <= c <= b:
+            raise ValueError(f"{it.name}: se requiere 0 ≤ impacto_min ≤ moda ≤ max")
+        if not (0.0 <= x <= 1.0 and 0.0 <= y <= 1.0):
+            raise ValueError(f"{it.name}: probabilidades en [0, 1]")
+        if it.kind not in ("triangular", "pert"):
+            raise ValueError(f"{it.name}: distribución desconocida {it.kind!r}")
+        if it.parent and it.parent not in pos:
+            raise ValueError(f"{it.name}: depende_de desconocido {it.parent!r}")
+
+    parent = np.array([pos[it.parent] if it.parent else -1 for it in items], dtype=np.int64)
+    depth = np.full(k, -1, dtype=np.int64)
+    for i in range(k):
+        chain, j = [], i
+        while j >= 0 and depth[j] < 0:
+            if j in chain:
+                raise ValueError(f"dependencia circular en {names[j]!r}")
+            chain.append(j)
+            j = parent[j]
+        d = depth[j] if j >= 0 else -1
+        for j in reversed(chain):
+            d += 1
+            depth[j] = d
+    levels = [np.flatnonzero(depth == d) for d in range(1, int(depth.max()) + 1)] if k else []
+
+    is_grouped = np.array([bool(it.group) and rho > 0.0 for it in items], dtype=bool)
+    grouped = np.flatnonzero(is_grouped)
+    groups = sorted({items[i].group for i in grouped})
+    gpos = {g: i for i, g in enumerate(groups)}
+    thr = np.where(is_grouped, _norm_ppf(p), p).astype(np.float32)[:, None]
+    thr_parent = np.where(is_grouped, _norm_ppf(pp), pp).astype(np.float32)[:, None]
+
+    pert = np.array([i for i, it in enumerate(items) if it.kind == "pert" and it.high > it.low], dtype=np.int64)
+    table_row = np.full(k, -1, dtype=np.int64)
+    table_row[pert] = np.arange(len(pert))
+    tables = np.stack([_pert_quantiles(low[i], mode[i], high[i]) for i in pert]) if len(pert) else None
+    return _Register(
+        names=names, low=low, mode=mode, high=high, pert=pert, tables=tables, table_row=table_row,
+        order=order, n_free=k - len(grouped),
+        group_idx=np.array([gpos[items[i].group] for i in grouped], dtype=np.int64), n_groups=len(groups),
+        thr=thr, thr_parent=thr_parent, parent=parent, levels=levels, probability=p, rho=float(rho),
+    )
+
+
+def _occurrences(reg: _Register, n: int, rng: np.random.Generator) -> np.ndarray:
+    """(k, n) booleano; latentes float32 por concepto (filas contiguas)."""
+    k, f = len(reg.names), reg.n_free
+    lat = np.empty((k, n), dtype=np.float32)
+    if f:
+        rng.random((f, n), dtype=np.float32, out=lat[:f])
+    if f < k:
+        z = lat[f:]
+        rng.standard_normal((k - f, n), dtype=np.float32, out=z)
+        z *= math.sqrt(1.0 - reg.rho)
+        common = rng.standard_normal((reg.n_groups, n), dtype=np.float32)
+        common *= math.sqrt(reg.rho)
+        z += common[reg.group_idx]
+    occ = lat < reg.thr
+    for layer in reg.levels:
+        thr = np.where(occ[reg.parent[layer]], reg.thr_parent[layer], reg.thr[layer])
+        occ[layer] = lat[layer] < thr
+    return occ
+
+
+def _impacts(reg: _Register, counts: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Impactos (% del directo) de los eventos ocurridos, ordenados por concepto (`counts` por concepto)."""
+    u = rng.random(int(counts.sum()))
+    out = tri_ppf(u, *(np.repeat(x, counts) for x in (reg.low, reg.mode, reg.high)))
+    if reg.tables is not None:
+        row = np.repeat(reg.table_row, counts)
+        sel = np.flatnonzero(row >= 0)
+        g = _PERT_GRID
+        x = u[sel]*(g - 1)
+        i = np.minimum(x.astype(np.int64), g - 2)
+        flat = reg.tables.ravel()
+        base = row[sel]*g + i
+        lo = flat[base]
+        out[sel] = lo + (x - i)*(flat[base + 1] - lo)
+    return out
+
+
+@dataclass
+class RegisterResult:
+    n: int
+    direct: float
+    total: StreamingHistogram
+    items: pd.DataFrame         # per item: occurrence, mean, var_share, contrib_P50/P80/P90 (€)
+    seed: Optional[int]
+
+    def percentiles(self, ps: Iterable[float] = LEVELS) -> Dict[str, float]:
+        return {f"P{int(p)}": self.total.quantile(p/100.0) for p in ps}
+
+    def pct(self, p: float) -> float:
+        """Contingencia del percentil p como fracción del directo."""
+        return self.total.quantile(p/100.0)/self.direct if self.direct else math.nan
+
+    def summary(self) -> Dict[str, float]:
+        return {"n": self.n, "mean": self.total.mean, "std": self.total.std,
+                "min": self.total.min, "max": self.total.max, **self.percentiles()}
+
+
+@timed("risk_register.simulate")
+def simulate_register(items: Sequence[RiskItem], direct: float = 1.0,
+                      config: RegisterConfig | None = None) -> RegisterResult:
+    """
+    Contingencia simulada (€ si `direct` es el coste directo; fracción si direct=1).
+    Aportación por concepto al percentil p: E[concepto | total ≥ Pp] reescalada para sumar Pp.
+    """
+    cfg = config or RegisterConfig()
+    reg = _compile(items, cfg.group_correlation)
+    k = len(reg.names)
+    scale = float(direct)/100.0
+    hi = float(reg.high.sum())*scale
+    total = StreamingHistogram(0.0, hi, int(cfg.bins))
+    cb = max(1, int(cfg.contribution_bins))
+    by_bin = np.zeros(cb*k)
+    bin_n = np.zeros(cb, dtype=np.int64)
+    item_sum, item_cross, item_occ = np.zeros(k), np.zeros(k), np.zeros(k, dtype=np.int64)
+
+    n_iter = int(cfg.n_iter)
+    chunk = max(1, int(cfg.chunk_elements) // max(k, 1))
+    sizes = [chunk]*(n_iter // chunk) + ([n_iter % chunk] if n_iter % chunk else [])
+    for n, ss in zip(sizes, np.random.SeedSequence(cfg.seed).spawn(len(sizes))):
+        rng = np.random.default_rng(ss)
+        if not k:
+            total.add(np.zeros(n))
+            bin_n[0] += n
+            continue
+        cols, rows = np.divmod(np.flatnonzero(_occurrences(reg, n, rng)), n)
+        counts = np.bincount(cols, minlength=k)
+        amount = _impacts(reg, counts, rng)
+        amount *= scale
+        t = np.bincount(rows, weights=amount, minlength=n)
+        total.add(t)
+        b = np.minimum((t*(cb/hi)).astype(np.int64), cb - 1) if hi > 0 else np.zeros(n, dtype=np.int64)
+        bin_n += np.bincount(b, minlength=cb)
+        by_bin += np.bincount(b[rows]*k + cols, weights=amount, minlength=cb*k)
+        item_sum += np.bincount(cols, weights=amount, minlength=k)
+        item_cross += np.bincount(cols, weights=amount*t[rows], minlength=k)
+        item_occ += counts
+
+    n = max(total.n, 1)
+    by_bin = by_bin.reshape(cb, k)
+    mean = item_sum/n
+    var = total.std**2 if total.n > 1 else 0.0
+    cov = item_cross/n - mean*total.mean
+    frame = pd.DataFrame({
+        "item": list(reg.names), "probability": reg.probability, "occurrence": item_occ/n,
+        "mean": mean, "mean_pct": mean/scale if scale else np.nan,
+        "var_share": cov/var if var > 0 else np.zeros(k),
+    })
+    width = hi/cb if hi > 0 else 1.0
+    for p in cfg.levels:
+        q = total.quantile(p/100.0)
+        j = min(int(q/width), cb - 1) if hi > 0 else 0
+        frac = min(max((j + 1) - q/width, 0.0), 1.0)   # share of bin j above the percentile
+        tail = by_bin[j + 1:].sum(axis=0) + frac*by_bin[j]
+        tail_n = bin_n[j + 1:].sum() + frac*bin_n[j]
+        cte = tail/tail_n if tail_n > 0 else mean
+        s = cte.sum()
+        frame[f"contrib_P{int(p)}"] = cte*(q/s) if s > 0 else np.zeros(k)
+    frame.index = reg.order
+    frame = frame.sort_index()
+    return RegisterResult(n=total.n, direct=float(direct), total=total, items=frame, seed=cfg.seed)
+
+
+def synthetic_register(k: int, seed: int = 0) -> List[RiskItem]:
+    """Registro sintético de k conceptos (benchmarks): grupos, PERT y cadenas de dependencias."""
+    rng = np.random.default_rng(seed)
+    items = []
+    for i in range(k):
+        lo = float(rng.uniform(0.0, 0.3))
+        mo = lo + float(rng.uniform(0.0, 0.5))
+        hi_ = mo + float(rng.uniform(0.1, 1.5))
+        parent = f"r{i - 1 - int(rng.integers(0, min(i, 8)))}" if i and rng.random() < 0.2 else ""
+        items.append(RiskItem(f"r{i}", float(rng.uniform(0.05, 0.6)), lo, mo, hi_,
+                              kind="pert" if i % 3 == 0 else "triangular",
+                              group=f"g{i % 12}" if i % 2 else "", parent=parent,
+                              probability_if_parent=float(rng.uniform(0.5, 0.95))))
+    return items
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.risk_register",
+                                 description="Contingencia simulada (P50/P80/P90) de un registro de riesgos.")
+    ap.add_argument("input", nargs="?", default=None, help="CSV con columnas de contingency_items.csv "
+                                                          "(por defecto data/contingency_items.csv)")
+    ap.add_argument("--n", type=int, default=200_000, help="iteraciones")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--direct", type=float, default=100.0, help="coste directo (€); 100 = resultados en %%")
+    ap.add_argument("--rho", type=float, default=RegisterConfig.group_correlation, help="correlación dentro de cada grupo")
+    ap.add_argument("--synthetic", type=int, default=0, help="ignora el CSV y usa k conceptos sintéticos")
+    args = ap.parse_args(argv)
+
+    if args.synthetic:
+        items = synthetic_register(args.synthetic)
+    else:
+        items = items_from_frame(pd.read_csv(args.input or DATA_DIR / "contingency_items.csv"))
+    res = simulate_register(items, args.direct, RegisterConfig(n_iter=args.n, seed=args.seed, group_correlation=args.rho))
+    with pd.option_context("display.width", 160, "display.max_rows", 40):
+        print(res.items.round(4).to_string(index=False))
+    pcts = "  ".join(f"{k} {v:,.2f}" for k, v in res.percentiles().items())
+    print(f"{res.n:,} iteraciones, {len(items)} conceptos | media {res.total.mean:,.2f}  {pcts}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,147 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Any, Tuple, Optional, Iterable, Callable
+import numpy as np
+import pandas as pd
+
+from src.calculations import Factors, FACTOR_RANGES, FACTOR_LABELS
+from src.model import CostModel
+from src.risk import FACTOR_FIELDS, MonteCarloConfig, build_spec, direct_cost, _Spec
+
+
+def _piecewise(u: np.ndarray, low, base, high) -> np.ndarray:
+    """u ∈ [0, 1] → low..base..high, con base en u = 0.5."""
+    return np.where(u < 0.5, base - (1.0 - 2.0*u)*(base - low), base + (2.0*u - 1.0)*(high - base))
+
+
+@dataclass
+class SensitivityModel:
+    """
+    Total (€) como función vectorizada de k entradas normalizadas u ∈ [0, 1]:
+    los 9 factores (rango de los sliders), el €/m² de cada capítulo (escenario bajo → alto, sobre y
+    bajo rasante a la vez) y los % de soft costs / contingencia. u = 0.5 reproduce la estimación base.
+    La calibración a benchmark se mantiene fija (como en Monte Carlo).
+    """
+    spec: _Spec
+    names: Tuple[str, ...]
+    labels: Tuple[str, ...]
+    kinds: Tuple[str, ...]     # factor / rate / pct
+    low: np.ndarray            # (k,) valor en u = 0 (para capítulos: €/m² sobre rasante)
+    base: np.ndarray
+    high: np.ndarray
+    _rate_cols: np.ndarray     # chapter column in spec for each rate input
+
+    @property
+    def k(self) -> int:
+        return len(self.names)
+
+    def evaluate(self, u: np.ndarray) -> np.ndarray:
+        u = np.atleast_2d(np.asarray(u, dtype=float))
+        s = self.spec
+        nf = len(FACTOR_FIELDS)
+        fac = _piecewise(u[:, :nf], self.low[:nf], self.base[:nf], self.high[:nf])
+        n, nr = len(u), len(self._rate_cols)
+        ur = np.full((n, s.rates_a.shape[1]), 0.5)
+        ur[:, self._rate_cols] = u[:, nf:nf + nr]
+        ra = _piecewise(ur, *s.rates_a)
+        rb = _piecewise(ur, *s.rates_b) if s.has_below else None
+        soft = _piecewise(u[:, -2], self.low[-2], self.base[-2], self.high[-2])
+        cont = _piecewise(u[:, -1], self.low[-1], self.base[-1], self.high[-1])
+        markup = 1.0 + s.pcts["indirects"] + s.pcts["gg_bi"] + soft + cont
+        return direct_cost(s, ra, rb, fac)*markup
+
+    def base_total(self) -> float:
+        return float(self.evaluate(np.full((1, self.k), 0.5))[0])
+
+
+def build_model(model: CostModel, module_key: str, scenario: str, m2_above: float, m2_below: float,
+                factors: Factors, options: Dict[str, Any] | None = None,
+                chapters: Iterable[str] | None = None, include_optional: bool = True,
+                calibration: float = 1.0, ranges: Dict[str, Tuple[float, float]] | None = None,
+                pct_span: float = 0.5) -> SensitivityModel:
+    """
+    `ranges` sustituye los rangos de FACTOR_RANGES (p.ej. localización × factor ciudad); si el valor
+    actual queda fuera del rango, el rango se amplía hasta él. Soft/contingencia varían ±pct_span.
+    """
+    rng = {**FACTOR_RANGES, **(ranges or {})}
+    spec = build_spec(model, module_key, scenario, m2_above, m2_below, factors, options=options,
+                      chapters=chapters, include_optional=include_optional, calibration=calibration,
+                      config=MonteCarloConfig(factor_spread=0.0))
+    names, labels, kinds, low, base, high = [], [], [], [], [], []
+    for f in FACTOR_FIELDS:
+        v = float(getattr(factors, f))
+        lo, hi = rng[f]
+        names.append(f); labels.append(FACTOR_LABELS[f]); kinds.append("factor")
+        low.append(min(lo, v)); base.append(v); high.append(max(hi, v))
+
+    cm = model.module(module_key)
+    label_of = dict(zip(cm.keys, cm.labels))
+    ranged = (spec.rates_a[2] > spec.rates_a[0])
+    if spec.has_below:
+        ranged |= spec.rates_b[2] > spec.rates_b[0]
+    rate_cols = np.flatnonzero(ranged)
+    for j in rate_cols:
+        key = spec.chapter_keys[j]
+        names.append("rate:" + key); labels.append(f"€/m² {label_of[key]}"); kinds.append("rate")
+        low.append(float(spec.rates_a[0, j])); base.append(float(spec.rates_a[1, j])); high.append(float(spec.rates_a[2, j]))
+
+    for key, label in (("soft", "% soft costs"), ("contingency", "% contingencia")):
+        v = float(spec.pcts[key])
+        names.append("pct:" + key); labels.append(label); kinds.append("pct")
+        low.append(v*(1.0 - pct_span)); base.append(v); high.append(v*(1.0 + pct_span))
+
+    return SensitivityModel(spec=spec, names=tuple(names), labels=tuple(labels), kinds=tuple(kinds),
+                            low=np.array(low), base=np.array(base), high=np.array(high),
+                            _rate_cols=rate_cols)
+
+
+def tornado(sm: SensitivityModel) -> pd.DataFrame:
+    """Δ total (€) llevando cada entrada a su extremo bajo y alto con el resto en su valor base (2k + 1 evaluaciones)."""
+    k = sm.k
+    u = np.full((2*k + 1, k), 0.5)
+    idx = np.arange(k)
+    u[idx, idx] = 0.0
+    u[k + idx, idx] = 1.0
+    f = sm.evaluate(u)
+    base = f[-1]
+    df = pd.DataFrame({"input": sm.names, "label": sm.labels, "kind": sm.kinds,
+                       "value_low": sm.low, "value_base": sm.base, "value_high": sm.high,
+                       "delta_low": f[:k] - base, "delta_high": f[k:2*k] - base})
+    df["swing"] = (df["delta_high"] - df["delta_low"]).abs()
+    df.attrs["base_total"] = float(base)
+    return df.sort_values("swing", ascending=False, ignore_index=True)
+
+
+def sobol(sm: SensitivityModel, n: int = 4096, seed: Optional[int] = 0, chunk_size: int = 8192,
+          progress: Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
+    """
+    Índices de Sobol de primer orden (Saltelli 2010) y totales (Jansen) con entradas uniformes en [0, 1]:
+    N·(k + 2) evaluaciones en bloques de `chunk_size` filas. `progress(hechas, total)` tras cada entrada.
+    """
+    k = sm.k
+    rng = np.random.default_rng(seed)
+    a = rng.random((n, k))
+    b = rng.random((n, k))
+
+    def _eval(x: np.ndarray) -> np.ndarray:
+        return np.concatenate([sm.evaluate(x[i:i + chunk_size]) for i in range(0, len(x), chunk_size)]) \
+            if len(x) else np.zeros(0)
+
+    fa, fb = _eval(a), _eval(b)
+    if progress is not None:
+        progress(2*n, n*(k + 2))
+    var = float(np.var(np.concatenate([fa, fb])))
+    s1, st_ = np.zeros(k), np.zeros(k)
+    if var > 0:
+        for i in range(k):
+            abi = a.copy()
+            abi[:, i] = b[:, i]
+            fabi = _eval(abi)
+            s1[i] = float(np.mean(fb*(fabi - fa)))/var
+            st_[i] = 0.5*float(np.mean((fa - fabi)**2))/var
+            if progress is not None:
+                progress(n*(i + 3), n*(k + 2))
+    df = pd.DataFrame({"input": sm.names, "label": sm.labels, "kind": sm.kinds, "S1": s1, "ST": st_})
+    df.attrs.update({"n": n, "evaluations": n*(k + 2), "mean": float(np.mean(np.concatenate([fa, fb]))),
+                     "std": var**0.5})
+    return df.sort_values("ST", ascending=False, ignore_index=True)
@@ -0,0 +1,452 @@
+"""
+Servicio HTTP local (ASGI, sin framework) sobre el modelo de estimación.
+
+    python -m src.service --port 8000          # requiere uvicorn
+
+GET  /health
+POST /estimate          {"module": ..., "m2_above": ..., ...}   → totales por escenario + totals_table
+POST /estimate/bulk     {"projects": [...]}                     → lista de resultados ({"error"} por elemento)
+POST /report.pdf        {... proyecto ..., "scenario": "mid", "project_name": "..."} → PDF
+POST /design/search     {... proyecto ..., "vary": [...], "budget_eur_m2": X, "step": 0.01} → frente de Pareto
+
+El modelo se carga una vez al arrancar. Las peticiones concurrentes a /estimate se agrupan en una
+sola evaluación vectorizada (micro-batching) y las respuestas para entradas normalizadas idénticas
+salen de una caché LRU.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import fields
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import tempfile
+import pandas as pd
+
+from src.calculations import Factors, SCENARIOS, SCENARIO_LABELS, totals_table
+from src.model import CostModel, load_model
+from src.batch import prepare_projects, benchmark_keys
+from src.portfolio import estimate_portfolio, _TRUE_STRINGS, _FALSE_STRINGS
+from src import estimate_cache
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+FACTOR_FIELDS = [f.name for f in fields(Factors)]
+INPUT_FIELDS = ["module","scenario","m2_above","m2_below","city","province","ine_code","benchmark_key","auto_calibrate",
+                "building_use","intervention_level","reform_level","use","include_furniture",
+                "soft_items_pct","cont_items_pct"] + FACTOR_FIELDS
+# /design/search limits (the request may ask for less, never for more)
+DESIGN_MAX_CONFIGS = 2_000_000
+DESIGN_MIN_STEP = 0.005
+DESIGN_MAX_TOP = 1000
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def normalize(payload: Dict[str, Any], model: CostModel) -> Dict[str, Any]:
+    """Entrada canónica: solo campos conocidos, sin nulos, numéricos como float."""
+    if not isinstance(payload, dict):
+        raise BadRequest("se esperaba un objeto JSON")
+    module = payload.get("module")
+    if module not in model.modules:
+        raise BadRequest(f"module desconocido: {module!r}")
+    scenario = payload.get("scenario")
+    if scenario is not None and scenario not in SCENARIOS:
+        raise BadRequest(f"scenario desconocido: {scenario!r}")
+    out = {}
+    for k in INPUT_FIELDS:
+        v = payload.get(k)
+        if v is None or v == "":
+            continue
+        if k in FACTOR_FIELDS or k in ("m2_above","m2_below","soft_items_pct","cont_items_pct"):
+            try:
+                v = float(v)
+            except (TypeError, ValueError) as e:
+                raise BadRequest(f"{k}: número no válido") from e
+            if not math.isfinite(v):
+                raise BadRequest(f"{k}: número no válido")
+        elif k in ("auto_calibrate","include_furniture"):
+            v = _parse_bool(k, v)
+        out[k] = v
+    return out
+
+
+def _parse_bool(name: str, v: Any) -> bool:
+    """Booleano JSON o texto como en los CSV de cartera ("false"/"no"/"0" → False)."""
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, (int, float)) and v in (0, 1):
+        return bool(v)
+    text = str(v).strip().lower()
+    if text in _TRUE_STRINGS:
+        return True
+    if text in _FALSE_STRINGS:
+        return False
+    raise BadRequest(f"{name}: se esperaba un booleano, no {v!r}")
+
+
+def cache_key(norm: Dict[str, Any]) -> str:
+    return json.dumps(norm, sort_keys=True, separators=(",",":"))
+
+
+def estimate_many(model: CostModel, inputs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Una sola evaluación vectorizada para todas las entradas (todas normalizadas)."""
+    rows = []
+    for i, inp in enumerate(inputs):
+        scs = [inp["scenario"]] if "scenario" in inp else SCENARIOS
+        for sc in scs:
+            rows.append({**inp, "scenario": sc, "project": i})
+    projects = prepare_projects(model, pd.DataFrame(rows))
+    totals = estimate_portfolio(model, projects).totals
+    results: List[Dict[str, Any]] = [{"scenarios": {}} for _ in inputs]
+    if "location_match" in projects.columns:  # same flag as the batch output (ninguno = national factor)
+        first = projects[~projects.index.duplicated()]
+        for i, m in zip(first.index, first["location_match"]):
+            results[int(i)]["location_match"] = m
+    for rec in totals.to_dict("records"):
+        i = int(rec.pop("project"))
+        sc = rec.pop("scenario")
+        rec.pop("module")
+        results[i]["scenarios"][sc] = {k: float(v) for k, v in rec.items()}
+    for inp, res in zip(inputs, results):
+        cm = model.module(inp["module"])
+        m2a, m2b = inp.get("m2_above", 0.0), inp.get("m2_below", 0.0)
+        area_ref = (m2a + m2b) if cm.area_split else m2a
+        tab = totals_table(res["scenarios"], float(area_ref))
+        res.setdefault("location_match", None)
+        res["module"] = inp["module"]
+        res["area_ref_m2"] = float(area_ref)
+        res["totals_table"] = json.loads(tab.to_json(orient="records"))
+    return results
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value) -> None:
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+
+class MicroBatcher:
+    """Agrupa peticiones concurrentes (hasta max_batch o max_wait_ms) en una evaluación."""
+
+    def __init__(self, model: CostModel, max_batch: int = 256, max_wait_ms: float = 2.0):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.batches = 0
+        self.items = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, norm: Dict[str, Any]) -> Dict[str, Any]:
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((norm, fut))
+        return await fut
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = await loop.run_in_executor(None, estimate_many, self.model, [b[0] for b in batch])
+            except Exception:
+                # one bad input must not fail its neighbours: retry one by one
+                for norm, fut in batch:
+                    try:
+                        res = (await loop.run_in_executor(None, estimate_many, self.model, [norm]))[0]
+                    except Exception as e:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    else:
+                        if not fut.done():
+                            fut.set_result(res)
+                continue
+            for (_, fut), res in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(res)
+
+
+def _estimate_one(model: CostModel, norm: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return estimate_many(model, [norm])[0]
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def render_pdf(model: CostModel, norm: Dict[str, Any], scenario: str, project_name: str = "") -> bytes:
+    from src.pdf_report import export_pdf, ReportInputs
+
+    projects = prepare_projects(model, pd.DataFrame([{**norm, "scenario": scenario}]))
+    p = projects.iloc[0]
+    module_key = norm["module"]
+    module_def = model.cost_data["modules"][module_key]
+    factors = Factors(**{k: float(p[k]) if k in p and pd.notna(p[k]) else 1.0 for k in FACTOR_FIELDS})
+    options = {k: norm[k] for k in ("building_use","intervention_level","reform_level","use","include_furniture") if k in norm}
+    options["soft_items_pct"] = float(p["soft_items_pct"])
+    options["cont_items_pct"] = float(p["cont_items_pct"])
+    bench_row = {("pem_"+sc): (None if pd.isna(p["pem_"+sc]) else float(p["pem_"+sc])) for sc in SCENARIOS}
+    bench_key = benchmark_keys(projects).iloc[0]   # same row as /estimate (incl. office fit-out)
+    bench_full = model.benchmark_rows.get(bench_key) if bench_key else None
+    df, totals = estimate_cache.shared().estimate_module(model.cost_data, module_key, scenario, norm.get("m2_above",0.0),
+                                                         norm.get("m2_below",0.0), factors, options=options, benchmark_row=bench_row,
+                                                         auto_calibrate_to_benchmark=bool(norm.get("auto_calibrate", False)))
+    cm = model.module(module_key)
+    inp = ReportInputs(
+        title=f"Informe CAPEX PRO - {project_name}".strip(" -"),
+        module_label=module_def["label"],
+        area_label="m² construidos" if cm.area_split else "m²",
+        m2_above=float(norm.get("m2_above",0.0)), m2_below=float(norm.get("m2_below",0.0)),
+        scenario_label=SCENARIO_LABELS[scenario],
+        building_use=module_def.get("use_profiles",{}).get(norm.get("building_use"),{}).get("label",""),
+        factors={k: getattr(factors, k) for k in FACTOR_FIELDS},
+        options={k: str(v) for k, v in options.items()},
+        notes="Estimación paramétrica orientativa.",
+    )
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td) / "capex.pdf"
+        export_pdf(path, inp, df, totals, model.sources, bench_full)
+        return path.read_bytes()
+
+
+class EstimatorApp:
+    """Aplicación ASGI."""
+
+    def __init__(self, data_dir: str | Path = DATA_DIR, cache_size: int = 4096,
+                 max_batch: int = 256, max_wait_ms: float = 2.0):
+        self.data_dir = Path(data_dir)
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.model: Optional[CostModel] = None
+        self.batcher: Optional[MicroBatcher] = None
+        self.cache = LRUCache(cache_size)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._startup_lock: Optional[asyncio.Lock] = None
+
+    async def startup(self) -> None:
+        if self.model is not None:
+            return
+        self.model = load_model(self.data_dir)
+        self.batcher = MicroBatcher(self.model, self.max_batch, self.max_wait_ms)
+        self.batcher.start()
+
+    async def _ensure_started(self) -> None:
+        """Arranque perezoso (servidores sin lifespan): una sola vez aunque lleguen peticiones concurrentes."""
+        if self._startup_lock is None:
+            self._startup_lock = asyncio.Lock()
+        async with self._startup_lock:
+            await self.startup()
+
+    async def shutdown(self) -> None:
+        if self.batcher:
+            await self.batcher.stop()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                msg = await receive()
+                if msg["type"] == "lifespan.startup":
+                    await self.startup()
+                    await send({"type": "lifespan.startup.complete"})
+                elif msg["type"] == "lifespan.shutdown":
+                    await self.shutdown()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        if self.batcher is None:  # servers without lifespan support
+            await self._ensure_started()
+        method, path = scope["method"], scope["path"]
+        try:
+            if method == "GET" and path == "/health":
+                status, body, ctype = 200, self._health(), "application/json"
+            elif method == "POST" and path in ("/estimate", "/estimate/bulk", "/report.pdf", "/design/search"):
+                payload = await _read_json(receive)
+                if path == "/estimate":
+                    status, body, ctype = 200, await self.estimate(payload), "application/json"
+                elif path == "/estimate/bulk":
+                    status, body, ctype = 200, await self.estimate_bulk(payload), "application/json"
+                elif path == "/design/search":
+                    status, body, ctype = 200, await self.design_search(payload), "application/json"
+                else:
+                    status, body, ctype = 200, await self.report(payload), "application/pdf"
+            else:
+                status, body, ctype = 404, {"error": "not found"}, "application/json"
+        except BadRequest as e:
+            status, body, ctype = 400, {"error": str(e)}, "application/json"
+        except KeyError as e:
+            status, body, ctype = 400, {"error": f"valor desconocido: {e}"}, "application/json"
+        except Exception as e:  # model/pipeline failure: the client still gets an answer
+            status, body, ctype = 500, {"error": f"{type(e).__name__}: {e}"}, "application/json"
+        data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", ctype.encode()), (b"content-length", str(len(data)).encode())]})
+        await send({"type": "http.response.body", "body": data})
+
+    def _health(self) -> Dict[str, Any]:
+        return {"status": "ok", "fingerprint": self.model.fingerprint,
+                "cache": {"size": len(self.cache.data), "hits": self.cache.hits, "misses": self.cache.misses},
+                "estimate_cache": estimate_cache.shared().stats(),
+                "batches": self.batcher.batches, "batched_items": self.batcher.items}
+
+    async def estimate(self, payload) -> Dict[str, Any]:
+        norm = normalize(payload, self.model)
+        key = cache_key(norm)
+        res = self.cache.get(key)
+        if res is not None:
+            return res
+        pending = self._inflight.get(key)
+        if pending is not None:  # identical request already being computed
+            return await asyncio.shield(pending)
+        pending = asyncio.ensure_future(self.batcher.submit(norm))
+        self._inflight[key] = pending
+        try:
+            res = await pending
+            self.cache.put(key, res)
+        finally:
+            self._inflight.pop(key, None)
+        return res
+
+    async def estimate_bulk(self, payload) -> Dict[str, Any]:
+        projects = payload.get("projects") if isinstance(payload, dict) else payload
+        if not isinstance(projects, list):
+            raise BadRequest("se esperaba {'projects': [...]}")
+        # errors are reported per item: one bad project does not fail the batch
+        results: List[Any] = [None]*len(projects)
+        norms: Dict[int, Dict[str, Any]] = {}
+        for i, p in enumerate(projects):
+            try:
+                norms[i] = normalize(p, self.model)
+            except BadRequest as e:
+                results[i] = {"error": str(e)}
+        keys = {i: cache_key(n) for i, n in norms.items()}
+        todo = []
+        for i, k in keys.items():
+            results[i] = self.cache.get(k)
+            if results[i] is None:
+                todo.append(i)
+        if todo:
+            loop = asyncio.get_running_loop()
+            try:
+                fresh = await loop.run_in_executor(None, estimate_many, self.model, [norms[i] for i in todo])
+            except Exception:
+                fresh = [await loop.run_in_executor(None, _estimate_one, self.model, norms[i]) for i in todo]
+            for i, r in zip(todo, fresh):
+                results[i] = r
+                if "error" not in r:
+                    self.cache.put(keys[i], r)
+        return {"results": results}
+
+    async def report(self, payload) -> bytes:
+        norm = normalize(payload, self.model)
+        scenario = payload.get("scenario") or "mid"
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, render_pdf, self.model, norm, scenario, str(payload.get("project_name","")))
+
+
+    async def design_search(self, payload) -> Dict[str, Any]:
+        norm = normalize(payload, self.model)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, design_search, self.model, norm, payload)
+
+
+def design_search(model: CostModel, norm: Dict[str, Any], payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Búsqueda de diseño para un proyecto normalizado; ciudad → localización como en /estimate."""
+    from src.design_space import build_space, search, SPEC_FACTORS
+    proj = prepare_projects(model, pd.DataFrame([norm]), use_items=False).iloc[0]
+    factors = Factors(**{f: float(proj[f]) for f in FACTOR_FIELDS if f in proj.index and pd.notna(proj[f])})
+    options = {k: norm[k] for k in ("building_use","intervention_level","reform_level","use","include_furniture",
+                                    "soft_items_pct","cont_items_pct") if k in norm}
+    vary = payload.get("vary") or list(SPEC_FACTORS) + ["intervention_level","reform_level","include_furniture"]
+    budget = payload.get("budget_eur_m2")
+    try:
+        # server-side limits: one request must not hold an executor thread indefinitely
+        step = float(payload.get("step", 0.01))
+        max_configs = min(int(payload.get("max_configs", DESIGN_MAX_CONFIGS)), DESIGN_MAX_CONFIGS)
+        top = min(int(payload.get("top", 200)), DESIGN_MAX_TOP)
+        if not step > 0 or max_configs < 1 or top < 1:
+            raise ValueError("step debe ser > 0 y max_configs y top ≥ 1")
+        step = max(step, DESIGN_MIN_STEP)
+        space = build_space(model, norm["module"], norm.get("m2_above", 0.0), norm.get("m2_below", 0.0), factors,
+                            options, scenario=norm.get("scenario", "mid"), vary=list(vary),
+                            step=step, weights=payload.get("weights"))
+        res = search(space, budget_eur_m2=float(budget) if budget is not None else None, max_configs=max_configs)
+    except (TypeError, ValueError) as e:
+        raise BadRequest(f"búsqueda: {e}") from e
+    return {"size": res.stats["size"], "evaluated": res.evaluated, "sampled": res.sampled, "feasible": res.feasible,
+            "seconds": res.seconds, "front": res.front.head(top).to_dict("records"),
+            "best": res.best.to_dict("records")}
+
+
+async def _read_json(receive):
+    chunks = []
+    while True:
+        msg = await receive()
+        chunks.append(msg.get("body", b""))
+        if not msg.get("more_body"):
+            break
+    try:
+        return json.loads(b"".join(chunks) or b"{}")
+    except json.JSONDecodeError as e:
+        raise BadRequest("JSON no válido") from e
+
+
+app = EstimatorApp()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.service", description="Servicio HTTP de estimación CAPEX.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    args = ap.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("Se necesita un servidor ASGI: pip install uvicorn")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,417 @@
+"""
+Análisis de variaciones entre dos estimaciones (versiones, escenarios o carteras): qué cambió y por qué.
+
+Cada capítulo es un producto de factores, igual que en `estimate_module`:
+
+    coste = (€/m² sobre · m² sobre + €/m² bajo · m² bajo) · factor_capitulo · uso · Factors · módulo · calibración
+
+y el total es directo · (1 + indirectos + GG/BI + soft + contingencia). `decompose(old, new)` reparte el Δ
+de cada capítulo entre tarifa, superficie, factores, multiplicador de módulo, perfil de uso, calibración y
+alcance (capítulos que entran o salen) con LMDI (media logarítmica, exacto y sin depender del orden), y el Δ
+del total añade los efectos de indirectos, GG/BI, soft costs y contingencia. Todo en arrays por módulo:
+una cartera entera se compara de una vez.
+
+    old = drivers_from_frame(pd.read_csv("v3.csv"))           # CSV exportado por la app (columnas factor_*)
+    new = drivers_from_portfolio(model, proyectos_v4)          # o una cartera (estimate_portfolio)
+    var = decompose(old, new); var.by_driver(); var.chapters; var.totals
+
+    python -m src.variance v3.csv v4.csv [--old-data datos_v3/] [-o variaciones.csv] [--chapters capitulos.csv]
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+import argparse
+import sys
+import numpy as np
+import pandas as pd
+
+from src.calculations import SCENARIOS, _is_mep
+from src.model import CostModel, compiled_modules
+from src.portfolio import estimate_portfolio, FACTOR_FIELDS, _column, _expand_scenarios
+
+DIRECT_DRIVERS = ("rate","area","factor","module_mult","use","calibration","scope")
+MARKUP_DRIVERS = ("indirects","gg_bi","soft","contingency")
+TOTAL_DRIVERS = DIRECT_DRIVERS + MARKUP_DRIVERS
+DRIVER_LABELS = {
+    "rate": "Tarifa €/m²", "area": "Superficie", "factor": "Factores", "module_mult": "Multiplicador de módulo",
+    "use": "Perfil de uso", "calibration": "Calibración", "scope": "Alcance (capítulos)",
+    "indirects": "Indirectos", "gg_bi": "GG+BI", "soft": "Soft costs", "contingency": "Contingencia",
+}
+KEYS = ["project","module","scenario"]
+PCT_COLUMNS = ["indirects_pct","gg_bi_pct","soft_pct","cont_pct"]
+
+
+@dataclass
+class DriverBlock:
+    """Factores de las filas de un módulo (n estimaciones × k capítulos)."""
+    keys: Tuple[str, ...]
+    labels: Tuple[str, ...]
+    rows: np.ndarray       # positions into Drivers.index
+    cost: np.ndarray       # (n, k) direct cost, 0 where excluded
+    included: np.ndarray   # (n, k) bool
+    rate_a: np.ndarray     # (n, k) €/m² above (or single)
+    rate_b: np.ndarray     # (n, k) €/m² below, 0 for single-rate chapters
+    m2_above: np.ndarray   # (n,)
+    m2_below: np.ndarray   # (n,)
+    chapter: np.ndarray    # (n, k) factor_capitulo (intensidad MEP / acabados)
+    use: np.ndarray        # (n, k) use profile multiplier of the chapter (× overall)
+    factors: np.ndarray    # (n,) Factors.combined()
+    module_mult: np.ndarray
+    calibration: np.ndarray
+
+
+@dataclass
+class Drivers:
+    index: pd.DataFrame            # KEYS + PCT_COLUMNS, one row per estimate
+    blocks: Dict[str, DriverBlock]
+
+
+@dataclass
+class Variance:
+    totals: pd.DataFrame      # KEYS, old, new, delta, TOTAL_DRIVERS, residual
+    chapters: pd.DataFrame    # KEYS, chapter_key, capitulo, old, new, delta, DIRECT_DRIVERS, residual (direct)
+
+    def by_driver(self) -> pd.Series:
+        """Δ total de todas las estimaciones por causa (€)."""
+        return self.totals[list(TOTAL_DRIVERS)].sum().rename(DRIVER_LABELS)
+
+    def by_chapter(self, n: Optional[int] = None) -> pd.DataFrame:
+        """Δ directo por módulo × capítulo y causa, de mayor a menor |Δ|."""
+        cols = ["old","new","delta", *DIRECT_DRIVERS]
+        out = self.chapters.groupby(["module","capitulo"], sort=False)[cols].sum().reset_index()
+        out = out.reindex(out["delta"].abs().sort_values(ascending=False).index).reset_index(drop=True)
+        return out.head(n) if n else out
+
+    def summary(self) -> Dict[str, float]:
+        t = self.totals
+        return {"estimates": len(t), "old": float(t["old"].sum()), "new": float(t["new"].sum()),
+                "delta": float(t["delta"].sum()), "max_residual": float(t["residual"].abs().max()) if len(t) else 0.0}
+
+
+# --- drivers ---------------------------------------------------------------------------------------------
+
+def _index(df: pd.DataFrame) -> pd.DataFrame:
+    return df[KEYS + PCT_COLUMNS].reset_index(drop=True)
+
+
+def drivers_from_frame(df: pd.DataFrame, project: Any = "", module: str = "", scenario: str = "") -> Drivers:
+    """
+    Desde filas con las columnas de `estimate_module` (una por estimación × capítulo incluido): CSV exportado
+    por la app o `EstimateResult.to_frame()`. Sin project/module/scenario se usan los argumentos; sin las
+    columnas de % (indirects_pct, gg_bi_pct, soft_pct, cont_pct) el total es el directo.
+    """
+    df = df.reset_index(drop=True)
+    for col, default in (("project", project), ("module", module), ("scenario", scenario)):
+        if col not in df.columns:
+            df[col] = default
+    for col in PCT_COLUMNS:
+        if col not in df.columns:
+            df[col] = 0.0
+    est = df.groupby(KEYS, sort=False, dropna=False).ngroup().to_numpy()
+    first = np.unique(est, return_index=True)[1]
+    index = _index(df.iloc[first])
+    num = {c: pd.to_numeric(df[c], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+           for c in ("eur_m2_above","eur_m2_below","m2_above","m2_below","cost_direct","factor_capitulo","factor_global",
+                     "factor_use_arch","factor_use_mep","factor_use_overall","factor_module","factor_calibration")}
+    keys_all = df["chapter_key"].astype(str).to_numpy()
+    mep = np.fromiter((_is_mep(k) for k in keys_all), bool, len(keys_all))
+    use = np.where(mep, num["factor_use_mep"], num["factor_use_arch"]) * num["factor_use_overall"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factors = np.where(num["factor_module"] != 0, num["factor_global"]/num["factor_module"], 0.0)
+
+    blocks: Dict[str, DriverBlock] = {}
+    modules = df["module"].astype(str).to_numpy()
+    for module_key in pd.unique(modules):
+        sel = np.flatnonzero(modules == module_key)
+        rows, r = np.unique(est[sel], return_inverse=True)
+        order = pd.unique(keys_all[sel])                   # chapter order of appearance
+        c = pd.Index(order).get_indexer(keys_all[sel])
+        n, k = len(rows), len(order)
+        labels = dict(zip(keys_all[sel], df["capitulo"].astype(str).to_numpy()[sel]))
+
+        def grid(values: np.ndarray, fill: float = 0.0) -> np.ndarray:
+            out = np.full((n, k), fill)
+            out[r, c] = values[sel]
+            return out
+
+        def per_row(values: np.ndarray) -> np.ndarray:
+            out = np.zeros(n)
+            np.maximum.at(out, r, values[sel])   # m2_below is 0 on single-rate chapter rows
+            return out
+
+        included = np.zeros((n, k), dtype=bool)
+        included[r, c] = True
+        blocks[module_key] = DriverBlock(
+            keys=tuple(order), labels=tuple(labels[x] for x in order), rows=rows, cost=grid(num["cost_direct"]),
+            included=included, rate_a=grid(num["eur_m2_above"]), rate_b=grid(num["eur_m2_below"]),
+            m2_above=per_row(num["m2_above"]), m2_below=per_row(num["m2_below"]),
+            chapter=grid(num["factor_capitulo"], 1.0), use=grid(use, 1.0), factors=per_row(factors),
+            module_mult=per_row(num["factor_module"]), calibration=per_row(num["factor_calibration"]))
+    return Drivers(index=index, blocks=blocks)
+
+
+def result_frame(res, project: Any = "") -> pd.DataFrame:
+    """`EstimateResult.to_frame()` con project/module/scenario y los % del total (formato de export de la app)."""
+    t = res.totals()
+    df = res.to_frame().copy()
+    df["scenario"] = res.scenario
+    df["module"] = res.module.key
+    df["project"] = project
+    df["indirects_pct"] = float(res.module.indirects_pct[res.sci])
+    df["gg_bi_pct"] = float(res.module.gg_bi_pct)
+    df["soft_pct"] = t["soft_pct_used"]
+    df["cont_pct"] = t["cont_pct_used"]
+    return df
+
+
+def drivers_from_result(res, project: Any = "") -> Drivers:
+    return drivers_from_frame(result_frame(res, project))
+
+
+def drivers_from_portfolio(model: CostModel, projects: pd.DataFrame, scenarios=None) -> Drivers:
+    """Desde una cartera ya preparada (`batch.prepare_projects`), con los mismos factores que `estimate_portfolio`."""
+    if "scenario" not in projects.columns:
+        projects = _expand_scenarios(projects, list(scenarios or SCENARIOS))
+    est = estimate_portfolio(model, projects, with_chapters=True)
+    t = est.totals
+    sci = pd.Index(SCENARIOS).get_indexer(t["scenario"].astype(str))
+    m2a, m2b = _column(projects, "m2_above", 0.0), _column(projects, "m2_below", 0.0)
+    fac = {name: _column(projects, name, 1.0) for name in FACTOR_FIELDS}
+    combined = fac[FACTOR_FIELDS[0]].copy()
+    for name in FACTOR_FIELDS[1:]:
+        combined *= fac[name]
+    compiled = compiled_modules(model)
+    index = pd.DataFrame({"project": t["project"].to_numpy(), "module": t["module"].to_numpy(),
+                          "scenario": t["scenario"].to_numpy(), "indirects_pct": 0.0, "gg_bi_pct": 0.0,
+                          "soft_pct": t["soft_pct_used"].to_numpy(), "cont_pct": t["cont_pct_used"].to_numpy()})
+    ind, gg = np.zeros(len(t)), np.zeros(len(t))
+    blocks: Dict[str, DriverBlock] = {}
+    for module_key, mc in est.chapters.items():
+        arr, rows = compiled[module_key], mc.rows
+        s = sci[rows]
+        ind[rows], gg[rows] = arr.indirects_pct[s], arr.gg_bi_pct
+        chapter = np.where(arr.mep, fac["intensidad_mep"][rows][:, None], 1.0) * \
+            np.where(arr.finish, fac["acabados"][rows][:, None], 1.0)
+        use = np.where(arr.mep, t["use_mep"].to_numpy()[rows][:, None], t["use_arch"].to_numpy()[rows][:, None]) * \
+            t["use_overall"].to_numpy()[rows][:, None]
+        blocks[module_key] = DriverBlock(
+            keys=arr.keys, labels=arr.labels, rows=rows, cost=mc.cost, included=mc.included,
+            rate_a=arr.above[:, s].T, rate_b=np.where(arr.single, 0.0, arr.below[:, s].T),
+            m2_above=m2a[rows], m2_below=m2b[rows], chapter=chapter, use=use, factors=combined[rows],
+            module_mult=t["module_mult"].to_numpy()[rows], calibration=t["calibration"].to_numpy()[rows])
+    index["indirects_pct"], index["gg_bi_pct"] = ind, gg
+    return Drivers(index=index, blocks=blocks)
+
+
+# --- decomposition ---------------------------------------------------------------------------------------
+
+def _logmean(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """(a − b)/(ln a − ln b), = a cuando a == b; solo para a, b > 0."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = (a - b) / (np.log(a) - np.log(b))
+    return np.where(np.abs(a - b) <= 1e-12*np.abs(a), a, out)
+
+
+def _widen(a: np.ndarray, pos: np.ndarray, k: int, fill: float = 0.0) -> np.ndarray:
+    out = np.full((a.shape[0], k), fill, dtype=a.dtype)
+    out[:, pos] = a
+    return out
+
+
+def _part_effects(v0, v1, x0: List[np.ndarray], x1: List[np.ndarray], scope: np.ndarray) -> np.ndarray:
+    """LMDI de v = Π x (una parte sobre/bajo rasante): (len(x) + 1, n, k), último índice = alcance."""
+    n_d = len(x0)
+    out = np.zeros((n_d + 1,) + v0.shape)
+    both = (v0 > 0) & (v1 > 0) & ~scope
+    if both.any():
+        w = _logmean(v1[both], v0[both])
+        for d in range(n_d):
+            out[d][both] = w*np.log(x1[d][both]/x0[d][both])
+    one = (v0 != v1) & ~both
+    if one.any():
+        # a chapter that appears/disappears: scope if it was (de)selected, else the driver that is zero
+        zero = np.stack([(x0[d] == 0) | (x1[d] == 0) for d in range(n_d)])[:, one]
+        cause = np.where(scope[one], n_d, np.where(zero.any(axis=0), zero.argmax(axis=0), n_d))
+        delta = v1[one] - v0[one]
+        idx = np.flatnonzero(one.ravel())
+        flat = out.reshape(n_d + 1, -1)
+        flat[cause, idx] = delta
+    return out
+
+
+def _decompose_block(b0: Optional[DriverBlock], b1: Optional[DriverBlock], i0: np.ndarray, i1: np.ndarray):
+    """Pares (i0, i1) de filas de bloque (-1 = no existe en esa versión) → (keys, labels, c0, c1, efectos)."""
+    keys = list(b1.keys) if b1 is not None else []
+    for k in (b0.keys if b0 is not None else ()):
+        if k not in keys:
+            keys.append(k)
+    K, n = len(keys), len(i0)
+    labels = dict(zip(b0.keys, b0.labels)) if b0 is not None else {}
+    labels.update(dict(zip(b1.keys, b1.labels)) if b1 is not None else {})
+
+    def side(b: Optional[DriverBlock], i: np.ndarray):
+        ok = i >= 0
+        z = np.zeros((n, K))
+        if b is None or not ok.any():
+            return z, np.zeros((n, K), bool), [z, z, z, z, z, z, z, z]
+        pos = pd.Index(keys).get_indexer(b.keys)
+        ii = i[ok]
+
+        def mat(a, fill=0.0):
+            out = np.full((n, K), fill)
+            out[ok] = _widen(a[ii], pos, K, fill)
+            return out
+
+        def vec(a):
+            out = np.zeros((n, K))
+            out[ok] = a[ii][:, None]
+            return out
+
+        inc = np.zeros((n, K), bool)
+        inc[ok] = _widen(b.included[ii], pos, K, False)
+        f = mat(b.chapter, 1.0) * vec(b.factors)
+        return mat(b.cost), inc, [mat(b.rate_a), mat(b.rate_b), vec(b.m2_above), vec(b.m2_below),
+                                  f, vec(b.module_mult), mat(b.use, 1.0), vec(b.calibration)]
+
+    c0, inc0, x0 = side(b0, i0)
+    c1, inc1, x1 = side(b1, i1)
+    scope = inc0 != inc1
+    eff = np.zeros((len(DIRECT_DRIVERS), n, K))
+    for ra, m2 in ((0, 2), (1, 3)):       # above / below parts: rate · area · factor · module · use · calibration
+        p0 = [x0[ra], x0[m2], x0[4], x0[5], x0[6], x0[7]]
+        p1 = [x1[ra], x1[m2], x1[4], x1[5], x1[6], x1[7]]
+        v0 = np.where(inc0, np.prod(p0, axis=0), 0.0)
+        v1 = np.where(inc1, np.prod(p1, axis=0), 0.0)
+        eff += _part_effects(v0, v1, p0, p1, scope)
+    return keys, [labels[k] for k in keys], c0, c1, eff
+
+
+def decompose(old: Drivers, new: Drivers, on: Sequence[str] = KEYS) -> Variance:
+    """
+    Δ de cada capítulo (directo) y de cada total entre `old` y `new`, emparejando por `on` (project × module ×
+    scenario; `on=["project","module"]` compara escenarios). Lo que solo está en un lado es alcance.
+    """
+    on = list(on)
+    k0 = pd.MultiIndex.from_frame(old.index[on].astype(object))
+    k1 = pd.MultiIndex.from_frame(new.index[on].astype(object))
+    j = k0.get_indexer(k1)                                  # new row → old row (-1 = new estimate)
+    gone = np.setdiff1d(np.arange(len(k0)), j[j >= 0])      # old rows without a match
+    o = np.concatenate([j, gone])                           # union rows: (old pos, new pos)
+    m = np.concatenate([np.arange(len(k1)), np.full(len(gone), -1)])
+    keys = pd.concat([new.index[KEYS], old.index[KEYS].iloc[gone]], ignore_index=True)
+    u = len(o)
+
+    def pcts(d: Drivers, pos: np.ndarray) -> np.ndarray:
+        p = np.zeros((u, len(PCT_COLUMNS)))
+        ok = pos >= 0
+        p[ok] = d.index[PCT_COLUMNS].to_numpy(dtype=float)[pos[ok]]
+        return p
+
+    d0, d1 = np.zeros(u), np.zeros(u)
+    direct_eff = np.zeros((len(DIRECT_DRIVERS), u))
+    chapter_parts = []
+    for module_key in list(new.blocks) + [k for k in old.blocks if k not in new.blocks]:
+        b0, b1 = old.blocks.get(module_key), new.blocks.get(module_key)
+        inv0 = np.full(max(len(k0), 1), -1)
+        if b0 is not None:
+            inv0[b0.rows] = np.arange(len(b0.rows))
+        inv1 = np.full(max(len(k1), 1), -1)
+        if b1 is not None:
+            inv1[b1.rows] = np.arange(len(b1.rows))
+        i0 = np.where(o >= 0, inv0[np.maximum(o, 0)], -1)
+        i1 = np.where(m >= 0, inv1[np.maximum(m, 0)], -1)
+        rows = np.flatnonzero((i0 >= 0) | (i1 >= 0))
+        if not len(rows):
+            continue
+        ckeys, clabels, c0, c1, eff = _decompose_block(b0, b1, i0[rows], i1[rows])
+        d0[rows] += c0.sum(axis=1)
+        d1[rows] += c1.sum(axis=1)
+        direct_eff[:, rows] += eff.sum(axis=2)
+        r, c = np.nonzero((c0 != 0) | (c1 != 0) | (np.abs(eff).sum(axis=0) != 0))
+        part = keys.iloc[rows[r]].reset_index(drop=True)
+        part["chapter_key"] = np.asarray(ckeys, dtype=object)[c]
+        part["capitulo"] = np.asarray(clabels, dtype=object)[c]
+        part["old"], part["new"] = c0[r, c], c1[r, c]
+        part["delta"] = part["new"] - part["old"]
+        for di, name in enumerate(DIRECT_DRIVERS):
+            part[name] = eff[di][r, c]
+        part["residual"] = part["delta"] - eff[:, r, c].sum(axis=0)
+        chapter_parts.append(part)
+
+    # total = D · M with M = 1 + Σ pct: Δ = ΔD · M̄ + D̄ · ΔM (exact); ΔM split per component
+    p0, p1 = pcts(old, o), pcts(new, m)
+    p0[o < 0], p1[m < 0] = p1[o < 0], p0[m < 0]             # missing side: same markup, all Δ goes to scope
+    m0, m1 = 1.0 + p0.sum(axis=1), 1.0 + p1.sum(axis=1)
+    t0, t1 = d0*m0, d1*m1
+    totals = keys.copy()
+    totals["old"], totals["new"], totals["delta"] = t0, t1, t1 - t0
+    m_bar, d_bar = 0.5*(m0 + m1), 0.5*(d0 + d1)
+    for di, name in enumerate(DIRECT_DRIVERS):
+        totals[name] = direct_eff[di]*m_bar
+    for pi, name in enumerate(MARKUP_DRIVERS):
+        totals[name] = d_bar*(p1[:, pi] - p0[:, pi])
+    totals["residual"] = totals["delta"] - totals[list(TOTAL_DRIVERS)].sum(axis=1)
+    chap_cols = KEYS + ["chapter_key","capitulo","old","new","delta", *DIRECT_DRIVERS, "residual"]
+    chapters = pd.concat(chapter_parts, ignore_index=True) if chapter_parts else pd.DataFrame(columns=chap_cols)
+    return Variance(totals=totals, chapters=chapters[chap_cols])
+
+
+def driver_table(var: Variance) -> pd.DataFrame:
+    """Tabla causa → Δ total (€ y % del total anterior) para UI/PDF."""
+    s = var.by_driver()
+    old = var.totals["old"].sum()
+    return pd.DataFrame({"causa": s.index, "delta": s.to_numpy(),
+                         "pct": s.to_numpy()/old if old else np.nan})
+
+
+def report_section(var: Variance, title: str, n: int = 12) -> Dict[str, Any]:
+    """Resumen para `pdf_report.export_pdf(..., variance=)`: totales, causas con Δ y los `n` capítulos con más Δ."""
+    s = var.summary()
+    drv = var.by_driver()
+    drv = drv[drv.abs() >= 0.5]
+    ch = var.by_chapter(n)
+    return {"title": title, "old": s["old"], "new": s["new"], "delta": s["delta"],
+            "drivers": list(zip(drv.index, drv.to_numpy(dtype=float))),
+            "chapters": list(zip(ch["capitulo"].astype(str), ch["delta"].to_numpy(dtype=float)))}
+
+
+# --- CLI -------------------------------------------------------------------------------------------------
+
+def _load_drivers(path: str, data_dir: Optional[str], use_items: bool) -> Drivers:
+    from src.batch import DATA_DIR, read_chunks, prepare_projects
+    from src.model import load_model
+    df = pd.concat(list(read_chunks(path, 200_000)), ignore_index=True)
+    if "factor_capitulo" in df.columns:       # estimate_module rows (app CSV export)
+        return drivers_from_frame(df)
+    model = load_model(data_dir or DATA_DIR)
+    return drivers_from_portfolio(model, prepare_projects(model, df, use_items))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.variance",
+                                 description="Descompone el Δ entre dos estimaciones/carteras por causa.")
+    ap.add_argument("old", help="CSV/JSONL anterior: cartera (entrada de src.batch) o export de la app")
+    ap.add_argument("new", help="CSV/JSONL nuevo (mismo formato)")
+    ap.add_argument("--old-data", help="directorio de datos de la versión anterior (por defecto data/)")
+    ap.add_argument("--new-data", help="directorio de datos de la versión nueva (por defecto data/)")
+    ap.add_argument("-o", "--output", help="Δ por estimación y causa (CSV)")
+    ap.add_argument("--chapters", help="Δ por estimación × capítulo y causa (CSV)")
+    ap.add_argument("--module-defaults", action="store_true", help="%% soft/contingencia por defecto del módulo")
+    args = ap.parse_args(argv)
+
+    var = decompose(_load_drivers(args.old, args.old_data, not args.module_defaults),
+                    _load_drivers(args.new, args.new_data, not args.module_defaults))
+    if args.output:
+        var.totals.to_csv(args.output, index=False)
+    if args.chapters:
+        var.chapters.to_csv(args.chapters, index=False)
+    s = var.summary()
+    with pd.option_context("display.width", 160, "display.float_format", "{:,.0f}".format):
+        print(var.by_driver().to_string())
+        print(var.by_chapter(15)[["module","capitulo","old","new","delta"]].to_string(index=False))
+    print(f"{s['estimates']:,} estimaciones: {s['old']:,.0f} € → {s['new']:,.0f} € (Δ {s['delta']:+,.0f} €)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,22 @@
+import io
+
+import pandas as pd
+
+from src.batch import run
+
+
+def test_blank_and_unknown_scenarios_do_not_abort(tmp_path):
+    src = tmp_path / "in.csv"
+    src.write_text("project,module,scenario,m2_above,m2_below\n"
+                   "a,obra_nueva_edificio,mid,1000,200\n"
+                   "b,obra_nueva_edificio,,1000,200\n"
+                   "c,reforma_piso,medium,80,0\n"
+                   "d,reforma_piso, high ,80,0\n")
+    log = io.StringIO()
+    stats = run(src, tmp_path / "out.csv", chunksize=2, log=log)
+    out = pd.read_csv(tmp_path / "out.csv")
+    assert list(zip(out["project"], out["scenario"])) == [("a", "mid"), ("b", "low"), ("b", "mid"), ("b", "high"),
+                                                          ("d", "high")]
+    assert stats["skipped_rows"] == 1 and "'medium'" in log.getvalue()
+    a, b_mid = out.loc[out["project"].eq("a"), "total"].item(), out.loc[2, "total"]
+    assert a == b_mid
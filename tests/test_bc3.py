@@ -0,0 +1,85 @@
+import io
+
+import pytest
+
+from benchmarks.bc3_import import make_bc3
+from src.bc3 import Bc3Store, import_bc3, iter_records, rollup
+
+# root → 2 chapters; chapter 01 → subchapter 01.01 → items; E02 has its own price and decomposition
+SAMPLE = (
+    "~V|PRUEBA|FIEBDC-3/2020\\01012024|tests|Banco de prueba\\|850|Cabecera|1|||\r\n"
+    "~C|0##||Presupuesto de prueba|0|01012024|0|\r\n"
+    "~D|0##|01#\\1\\1\\02#\\1\\1\\|\r\n"
+    "~C|01#||Cimentación y estructura|0|01012024|0|\r\n"
+    "~D|01#|01.01#\\1\\1\\|\r\n"
+    "~C|01.01#||Hormigón armado|0|01012024|0|\r\n"
+    "~D|01.01#|E01\\1\\10\\E02\\2\\5\\|\r\n"
+    "~C|E01\\E01-SIN|m3|Hormigón HA-25 en zapatas, ñ|120,50|01012024|0|\r\n"
+    "~C|E02|m2|Encofrado|30.00|01012024|0|\r\n"
+    "~D|E02|B01\\1\\0.5\\B02\\1\\2\\|\r\n"
+    "~C|B01|h|Oficial 1ª|20.00|01012024|1|\r\n"
+    "~C|B02|kg|Acero B-500S|1.00|01012024|3|\r\n"
+    "~T|E01|Hormigón armado HA-25/B/20/IIa,\r\nvertido con bomba.|\r\n"
+    "~C|02#||Albañilería|0|01012024|0|\r\n"
+    "~D|02#|E03\\1\\4\\|\r\n"
+    "~C|E03|m2|Fábrica de ladrillo|25|01012024|0|\r\n"
+)
+
+
+@pytest.fixture()
+def store(tmp_path):
+    bc3 = tmp_path / "sample.bc3"
+    bc3.write_bytes(SAMPLE.encode("cp850"))
+    stats = import_bc3(bc3, tmp_path / "sample.sqlite", texts=True)
+    assert stats["concepts"] == 9 and stats["decompositions"] == 8 and stats["texts"] == 1
+    s = Bc3Store(tmp_path / "sample.sqlite")
+    yield s
+    s.close()
+
+
+def test_records_split_across_blocks():
+    raw = SAMPLE.encode("cp850")
+    whole = list(iter_records(io.BytesIO(raw)))
+    assert list(iter_records(io.BytesIO(raw), block_size=7)) == whole
+    assert [k for k, _ in whole].count("C") == 9
+
+
+def test_concepts_decompositions_and_texts(store):
+    assert store.meta()["root"] == "0"
+    e01 = store.concept("E01")
+    assert (e01.unit, e01.summary, e01.price, e01.is_chapter) == ("m3", "Hormigón HA-25 en zapatas, ñ", 120.5, 0)
+    assert store.concept("B01").summary == "Oficial 1ª"
+    assert store.concept("01#").is_chapter == 1 and store.concept("0").is_chapter == 2
+    kids = store.children("01.01#")
+    assert list(kids["code"]) == ["E01", "E02"] and list(kids["factor"]) == [1.0, 2.0]
+    assert list(kids["yield"]) == [10.0, 5.0]
+    assert store.text("E01") == "Hormigón armado HA-25/B/20/IIa,\r\nvertido con bomba."
+
+
+def test_chapter_membership_is_recursive(store):
+    # items under a subchapter, and the basic resources below them, belong to the top-level chapter
+    assert store.concept("E01").chapter == "01" and store.concept("B02").chapter == "01"
+    assert store.concept("E03").chapter == "02"
+    assert list(store.chapter_items("01")["code"]) == ["B01", "B02", "E01", "E02"]
+    assert list(store.chapters()["code"]) == ["01", "02"]
+
+
+def test_rollup_of_sample(store):
+    got = rollup(store, 100.0).set_index("code")
+    # E02 keeps its own price (30), not the sum of its decomposition
+    assert got.loc["01", "amount"] == pytest.approx(10*120.5 + 2*5*30.0)
+    assert got.loc["02", "amount"] == pytest.approx(4*25.0)
+    assert got.loc["01", "eur_m2"] == pytest.approx(got.loc["01", "amount"]/100.0)
+
+
+def test_rollup_matches_generated_amounts(tmp_path):
+    expected = make_bc3(tmp_path / "synthetic.bc3", n_concepts=3000, n_chapters=5, seed=3)
+    import_bc3(tmp_path / "synthetic.bc3", tmp_path / "synthetic.sqlite")
+    store = Bc3Store(tmp_path / "synthetic.sqlite")
+    try:
+        ch = rollup(store, 1.0)
+        assert len(ch) == 5
+        assert ch["amount"].sum() == pytest.approx(expected, rel=1e-9)
+        assert store.concept("E0000000").chapter == "01"
+    finally:
+        store.close()
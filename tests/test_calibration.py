@@ -0,0 +1,13 @@
+import numpy as np
+
+from src.calibration import _huber
+
+
+def test_huber_ignores_common_bias():
+    rng = np.random.default_rng(0)
+    r = 0.10 + rng.normal(0, 0.01, 1000)     # every row 10% high, small spread
+    r[:5] += 0.5                             # a few real outliers
+    w, scale = _huber(r, 1.345)
+    assert abs(scale - 0.01) < 0.002
+    assert (w[:5] < 0.1).all()
+    assert (w[5:] < 1.0).mean() < 0.25       # about the Gaussian share beyond 1.345σ, not every row
@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.calculations import SCENARIOS
+from src.cube import cube_for, estimate_totals
+from src.model import load_model
+from src.portfolio import TOTAL_COLUMNS, _expand_scenarios, estimate_portfolio
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+
+
+@pytest.fixture(scope="module")
+def model():
+    return load_model(DATA_DIR)
+
+
+def _mixed_projects():
+    # cube hits (standard rows) and misses (chapter factor, calibration) across modules
+    return pd.DataFrame([
+        {"module": "obra_nueva_edificio", "m2_above": 2000, "m2_below": 500, "building_use": "oficinas"},
+        {"module": "obra_nueva_edificio", "m2_above": 2000, "m2_below": 500, "acabados": 1.2},
+        {"module": "reposicionamiento_edificio", "m2_above": 1500, "m2_below": 0, "intervention_level": "intensivo",
+         "localizacion": 1.1},
+        {"module": "reforma_piso", "m2_above": 90, "m2_below": 0, "intensidad_mep": 0.9},
+        {"module": "fitout_oficinas", "m2_above": 800, "m2_below": 0, "include_furniture": True,
+         "soft_items_pct": 0.05},
+        {"module": "fitout_local_por_uso", "m2_above": 300, "m2_below": 0, "use": "fitness",
+         "auto_calibrate": True, "pem_low": 400.0, "pem_mid": 500.0, "pem_high": 650.0},
+    ])
+
+
+@pytest.mark.parametrize("cow", [False, True])
+def test_estimate_totals_matches_portfolio(model, cow):
+    projects = _mixed_projects()
+    with pd.option_context("mode.copy_on_write", cow):
+        got = estimate_totals(model, projects)
+        want = estimate_portfolio(model, projects).totals
+    hit = cube_for(model).cells_for(_expand_scenarios(projects, list(SCENARIOS))) >= 0
+    assert hit.any() and not hit.all()
+    assert list(got["project"]) == list(want["project"]) and list(got["scenario"]) == list(want["scenario"])
+    np.testing.assert_allclose(got[TOTAL_COLUMNS].to_numpy(float), want[TOTAL_COLUMNS].to_numpy(float), rtol=1e-12)
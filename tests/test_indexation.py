@@ -0,0 +1,33 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.indexation import IndexTable, _days
+
+
+def test_days_mixed_month_and_day_formats():
+    got = _days(["2024-01", "2024-02-15", dt.date(2024, 3, 1), np.datetime64("2024-04-02")])
+    want = (np.array(["2024-01-01", "2024-02-15", "2024-03-01", "2024-04-02"], dtype="datetime64[D]")
+            - np.datetime64("1970-01-01", "D")).astype(np.int64)
+    np.testing.assert_array_equal(got, want)
+
+
+def test_days_day_format_first():
+    np.testing.assert_array_equal(_days(pd.Series(["2024-02-15", "2024-03"])), _days(["2024-02-15", "2024-03-01"]))
+
+
+def test_days_rejects_garbage():
+    with pytest.raises(ValueError):
+        _days(["2024-01", "enero"])
+
+
+def test_index_table_from_mixed_dates():
+    df = pd.DataFrame({"fecha": ["2024-01", "2024-01-31", "2024-01", "2024-03-01"],
+                       "serie": ["mano_obra", "mano_obra", "acero", "acero"],
+                       "valor": [100.0, 130.0, 200.0, 260.0]})
+    t = IndexTable.from_frame(df)
+    v = t.at(["2024-01-16", "2024-01-31"])
+    np.testing.assert_allclose(v[:, t.series.index("mano_obra")], [115.0, 130.0])
+    np.testing.assert_allclose(v[0, t.series.index("acero")], 200.0 + 60.0*15/60)
@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.calculations import SCENARIOS, Factors, estimate_module
+from src.model import load_model
+from src.portfolio import TOTAL_COLUMNS, estimate_portfolio
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+FACTORS = {"complejidad": 1.05, "altura": 1.02, "localizacion": 0.93, "intensidad_mep": 1.15, "acabados": 0.9,
+           "certificacion": 1.03, "plazo": 1.01, "estado_previo": 1.04, "indexacion_temporal": 1.08}
+BENCH = {"pem_low": 700.0, "pem_mid": 900.0, "pem_high": 1300.0}
+
+# (id, module, options, factors, benchmark + auto_calibrate)
+CASES = [(f"{m}-base", m, {}, {}, False) for m in
+         ("obra_nueva_edificio", "reposicionamiento_edificio", "reforma_piso", "reforma_local", "fitout_oficinas",
+          "fitout_local_por_uso")]
+CASES += [(f"obra_nueva-{u}", "obra_nueva_edificio", {"building_use": u}, {}, False)
+          for u in ("residencial", "oficinas", "hotel", "sanitario", "educativo", "industrial_logistica", "retail",
+                    "desconocido")]
+CASES += [(f"reposicionamiento-{lv}-hotel", "reposicionamiento_edificio",
+           {"intervention_level": lv, "building_use": "hotel"}, {}, False) for lv in ("ligero", "medio", "intensivo")]
+CASES += [(f"reforma_piso-{lv}", "reforma_piso", {"reform_level": lv}, {}, False)
+          for lv in ("parcial", "integral", "integral_plus")]
+CASES += [(f"reforma_local-{lv}", "reforma_local", {"intervention_level": lv}, {}, False)
+          for lv in ("ligera", "media", "intensiva")]
+CASES += [(f"fitout_local-{u}", "fitout_local_por_uso", {"use": u}, {}, False)
+          for u in ("retail", "restauracion", "fitness", "clinica", "otros", "desconocido")]
+CASES += [
+    ("fitout_oficinas-furniture", "fitout_oficinas", {"include_furniture": True}, {}, False),
+    ("fitout_oficinas-no-furniture", "fitout_oficinas", {"include_furniture": False}, {}, False),
+    ("obra_nueva-factors", "obra_nueva_edificio", {"building_use": "oficinas"}, FACTORS, False),
+    ("reforma_piso-factors", "reforma_piso", {"reform_level": "parcial"}, FACTORS, False),
+    ("obra_nueva-overrides", "obra_nueva_edificio", {"soft_items_pct": 0.07, "cont_items_pct": 0.025}, {}, False),
+    ("fitout_oficinas-overrides", "fitout_oficinas", {"soft_items_pct": 0.0, "cont_items_pct": 0.1}, FACTORS, False),
+    ("obra_nueva-calibrated", "obra_nueva_edificio", {"building_use": "residencial"}, FACTORS, True),
+    ("reposicionamiento-calibrated", "reposicionamiento_edificio", {"intervention_level": "intensivo"}, {}, True),
+    ("reforma_local-calibrated", "reforma_local", {"intervention_level": "ligera"}, FACTORS, True),
+]
+M2 = {"obra_nueva_edificio": (2400.0, 600.0), "reposicionamiento_edificio": (1800.0, 300.0)}
+
+
+@pytest.fixture(scope="module")
+def model():
+    return load_model(DATA_DIR)
+
+
+@pytest.fixture(scope="module")
+def portfolio(model):
+    """Todos los casos × escenarios en una sola llamada (módulos mezclados en la misma tabla)."""
+    rows = []
+    for case_id, module, options, factors, calib in CASES:
+        m2a, m2b = M2.get(module, (350.0, 0.0))
+        rows.append({"project": case_id, "module": module, "m2_above": m2a, "m2_below": m2b, **options, **factors,
+                     **(dict(BENCH, auto_calibrate=True) if calib else {})})
+    projects = pd.DataFrame(rows).set_index("project")
+    totals = estimate_portfolio(model, projects).totals
+    return totals.set_index(["project", "scenario"])
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+@pytest.mark.parametrize("case_id, module, options, factors, calib", CASES, ids=[c[0] for c in CASES])
+def test_portfolio_matches_estimate_module(model, portfolio, case_id, module, options, factors, calib, scenario):
+    m2a, m2b = M2.get(module, (350.0, 0.0))
+    _, want = estimate_module(model.cost_data, module, scenario, m2a, m2b, Factors(**factors), options=options,
+                              benchmark_row=BENCH if calib else None, auto_calibrate_to_benchmark=calib)
+    got = portfolio.loc[(case_id, scenario)]
+    np.testing.assert_allclose([got[c] for c in TOTAL_COLUMNS], [want[c] for c in TOTAL_COLUMNS], rtol=1e-12)
+    if calib:
+        assert got["calibration"] != 1.0
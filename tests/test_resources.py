@@ -0,0 +1,17 @@
+import os
+
+from src import resources
+
+
+def test_frame_returns_copies_and_follows_file_changes(tmp_path):
+    csv = tmp_path / "benchmarks.csv"
+    csv.write_text("key,pem_mid\na,100\n")
+    first = resources.frame("benchmarks", tmp_path)
+    first.loc[0, "pem_mid"] = -1                     # a caller mutating its table
+    assert resources.frame("benchmarks", tmp_path).loc[0, "pem_mid"] == 100
+
+    csv.write_text("key,pem_mid\na,100\nb,250\n")
+    st = os.stat(csv)
+    os.utime(csv, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert list(resources.frame("benchmarks", tmp_path)["key"]) == ["a", "b"]
+    assert sum(p.startswith(str(tmp_path)) for p in resources._frames) == 1   # old version dropped